@@ -0,0 +1,119 @@
+{#
+    Macros multi-moteurs : les modèles compilent pour BigQuery (dev, prod)
+    et pour DuckDB (target local, moteur embarqué).
+
+    Chaque macro passe par adapter.dispatch : l'implémentation
+    `<adapter>__<macro>` est choisie selon target.type, avec `default__`
+    en repli (syntaxe SQL standard, comprise par DuckDB).
+#}
+
+{# Stratégie incrémentale d'upsert sur unique_key #}
+{% macro upsert_strategy() %}
+    {{ return(adapter.dispatch('upsert_strategy', 'projet_m2_bi')()) }}
+{% endmacro %}
+
+{% macro default__upsert_strategy() %}
+    {{ return('delete+insert') }}
+{% endmacro %}
+
+{% macro bigquery__upsert_strategy() %}
+    {{ return('merge') }}
+{% endmacro %}
+
+
+{# Stratégie incrémentale de remplacement des partitions recalculées (unique_key = colonne de partition) #}
+{% macro partition_overwrite_strategy() %}
+    {{ return(adapter.dispatch('partition_overwrite_strategy', 'projet_m2_bi')()) }}
+{% endmacro %}
+
+{% macro default__partition_overwrite_strategy() %}
+    {{ return('delete+insert') }}
+{% endmacro %}
+
+{% macro bigquery__partition_overwrite_strategy() %}
+    {{ return('insert_overwrite') }}
+{% endmacro %}
+
+
+{# Littéral timestamp UTC (format 'YYYY-MM-DD HH:MM:SS[.ffffff]') #}
+{% macro timestamp_literal(value) %}
+    {{ return(adapter.dispatch('timestamp_literal', 'projet_m2_bi')(value)) }}
+{% endmacro %}
+
+{% macro default__timestamp_literal(value) -%}
+    cast('{{ value }}' as timestamp)
+{%- endmacro %}
+
+{% macro bigquery__timestamp_literal(value) -%}
+    timestamp('{{ value }}')
+{%- endmacro %}
+
+
+{# Date (jour) d'un timestamp d'événement #}
+{% macro event_date(column) %}
+    {{ return(adapter.dispatch('event_date', 'projet_m2_bi')(column)) }}
+{% endmacro %}
+
+{% macro default__event_date(column) -%}
+    cast({{ column }} as date)
+{%- endmacro %}
+
+{% macro bigquery__event_date(column) -%}
+    date({{ column }})
+{%- endmacro %}
+
+
+{# Bucket déterministe [0, buckets) d'une clé (même clé => même bucket, sur tous les runs) #}
+{% macro hash_bucket(column, buckets) %}
+    {{ return(adapter.dispatch('hash_bucket', 'projet_m2_bi')(column, buckets)) }}
+{% endmacro %}
+
+{% macro default__hash_bucket(column, buckets) -%}
+    (hash(cast({{ column }} as varchar)) % {{ buckets }})
+{%- endmacro %}
+
+{% macro bigquery__hash_bucket(column, buckets) -%}
+    mod(abs(farm_fingerprint(cast({{ column }} as string))), {{ buckets }})
+{%- endmacro %}
+
+
+{# Début de période (date) d'une date : grain day, week (ISO, lundi), month, quarter ou year #}
+{% macro date_bucket(column, grain) %}
+    {{ return(adapter.dispatch('date_bucket', 'projet_m2_bi')(column, grain)) }}
+{% endmacro %}
+
+{% macro default__date_bucket(column, grain) -%}
+    cast(date_trunc('{{ grain }}', {{ column }}) as date)
+{%- endmacro %}
+
+{% macro bigquery__date_bucket(column, grain) -%}
+    date_trunc({{ column }}, {{ 'isoweek' if grain == 'week' else grain }})
+{%- endmacro %}
+
+
+{# Décalage d'une date d'un nombre de jours (négatif pour reculer) #}
+{% macro date_add_days(column, days) %}
+    {{ return(adapter.dispatch('date_add_days', 'projet_m2_bi')(column, days)) }}
+{% endmacro %}
+
+{% macro default__date_add_days(column, days) -%}
+    (cast({{ column }} as date) + {{ days }})
+{%- endmacro %}
+
+{% macro bigquery__date_add_days(column, days) -%}
+    date_add({{ column }}, interval {{ days }} day)
+{%- endmacro %}
+
+
+{# Partitionnement par jour d'une table (BigQuery) ; aucun ailleurs (pas de partitions de table sur DuckDB) #}
+{% macro day_partition(field, data_type='date') %}
+    {{ return(adapter.dispatch('day_partition', 'projet_m2_bi')(field, data_type)) }}
+{% endmacro %}
+
+{% macro default__day_partition(field, data_type) %}
+    {{ return(none) }}
+{% endmacro %}
+
+{% macro bigquery__day_partition(field, data_type) %}
+    {{ return({'field': field, 'data_type': data_type, 'granularity': 'day'}) }}
+{% endmacro %}
@@ -0,0 +1,31 @@
+{#
+    Fenêtre de recalcul des marts incrémentaux (données arrivées en retard).
+
+    - Le flow dbt_full_pipeline passe le premier jour recalculé de chaque mart
+      dans la variable `mart_windows` (voir prefect_flows/incremental_marts.py) :
+          {"mart_content_performance": "2025-01-03", "mart_users": "2025-01-03"}
+      ce qui lui permet de rapporter ensuite les partitions touchées.
+    - Hors flow (dbt run classique), on recule de `mart_lookback_days` jours
+      (3 par défaut) depuis le dernier jour déjà présent dans le mart.
+#}
+{% macro mart_window_start(date_column) %}
+    {%- set start = var('mart_windows', {}).get(model.name) -%}
+    {%- if start -%}
+        cast('{{ start }}' as date)
+    {%- else -%}
+        (
+            select {{ date_add_days(event_date('max(' ~ date_column ~ ')'), -1 * var('mart_lookback_days', 3)) }}
+            from {{ this }}
+        )
+    {%- endif -%}
+{% endmacro %}
+
+
+{# Filtre des lignes d'un modèle amont sur la fenêtre de recalcul (toutes les lignes hors incrémental) #}
+{% macro mart_window_filter(timestamp_column, date_column='event_date') %}
+    {%- if is_incremental() -%}
+        {{ event_date(timestamp_column) }} >= {{ mart_window_start(date_column) }}
+    {%- else -%}
+        true
+    {%- endif -%}
+{% endmacro %}
@@ -0,0 +1,22 @@
+{#
+    Filtre de fenêtre de chargement pour les modèles incrémentaux du micro-batch.
+
+    - En micro-batch, le flow prefect_flows/microbatch.py passe la fenêtre
+      de chaque source dans la variable `microbatch_windows` :
+          {"viewing_logs": {"from": "2025-01-01 10:00:00.000000", "to": "..."}}
+      et seules les lignes avec from < loaded_at <= to sont lues.
+    - Hors micro-batch (dbt run classique), on reprend depuis le max déjà chargé.
+#}
+{% macro microbatch_window_filter(source_table, loaded_at_column='_loaded_at') %}
+    {%- set window = var('microbatch_windows', {}).get(source_table) -%}
+    {%- if window -%}
+        {%- if window.get('from') -%}
+            {{ loaded_at_column }} > {{ timestamp_literal(window['from']) }} and
+        {% endif -%}
+        {{ loaded_at_column }} <= {{ timestamp_literal(window['to']) }}
+    {%- elif is_incremental() -%}
+        {{ loaded_at_column }} > (select max({{ loaded_at_column }}) from {{ this }})
+    {%- else -%}
+        true
+    {%- endif -%}
+{% endmacro %}
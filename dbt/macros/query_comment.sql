@@ -0,0 +1,19 @@
+{#
+    Commentaire de requête de la pipeline (`query-comment` dans dbt_project.yml).
+
+    Avec `job-label: true`, dbt-bigquery convertit ce JSON en labels du job
+    BigQuery (valeurs passées en minuscules, caractères hors [a-z0-9_-]
+    remplacés par `_`, 63 caractères max). Le rapport de coûts
+    (prefect_flows/job_costs.py) retrouve ainsi chaque job par flow run,
+    target et modèle. Sur DuckDB, il reste un simple commentaire SQL.
+#}
+{% macro pipeline_query_comment(node) %}
+    {%- set labels = {
+        'app': 'projet_m2_bi',
+        'flow_run_id': env_var('DBT_FLOW_RUN_ID', 'manual'),
+        'target': target.name,
+        'dbt_invocation_id': invocation_id,
+        'dbt_model': node.unique_id if node is not none else 'none',
+    } -%}
+    {{ return(tojson(labels)) }}
+{% endmacro %}
@@ -0,0 +1,58 @@
+{#
+    Agrégat pré-calculé d'un mart à un grain plus grossier (rollup).
+
+    Les modèles de dbt/models/rollups/ sont générés depuis dbt/rollups/rollups.yml
+    par `python -m prefect_flows.rollups generate` et appellent cette macro.
+
+    - time_column / grain : la date est ramenée au début de sa période
+      (colonne `period_start`) ; sans time_column, le rollup agrège toute l'histoire.
+    - measures : {colonne: agrégation}, agrégations ré-agrégeables uniquement
+      (sum, min, max, count ; `count` compte les lignes, la colonne nomme le résultat).
+    - En incrémental (time_column = colonne de fenêtre d'un mart incrémental,
+      voir prefect_flows/rollups.py), seules les périodes qui contiennent un jour
+      de la fenêtre recalculée du mart sont recalculées, entièrement, puis
+      remplacées via l'unique_key (period_start + dimensions) :
+      date_bucket(début de fenêtre, grain). Hors flow, sans `mart_windows`, la
+      fenêtre part de max(period_start) - `mart_lookback_days` jours, qui précède
+      toujours celle du mart (son dernier jour est dans la dernière période).
+#}
+{% macro rollup(model, dimensions, measures, time_column=none, grain=none) %}
+    {%- set group_columns = [] -%}
+    {%- if time_column -%}
+        {%- set period = date_bucket(event_date(time_column), grain) -%}
+        {%- do group_columns.append(period) -%}
+    {%- endif -%}
+    {%- do group_columns.extend(dimensions) -%}
+
+select
+    {%- if time_column %}
+    {{ period }} as period_start,
+    {%- endif %}
+    {%- for dimension in dimensions %}
+    {{ dimension }},
+    {%- endfor %}
+    {%- for column, aggregation in measures.items() %}
+    {{ 'count(*)' if aggregation == 'count' else aggregation ~ '(' ~ column ~ ')' }} as {{ column }}{{ ',' if not loop.last }}
+    {%- endfor %}
+from {{ ref(model) }}
+{%- if time_column and is_incremental() %}
+where {{ period }} >= {{ rollup_window_start(model, grain) }}
+{%- endif %}
+{%- if group_columns %}
+group by {{ group_columns | join(', ') }}
+{%- endif %}
+{% endmacro %}
+
+
+{# Début de la première période recalculée d'un rollup incrémental du mart `model` #}
+{% macro rollup_window_start(model, grain) %}
+    {%- set start = var('mart_windows', {}).get(model) -%}
+    {%- if start -%}
+        {{ date_bucket("cast('" ~ start ~ "' as date)", grain) }}
+    {%- else -%}
+        (
+            select {{ date_bucket(date_add_days('max(period_start)', -1 * var('mart_lookback_days', 3)), grain) }}
+            from {{ this }}
+        )
+    {%- endif -%}
+{% endmacro %}
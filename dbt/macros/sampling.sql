@@ -0,0 +1,38 @@
+{#
+    Échantillonnage déterministe des sources pour les targets de développement.
+
+    `sampled_source` remplace `source()` dans les modèles de staging. Avec la
+    variable `sample_rate` (ex: 0.1, passée par le flow dbt_full_pipeline),
+    seules les lignes dont la clé tombe dans les premiers buckets de hash sont
+    lues. L'échantillon porte sur la clé utilisateur pour toutes les sources :
+    un utilisateur retenu l'est avec tous ses visionnages et interactions, les
+    jointures entre modèles restent donc cohérentes.
+
+    Les targets de `full_volume_targets` (prod par défaut) ignorent toujours
+    l'échantillonnage.
+#}
+
+{% macro sample_rate() %}
+    {%- set rate = var('sample_rate', none) -%}
+    {%- if rate is none or target.name in var('full_volume_targets', ['prod']) -%}
+        {{ return(1.0) }}
+    {%- endif -%}
+    {%- set rate = rate | float -%}
+    {%- if rate <= 0 or rate > 1 -%}
+        {{ exceptions.raise_compiler_error("sample_rate doit être dans ]0, 1], reçu: " ~ rate) }}
+    {%- endif -%}
+    {{ return(rate) }}
+{% endmacro %}
+
+{% macro sampled_source(source_name, table_name, sample_key='user_id') %}
+    {%- set relation = source(source_name, table_name) -%}
+    {%- set rate = sample_rate() -%}
+    {%- if rate >= 1 -%}
+        {{ relation }}
+    {%- else -%}
+        (
+            select * from {{ relation }}
+            where {{ hash_bucket(sample_key, 10000) }} < {{ (rate * 10000) | round | int }}
+        ) as {{ table_name }}
+    {%- endif -%}
+{% endmacro %}
@@ -0,0 +1,115 @@
+{#
+    Snapshots par empreinte de ligne (historique des dimensions à évolution lente).
+
+    La stratégie `check` de dbt compare chaque colonne suivie, sur toutes les
+    lignes du snapshot, à chaque exécution. La stratégie `hash` :
+
+    - stocke avec chaque version une empreinte des colonnes suivies
+      (colonne `hash_column`, `dbt_row_hash` par défaut, calculée dans la
+      requête du snapshot par `snapshot_row_hash`) ;
+    - ne compare que cette empreinte ;
+    - et, avec `snapshot_changed_keys`, ne lit que les clés présentes dans les
+      partitions récentes des sources : le coût suit le volume de changements
+      du jour, pas la taille de la dimension.
+
+    Les clés absentes de la requête ne sont pas considérées comme supprimées
+    (hard_deletes='ignore', comportement par défaut) : ne pas l'activer sur un
+    snapshot filtré.
+#}
+
+{# Stratégie `hash`, résolue par dbt à partir de strategy='hash' (voir strategy_dispatch) #}
+{% macro snapshot_hash_strategy(node, snapshotted_rel, current_rel, model_config, target_exists) %}
+    {% set primary_key = config.get('unique_key') %}
+    {% set hash_column = config.get('hash_column', 'dbt_row_hash') %}
+    {% set hard_deletes = adapter.get_hard_deletes_behavior(config) %}
+    {% set updated_at = config.get('updated_at') or snapshot_get_time() %}
+
+    {# Empreinte absente (colonne ajoutée à un snapshot existant) : version réécrite une fois #}
+    {% set row_changed_expr -%}
+        ({{ snapshotted_rel }}.{{ hash_column }} is null
+         or {{ snapshotted_rel }}.{{ hash_column }} != {{ current_rel }}.{{ hash_column }})
+    {%- endset %}
+
+    {% set scd_args = api.Relation.scd_args(primary_key, updated_at) %}
+
+    {% do return({
+        "unique_key": primary_key,
+        "updated_at": updated_at,
+        "row_changed": row_changed_expr,
+        "scd_id": snapshot_hash_arguments(scd_args),
+        "invalidate_hard_deletes": hard_deletes == 'invalidate',
+        "hard_deletes": hard_deletes
+    }) %}
+{% endmacro %}
+
+
+{# Empreinte (hexadécimale) des colonnes suivies d'une ligne ; null et chaîne vide sont distingués #}
+{% macro snapshot_row_hash(columns) %}
+    {{ return(adapter.dispatch('snapshot_row_hash', 'projet_m2_bi')(columns)) }}
+{% endmacro %}
+
+{% macro default__snapshot_row_hash(columns) -%}
+    md5(
+        {%- for column in columns -%}
+            coalesce(cast({{ column }} as varchar), '<null>')
+            {%- if not loop.last %} || '|' || {% endif -%}
+        {%- endfor -%}
+    )
+{%- endmacro %}
+
+{% macro bigquery__snapshot_row_hash(columns) -%}
+    to_hex(md5(concat(
+        {%- for column in columns -%}
+            coalesce(cast({{ column }} as string), '<null>')
+            {%- if not loop.last %}, '|', {% endif -%}
+        {%- endfor -%}
+    )))
+{%- endmacro %}
+
+
+{#
+    Premier jour des partitions sources relues par un snapshot :
+
+    - variable `snapshot_windows` ({snapshot: "YYYY-MM-DD"}) si fournie ;
+    - sinon `snapshot_lookback_days` jours (3 par défaut) avant le dernier jour
+      de `window_column` dans les versions courantes du snapshot.
+#}
+{% macro snapshot_window_start(window_column) %}
+    {%- set start = var('snapshot_windows', {}).get(model.name) -%}
+    {%- if start -%}
+        cast('{{ start }}' as date)
+    {%- else -%}
+        (
+            select coalesce(
+                {{ date_add_days(event_date('max(' ~ window_column ~ ')'), -1 * var('snapshot_lookback_days', 3)) }},
+                cast('1900-01-01' as date)
+            )
+            from {{ this }}
+            where dbt_valid_to is null
+        )
+    {%- endif -%}
+{% endmacro %}
+
+
+{#
+    Filtre des clés d'un snapshot sur les partitions sources récentes.
+
+    `sources` : liste de {"relation": ref(...), "column": timestamp d'événement}.
+    Toutes les clés sont lues au premier snapshot et avec la variable
+    `snapshot_full_scan` (full refresh des marts : changements hors fenêtre).
+#}
+{% macro snapshot_changed_keys(key_column, sources, window_column) %}
+    {%- if var('snapshot_full_scan', false) or not execute or load_relation(this) is none -%}
+        true
+    {%- else -%}
+        {{ key_column }} in (
+            {%- for source in sources %}
+            select {{ key_column }} from {{ source['relation'] }}
+            where {{ event_date(source['column']) }} >= {{ snapshot_window_start(window_column) }}
+            {%- if not loop.last %}
+            union all
+            {%- endif -%}
+            {% endfor %}
+        )
+    {%- endif -%}
+{% endmacro %}
@@ -0,0 +1,52 @@
+
+-- Performance quotidienne des contenus (grain : event_date x content_id), lue par Power BI
+-- Incrémental : seuls les jours de la fenêtre de recalcul sont relus et remplacés
+-- (voir macros/incremental_marts.sql)
+
+{{
+    config(
+        materialized='incremental',
+        unique_key='event_date',
+        incremental_strategy=partition_overwrite_strategy(),
+        partition_by=day_partition('event_date'),
+        cluster_by=['content_id'],
+    )
+}}
+
+with views as (
+    select
+        {{ event_date('viewed_at') }} as event_date,
+        content_id,
+        count(*) as views,
+        count(distinct user_id) as unique_viewers,
+        sum(watch_seconds) as watch_seconds
+    from {{ ref('stg_viewing_logs') }}
+    where {{ mart_window_filter('viewed_at') }}
+    group by 1, 2
+),
+
+interactions as (
+    select
+        {{ event_date('interacted_at') }} as event_date,
+        content_id,
+        sum(case when interaction_type = 'like' then 1 else 0 end) as likes,
+        sum(case when interaction_type = 'share' then 1 else 0 end) as shares,
+        sum(case when interaction_type = 'comment' then 1 else 0 end) as comments
+    from {{ ref('stg_social_interactions') }}
+    where {{ mart_window_filter('interacted_at') }}
+    group by 1, 2
+)
+
+select
+    coalesce(views.event_date, interactions.event_date) as event_date,
+    coalesce(views.content_id, interactions.content_id) as content_id,
+    coalesce(views.views, 0) as views,
+    coalesce(views.unique_viewers, 0) as unique_viewers,
+    coalesce(views.watch_seconds, 0) as watch_seconds,
+    coalesce(interactions.likes, 0) as likes,
+    coalesce(interactions.shares, 0) as shares,
+    coalesce(interactions.comments, 0) as comments
+from views
+full outer join interactions
+    on views.event_date = interactions.event_date
+    and views.content_id = interactions.content_id
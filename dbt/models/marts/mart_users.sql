@@ -0,0 +1,67 @@
+
+-- Dimension utilisateurs : activité cumulée par utilisateur, lue par Power BI
+-- Incrémental : seuls les utilisateurs actifs dans la fenêtre de recalcul sont
+-- réagrégés (sur tout leur historique) puis fusionnés (voir macros/incremental_marts.sql)
+
+{{
+    config(
+        materialized='incremental',
+        unique_key='user_id',
+        incremental_strategy=upsert_strategy(),
+        partition_by=day_partition('first_activity_at', 'timestamp'),
+        cluster_by=['user_id'],
+    )
+}}
+
+with
+
+{% if is_incremental() %}
+touched_users as (
+    select distinct user_id
+    from (
+        select user_id from {{ ref('stg_viewing_logs') }}
+        where {{ mart_window_filter('viewed_at', 'last_activity_at') }}
+
+        union all
+
+        select user_id from {{ ref('stg_social_interactions') }}
+        where {{ mart_window_filter('interacted_at', 'last_activity_at') }}
+    ) as recent_activity
+),
+{% endif %}
+
+activity as (
+    select
+        user_id,
+        viewed_at as activity_at,
+        1 as views,
+        watch_seconds,
+        0 as interactions
+    from {{ ref('stg_viewing_logs') }}
+    {% if is_incremental() %}
+    where user_id in (select user_id from touched_users)
+    {% endif %}
+
+    union all
+
+    select
+        user_id,
+        interacted_at as activity_at,
+        0 as views,
+        0 as watch_seconds,
+        1 as interactions
+    from {{ ref('stg_social_interactions') }}
+    {% if is_incremental() %}
+    where user_id in (select user_id from touched_users)
+    {% endif %}
+)
+
+select
+    user_id,
+    min(activity_at) as first_activity_at,
+    max(activity_at) as last_activity_at,
+    sum(views) as views,
+    sum(watch_seconds) as watch_seconds,
+    sum(interactions) as interactions
+from activity
+group by user_id
@@ -0,0 +1,19 @@
+-- Généré par `python -m prefect_flows.rollups generate` : ne pas modifier
+-- Rollup de mart_content_performance (voir dbt/rollups/ et macros/rollups.sql)
+
+{{
+    config(
+        materialized='incremental',
+        unique_key=['period_start'],
+        incremental_strategy=upsert_strategy(),
+        tags=['rollup'],
+    )
+}}
+
+{{ rollup(
+    'mart_content_performance',
+    dimensions=[],
+    measures={'views': 'sum', 'watch_seconds': 'sum', 'likes': 'sum', 'shares': 'sum', 'comments': 'sum'},
+    time_column='event_date',
+    grain='day',
+) }}
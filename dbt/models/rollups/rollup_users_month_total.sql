@@ -0,0 +1,17 @@
+-- Généré par `python -m prefect_flows.rollups generate` : ne pas modifier
+-- Rollup de mart_users (voir dbt/rollups/ et macros/rollups.sql)
+
+{{
+    config(
+        materialized='table',
+        tags=['rollup'],
+    )
+}}
+
+{{ rollup(
+    'mart_users',
+    dimensions=[],
+    measures={'users': 'count', 'views': 'sum', 'watch_seconds': 'sum', 'interactions': 'sum'},
+    time_column='first_activity_at',
+    grain='month',
+) }}
@@ -0,0 +1,22 @@
+
+-- Interactions sociales nettoyées, chargées par fenêtre de `_loaded_at` (voir macros/microbatch.sql)
+-- et échantillonnées par utilisateur hors prod (voir macros/sampling.sql)
+
+{{
+    config(
+        materialized='incremental',
+        unique_key='interaction_id',
+        incremental_strategy=upsert_strategy(),
+        tags=['microbatch'],
+    )
+}}
+
+select
+    interaction_id,
+    user_id,
+    content_id,
+    lower(interaction_type) as interaction_type,
+    interacted_at,
+    _loaded_at
+from {{ sampled_source('raw', 'social_interactions') }}
+where {{ microbatch_window_filter('social_interactions') }}
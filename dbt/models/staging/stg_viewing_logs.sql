@@ -0,0 +1,23 @@
+
+-- Visionnages nettoyés, chargés par fenêtre de `_loaded_at` (voir macros/microbatch.sql)
+-- et échantillonnés par utilisateur hors prod (voir macros/sampling.sql)
+
+{{
+    config(
+        materialized='incremental',
+        unique_key='view_id',
+        incremental_strategy=upsert_strategy(),
+        tags=['microbatch'],
+    )
+}}
+
+select
+    view_id,
+    user_id,
+    content_id,
+    viewed_at,
+    watch_seconds,
+    device,
+    _loaded_at
+from {{ sampled_source('raw', 'viewing_logs') }}
+where {{ microbatch_window_filter('viewing_logs') }}
@@ -0,0 +1,35 @@
+
+-- Historique de la dimension utilisateurs (une version par changement d'activité cumulée)
+-- Stratégie `hash` : seule l'empreinte des colonnes suivies est comparée, et seuls les
+-- utilisateurs actifs dans les partitions récentes des sources sont relus (voir macros/snapshots.sql)
+
+{% snapshot snap_mart_users %}
+
+{{
+    config(
+        unique_key='user_id',
+        strategy='hash',
+        hash_column='dbt_row_hash',
+    )
+}}
+
+select
+    user_id,
+    first_activity_at,
+    last_activity_at,
+    views,
+    watch_seconds,
+    interactions,
+    {{ snapshot_row_hash(['first_activity_at', 'last_activity_at', 'views', 'watch_seconds', 'interactions']) }}
+        as dbt_row_hash
+from {{ ref('mart_users') }}
+where {{ snapshot_changed_keys(
+    'user_id',
+    [
+        {'relation': ref('stg_viewing_logs'), 'column': 'viewed_at'},
+        {'relation': ref('stg_social_interactions'), 'column': 'interacted_at'},
+    ],
+    'last_activity_at'
+) }}
+
+{% endsnapshot %}
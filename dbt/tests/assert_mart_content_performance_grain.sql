@@ -0,0 +1,10 @@
+
+-- Grain de mart_content_performance : une seule ligne par (event_date, content_id)
+
+select
+    event_date,
+    content_id,
+    count(*) as row_count
+from {{ ref('mart_content_performance') }}
+group by event_date, content_id
+having count(*) > 1
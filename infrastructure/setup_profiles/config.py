@@ -2,11 +2,24 @@
 Configuration and error classes for dbt setup.
 """
 import logging
+import os
+from pathlib import Path
 
 
 # Configuration du logging pour l'exécution locale
 logger = logging.getLogger("dbt_setup")
 
+# Base DuckDB du target 'local' (relative à la racine du projet si non absolue)
+DEFAULT_DUCKDB_PATH = ".local/projet_m2_bi.duckdb"
+
+
+def resolve_duckdb_path(project_root: Path) -> Path:
+    """Chemin absolu de la base DuckDB locale (surchargeable via DBT_DUCKDB_PATH)."""
+    path = Path(os.getenv("DBT_DUCKDB_PATH", DEFAULT_DUCKDB_PATH))
+    if not path.is_absolute():
+        path = project_root / path
+    return path
+
 
 def setup_local_logging() -> None:
     """Configure le logging pour l'exécution locale."""
@@ -6,6 +6,9 @@ from typing import Dict, Any
 
 from prefect import flow
 
+from prefect_flows.metrics import FLOW_METRIC_HOOKS
+
+from .config import resolve_duckdb_path
 from .tasks import (
     parse_template_targets,
     load_terraform_outputs,
@@ -14,12 +17,13 @@ from .tasks import (
     write_local_profile,
     setup_gcp_credentials,
     setup_bigquery_target,
+    setup_duckdb_target,
     setup_dbt_profile,
     setup_dbt_operation,
 )
 
 
-@flow(name="generate-local-profiles", log_prints=True)
+@flow(name="generate-local-profiles", log_prints=True, **FLOW_METRIC_HOOKS)
 def generate_local_profiles_pipeline(
     outputs_json_path: Path | None = None,
     template_path: Path | None = None,
@@ -79,7 +83,7 @@ def generate_local_profiles_pipeline(
     return result_path
 
 
-@flow(name="setup-dbt-blocks", log_prints=True)
+@flow(name="setup-dbt-blocks", log_prints=True, **FLOW_METRIC_HOOKS)
 def setup_dbt_blocks_pipeline(
     gcp_project: str,
     credentials_block_name: str = "gcp-credentials",
@@ -96,7 +100,8 @@ def setup_dbt_blocks_pipeline(
     2. Charge les outputs Terraform pour obtenir les datasets
     3. Crée les credentials GCP
     4. Pour chaque target du template:
-       - Configure BigQuery avec le dataset approprié
+       - Configure BigQuery avec le dataset approprié (ou DuckDB pour un target
+         de type duckdb, qui ne nécessite ni credentials ni outputs GCP)
        - Configure le profil dbt
        - Configure l'opération dbt
     
@@ -147,9 +152,13 @@ def setup_dbt_blocks_pipeline(
     print("\n📥 Étape 2/5 : Chargement des outputs Terraform...")
     outputs = load_terraform_outputs(outputs_json_path)
     
-    # 3. Crée les credentials GCP depuis le fichier
+    # 3. Crée les credentials GCP depuis le fichier (inutile si seuls des targets DuckDB)
     print("\n🔑 Étape 3/5 : Création des credentials GCP...")
-    credentials = setup_gcp_credentials(credentials_block_name, gcp_project, service_account_file)
+    credentials = None
+    if any(config.get("type", "bigquery") == "bigquery" for config in targets.values()):
+        credentials = setup_gcp_credentials(credentials_block_name, gcp_project, service_account_file)
+    else:
+        print("   Aucun target BigQuery : credentials GCP non nécessaires")
     
     # 4. Pour chaque target, crée les blocs appropriés
     print(f"\n🎯 Étape 4/5 : Configuration des blocs pour {len(targets)} target(s)...")
@@ -164,47 +173,66 @@ def setup_dbt_blocks_pipeline(
     for target_name, target_config in targets.items():
         print(f"\n  📊 Configuration du target '{target_name}'...")
         
-        # Récupérer le dataset depuis les outputs Terraform
-        dataset_key = f"bq_{target_name}_dataset_id"
-        if dataset_key not in outputs:
-            print(f"     ⚠️  Warning: {dataset_key} non trouvé dans les outputs Terraform, utilisation du nom par défaut")
-            schema_name = f"{gcp_project.replace('-', '_')}_{target_name}"
-        else:
-            schema_name = outputs[dataset_key].get("value") if isinstance(outputs[dataset_key], dict) else outputs[dataset_key]
-        
-        # Récupérer threads et location depuis le template
-        threads = target_config.get("threads", 1)
-        location = target_config.get("location", "europe-west9")
-        
-        # Remplacer les variables du template dans location (ex: ${region})
-        if isinstance(location, str) and "${" in location:
-            from string import Template
-            location_template = Template(location)
-            # Préparer le contexte avec les outputs Terraform
-            location_context = {
-                "region": outputs.get("region", {}).get("value") if isinstance(outputs.get("region"), dict) else outputs.get("region", "europe-west9")
-            }
-            location = location_template.safe_substitute(location_context)
-        
         # Noms des blocs pour ce target
-        target_configs_block_name = f"bigquery-target-configs-{target_name}"
         dbt_profile_block_name = f"dbt-cli-profile-{target_name}"
         dbt_operation_run_block_name = f"dbt-operation-run-{target_name}"
         dbt_operation_test_block_name = f"dbt-operation-test-{target_name}"
         dbt_operation_debug_block_name = f"dbt-operation-debug-{target_name}"
         
-        print(f"     - Dataset: {schema_name}")
-        print(f"     - Threads: {threads}")
-        print(f"     - Location: {location}")
+        if target_config.get("type") == "duckdb":
+            # Moteur embarqué : base locale, pas de dataset ni de location
+            target_configs_block_name = f"duckdb-target-configs-{target_name}"
+            schema_name = "main"
+            threads = target_config.get("threads", 4)
+            location = None
+            database_path = resolve_duckdb_path(project_root)
+            
+            print(f"     - Base DuckDB: {database_path}")
+            print(f"     - Threads: {threads}")
+            
+            target_configs = setup_duckdb_target(
+                database_path=database_path,
+                target_configs_block_name=target_configs_block_name,
+                threads=threads,
+                schema_name=schema_name,
+            )
+        else:
+            # Récupérer le dataset depuis les outputs Terraform
+            dataset_key = f"bq_{target_name}_dataset_id"
+            if dataset_key not in outputs:
+                print(f"     ⚠️  Warning: {dataset_key} non trouvé dans les outputs Terraform, utilisation du nom par défaut")
+                schema_name = f"{gcp_project.replace('-', '_')}_{target_name}"
+            else:
+                schema_name = outputs[dataset_key].get("value") if isinstance(outputs[dataset_key], dict) else outputs[dataset_key]
         
-        # Configure BigQuery
-        target_configs = setup_bigquery_target(
-            credentials=credentials,
-            schema_name=schema_name,
-            target_configs_block_name=target_configs_block_name,
-            threads=threads,
-            location=location
-        )
+            # Récupérer threads et location depuis le template
+            threads = target_config.get("threads", 1)
+            location = target_config.get("location", "europe-west9")
+        
+            # Remplacer les variables du template dans location (ex: ${region})
+            if isinstance(location, str) and "${" in location:
+                from string import Template
+                location_template = Template(location)
+                # Préparer le contexte avec les outputs Terraform
+                location_context = {
+                    "region": outputs.get("region", {}).get("value") if isinstance(outputs.get("region"), dict) else outputs.get("region", "europe-west9")
+                }
+                location = location_template.safe_substitute(location_context)
+        
+            target_configs_block_name = f"bigquery-target-configs-{target_name}"
+        
+            print(f"     - Dataset: {schema_name}")
+            print(f"     - Threads: {threads}")
+            print(f"     - Location: {location}")
+        
+            # Configure BigQuery
+            target_configs = setup_bigquery_target(
+                credentials=credentials,
+                schema_name=schema_name,
+                target_configs_block_name=target_configs_block_name,
+                threads=threads,
+                location=location
+            )
         
         # Configure le profil dbt
         dbt_profile = setup_dbt_profile(
@@ -272,7 +300,7 @@ def setup_dbt_blocks_pipeline(
     return results
 
 
-@flow(name="setup-dbt-complete", log_prints=True)
+@flow(name="setup-dbt-complete", log_prints=True, **FLOW_METRIC_HOOKS)
 def setup_dbt_complete_pipeline(
     gcp_project: str,
     credentials_block_name: str = "gcp-credentials",
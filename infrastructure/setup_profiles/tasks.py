@@ -10,11 +10,14 @@ from typing import Any, Dict
 from prefect import task, get_run_logger
 from prefect_gcp.credentials import GcpCredentials
 from prefect_dbt.cli import BigQueryTargetConfigs, DbtCliProfile, DbtCoreOperation
+from prefect_dbt.cli.configs import TargetConfigs
 
-from .config import logger, ProfileGenerationError
+from prefect_flows.metrics import TASK_METRIC_HOOKS
 
+from .config import logger, ProfileGenerationError, resolve_duckdb_path
 
-@task(name="parse-template-targets")
+
+@task(name="parse-template-targets", **TASK_METRIC_HOOKS)
 def parse_template_targets(template_path: Path) -> Dict[str, Dict[str, Any]]:
     """
     Parse le template dbt pour extraire les targets définis
@@ -67,7 +70,7 @@ def parse_template_targets(template_path: Path) -> Dict[str, Dict[str, Any]]:
     }
 
 
-@task(name="load-terraform-outputs")
+@task(name="load-terraform-outputs", **TASK_METRIC_HOOKS)
 def load_terraform_outputs(outputs_path: Path) -> Dict[str, Any]:
     """
     Charge les outputs Terraform depuis un fichier JSON
@@ -102,7 +105,7 @@ def load_terraform_outputs(outputs_path: Path) -> Dict[str, Any]:
         ) from exc
 
 
-@task(name="build-profile-context")
+@task(name="build-profile-context", **TASK_METRIC_HOOKS)
 def build_profile_context(
     outputs: Dict[str, Any],
     project_root: Path,
@@ -158,19 +161,24 @@ def build_profile_context(
     except ValueError:
         relative_sa_path = sa_path
     
+    # Base DuckDB du target local : chemin absolu, dbt-duckdb le résout depuis le cwd
+    duckdb_path = resolve_duckdb_path(project_root)
+    duckdb_path.parent.mkdir(parents=True, exist_ok=True)
+    
     context = {
         "project": unwrap("project_id"),
         "region": unwrap("region"),
         "dev_dataset": unwrap("bq_dev_dataset_id"),
         "prod_dataset": unwrap("bq_prod_dataset_id"),
         "sa_key_path": relative_sa_path.as_posix(),
+        "duckdb_path": duckdb_path.as_posix(),
     }
     
     run_logger.info(f"Contexte construit: project={context['project']}, region={context['region']}")
     return context
 
 
-@task(name="render-profile-template")
+@task(name="render-profile-template", **TASK_METRIC_HOOKS)
 def render_profile_template(template_path: Path, context: Dict[str, str]) -> str:
     """
     Rend le template de profil dbt avec le contexte fourni
@@ -204,7 +212,7 @@ def render_profile_template(template_path: Path, context: Dict[str, str]) -> str
         ) from exc
 
 
-@task(name="write-local-profile")
+@task(name="write-local-profile", **TASK_METRIC_HOOKS)
 def write_local_profile(content: str, output_path: Path) -> Path:
     """
     Écrit le profil dbt dans un fichier local
@@ -227,7 +235,7 @@ def write_local_profile(content: str, output_path: Path) -> Path:
     return output_path
 
 
-@task(name="setup-gcp-credentials")
+@task(name="setup-gcp-credentials", **TASK_METRIC_HOOKS)
 def setup_gcp_credentials(credentials_block_name: str, gcp_project: str, service_account_file: Path):
     """
     Crée et sauvegarde les credentials GCP depuis un fichier de service account
@@ -259,7 +267,7 @@ def setup_gcp_credentials(credentials_block_name: str, gcp_project: str, service
     return credentials
 
 
-@task(name="setup-bigquery-target")
+@task(name="setup-bigquery-target", **TASK_METRIC_HOOKS)
 def setup_bigquery_target(
     credentials: GcpCredentials,
     schema_name: str,
@@ -298,9 +306,45 @@ def setup_bigquery_target(
     return target_configs
 
 
-@task(name="setup-dbt-profile")
+@task(name="setup-duckdb-target", **TASK_METRIC_HOOKS)
+def setup_duckdb_target(
+    database_path: Path,
+    target_configs_block_name: str,
+    threads: int = 4,
+    schema_name: str = "main",
+):
+    """
+    Configure et sauvegarde les configurations DuckDB (moteur embarqué) pour dbt
+    
+    Args:
+        database_path: Chemin du fichier de base DuckDB
+        target_configs_block_name: Nom du bloc où sauvegarder la configuration
+        threads: Nombre de threads pour dbt (default: 4)
+        schema_name: Schéma DuckDB cible (default: main)
+    
+    Returns:
+        TargetConfigs: La configuration DuckDB
+    """
+    try:
+        run_logger = get_run_logger()
+    except Exception:
+        run_logger = logger
+    
+    run_logger.info(f"Configuration de DuckDB sur '{database_path}' (threads={threads})...")
+    target_configs = TargetConfigs(
+        type="duckdb",
+        schema=schema_name,
+        threads=threads,
+        extras={"path": Path(database_path).as_posix()},
+    )
+    target_configs.save(target_configs_block_name, overwrite=True)
+    run_logger.info(f"Configuration DuckDB sauvegardée dans le bloc '{target_configs_block_name}'")
+    return target_configs
+
+
+@task(name="setup-dbt-profile", **TASK_METRIC_HOOKS)
 def setup_dbt_profile(
-    target_configs: BigQueryTargetConfigs,
+    target_configs: BigQueryTargetConfigs | TargetConfigs,
     profile_name: str,
     target_name: str,
     dbt_profile_block_name: str
@@ -309,7 +353,7 @@ def setup_dbt_profile(
     Configure et sauvegarde le profil dbt
     
     Args:
-        target_configs: Configuration BigQuery
+        target_configs: Configuration du target (BigQuery ou DuckDB)
         profile_name: Nom du profil dbt
         target_name: Nom de la target dbt
         dbt_profile_block_name: Nom du bloc où sauvegarder le profil
@@ -333,7 +377,7 @@ def setup_dbt_profile(
     return dbt_cli_profile
 
 
-@task(name="setup-dbt-operation")
+@task(name="setup-dbt-operation", **TASK_METRIC_HOOKS)
 def setup_dbt_operation(
     dbt_profile: DbtCliProfile | None,
     dbt_profile_block_name: str | None,
@@ -0,0 +1,210 @@
+"""
+Cache de construction des modèles dbt, adressé par le contenu
+
+Dans le run nocturne, la plupart des modèles ont les mêmes entrées d'un jour
+à l'autre : les reconstruire ne change rien. Avant `dbt run`, les modèles sont
+compilés (`dbt compile`) et chacun reçoit une clé :
+
+    empreinte(SHA-256 du SQL compilé, config du modèle (matérialisation,
+              stratégie, partitionnement...), versions des relations amont)
+
+(versions : voir data_versions.py). Un modèle est sauté si :
+
+    - sa clé est celle de sa dernière construction réussie,
+    - sa relation existe toujours, avec la version relevée juste après cette
+      construction (pas de modification hors pipeline),
+    - aucun de ses modèles amont n'est reconstruit par ce run.
+
+Après le run, la clé de chaque modèle construit est recalculée avec les
+versions amont qu'il a effectivement lues, puis enregistrée : versions relevées
+au plan pour les relations que le run n'a pas reconstruites, relues juste après
+le run pour celles qu'il a reconstruites. Le flow détient le verrou dbt du
+target du plan à l'enregistrement (microbatch.holding_target_lock) : un
+micro-batch ne modifie pas les relations amont entre-temps.
+
+État conservé par target dans STATE_DIR/build_cache/{target}.json, une entrée
+par modèle. Le cache ne s'applique pas aux runs en full refresh ni aux runs
+échantillonnés. Le résumé (modèles sautés, construits, entrées) est retourné
+dans `build_cache` du résultat de la pipeline.
+"""
+import time
+from typing import Any
+
+from prefect import task, get_run_logger
+
+from prefect_flows.config import STATE_DIR
+from prefect_flows.data_versions import fingerprint, node_data_versions
+from prefect_flows.dbt_runner import build_dbt_command, run_dbt_command
+from prefect_flows.materialization import load_manifest
+from prefect_flows.metrics import DBT_NODES, TASK_METRIC_HOOKS
+from prefect_flows.run_history import current_flow_run_id, load_invocations
+from prefect_flows.state import read_json, write_json_atomic
+from prefect_flows.warehouse import Warehouse, resolve_warehouse
+
+
+BUILD_CACHE_DIR = STATE_DIR / "build_cache"
+
+# Statut rapporté pour un modèle non reconstruit car en cache
+CACHED_BUILD = "cached"
+
+
+def _cache_path(target: str):
+    return BUILD_CACHE_DIR / f"{target}.json"
+
+
+def _models(manifest: dict[str, Any]) -> dict[str, dict[str, Any]]:
+    return {unique_id: node for unique_id, node in manifest["nodes"].items() if node["resource_type"] == "model"}
+
+
+def _parents(models: dict[str, dict[str, Any]]) -> list[str]:
+    return sorted({parent for node in models.values() for parent in node["depends_on"]["nodes"]})
+
+
+def _build_keys(
+    warehouse: Warehouse,
+    manifest: dict[str, Any],
+    models: dict[str, dict[str, Any]],
+    input_versions: dict[str, str | None],
+) -> tuple[dict[str, str], dict[str, str | None]]:
+    """Clés de construction (d'après les versions amont données) et versions des relations des modèles."""
+    keys = {}
+    for unique_id, node in models.items():
+        inputs = {parent: input_versions.get(parent) for parent in node["depends_on"]["nodes"]}
+        if node.get("compiled_code") is None or None in inputs.values():
+            continue
+        keys[unique_id] = fingerprint([fingerprint(node["compiled_code"]), node["config"], inputs])
+
+    # Version propre de chaque relation (existence et absence de modification hors pipeline)
+    relations = {unique_id: node["relation_name"] for unique_id, node in models.items() if node.get("relation_name")}
+    relation_versions = warehouse.data_versions(sorted(set(relations.values())))
+    return keys, {unique_id: relation_versions.get(relation) for unique_id, relation in relations.items()}
+
+
+@task(name="plan-model-builds", **TASK_METRIC_HOOKS)
+def plan_model_builds(target: str = "dev", dbt_vars: dict[str, Any] | None = None) -> dict[str, Any]:
+    """
+    Compile les modèles et repère ceux dont la dernière construction est toujours valable
+
+    Args:
+        target: Environnement cible
+        dbt_vars: Variables dbt du run (même compilation, fenêtres des marts comprises)
+
+    Returns:
+        Dict {"planned_at", "keys": {unique_id: clé}, "cached": [unique_id],
+        "exclude": [nom des modèles en cache], "total": modèles du projet,
+        "input_versions": {unique_id amont: version relevée au plan}}
+    """
+    logger = get_run_logger()
+    planned_at = time.time()
+    run_dbt_command(
+        build_dbt_command("compile", select=["resource_type:model"], dbt_vars=dbt_vars),
+        target=target, operation="compile", logger=logger,
+    )
+    manifest = load_manifest()
+    models = _models(manifest)
+    warehouse = resolve_warehouse(target, logger, stage="build_cache")
+    input_versions = node_data_versions(warehouse, manifest, _parents(models))
+    keys, versions = _build_keys(warehouse, manifest, models, input_versions)
+    cache = read_json(_cache_path(target), default={})
+
+    hits: dict[str, bool] = {}
+
+    def is_hit(unique_id: str) -> bool:
+        if unique_id not in hits:
+            node = models[unique_id]
+            # Un modèle amont reconstruit change les données lues : pas de saut en aval
+            parents_hit = all(is_hit(parent) for parent in node["depends_on"]["nodes"] if parent in models)
+            if node["config"].get("materialized") == "ephemeral":
+                hits[unique_id] = parents_hit
+            else:
+                entry = cache.get(unique_id) or {}
+                hits[unique_id] = (
+                    parents_hit
+                    and unique_id in keys
+                    and entry.get("key") == keys[unique_id]
+                    and versions.get(unique_id) is not None
+                    and entry.get("version") == versions[unique_id]
+                )
+        return hits[unique_id]
+
+    cached = sorted(
+        unique_id for unique_id, node in models.items()
+        if is_hit(unique_id) and node["config"].get("materialized") != "ephemeral"
+    )
+    buildable = [unique_id for unique_id, node in models.items() if node["config"].get("materialized") != "ephemeral"]
+    if cached:
+        DBT_NODES.inc(len(cached), target=target, operation="run", status=CACHED_BUILD)
+        logger.info(
+            f"📦 {len(cached)}/{len(buildable)} modèle(s) en cache (SQL, config et entrées inchangés) : "
+            f"{', '.join(models[unique_id]['name'] for unique_id in cached)}"
+        )
+    else:
+        logger.info(f"📦 Aucun modèle en cache : {len(buildable)} modèle(s) construit(s)")
+    return {
+        "planned_at": planned_at,
+        "keys": keys,
+        "cached": cached,
+        "exclude": [models[unique_id]["name"] for unique_id in cached],
+        "total": len(buildable),
+        "input_versions": input_versions,
+    }
+
+
+@task(name="record-model-builds", **TASK_METRIC_HOOKS)
+def record_model_builds(target: str = "dev", plan: dict[str, Any] | None = None) -> dict[str, Any]:
+    """
+    Enregistre les constructions réussies du dernier `dbt run` du flow run en cours
+
+    Args:
+        target: Environnement cible
+        plan: Résultat de plan_model_builds
+
+    Returns:
+        Résumé {"cached": [nom], "built", "recorded", "entries"}
+    """
+    logger = get_run_logger()
+    cache = read_json(_cache_path(target), default={})
+    invocations = load_invocations(target, flow_run_id=current_flow_run_id(), operation="run", limit=1)
+    results = []
+    if invocations and invocations[0]["started_at"] >= plan["planned_at"]:
+        results = invocations[0]["results"]
+
+    manifest = load_manifest()
+    models = _models(manifest)
+    built = [
+        result["unique_id"] for result in results if result["status"] == "success" and result["unique_id"] in models
+    ]
+    for result in results:
+        cache.pop(result["unique_id"], None)
+
+    recorded = 0
+    if built:
+        # Versions amont lues par le run : celles du plan, sauf pour les relations
+        # que le run vient de reconstruire (et les modèles éphémères), relues maintenant
+        warehouse = resolve_warehouse(target, logger, stage="build_cache")
+        built_models = {unique_id: models[unique_id] for unique_id in built}
+        rebuilt = {result["unique_id"] for result in results}
+        reread = [
+            parent for parent in _parents(built_models)
+            if parent in rebuilt or (parent in models and models[parent]["config"].get("materialized") == "ephemeral")
+        ]
+        input_versions = {**plan["input_versions"]}
+        if reread:
+            input_versions.update(node_data_versions(warehouse, manifest, reread))
+        keys, versions = _build_keys(warehouse, manifest, built_models, input_versions)
+        now = time.time()
+        for unique_id in built:
+            if unique_id in keys and versions.get(unique_id) is not None:
+                cache[unique_id] = {"key": keys[unique_id], "version": versions[unique_id], "built_at": now}
+                recorded += 1
+
+    # Modèles supprimés du projet
+    cache = {unique_id: entry for unique_id, entry in cache.items() if unique_id in models}
+    write_json_atomic(_cache_path(target), cache)
+    logger.info(f"📦 {recorded} construction(s) enregistrée(s) dans le cache ({len(cache)} entrée(s))")
+    return {
+        "cached": plan["exclude"],
+        "built": len(built),
+        "recorded": recorded,
+        "entries": len(cache),
+    }
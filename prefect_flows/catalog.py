@@ -0,0 +1,208 @@
+"""
+Cache des métadonnées du catalogue de l'entrepôt, partagé entre les runs
+
+Les étapes Python de la pipeline (ingestion, rollups, conseiller de
+matérialisation...) interrogent l'entrepôt relation par relation : colonnes
+d'une table, existence d'une table. Sur BigQuery, chaque appel est un
+aller-retour vers l'API.
+
+Au début d'un run, le catalogue de chaque dataset (schéma DuckDB) est lu en une
+requête (INFORMATION_SCHEMA, voir Warehouse.catalog_entries) et conservé dans
+STATE_DIR/catalog/{target}.json. Les appels Warehouse.columns sont ensuite
+servis par le cache :
+
+    - relation présente          -> ses colonnes
+    - relation absente d'un dataset lu -> liste vide (la relation n'existe pas)
+    - relation invalidée, dataset non lu ou lu depuis plus de
+      CATALOG_MAX_AGE_SECONDS    -> requête à l'entrepôt, dont le résultat est
+                                    remis en cache
+
+Une relation est invalidée dès que le run l'écrit : tables créées, remplacées,
+fusionnées ou supprimées par Warehouse.execute / load_csv, et nœuds exécutés
+par dbt (run_results, voir dbt_runner.py). Un dataset lu il y a moins de
+CATALOG_PREFETCH_AGE_SECONDS n'est pas relu (runs rapprochés du micro-batch).
+
+Les recherches servies par le cache (allers-retours évités) et celles envoyées
+à l'entrepôt sont comptées dans pipeline_catalog_lookups_total, et par flow
+run (catalog_usage, repris dans le résultat de l'ingestion).
+
+L'introspection de dbt n'est pas servie par ce cache : sur BigQuery,
+list_relations_without_caching et get_columns_in_relation sont des méthodes
+Python de l'adaptateur, pas des macros surchargeables par le projet. Le flow
+dbt_full_pipeline ne lit donc pas le catalogue ; seules les invalidations
+dues aux nœuds exécutés par dbt le concernent.
+"""
+import re
+import threading
+import time
+from typing import Any
+
+from prefect import task, get_run_logger
+
+from prefect_flows.config import OFFLINE_TARGETS, STATE_DIR
+from prefect_flows.metrics import TASK_METRIC_HOOKS, Counter
+from prefect_flows.run_history import current_flow_run_id
+from prefect_flows.state import read_json, write_json_atomic
+
+
+CATALOG_DIR = STATE_DIR / "catalog"
+
+# Âge maximal d'un catalogue servi, et âge en dessous duquel il n'est pas relu en début de run
+CATALOG_MAX_AGE_SECONDS = 3600
+CATALOG_PREFETCH_AGE_SECONDS = 300
+
+# Instructions qui écrivent une relation : create/drop table, insert/merge into, update, delete from
+_WRITTEN_RELATION = re.compile(
+    r"\b(?:table|view|into|update|delete\s+from)\s+(?:if\s+(?:not\s+)?exists\s+)?([`\"\w.\-]+)",
+    re.IGNORECASE,
+)
+
+CATALOG_LOOKUPS = Counter(
+    "pipeline_catalog_lookups_total", "Recherches de métadonnées (colonnes, existence), par résultat (hit, miss)",
+    ("target", "result"),
+)
+
+_lock = threading.Lock()
+_usage: dict[str, dict[str, int]] = {}
+
+
+def written_relations(sql: str) -> set[str]:
+    """Noms (sans dataset) des relations écrites par une instruction SQL."""
+    return {match.replace("`", "").replace('"', "").split(".")[-1] for match in _WRITTEN_RELATION.findall(sql)}
+
+
+class CatalogCache:
+    """Catalogue d'un target : {namespace: {"fetched_at", "relations": {nom: colonnes}, "stale": [nom]}}."""
+
+    def __init__(self, target: str):
+        self.target = target
+        self.path = CATALOG_DIR / f"{target}.json"
+
+    def _load(self) -> dict[str, Any]:
+        try:
+            return read_json(self.path, default={})
+        except ValueError:
+            return {}
+
+    def _update(self, change) -> None:
+        # Écritures concurrentes (processus du worker) : au pire une entrée perdue, relue ensuite
+        with _lock:
+            catalog = self._load()
+            change(catalog)
+            write_json_atomic(self.path, catalog)
+
+    def _count(self, result: str) -> None:
+        CATALOG_LOOKUPS.inc(target=self.target, result=result)
+        with _lock:
+            usage = _usage.setdefault(current_flow_run_id(), {"hit": 0, "miss": 0})
+            usage[result] += 1
+
+    def age(self, namespace: str) -> float | None:
+        """Âge (secondes) du catalogue d'un namespace, None s'il n'a pas été lu."""
+        entry = self._load().get(namespace)
+        return time.time() - entry["fetched_at"] if entry else None
+
+    def prefetch(self, warehouse, max_age: float = CATALOG_PREFETCH_AGE_SECONDS) -> bool:
+        """
+        Lit le catalogue du schéma d'un entrepôt en une requête, sauf s'il est récent
+
+        Returns:
+            True si le catalogue a été relu
+        """
+        age = self.age(warehouse.namespace)
+        if age is not None and age < max_age:
+            return False
+        fetched_at = time.time()
+        relations = warehouse.catalog_entries()
+
+        def store(catalog):
+            catalog[warehouse.namespace] = {"fetched_at": fetched_at, "relations": relations, "stale": []}
+
+        self._update(store)
+        return True
+
+    def columns(self, namespace: str, name: str) -> list[str] | None:
+        """Colonnes en cache d'une relation ([] si absente du dataset), None si inconnues."""
+        entry = self._load().get(namespace)
+        if not entry or time.time() - entry["fetched_at"] > CATALOG_MAX_AGE_SECONDS or name in entry["stale"]:
+            self._count("miss")
+            return None
+        self._count("hit")
+        return entry["relations"].get(name, [])
+
+    def store(self, namespace: str, name: str, columns: list[str]) -> None:
+        """Remet en cache les colonnes lues dans l'entrepôt après un défaut de cache."""
+        def change(catalog):
+            entry = catalog.get(namespace)
+            if not entry:
+                return
+            if columns:
+                entry["relations"][name] = columns
+            else:
+                entry["relations"].pop(name, None)
+            entry["stale"] = [stale for stale in entry["stale"] if stale != name]
+
+        self._update(change)
+
+    def invalidate(self, names: set[str] | list[str], namespace: str | None = None) -> None:
+        """Invalide des relations écrites par le run (dans tous les namespaces si non précisé)."""
+        names = set(names)
+        if not names or not self.path.exists():
+            return
+
+        def change(catalog):
+            for key, entry in catalog.items():
+                if namespace is None or key == namespace:
+                    entry["stale"] = sorted(set(entry["stale"]) | names)
+
+        self._update(change)
+
+
+def catalog_usage(flow_run_id: str | None = None) -> dict[str, int]:
+    """Recherches du flow run (défaut : en cours) servies par le cache (hit) ou l'entrepôt (miss)."""
+    with _lock:
+        return dict(_usage.get(flow_run_id or current_flow_run_id(), {"hit": 0, "miss": 0}))
+
+
+def invalidate_dbt_results(target: str, results: list[dict[str, Any]]) -> None:
+    """Invalide les relations des nœuds exécutés par une commande dbt (modèles, seeds, snapshots)."""
+    names = {
+        result["unique_id"].split(".")[-1] for result in results
+        if result["unique_id"].split(".")[0] in ("model", "seed", "snapshot")
+    }
+    CatalogCache(target).invalidate(names)
+
+
+@task(name="prefetch-catalog", **TASK_METRIC_HOOKS)
+def prefetch_catalog(target: str = "dev", schemas: list[str] | None = None) -> dict[str, Any]:
+    """
+    Lit en début de run le catalogue des datasets du target (une requête par dataset)
+
+    Args:
+        target: Environnement cible
+        schemas: Datasets supplémentaires (ex: schéma des tables brutes)
+
+    Returns:
+        Dict {"prefetched": [namespace relu], "reused": [namespace récent]}
+    """
+    # Import différé : warehouse.py importe ce module
+    from prefect_flows.ingestion import LOCAL_RAW_SCHEMA
+    from prefect_flows.warehouse import resolve_warehouse
+
+    logger = get_run_logger()
+    warehouse = resolve_warehouse(target, logger, stage="catalog")
+    schemas = list(schemas or [])
+    if target in OFFLINE_TARGETS:
+        schemas.append(LOCAL_RAW_SCHEMA)
+    warehouses = [warehouse] + [warehouse.in_schema(schema) for schema in schemas]
+
+    cache = CatalogCache(target)
+    summary: dict[str, list[str]] = {"prefetched": [], "reused": []}
+    for schema_warehouse in warehouses:
+        refreshed = cache.prefetch(schema_warehouse)
+        summary["prefetched" if refreshed else "reused"].append(schema_warehouse.namespace)
+    logger.info(
+        f"🗂️  Catalogue : {len(summary['prefetched'])} dataset(s) lu(s) en une requête chacun "
+        f"{summary['prefetched'] or ''}, {len(summary['reused'])} récent(s) réutilisé(s)"
+    )
+    return summary
@@ -0,0 +1,437 @@
+"""
+Compaction des petits fichiers déposés dans le magasin d'objets de landing
+
+Les batchs d'ingestion fréquents laissent sous `<prefix>/<table>/` (voir
+prefect_flows/upload.py) des milliers de petits CSV : chaque fichier coûte un
+job de chargement et ralentit les lectures. La compaction réécrit ces dépôts
+en fichiers Parquet (zstd) d'environ `target_file_mb` Mo, rangés par jour
+d'événement :
+
+    <prefix>/<table>/event_date=YYYY-MM-DD/part-<génération>-<n>.parquet
+
+Pour chaque table :
+
+    1. les CSV déposés sont lus en flux (blocs de CSV_BLOCK_MB Mo), répartis
+       par jour d'événement (RAW_TABLES), puis les fichiers Parquet existants
+       des jours touchés sont relus pour être fusionnés avec eux
+    2. les lignes sont tamponnées par partition et écrites par row groups ;
+       le total tamponné est borné (MAX_BUFFERED_MB), la partition la plus
+       chargée est vidée au-delà. Un fichier est fermé dès qu'il atteint la
+       taille cible.
+    3. le nombre de lignes écrites est comparé au nombre de lignes lues, puis
+       les nouveaux fichiers sont déposés (par morceaux, CRC32C vérifié)
+    4. bascule : le manifeste `<prefix>/<table>/_compaction.json`, qui liste
+       les fichiers actifs de chaque partition, est remplacé en une écriture ;
+       les fichiers remplacés sont ensuite supprimés
+
+Les lecteurs s'appuient sur le manifeste : avant la bascule ils voient
+l'ancienne génération complète, après elle la nouvelle. Un run interrompu est
+rattrapé au run suivant (fichiers non publiés et sources déjà compactées
+supprimés avant toute relecture).
+
+Le flow tourne à heure fixe et, entre deux, dès que `min_files` CSV sont en
+attente pour une table (deployment `compaction` dans prefect.yml). Les fichiers
+et octets avant/après sont loggés, conservés dans l'historique du manifeste et
+exposés dans les métriques (pipeline_compaction_files, pipeline_compaction_bytes).
+
+En local:
+    uv run python -m prefect_flows.compaction --target local --min-files 1
+"""
+import argparse
+import base64
+import json
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from prefect import flow, task, get_run_logger
+
+from prefect_flows.ingestion import RAW_TABLES
+from prefect_flows.metrics import FLOW_METRIC_HOOKS, TASK_METRIC_HOOKS, Gauge
+from prefect_flows.upload import LANDING_PREFIX, ObjectStore, crc32c, resolve_object_store, upload_file
+
+
+# Nombre de CSV en attente qui déclenche la compaction d'une table
+COMPACTION_MIN_FILES = 20
+
+# Taille visée des fichiers compactés
+TARGET_FILE_MB = 128
+
+# Lecture des CSV et tampons d'écriture (bornent la mémoire du run)
+CSV_BLOCK_MB = 16
+PARTITION_BUFFER_MB = 32
+MAX_BUFFERED_MB = 256
+
+PARQUET_COMPRESSION = "zstd"
+
+# Colonne de partition des fichiers compactés, et partition des lignes sans jour d'événement
+PARTITION_COLUMN = "event_date"
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+MANIFEST_NAME = "_compaction.json"
+MANIFEST_HISTORY = 20
+
+SOURCE_SUFFIXES = (".csv", ".csv.gz")
+
+COMPACTION_FILES = Gauge(
+    "pipeline_compaction_files", "Fichiers du périmètre de la dernière compaction", ("target", "table", "stage")
+)
+COMPACTION_BYTES = Gauge(
+    "pipeline_compaction_bytes", "Octets du périmètre de la dernière compaction", ("target", "table", "stage")
+)
+
+
+class _PartitionWriter:
+    """Fichiers Parquet d'une partition, fermés à la taille cible."""
+
+    def __init__(self, directory: Path, generation: int, schema: pa.Schema, target_bytes: int):
+        self.directory = directory
+        self.generation = generation
+        self.schema = schema
+        self.target_bytes = target_bytes
+        self.files: list[Path] = []
+        self.buffer: list[pa.RecordBatch] = []
+        self.buffered = 0
+        self.rows = 0
+        self._writer = None
+
+    def add(self, batch: pa.RecordBatch) -> None:
+        self.buffer.append(batch)
+        self.buffered += batch.nbytes
+
+    def flush(self) -> None:
+        """Écrit le tampon en un row group."""
+        if not self.buffer:
+            return
+        table = pa.Table.from_batches(self.buffer, schema=self.schema)
+        if self._writer is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / f"part-{self.generation:05d}-{len(self.files):05d}.parquet"
+            self._writer = pq.ParquetWriter(path, self.schema, compression=PARQUET_COMPRESSION)
+            self.files.append(path)
+        self._writer.write_table(table, row_group_size=table.num_rows)
+        self.rows += table.num_rows
+        self.buffer, self.buffered = [], 0
+        if self.files[-1].stat().st_size >= self.target_bytes:
+            self._close_file()
+
+    def _close_file(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def close(self) -> None:
+        self.flush()
+        self._close_file()
+
+
+class _Compactor:
+    """Répartit des lignes par jour d'événement, avec un tampon total borné."""
+
+    def __init__(self, workdir: Path, generation: int, schema: pa.Schema, event_column: str, target_bytes: int):
+        self.workdir = workdir
+        self.generation = generation
+        self.schema = schema
+        self.event_column = event_column
+        self.target_bytes = target_bytes
+        self.partitions: dict[str, _PartitionWriter] = {}
+        self.rows_read = 0
+
+    def _writer(self, partition: str) -> _PartitionWriter:
+        if partition not in self.partitions:
+            self.partitions[partition] = _PartitionWriter(
+                self.workdir / f"{PARTITION_COLUMN}={partition}", self.generation, self.schema, self.target_bytes
+            )
+        return self.partitions[partition]
+
+    def add(self, batch: pa.RecordBatch) -> None:
+        batch = pa.Table.from_batches([batch.select(self.schema.names)]).cast(self.schema).combine_chunks()
+        self.rows_read += batch.num_rows
+        days = pc.cast(batch[self.event_column], pa.date32())
+        for day in pc.unique(days).to_pylist():
+            mask = pc.is_null(days) if day is None else pc.fill_null(pc.equal(days, pa.scalar(day, pa.date32())), False)
+            partition = NULL_PARTITION if day is None else day.isoformat()
+            writer = self._writer(partition)
+            for chunk in batch.filter(mask).to_batches():
+                writer.add(chunk)
+            if writer.buffered >= PARTITION_BUFFER_MB * 1024 * 1024:
+                writer.flush()
+        while sum(writer.buffered for writer in self.partitions.values()) > MAX_BUFFERED_MB * 1024 * 1024:
+            max(self.partitions.values(), key=lambda writer: writer.buffered).flush()
+
+    def close(self) -> dict[str, list[Path]]:
+        for writer in self.partitions.values():
+            writer.close()
+        return {partition: writer.files for partition, writer in self.partitions.items()}
+
+    @property
+    def rows_written(self) -> int:
+        return sum(writer.rows for writer in self.partitions.values())
+
+
+def _csv_reader(path: Path, schema: pa.Schema | None, event_column: str):
+    """Lecteur CSV en flux ; types imposés par le schéma de référence s'il existe."""
+    column_types = {field.name: field.type for field in schema} if schema else {event_column: pa.timestamp("us")}
+    return pa_csv.open_csv(
+        pa.input_stream(str(path), compression="detect"),
+        read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_MB * 1024 * 1024),
+        convert_options=pa_csv.ConvertOptions(column_types=column_types),
+    )
+
+
+def _reference_schema(schema: pa.Schema) -> pa.Schema:
+    # Une colonne vide dans le premier bloc est inférée `null` : on la garde en texte
+    return pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in schema])
+
+
+def _encode_schema(schema: pa.Schema) -> str:
+    return base64.b64encode(schema.serialize().to_pybytes()).decode("ascii")
+
+
+def _decode_schema(encoded: str) -> pa.Schema:
+    return pa.ipc.read_schema(pa.py_buffer(base64.b64decode(encoded)))
+
+
+def _read_manifest(store: ObjectStore, name: str) -> dict[str, Any]:
+    content = store.read(name)
+    if content is None:
+        return {"generation": 0, "schema": None, "partitions": {}, "consumed": [], "history": []}
+    return json.loads(content)
+
+
+def _write_manifest(store: ObjectStore, name: str, manifest: dict[str, Any]) -> None:
+    content = json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+    store.put(name, content, crc32c(content))
+
+
+def compact_table(
+    store: ObjectStore,
+    table: str,
+    prefix: str = LANDING_PREFIX,
+    min_files: int = COMPACTION_MIN_FILES,
+    target_file_mb: int = TARGET_FILE_MB,
+    logger=None,
+) -> dict[str, Any]:
+    """
+    Compacte les CSV déposés d'une table en fichiers Parquet partitionnés par jour
+
+    Args:
+        store: Magasin d'objets de landing
+        table: Table brute (RAW_TABLES)
+        prefix: Préfixe des dépôts (les objets de la table sont sous `<prefix>/<table>/`)
+        min_files: CSV en attente en dessous desquels la table n'est pas compactée
+        target_file_mb: Taille visée des fichiers Parquet
+        logger: Logger des rattrapages (optionnel)
+
+    Returns:
+        Dict {"table", "skipped", "pending_files", "generation", "partitions",
+        "rows", "before": {"files", "bytes"}, "after": {"files", "bytes"}}
+    """
+    root = f"{prefix.rstrip('/')}/{table}"
+    manifest_name = f"{root}/{MANIFEST_NAME}"
+    event_column = RAW_TABLES[table]["event_column"]
+    manifest = _read_manifest(store, manifest_name)
+    objects = store.list(f"{root}/")
+
+    # Rattrapage d'un run interrompu : sources compactées non supprimées, fichiers non publiés
+    live = {entry["name"] for entries in manifest["partitions"].values() for entry in entries}
+    leftovers = [name for name in manifest["consumed"] if name in objects]
+    leftovers += [name for name in objects if name.endswith(".parquet") and name not in live]
+    if leftovers:
+        if logger:
+            logger.info(f"🧹 {table}: {len(leftovers)} fichier(s) laissé(s) par une compaction interrompue supprimé(s)")
+        store.delete(leftovers)
+        objects = {name: size for name, size in objects.items() if name not in leftovers}
+    if manifest["consumed"]:
+        manifest["consumed"] = []
+        _write_manifest(store, manifest_name, manifest)
+
+    sources = sorted(name for name in objects if name.endswith(SOURCE_SUFFIXES))
+    result = {"table": table, "skipped": len(sources) < max(min_files, 1), "pending_files": len(sources)}
+    if result["skipped"]:
+        return result
+
+    generation = manifest["generation"] + 1
+    schema = _decode_schema(manifest["schema"]) if manifest["schema"] else None
+    replaced: list[dict] = []
+    with tempfile.TemporaryDirectory(prefix=f"compaction-{table}-") as tmp:
+        workdir = Path(tmp)
+        download = workdir / "download"
+        compactor = None
+        for name in sources:
+            store.download(name, download)
+            reader = _csv_reader(download, schema, event_column)
+            if compactor is None:
+                schema = schema or _reference_schema(reader.schema)
+                if schema != reader.schema:
+                    reader = _csv_reader(download, schema, event_column)
+                compactor = _Compactor(workdir / "out", generation, schema, event_column, target_file_mb * 1024 * 1024)
+            for batch in reader:
+                compactor.add(batch)
+            download.unlink()
+
+        # Fichiers déjà compactés des jours touchés : fusionnés dans la nouvelle génération
+        for partition in list(compactor.partitions):
+            for entry in manifest["partitions"].get(partition, []):
+                store.download(entry["name"], download)
+                for batch in pq.ParquetFile(download).iter_batches():
+                    compactor.add(batch)
+                download.unlink()
+                replaced.append(entry)
+
+        files = compactor.close()
+        if compactor.rows_written != compactor.rows_read:
+            raise ValueError(
+                f"{table}: {compactor.rows_written} ligne(s) écrite(s) pour {compactor.rows_read} lue(s), "
+                f"compaction annulée"
+            )
+
+        published = {}
+        for partition, paths in files.items():
+            published[partition] = []
+            for path in paths:
+                name = f"{root}/{PARTITION_COLUMN}={partition}/{path.name}"
+                upload_file(store, path, name)
+                published[partition].append(
+                    {"name": name, "bytes": path.stat().st_size, "rows": pq.ParquetFile(path).metadata.num_rows}
+                )
+
+    consumed = sources + [entry["name"] for entry in replaced]
+    result.update({
+        "generation": generation,
+        "partitions": sorted(published),
+        "rows": compactor.rows_written,
+        "before": {
+            "files": len(consumed),
+            "bytes": sum(objects[name] for name in sources) + sum(entry["bytes"] for entry in replaced),
+        },
+        "after": {
+            "files": sum(len(entries) for entries in published.values()),
+            "bytes": sum(entry["bytes"] for entries in published.values() for entry in entries),
+        },
+    })
+
+    # Bascule : une seule écriture du manifeste, puis suppression des fichiers remplacés
+    manifest.update({
+        "generation": generation,
+        "schema": _encode_schema(schema),
+        "partitions": {**manifest["partitions"], **published},
+        "consumed": consumed,
+        "history": (manifest["history"] + [{
+            "generation": generation,
+            "compacted_at": datetime.now(timezone.utc).isoformat(),
+            **{key: result[key] for key in ("partitions", "rows", "before", "after")},
+        }])[-MANIFEST_HISTORY:],
+    })
+    _write_manifest(store, manifest_name, manifest)
+    store.delete(consumed)
+    manifest["consumed"] = []
+    _write_manifest(store, manifest_name, manifest)
+    return result
+
+
+@task(name="compact-landed-files", **TASK_METRIC_HOOKS)
+def compact_landed_files(
+    target: str,
+    table: str,
+    prefix: str = LANDING_PREFIX,
+    min_files: int = COMPACTION_MIN_FILES,
+    target_file_mb: int = TARGET_FILE_MB,
+    bucket: str | None = None,
+) -> dict[str, Any]:
+    """
+    Compacte les dépôts d'une table brute si assez de CSV sont en attente
+
+    Args:
+        target: Environnement cible (dev, prod ou local)
+        table: Table brute (viewing_logs ou social_interactions)
+        prefix: Préfixe des dépôts
+        min_files: CSV en attente qui déclenchent la compaction
+        target_file_mb: Taille visée des fichiers Parquet
+        bucket: Bucket GCS (default: PIPELINE_LANDING_BUCKET)
+
+    Returns:
+        Résultat de la compaction (voir compact_table)
+    """
+    if table not in RAW_TABLES:
+        raise ValueError(f"Table brute inconnue: {table} (attendu: {', '.join(RAW_TABLES)})")
+    logger = get_run_logger()
+    store = resolve_object_store(target, logger, bucket)
+    result = compact_table(store, table, prefix, min_files, target_file_mb, logger)
+
+    if result["skipped"]:
+        logger.info(f"⏭️  {table}: {result['pending_files']} fichier(s) en attente, seuil de {min_files} non atteint")
+        return result
+    for stage in ("before", "after"):
+        COMPACTION_FILES.set(result[stage]["files"], target=target, table=table, stage=stage)
+        COMPACTION_BYTES.set(result[stage]["bytes"], target=target, table=table, stage=stage)
+    logger.info(
+        f"🗜️  {table} (génération {result['generation']}): {result['before']['files']} fichier(s) / "
+        f"{result['before']['bytes'] / 1e6:.1f} Mo → {result['after']['files']} fichier(s) / "
+        f"{result['after']['bytes'] / 1e6:.1f} Mo, {result['rows']} ligne(s) sur {len(result['partitions'])} jour(s)"
+    )
+    return result
+
+
+@flow(name="pipeline-compaction", log_prints=True, **FLOW_METRIC_HOOKS)
+def landing_compaction_pipeline(
+    target: str = "dev",
+    tables: list[str] | None = None,
+    prefix: str = LANDING_PREFIX,
+    min_files: int = COMPACTION_MIN_FILES,
+    target_file_mb: int = TARGET_FILE_MB,
+    bucket: str | None = None,
+):
+    """
+    Compacte les petits fichiers déposés de chaque table brute
+
+    Args:
+        target: Environnement cible (dev, prod ou local). Par défaut "dev".
+        tables: Tables brutes à compacter (default: toutes)
+        prefix: Préfixe des dépôts
+        min_files: CSV en attente qui déclenchent la compaction d'une table
+            (1 pour compacter tout ce qui attend, comme le run planifié)
+        target_file_mb: Taille visée des fichiers Parquet
+        bucket: Bucket GCS (default: PIPELINE_LANDING_BUCKET)
+
+    Returns:
+        Dict {table: résultat de compact_landed_files}
+    """
+    results = {
+        table: compact_landed_files(
+            target=target, table=table, prefix=prefix, min_files=min_files,
+            target_file_mb=target_file_mb, bucket=bucket,
+        )
+        for table in tables or list(RAW_TABLES)
+    }
+    compacted = [result for result in results.values() if not result["skipped"]]
+    get_run_logger().info(
+        f"✅ {len(compacted)} table(s) compactée(s): "
+        f"{sum(result['before']['files'] for result in compacted)} fichier(s) → "
+        f"{sum(result['after']['files'] for result in compacted)}"
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compaction des petits fichiers déposés en landing")
+    parser.add_argument("--target", default="dev")
+    parser.add_argument("--table", action="append", choices=sorted(RAW_TABLES), dest="tables")
+    parser.add_argument("--prefix", default=LANDING_PREFIX)
+    parser.add_argument("--min-files", type=int, default=COMPACTION_MIN_FILES)
+    parser.add_argument("--target-file-mb", type=int, default=TARGET_FILE_MB)
+    parser.add_argument("--bucket", default=None)
+    args = parser.parse_args()
+    landing_compaction_pipeline(
+        target=args.target, tables=args.tables, prefix=args.prefix, min_files=args.min_files,
+        target_file_mb=args.target_file_mb, bucket=args.bucket,
+    )
+
+
+if __name__ == "__main__":
+    main()
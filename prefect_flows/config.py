@@ -0,0 +1,61 @@
+"""
+Configuration partagée des flows Prefect (chemins du projet et de l'état local).
+"""
+import os
+from pathlib import Path
+
+
+# Racine du dépôt et projet dbt
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DBT_PROJECT_DIR = PROJECT_ROOT / "dbt"
+
+# Répertoire d'état persistant entre les runs (watermarks, verrous, caches).
+# Sur un worker éphémère (conteneur), pointer PIPELINE_STATE_DIR vers un volume persistant.
+STATE_DIR = Path(os.getenv("PIPELINE_STATE_DIR", PROJECT_ROOT / ".state"))
+
+# Targets exécutés sur le moteur embarqué (DuckDB) : le profiles.yml local est
+# utilisé en priorité, sans aller-retour vers l'API Prefect pour les blocs
+OFFLINE_TARGETS = ("local",)
+
+# Fichiers sources lus par le target local (voir dbt/models/staging/sources.yml)
+LOCAL_DATA_DIR = Path(os.getenv("DBT_LOCAL_DATA_DIR", PROJECT_ROOT / "data" / "raw"))
+
+# Copies de travail des sources du target local réécrites par l'ingestion (hors
+# dépôt) : lues par dbt dès qu'elles existent, les CSV de LOCAL_DATA_DIR restent intacts
+LOCAL_INGESTED_DATA_DIR = Path(os.getenv("PIPELINE_LOCAL_INGESTED_DIR", PROJECT_ROOT / ".local" / "raw"))
+
+# Targets toujours exécutés sur le volume complet (échantillonnage refusé,
+# aligné sur la variable dbt `full_volume_targets`)
+FULL_VOLUME_TARGETS = ("prod",)
+
+# Exports Parquet des marts pour les dashboards Power BI en mode Import
+# (un sous-répertoire par target, voir prefect_flows/export.py)
+EXPORT_DIR = Path(os.getenv("MART_EXPORT_DIR", PROJECT_ROOT / "exports"))
+
+# Rapports produits par les flows (coûts, profils, recommandations...)
+REPORTS_DIR = Path(os.getenv("PIPELINE_REPORTS_DIR", PROJECT_ROOT / "reports"))
+
+# Dépôt des fichiers sources bruts avant chargement (voir prefect_flows/upload.py) :
+# bucket GCS des targets dev/prod (le compte de service dbt y est storage.objectAdmin),
+# magasin d'objets émulé sur disque pour le target local
+LANDING_BUCKET = os.getenv("PIPELINE_LANDING_BUCKET")
+LOCAL_OBJECT_STORE_DIR = Path(os.getenv("PIPELINE_LOCAL_OBJECT_STORE_DIR", PROJECT_ROOT / ".local" / "object_store"))
+
+# Courtier de jetons d'accès GCP (voir prefect_flows/credentials.py) : désactivable
+# avec PIPELINE_TOKEN_BROKER=0 ; PIPELINE_TOKEN_URI remplace l'endpoint de jetons
+# du compte de service (endpoint local de substitution pour les essais)
+TOKEN_BROKER_ENABLED = os.getenv("PIPELINE_TOKEN_BROKER", "1") != "0"
+TOKEN_URI = os.getenv("PIPELINE_TOKEN_URI")
+
+# Contrôle d'admission des commandes dbt sur le worker (voir prefect_flows/resources.py) :
+# désactivable avec PIPELINE_DBT_ADMISSION=0 ; budgets par défaut : 80% de la
+# mémoire totale de l'hôte et tous ses cœurs
+DBT_ADMISSION_ENABLED = os.getenv("PIPELINE_DBT_ADMISSION", "1") != "0"
+DBT_MEMORY_BUDGET_MB = float(os.getenv("PIPELINE_DBT_MEMORY_BUDGET_MB", "0")) or None
+DBT_CPU_BUDGET = float(os.getenv("PIPELINE_DBT_CPU_BUDGET", "0")) or None
+# Registre des réservations, partagé par les conteneurs d'un même hôte (volume monté,
+# voir prefect.yml), et nom de l'hôte du worker : PIPELINE_WORKER_HOST, sinon le
+# fichier /etc/hostname de l'hôte monté en PIPELINE_WORKER_HOST_FILE, sinon le nom du conteneur
+ADMISSION_DIR = Path(os.getenv("PIPELINE_ADMISSION_DIR", STATE_DIR / "resources"))
+WORKER_HOST = os.getenv("PIPELINE_WORKER_HOST")
+WORKER_HOST_FILE = Path(os.getenv("PIPELINE_WORKER_HOST_FILE", "/etc/pipeline-worker-host"))
@@ -0,0 +1,302 @@
+"""
+Courtier de jetons d'accès GCP partagé par les processus d'un worker
+
+Le compte de service est stocké tel quel (bloc `gcp-credentials`, ou keyfile
+de dbt/profiles.yml). Sans courtier, chaque invocation dbt et chaque client
+Python signe et échange son propre jeton : un aller-retour réseau par
+processus. Le courtier émet un jeton d'accès une fois, puis le sert :
+
+    1. depuis la mémoire du processus,
+    2. sinon depuis STATE_DIR/tokens/{clé}.json (répertoire 0700, fichier 0600),
+       partagé par les processus du worker (dbt, ingestion, dépôts),
+    3. sinon en émettant un nouveau jeton, sous verrou inter-processus : un
+       seul processus émet, les autres relisent le fichier.
+
+Un jeton est servi tant qu'il lui reste plus de TOKEN_REFRESH_MARGIN_SECONDS.
+dbt ne peut pas renouveler un jeton fixe en cours de commande : il ne reçoit le
+jeton partagé que si sa durée prévue (profil de ressources, resources.py),
+majorée de DBT_TOKEN_DURATION_MARGIN, tient dans la durée de vie d'un jeton
+(dbt_token_min_ttl). Sinon, ou sans prévision, dbt garde l'authentification par
+le compte de service, qu'il renouvelle lui-même.
+
+Consommateurs :
+    - clients Python (BigQuery, GCS) : BrokeredCredentials, dont le
+      renouvellement passe par le courtier (voir warehouse.py)
+    - dbt via les blocs Prefect : profil `oauth-secrets` avec le jeton
+      (brokered_target_configs)
+    - dbt via dbt/profiles.yml : variable DBT_BIGQUERY_TOKEN, lue par le profil
+      (dbt_token_env, voir dbt/profiles.tpl.yml)
+
+Les demandes sont comptées par origine (mint, memory, file) dans la métrique
+pipeline_token_requests_total, et les émissions par flow run (token_usage).
+PIPELINE_TOKEN_BROKER=0 rétablit l'authentification directe par le compte de
+service ; PIPELINE_TOKEN_URI redirige les émissions vers un autre endpoint.
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any
+
+import yaml
+from google.auth import credentials as google_credentials
+
+from prefect_flows.config import DBT_PROJECT_DIR, STATE_DIR, TOKEN_BROKER_ENABLED, TOKEN_URI
+from prefect_flows.metrics import Counter
+from prefect_flows.run_history import current_flow_run_id
+from prefect_flows.state import FileLock, read_json, write_json_atomic
+
+
+TOKEN_CACHE_DIR = STATE_DIR / "tokens"
+
+# Portées des jetons (celles de dbt-bigquery : BigQuery, GCS, sources Drive)
+TOKEN_SCOPES = (
+    "https://www.googleapis.com/auth/bigquery",
+    "https://www.googleapis.com/auth/cloud-platform",
+    "https://www.googleapis.com/auth/drive",
+)
+
+# Durée de validité restante minimale d'un jeton servi
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+# Durée de vie d'un jeton émis par Google, et facteur appliqué à la durée prévue d'une commande dbt
+TOKEN_LIFETIME_SECONDS = 3600
+DBT_TOKEN_DURATION_MARGIN = 2.0
+
+# Attente maximale du verrou d'émission détenu par un autre processus
+TOKEN_LOCK_WAIT_SECONDS = 30
+
+TOKEN_REQUESTS = Counter(
+    "pipeline_token_requests_total", "Jetons d'accès servis par le courtier, par origine (mint, memory, file)",
+    ("principal", "origin"),
+)
+
+_lock = threading.Lock()
+_memory: dict[str, dict[str, Any]] = {}
+# Demandes par flow run et par origine (processus courant)
+_usage: dict[str, dict[str, int]] = {}
+
+
+def _cache_key(info: dict[str, Any], scopes: tuple[str, ...]) -> str:
+    payload = json.dumps([info.get("client_email"), info.get("private_key_id"), sorted(scopes), TOKEN_URI])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+
+def _is_fresh(entry: dict[str, Any] | None, min_ttl: float) -> bool:
+    return bool(entry) and entry["expiry"] - time.time() > min_ttl
+
+
+def _count(info: dict[str, Any], origin: str) -> None:
+    TOKEN_REQUESTS.inc(principal=info.get("client_email", "?"), origin=origin)
+    usage = _usage.setdefault(current_flow_run_id(), {"mint": 0, "memory": 0, "file": 0})
+    usage[origin] += 1
+
+
+def _read_cached(path) -> dict[str, Any] | None:
+    try:
+        return read_json(path, default=None)
+    except ValueError:
+        return None
+
+
+def _write_cached(path, entry: dict[str, Any]) -> None:
+    # mkstemp (write_json_atomic) crée le fichier en 0600 ; répertoire réservé au propriétaire
+    TOKEN_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    TOKEN_CACHE_DIR.chmod(0o700)
+    write_json_atomic(path, entry)
+
+
+def _mint(info: dict[str, Any], scopes: tuple[str, ...]) -> dict[str, Any]:
+    """Échange une assertion signée par le compte de service contre un jeton d'accès."""
+    from google.auth.transport.requests import Request
+    from google.oauth2 import service_account
+
+    if TOKEN_URI:
+        info = {**info, "token_uri": TOKEN_URI}
+    credentials = service_account.Credentials.from_service_account_info(info, scopes=list(scopes))
+    credentials.refresh(Request())
+    # google-auth manipule des dates UTC naïves
+    expiry = credentials.expiry.replace(tzinfo=timezone.utc).timestamp()
+    return {"token": credentials.token, "expiry": expiry, "minted_at": time.time()}
+
+
+def access_token(
+    info: dict[str, Any],
+    scopes: tuple[str, ...] = TOKEN_SCOPES,
+    min_ttl: float = TOKEN_REFRESH_MARGIN_SECONDS,
+) -> tuple[str, float]:
+    """
+    Jeton d'accès du compte de service, émis une fois puis partagé
+
+    Args:
+        info: Contenu JSON de la clé du compte de service
+        scopes: Portées OAuth du jeton
+        min_ttl: Validité restante minimale (secondes) du jeton servi
+
+    Returns:
+        Tuple (jeton, expiration en secondes epoch)
+    """
+    key = _cache_key(info, scopes)
+    path = TOKEN_CACHE_DIR / f"{key}.json"
+    with _lock:
+        if _is_fresh(_memory.get(key), min_ttl):
+            _count(info, "memory")
+            return _memory[key]["token"], _memory[key]["expiry"]
+
+        entry = _read_cached(path)
+        origin = "file"
+        if not _is_fresh(entry, min_ttl):
+            lock = FileLock(path.with_suffix(".lock"), stale_after_seconds=TOKEN_LOCK_WAIT_SECONDS)
+            deadline = time.monotonic() + TOKEN_LOCK_WAIT_SECONDS
+            # Un autre processus émet peut-être déjà : on relit son jeton plutôt que d'en émettre un second
+            while not lock.acquire() and time.monotonic() < deadline:
+                time.sleep(0.2)
+                entry = _read_cached(path)
+                if _is_fresh(entry, min_ttl):
+                    break
+            try:
+                if not _is_fresh(entry, min_ttl):
+                    entry = _read_cached(path)
+                if not _is_fresh(entry, min_ttl):
+                    entry = _mint(info, scopes)
+                    _write_cached(path, entry)
+                    origin = "mint"
+            finally:
+                lock.release()
+
+        _memory[key] = entry
+        _count(info, origin)
+        return entry["token"], entry["expiry"]
+
+
+def token_usage(flow_run_id: str | None = None) -> dict[str, int]:
+    """Jetons servis pendant un flow run (défaut : le flow run en cours), par origine."""
+    with _lock:
+        return dict(_usage.get(flow_run_id or current_flow_run_id(), {"mint": 0, "memory": 0, "file": 0}))
+
+
+class BrokeredCredentials(google_credentials.Credentials):
+    """Credentials google-auth renouvelées par le courtier (clients BigQuery, GCS)."""
+
+    def __init__(self, info: dict[str, Any], scopes: tuple[str, ...] = TOKEN_SCOPES):
+        super().__init__()
+        self._info = info
+        self._scopes = scopes
+
+    @property
+    def service_account_email(self) -> str | None:
+        return self._info.get("client_email")
+
+    def refresh(self, request) -> None:
+        token, expiry = access_token(self._info, self._scopes)
+        self.token = token
+        self.expiry = datetime.fromtimestamp(expiry, tz=timezone.utc).replace(tzinfo=None)
+
+
+def block_service_account_info(gcp_credentials) -> dict[str, Any] | None:
+    """Clé du compte de service d'un bloc GcpCredentials, None s'il n'en porte pas."""
+    if gcp_credentials.service_account_info:
+        return dict(gcp_credentials.service_account_info.get_secret_value())
+    if gcp_credentials.service_account_file:
+        return json.loads(gcp_credentials.service_account_file.read_text(encoding="utf-8"))
+    return None
+
+
+def brokered_credentials(info: dict[str, Any] | None, fallback=None):
+    """Credentials des clients Python : via le courtier si une clé est disponible et le courtier actif."""
+    if info is None or not TOKEN_BROKER_ENABLED:
+        return fallback
+    return BrokeredCredentials(info)
+
+
+def dbt_token_min_ttl(expected_seconds: float | None) -> float | None:
+    """
+    Validité restante exigée du jeton partagé pour une commande dbt
+
+    Args:
+        expected_seconds: Durée prévue de la commande (None si inconnue)
+
+    Returns:
+        Validité minimale en secondes, ou None si la commande doit garder
+        l'authentification par le compte de service (durée inconnue, ou trop
+        longue pour un jeton fixe)
+    """
+    if expected_seconds is None:
+        return None
+    min_ttl = expected_seconds * DBT_TOKEN_DURATION_MARGIN + TOKEN_REFRESH_MARGIN_SECONDS
+    return min_ttl if min_ttl <= TOKEN_LIFETIME_SECONDS - TOKEN_REFRESH_MARGIN_SECONDS else None
+
+
+def _dbt_access_token(info: dict[str, Any], expected_seconds: float | None, logger) -> str | None:
+    """Jeton partagé pour une commande dbt, None si elle doit garder le compte de service."""
+    min_ttl = dbt_token_min_ttl(expected_seconds)
+    if min_ttl is None:
+        duration = "inconnue" if expected_seconds is None else f"{expected_seconds / 60:.0f} min"
+        logger.info(f"🔑 Durée prévue de la commande dbt {duration} : authentification par le compte de service")
+        return None
+    token, expiry = access_token(info, min_ttl=min_ttl)
+    logger.info(f"🔑 Jeton d'accès partagé pour dbt (expire dans {(expiry - time.time()) / 60:.0f} min)")
+    return token
+
+
+def brokered_target_configs(target_configs, logger, expected_seconds: float | None = None):
+    """
+    Target configs BigQuery authentifiées par un jeton du courtier (profil `oauth-secrets`)
+
+    Args:
+        target_configs: Bloc BigQueryTargetConfigs du target
+        logger: Logger Prefect de la tâche appelante
+        expected_seconds: Durée prévue de la commande dbt (dbt_token_min_ttl)
+
+    Returns:
+        TargetConfigs équivalentes avec le jeton, ou les target configs d'origine
+        si le courtier est désactivé, le bloc sans clé de compte de service ou
+        la commande trop longue (ou de durée inconnue) pour un jeton fixe
+    """
+    from prefect_dbt.cli.configs import TargetConfigs
+
+    info = block_service_account_info(target_configs.credentials) if TOKEN_BROKER_ENABLED else None
+    if info is None:
+        return target_configs
+    token = _dbt_access_token(info, expected_seconds, logger)
+    if token is None:
+        return target_configs
+    return TargetConfigs(
+        type="bigquery",
+        schema=target_configs.schema_,
+        threads=target_configs.threads,
+        extras={
+            **(target_configs.extras or {}),
+            "project": target_configs.project or target_configs.credentials.project,
+            "method": "oauth-secrets",
+            "token": token,
+        },
+    )
+
+
+def dbt_token_env(target: str, logger, expected_seconds: float | None = None) -> dict[str, str]:
+    """
+    Jeton du courtier pour un target BigQuery de dbt/profiles.yml (variable DBT_BIGQUERY_TOKEN)
+
+    Args:
+        target: Target de dbt/profiles.yml
+        logger: Logger Prefect de la tâche appelante
+        expected_seconds: Durée prévue de la commande dbt (dbt_token_min_ttl)
+
+    Returns:
+        {"DBT_BIGQUERY_TOKEN": jeton}, ou {} (courtier désactivé, target non
+        BigQuery ou sans keyfile, commande trop longue ou de durée inconnue :
+        dbt s'authentifie lui-même)
+    """
+    profiles_path = DBT_PROJECT_DIR / "profiles.yml"
+    if not TOKEN_BROKER_ENABLED or not profiles_path.exists():
+        return {}
+    profiles = yaml.safe_load(profiles_path.read_text(encoding="utf-8"))
+    output = next(iter(profiles.values()))["outputs"].get(target) or {}
+    if output.get("type") != "bigquery" or not output.get("keyfile"):
+        return {}
+    with open(output["keyfile"], encoding="utf-8") as keyfile:
+        info = json.load(keyfile)
+    token = _dbt_access_token(info, expected_seconds, logger)
+    return {"DBT_BIGQUERY_TOKEN": token} if token else {}
@@ -0,0 +1,84 @@
+"""
+Versions des données lues par les nœuds dbt
+
+La version d'une table ou d'une source vient de l'entrepôt
+(Warehouse.data_versions : dernière modification et nombre de lignes sur
+BigQuery, nombre de lignes et empreinte du contenu sur DuckDB). Une vue ou un
+modèle éphémère n'a pas de données propres : sa version combine son code
+(checksum du manifest) et les versions de ses parents, récursivement.
+
+Ces versions servent de clés aux caches de tests et de construction : une
+version inchangée garantit que les données lues n'ont pas changé.
+"""
+import hashlib
+import json
+from typing import Any
+
+from prefect_flows.warehouse import Warehouse
+
+
+# Matérialisations sans données propres (version dérivée des parents)
+DERIVED_MATERIALIZATIONS = ("view", "ephemeral")
+
+
+def fingerprint(payload: Any) -> str:
+    """Empreinte SHA-256 d'une structure sérialisable en JSON."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _node(manifest: dict[str, Any], unique_id: str) -> dict[str, Any] | None:
+    return manifest["nodes"].get(unique_id) or manifest["sources"].get(unique_id)
+
+
+def _is_derived(node: dict[str, Any]) -> bool:
+    return node["resource_type"] == "model" and node["config"].get("materialized") in DERIVED_MATERIALIZATIONS
+
+
+def _physical_relations(manifest: dict[str, Any], unique_ids: list[str]) -> set[str]:
+    """Relations stockées dont dépendent les nœuds (à travers les vues)."""
+    relations, pending, seen = set(), list(unique_ids), set()
+    while pending:
+        unique_id = pending.pop()
+        if unique_id in seen:
+            continue
+        seen.add(unique_id)
+        node = _node(manifest, unique_id)
+        if node is None:
+            continue
+        if _is_derived(node):
+            pending.extend(node["depends_on"]["nodes"])
+        elif node.get("relation_name"):
+            relations.add(node["relation_name"])
+    return relations
+
+
+def node_data_versions(warehouse: Warehouse, manifest: dict[str, Any], unique_ids: list[str]) -> dict[str, str | None]:
+    """
+    Version des données de nœuds dbt (modèles, seeds, snapshots, sources)
+
+    Args:
+        warehouse: Entrepôt du target
+        manifest: manifest.json de dbt
+        unique_ids: Nœuds dont on veut la version
+
+    Returns:
+        Dict {unique_id: version, ou None si une relation stockée est absente}
+    """
+    relation_versions = warehouse.data_versions(sorted(_physical_relations(manifest, unique_ids)))
+    versions: dict[str, str | None] = {}
+
+    def version(unique_id: str) -> str | None:
+        if unique_id not in versions:
+            node = _node(manifest, unique_id)
+            if node is None:
+                versions[unique_id] = None
+            elif _is_derived(node):
+                parents = [version(parent) for parent in node["depends_on"]["nodes"]]
+                versions[unique_id] = None if None in parents else fingerprint(
+                    [node["checksum"]["checksum"], parents]
+                )
+            else:
+                versions[unique_id] = relation_versions.get(node.get("relation_name"))
+        return versions[unique_id]
+
+    return {unique_id: version(unique_id) for unique_id in unique_ids}
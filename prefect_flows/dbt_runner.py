@@ -0,0 +1,265 @@
+"""
+Exécution des commandes dbt avec la stratégie Cloud/Local commune aux flows.
+
+Ordre de résolution (identique pour toutes les commandes) :
+  1. Profil Prefect reconstruit depuis les blocs '{bigquery,duckdb}-target-configs-{target}'
+     et 'dbt-cli-profile-{target}'
+  2. Bloc d'opération dbt ('dbt-operation-{sous-commande}-{target}', ...) dont on
+     remplace les commandes par la commande demandée
+  3. Fallback local sur dbt/profiles.yml
+
+Pour les targets hors-ligne (OFFLINE_TARGETS, moteur DuckDB embarqué), le
+profiles.yml local est essayé en premier : aucun appel réseau n'est fait.
+
+Chaque invocation reçoit l'identifiant du flow run (DBT_FLOW_RUN_ID, repris
+dans les labels des jobs BigQuery, voir dbt/macros/query_comment.sql) et son
+run_results.json est archivé dans l'historique (run_history.py). Les relations
+écrites sont invalidées dans le cache du catalogue (catalog.py).
+
+Chaque commande attend son admission sur le worker selon le profil mémoire et
+CPU des invocations précédentes, puis son Resource report (logs/dbt.log) est
+ajouté à ce profil (resources.py). La durée prévue par ce profil décide si dbt
+reçoit le jeton partagé du courtier (credentials.py).
+"""
+import json
+import os
+import shlex
+import time
+from typing import Any, Iterable
+
+from prefect_dbt.cli.commands import DbtCoreOperation
+from prefect_dbt.cli import DbtCliProfile, BigQueryTargetConfigs
+from prefect_dbt.cli.configs import TargetConfigs
+
+from prefect_flows.catalog import invalidate_dbt_results
+from prefect_flows.config import DBT_PROJECT_DIR, LOCAL_DATA_DIR, LOCAL_INGESTED_DATA_DIR, OFFLINE_TARGETS
+from prefect_flows.credentials import brokered_target_configs, dbt_token_env
+from prefect_flows.log_forwarding import DbtLogForwarder
+from prefect_flows.metrics import record_dbt_invocation_metrics
+from prefect_flows.profiling import phase, record_dbt_invocation
+from prefect_flows.resources import (
+    admitted,
+    dbt_log_position,
+    predict_resources,
+    read_resource_report,
+    record_resource_report,
+)
+from prefect_flows.run_history import archive_invocation, current_flow_run_id
+from prefect_flows.state import read_json
+
+
+# Opérations dbt qui n'écrivent aucune relation (cache du catalogue conservé)
+READ_ONLY_OPERATIONS = ("compile", "parse", "test")
+
+
+def build_dbt_command(
+    verb: str,
+    select: Iterable[str] | None = None,
+    exclude: Iterable[str] | None = None,
+    dbt_vars: dict[str, Any] | None = None,
+    extra_args: Iterable[str] | None = None,
+) -> str:
+    """
+    Construit une ligne de commande dbt
+
+    Args:
+        verb: Sous-commande dbt (run, test, build, ...)
+        select: Sélecteurs passés à --select
+        exclude: Sélecteurs passés à --exclude
+        dbt_vars: Variables passées à --vars (sérialisées en JSON)
+        extra_args: Arguments supplémentaires ajoutés tels quels
+
+    Returns:
+        La commande, ex: "dbt run --select tag:microbatch --vars '{...}'"
+    """
+    parts = ["dbt", verb]
+    if select:
+        parts += ["--select", *select]
+    if exclude:
+        parts += ["--exclude", *exclude]
+    if dbt_vars:
+        parts += ["--vars", shlex.quote(json.dumps(dbt_vars, sort_keys=True))]
+    if extra_args:
+        parts += list(extra_args)
+    return " ".join(parts)
+
+
+def dbt_env() -> dict[str, str]:
+    """
+    Variables d'environnement transmises à chaque invocation dbt
+
+    DBT_FLOW_RUN_ID déjà défini (sous-graphe d'un run distribué, voir
+    distributed.py) est conservé : les jobs sont labellisés par le run parent.
+    Les sources du target local sont lues dans les copies de l'ingestion si elle a tourné.
+    """
+    local_data_dir = LOCAL_INGESTED_DATA_DIR if LOCAL_INGESTED_DATA_DIR.is_dir() else LOCAL_DATA_DIR
+    return {
+        "DBT_LOCAL_DATA_DIR": str(local_data_dir),
+        "DBT_FLOW_RUN_ID": os.getenv("DBT_FLOW_RUN_ID") or current_flow_run_id(),
+    }
+
+
+def _execute(op: DbtCoreOperation, target: str, operation: str, command: str, logger) -> list[str]:
+    """
+    Exécute une opération dbt et archive son run_results.json, même en cas d'échec
+
+    La sortie dbt est transmise aux logs par lots (voir log_forwarding.py).
+    """
+    log_position = dbt_log_position()
+    started_at = time.time()
+    success = False
+    try:
+        with DbtLogForwarder(logger):
+            result = op.run()
+        success = True
+        return result
+    finally:
+        finished_at = time.time()
+        resources = read_resource_report(log_position, command, started_at, finished_at)
+        if resources is not None:
+            record_resource_report(target, operation, command, resources)
+        history_path = archive_invocation(
+            target, operation, command, started_at=started_at, success=success, resources=resources,
+        )
+        record_dbt_invocation(operation, started_at, finished_at, history_path)
+        record_dbt_invocation_metrics(target, operation, finished_at - started_at, history_path)
+        if history_path is not None and operation not in READ_ONLY_OPERATIONS:
+            invalidate_dbt_results(target, read_json(history_path)["results"])
+
+
+def load_target_configs(target: str, logger):
+    """Charge le bloc de target configs (BigQuery, sinon DuckDB) d'un target."""
+    try:
+        with phase(f"block_load:bigquery-target-configs-{target}"):
+            target_configs = BigQueryTargetConfigs.load(f"bigquery-target-configs-{target}")
+        logger.info(f"✅ BigQuery target configs chargé: {target_configs}")
+    except ValueError:
+        with phase(f"block_load:duckdb-target-configs-{target}"):
+            target_configs = TargetConfigs.load(f"duckdb-target-configs-{target}")
+        logger.info(f"✅ DuckDB target configs chargé: {target_configs}")
+    return target_configs
+
+
+def _run_local(command: str, target: str, operation: str, logger, expected_seconds: float | None = None) -> list[str]:
+    """Exécute la commande avec le profiles.yml local (dbt/profiles.yml)."""
+    project_dir = DBT_PROJECT_DIR
+    profiles_dir = project_dir
+
+    logger.info(f"📁 Répertoire du projet: {project_dir}")
+    logger.info(f"📋 Fichier de profils: {profiles_dir / 'profiles.yml'}")
+
+    if not (profiles_dir / "profiles.yml").exists():
+        logger.error("❌ Le fichier profiles.yml n'existe pas!")
+        logger.error("Générez-le avec: uv run python -m infrastructure.setup_profiles --local-only")
+        raise FileNotFoundError(
+            f"Le fichier {profiles_dir / 'profiles.yml'} n'existe pas. "
+            f"Exécutez: uv run python -m infrastructure.setup_profiles --local-only"
+        )
+
+    op = DbtCoreOperation(
+        commands=[f"{command} --target {target}"],
+        project_dir=str(project_dir),
+        profiles_dir=str(profiles_dir),
+        overwrite_profiles=False,
+        env={**dbt_env(), **dbt_token_env(target, logger, expected_seconds)},
+    )
+    result = _execute(op, target, operation, command, logger)
+
+    logger.info(f"✅ dbt {operation} terminé avec succès sur {target}")
+    return result
+
+
+def run_dbt_command(command: str, target: str, operation: str, logger) -> list[str]:
+    """
+    Exécute une commande dbt en mode Cloud (blocs Prefect) ou Local (profiles.yml)
+
+    La commande n'est lancée qu'une fois admise sur le worker (resources.admitted).
+
+    Args:
+        command: Commande dbt complète, sans --target (ex: "dbt run --select staging")
+        target: Environnement cible (dev ou prod). Correspond au target dans profiles.yml
+        operation: Nom court de l'opération (run, test, microbatch...), pour l'historique et les métriques
+        logger: Logger Prefect de la tâche appelante
+
+    Returns:
+        Lignes de sortie de dbt
+
+    Raises:
+        AdmissionRefused: Budget mémoire ou CPU du worker insuffisant dans le délai d'attente
+    """
+    with admitted(target, operation, command, logger) as prediction:
+        expected_seconds = (prediction or predict_resources(target, operation, command))["wall_seconds"]
+        return _run_with_fallbacks(command, target, operation, logger, expected_seconds)
+
+
+def _run_with_fallbacks(
+    command: str, target: str, operation: str, logger, expected_seconds: float | None = None,
+) -> list[str]:
+    """Exécute la commande via le premier mode disponible (voir l'ordre de résolution du module)."""
+    project_dir = DBT_PROJECT_DIR
+    label = f"dbt {operation}"
+
+    if target in OFFLINE_TARGETS and (project_dir / "profiles.yml").exists():
+        logger.info(f"💻 Target hors-ligne '{target}' : exécution directe via profiles.yml (moteur embarqué)")
+        return _run_local(command, target, operation, logger, expected_seconds)
+
+    logger.info("🔎 Tentative d'exécution via un bloc Prefect (mode Cloud)...")
+
+    # 1) Tentative Cloud (profil): charger les blocs et reconstruire le profil
+    try:
+        # Charger les target configs et le profil séparément
+        target_configs = load_target_configs(target, logger)
+        if isinstance(target_configs, BigQueryTargetConfigs):
+            # Jeton partagé du courtier plutôt qu'un échange par invocation (voir credentials.py)
+            target_configs = brokered_target_configs(target_configs, logger, expected_seconds)
+
+        with phase(f"block_load:dbt-cli-profile-{target}"):
+            dbt_cli_profile_block = DbtCliProfile.load(f"dbt-cli-profile-{target}")
+        logger.info(f"✅ Profil dbt chargé: {dbt_cli_profile_block.name}")
+
+        # Reconstruire le profil avec les target configs à jour
+        profile = DbtCliProfile(
+            name=dbt_cli_profile_block.name,
+            target=dbt_cli_profile_block.target,
+            target_configs=target_configs
+        )
+
+        logger.info(f"☁️  Exécution via le profil Prefect reconstruit pour {target}")
+        op = DbtCoreOperation(
+            project_dir=project_dir,
+            commands=[command],
+            dbt_cli_profile=profile,
+            overwrite_profiles=True,
+            env=dbt_env(),
+        )
+        result = _execute(op, target, operation, command, logger)
+        logger.info(f"✅ {label} terminé avec succès via profil '{target}'")
+        return result
+    except Exception as e:
+        logger.warning(f"⚠️  Impossible de charger les blocs Prefect pour {target}: {e}")
+
+    # 2) Tentative Cloud (opération): charger une opération dbt depuis Prefect Blocks
+    # Blocs nommés d'après la sous-commande dbt (l'opération `microbatch` est un `dbt run`)
+    preferred_block_names = [
+        f"dbt-operation-{shlex.split(command)[1]}-{target}",
+        f"dbt-core-operation-{target}",
+        "dbt-core-operation",
+    ]
+    for block_name in preferred_block_names:
+        try:
+            with phase(f"block_load:{block_name}"):
+                op = DbtCoreOperation.load(block_name)
+            # Le bloc porte le profil ; la commande est celle demandée par l'appelant
+            op.commands = [command]
+            op.env = {**op.env, **dbt_env()}
+            logger.info(f"☁️  Exécution via le bloc Prefect: {block_name}")
+            result = _execute(op, target, operation, command, logger)
+            logger.info(f"✅ {label} terminé avec succès via bloc '{block_name}'")
+            return result
+        except Exception:
+            # On essaye le prochain bloc
+            continue
+
+    # 3) Fallback Local: utiliser le profiles.yml local
+    logger.info("💻 Aucun bloc Prefect compatible trouvé. Bascule en mode local (profiles.yml)...")
+    return _run_local(command, target, operation, logger, expected_seconds)
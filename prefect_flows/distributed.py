@@ -0,0 +1,717 @@
+"""
+Exécution distribuée d'un run dbt sur plusieurs workers d'un work pool
+
+Un seul `dbt run` est limité par la machine du worker (threads, mémoire,
+connexions). Sur un DAG large, le run est découpé en sous-graphes exécutés
+chacun par un flow run du déploiement `dbt-subgraph`, donc par des workers
+différents du work pool :
+
+    1. Découpage (plan_distribution) : les modèles sont affectés à `workers`
+       sous-graphes de façon gloutonne (Linear Deterministic Greedy), des marts
+       vers les sources : un modèle rejoint le sous-graphe qui contient le plus
+       de ses enfants, pondéré par la charge restante (durées du dernier run,
+       voir run_history.py). Un sous-graphe qui créerait un cycle entre
+       sous-graphes est écarté : le graphe des sous-graphes reste un DAG, et
+       les arêtes qui le traversent sont peu nombreuses.
+    2. Estimation : le makespan d'un seul worker et celui du découpage sont
+       simulés (ordonnancement par liste, `threads` nœuds simultanés par worker,
+       démarrage des workers et attente des sous-graphes amont comprises). Le
+       run n'est distribué que si le découpage est plus rapide ; sinon il est
+       exécuté en un seul `dbt run`, comme sans distribution.
+    3. Répartition (run_distributed) : le manifest du run est déposé dans le
+       magasin d'objets (pipeline-runs/{flow_run_id}/manifest.json, voir
+       upload.py), puis un flow run `dbt-subgraph` est créé par sous-graphe dès
+       que ses sous-graphes amont sont terminés : un sous-graphe n'occupe un
+       slot du work pool que lorsqu'il peut construire (pas d'interblocage sous
+       une limite de concurrence du pool). Un sous-graphe dont un amont échoue
+       n'est pas soumis.
+    4. Chaque sous-graphe (dbt_subgraph_flow) relit le manifest partagé, vérifie
+       que sa copie du projet est la même (checksums des modèles), vérifie que
+       ses sous-graphes amont ont réussi, puis construit ses modèles (`dbt run
+       --select`) dans un répertoire d'artefacts dédié (DBT_TARGET_PATH). Son
+       résumé run_results est redéposé dans le magasin d'objets.
+    5. Le flow parent attend tous les sous-graphes et archive un résumé fusionné
+       dans son propre historique, avec les threads de chaque sous-graphe :
+       cache de construction, rapport de coût et réglage des threads voient un
+       seul `dbt run`.
+
+Les jobs des sous-graphes sont labellisés avec le flow run parent
+(DBT_FLOW_RUN_ID). Les tests, l'export et le rapport de coût restent exécutés
+par le flow parent.
+
+Les targets hors-ligne (DuckDB) ne sont pas distribués : un fichier DuckDB
+n'accepte qu'un processus écrivain.
+
+En local, avec plusieurs workers process (voir README) :
+    uv run python -m prefect_flows.distributed --register-local local-dbt
+    uv run python prefect_flows/pipeline.py --target dev --workers 3
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import statistics
+import time
+from contextlib import contextmanager
+from typing import Any
+from uuid import UUID
+
+from prefect import flow, task, get_client, get_run_logger
+from prefect.deployments import run_deployment
+
+from prefect_flows.config import DBT_PROJECT_DIR, OFFLINE_TARGETS, PROJECT_ROOT
+from prefect_flows.dbt_runner import build_dbt_command, run_dbt_command
+from prefect_flows.materialization import load_manifest
+from prefect_flows.metrics import FLOW_METRIC_HOOKS, TASK_METRIC_HOOKS, record_dbt_invocation_metrics
+from prefect_flows.run_history import (
+    DBT_TARGET_DIR, current_flow_run_id, dbt_target_dir, load_invocations, record_invocation,
+)
+from prefect_flows.upload import crc32c, resolve_object_store
+
+
+# Déploiement des sous-graphes ({nom du flow}/{nom du déploiement}, voir prefect.yml)
+SUBGRAPH_DEPLOYMENT = "dbt-subgraph/dbt-subgraph"
+
+# Préfixe des artefacts partagés d'un run distribué dans le magasin d'objets
+DISTRIBUTED_PREFIX = "pipeline-runs"
+
+# Artefacts dbt des sous-graphes (un répertoire par sous-graphe)
+SUBGRAPH_TARGET_DIR = DBT_TARGET_DIR / "subgraphs"
+
+# Démarrage d'un sous-graphe sur un worker : clone, installation, parse dbt
+SUBGRAPH_STARTUP_SECONDS = 45.0
+
+# Intervalle de suivi des flow runs (sous-graphes amont, flow parent)
+POLL_SECONDS = 10.0
+
+# Durée d'un modèle absent de l'historique des runs
+DEFAULT_MODEL_SECONDS = 5.0
+
+# Dépassements tolérés de la charge moyenne d'un sous-graphe (le meilleur makespan estimé est retenu)
+BALANCE_SLACKS = (0.05, 0.25, 0.50)
+
+# Attente maximale des sous-graphes amont
+UPSTREAM_TIMEOUT_SECONDS = 6 * 3600
+
+# Attente maximale de l'ensemble des sous-graphes par le flow parent (défaut de run_distributed)
+SUBGRAPH_TIMEOUT_SECONDS = 8 * 3600
+
+# Runs précédents relus pour estimer la durée des modèles
+COST_HISTORY_RUNS = 5
+
+
+def _run_key(parent_flow_run_id: str, name: str) -> str:
+    return f"{DISTRIBUTED_PREFIX}/{parent_flow_run_id}/{name}"
+
+
+def model_graph(manifest: dict[str, Any], exclude: list[str] | None = None) -> dict[str, list[str]]:
+    """
+    Graphe des modèles construits par le run : {unique_id: parents construits par le run}
+
+    Les modèles éphémères sont traversés (leurs parents deviennent ceux du
+    modèle qui les lit) ; les modèles exclus (cache de construction) sont déjà
+    construits et ne créent pas de dépendance.
+    """
+    excluded = set(exclude or [])
+    models = {
+        unique_id: node for unique_id, node in manifest["nodes"].items()
+        if node["resource_type"] == "model" and node["config"].get("enabled", True)
+    }
+
+    def built(unique_id: str) -> bool:
+        node = models[unique_id]
+        return node["config"].get("materialized") != "ephemeral" and node["name"] not in excluded
+
+    def built_parents(unique_id: str, seen: set[str]) -> set[str]:
+        parents = set()
+        for parent in models[unique_id]["depends_on"]["nodes"]:
+            if parent not in models or parent in seen:
+                continue
+            seen.add(parent)
+            if built(parent):
+                parents.add(parent)
+            elif models[parent]["config"].get("materialized") == "ephemeral":
+                parents |= built_parents(parent, seen)
+        return parents
+
+    return {unique_id: sorted(built_parents(unique_id, set())) for unique_id in models if built(unique_id)}
+
+
+def topological_order(graph: dict[str, list[str]]) -> list[str]:
+    """Ordre topologique (Kahn, déterministe) d'un graphe {nœud: parents}."""
+    children: dict[str, list[str]] = {node: [] for node in graph}
+    remaining = {node: len(parents) for node, parents in graph.items()}
+    for node, parents in graph.items():
+        for parent in parents:
+            children[parent].append(node)
+    ready = sorted(node for node, count in remaining.items() if count == 0)
+    order = []
+    while ready:
+        node = ready.pop(0)
+        order.append(node)
+        for child in sorted(children[node]):
+            remaining[child] -= 1
+            if remaining[child] == 0:
+                ready.append(child)
+    if len(order) != len(graph):
+        raise ValueError("Le graphe des modèles contient un cycle")
+    return order
+
+
+def model_costs(target: str, models: list[str]) -> dict[str, float]:
+    """Durée estimée de chaque modèle : dernière durée observée, sinon la médiane des autres."""
+    observed: dict[str, float] = {}
+    for invocation in load_invocations(target, operation="run")[-COST_HISTORY_RUNS:]:
+        for result in invocation["results"]:
+            if result.get("execution_time") is not None and result["status"] == "success":
+                observed[result["unique_id"]] = float(result["execution_time"])
+    known = [observed[unique_id] for unique_id in models if unique_id in observed]
+    default = statistics.median(known) if known else DEFAULT_MODEL_SECONDS
+    return {unique_id: observed.get(unique_id, default) for unique_id in models}
+
+
+def _branch_order(graph: dict[str, list[str]]) -> list[str]:
+    """Ordre topologique en profondeur : les ancêtres d'un mart se suivent."""
+    order: list[str] = []
+    seen: set[str] = set()
+    has_children = {parent for parents in graph.values() for parent in parents}
+    for sink in sorted(node for node in graph if node not in has_children):
+        pending = [(sink, False)]
+        while pending:
+            node, expanded = pending.pop()
+            if expanded:
+                order.append(node)
+            elif node not in seen:
+                seen.add(node)
+                pending.append((node, True))
+                pending.extend((parent, False) for parent in sorted(graph[node], reverse=True) if parent not in seen)
+    return order
+
+
+def partition_dag(
+    graph: dict[str, list[str]], costs: dict[str, float], workers: int, slack: float = BALANCE_SLACKS[0]
+) -> list[list[str]]:
+    """
+    Découpe le graphe des modèles en sous-graphes au plus `workers`, sans cycle entre eux
+
+    Args:
+        graph: {unique_id: parents}, voir model_graph
+        costs: Durée estimée de chaque modèle
+        workers: Nombre maximal de sous-graphes
+        slack: Dépassement toléré de la charge moyenne d'un sous-graphe
+
+    Returns:
+        Sous-graphes non vides, chacun dans l'ordre topologique, dans un ordre
+        compatible avec leurs dépendances (un sous-graphe ne dépend que des précédents)
+    """
+    capacity = max(sum(costs.values()) / workers * (1 + slack), max(costs.values(), default=0))
+    loads = [0.0] * workers
+    assignment: dict[str, int] = {}
+    # Arêtes entre sous-graphes : upstream[g] = sous-graphes dont g dépend
+    upstream: list[set[int]] = [set() for _ in range(workers)]
+
+    def reaches(start: int, goal: int) -> bool:
+        """Vrai si le sous-graphe `goal` est (transitivement) en aval de `start`."""
+        pending, seen = [start], {start}
+        while pending:
+            group = pending.pop()
+            if group == goal:
+                return True
+            for downstream in range(workers):
+                if group in upstream[downstream] and downstream not in seen:
+                    seen.add(downstream)
+                    pending.append(downstream)
+        return False
+
+    children: dict[str, list[str]] = {unique_id: [] for unique_id in graph}
+    for unique_id, parents in graph.items():
+        for parent in parents:
+            children[parent].append(unique_id)
+
+    # Des marts vers les sources : une branche rejoint le sous-graphe des modèles qui la lisent
+    for unique_id in reversed(_branch_order(graph)):
+        child_groups = [assignment[child] for child in children[unique_id]]
+        # Un sous-graphe en aval d'un sous-graphe enfant créerait un cycle
+        allowed = [
+            group for group in range(workers)
+            if not any(child_group != group and reaches(child_group, group) for child_group in child_groups)
+        ]
+        open_groups = [group for group in allowed if loads[group] + costs[unique_id] <= capacity] or allowed
+
+        def score(group: int) -> tuple[float, float]:
+            shared = sum(1 for child_group in child_groups if child_group == group)
+            return shared * (1 - loads[group] / capacity), -loads[group]
+
+        group = max(open_groups, key=score)
+        assignment[unique_id] = group
+        loads[group] += costs[unique_id]
+        for child_group in child_groups:
+            if child_group != group:
+                upstream[child_group].add(group)
+
+    members = {group: [unique_id for unique_id in topological_order(graph) if assignment[unique_id] == group]
+               for group in range(workers)}
+    group_graph = {group: sorted(upstream[group]) for group in range(workers) if members[group]}
+    return [members[group] for group in topological_order(group_graph)]
+
+
+def _list_schedule(
+    nodes: list[str], graph: dict[str, list[str]], costs: dict[str, float], threads: int, start: float
+) -> float:
+    """Fin d'un ordonnancement par liste de `nodes` sur `threads` slots (dépendances internes seulement)."""
+    members = set(nodes)
+    remaining = {node: sum(1 for parent in graph[node] if parent in members) for node in nodes}
+    children: dict[str, list[str]] = {node: [] for node in nodes}
+    for node in nodes:
+        for parent in graph[node]:
+            if parent in members:
+                children[parent].append(node)
+    ready = [node for node in nodes if remaining[node] == 0]
+    running: list[tuple[float, str]] = []
+    now = finish = start
+    while ready or running:
+        while ready and len(running) < threads:
+            node = ready.pop(0)
+            heapq.heappush(running, (now + costs[node], node))
+        now, node = heapq.heappop(running)
+        finish = max(finish, now)
+        for child in children[node]:
+            remaining[child] -= 1
+            if remaining[child] == 0:
+                ready.append(child)
+    return finish
+
+
+def estimate_makespan(
+    graph: dict[str, list[str]], costs: dict[str, float], groups: list[list[str]], threads: int
+) -> dict[str, Any]:
+    """
+    Makespan estimé d'un seul `dbt run` et du run découpé en sous-graphes
+
+    Un sous-graphe est soumis quand ses sous-graphes amont sont terminés
+    (détecté à POLL_SECONDS près), puis démarre une fois son worker prêt
+    (SUBGRAPH_STARTUP_SECONDS).
+
+    Returns:
+        Dict {"single", "distributed" (secondes), "cross_edges", "groups"}
+    """
+    order = topological_order(graph)
+    single = _list_schedule(order, graph, costs, threads, 0.0)
+
+    group_of = {unique_id: index for index, group in enumerate(groups) for unique_id in group}
+    finished: list[float] = []
+    for index, group in enumerate(groups):
+        upstream = {group_of[parent] for unique_id in group for parent in graph[unique_id]} - {index}
+        submitted = max([0.0] + [finished[parent] + POLL_SECONDS for parent in upstream])
+        start = submitted + SUBGRAPH_STARTUP_SECONDS
+        finished.append(_list_schedule(group, graph, costs, threads, start))
+    cross_edges = sum(
+        1 for unique_id, parents in graph.items() for parent in parents if group_of[parent] != group_of[unique_id]
+    )
+    return {
+        "single": round(single, 1),
+        "distributed": round(max(finished, default=0.0), 1),
+        "cross_edges": cross_edges,
+        "groups": len(groups),
+    }
+
+
+def _run_threads(target: str, threads: int | str | None) -> int:
+    """Threads d'un worker pour l'estimation : valeur demandée, sinon celle du dernier run."""
+    if isinstance(threads, int) or (isinstance(threads, str) and threads.isdigit()):
+        return int(threads)
+    last = load_invocations(target, operation="run", limit=1)
+    return int(last[0].get("threads") or 1) if last else 1
+
+
+@task(name="plan-distribution", **TASK_METRIC_HOOKS)
+def plan_distribution(
+    target: str = "dev",
+    workers: int = 2,
+    exclude: list[str] | None = None,
+    threads: int | str | None = None,
+    compiled: bool = False,
+) -> dict[str, Any]:
+    """
+    Découpe les modèles du run en sous-graphes et décide de la distribution
+
+    Args:
+        target: Environnement cible
+        workers: Nombre maximal de sous-graphes (workers du work pool) ; moins de
+            sous-graphes sont créés s'ils sont estimés plus rapides
+        exclude: Modèles non reconstruits (cache de construction)
+        threads: Threads dbt de chaque worker (pour l'estimation)
+        compiled: Le manifest du run vient d'être compilé (cache de construction) :
+            pas de `dbt parse`
+
+    Returns:
+        Dict {"distribute", "groups": [{"index", "models", "upstream", "cost"}],
+        "estimate"} ; "distribute" est faux si le découpage n'est pas plus rapide
+    """
+    logger = get_run_logger()
+    if target in OFFLINE_TARGETS:
+        logger.warning(f"⚠️  Target hors-ligne '{target}' : un seul processus écrivain DuckDB, run non distribué")
+        return {"distribute": False, "groups": [], "estimate": None}
+
+    if not compiled:
+        run_dbt_command(build_dbt_command("parse"), target=target, operation="parse", logger=logger)
+    manifest = load_manifest()
+    graph = model_graph(manifest, exclude)
+    if not graph:
+        return {"distribute": False, "groups": [], "estimate": None}
+
+    costs = model_costs(target, list(graph))
+    run_threads = _run_threads(target, threads)
+    # Meilleur découpage estimé parmi les nombres de workers et les tolérances de charge
+    candidates = []
+    for count in range(2, workers + 1):
+        for slack in BALANCE_SLACKS:
+            groups = partition_dag(graph, costs, count, slack)
+            candidates.append((estimate_makespan(graph, costs, groups, run_threads), groups))
+    estimate, groups = min(candidates, key=lambda candidate: (candidate[0]["distributed"], candidate[0]["groups"]))
+    distribute = len(groups) > 1 and estimate["distributed"] < estimate["single"]
+
+    group_of = {unique_id: index for index, group in enumerate(groups) for unique_id in group}
+    plan = [
+        {
+            "index": index,
+            "models": group,
+            "upstream": sorted({group_of[parent] for unique_id in group for parent in graph[unique_id]} - {index}),
+            "cost": round(sum(costs[unique_id] for unique_id in group), 1),
+        }
+        for index, group in enumerate(groups)
+    ]
+    for group in plan:
+        logger.info(
+            f"🧩 Sous-graphe {group['index']} : {len(group['models'])} modèle(s), ~{group['cost']}s, "
+            f"amont: {group['upstream'] or '-'}"
+        )
+    logger.info(
+        f"🧩 Makespan estimé : {estimate['single']}s sur un worker, {estimate['distributed']}s sur "
+        f"{estimate['groups']} worker(s) ({estimate['cross_edges']} dépendance(s) entre sous-graphes) "
+        f"-> {'distribué' if distribute else 'non distribué'}"
+    )
+    return {"distribute": distribute, "groups": plan, "estimate": estimate}
+
+
+def _wait_for_flow_runs(flow_run_ids: list[str], logger, timeout: float | None = None) -> dict[str, Any]:
+    """Attend la fin de flow runs ; retourne leur état final {id: State}."""
+    deadline = time.monotonic() + timeout if timeout else None
+    states: dict[str, Any] = {}
+    with get_client(sync_client=True) as client:
+        while True:
+            for flow_run_id in flow_run_ids:
+                if flow_run_id not in states:
+                    state = client.read_flow_run(UUID(flow_run_id)).state
+                    if state is not None and state.is_final():
+                        states[flow_run_id] = state
+            if len(states) == len(flow_run_ids):
+                return states
+            if deadline and time.monotonic() > deadline:
+                raise TimeoutError(f"Flow runs non terminés après {timeout}s: {sorted(set(flow_run_ids) - set(states))}")
+            logger.debug(f"⏳ {len(states)}/{len(flow_run_ids)} flow run(s) terminé(s)")
+            time.sleep(POLL_SECONDS)
+
+
+def _schedule_subgraphs(groups: list[dict[str, Any]], submit, logger, timeout: float | None = None):
+    """
+    Soumet chaque sous-graphe quand ses sous-graphes amont ont réussi, et attend la fin de tous
+
+    Args:
+        groups: Sous-graphes du plan (plan_distribution), dans un ordre compatible avec leurs dépendances
+        submit: Fonction (sous-graphe, flow runs amont) -> identifiant du flow run créé
+        logger: Logger Prefect
+        timeout: Attente maximale ; au-delà, les sous-graphes soumis non terminés sont annulés
+
+    Returns:
+        Tuple ({index: flow run}, {index: State final}, {index non soumis (amont en échec)}, délai dépassé)
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    flow_run_ids: dict[int, str] = {}
+    states: dict[int, Any] = {}
+    skipped: set[int] = set()
+    with get_client(sync_client=True) as client:
+        while True:
+            for group in groups:
+                index = group["index"]
+                if index in flow_run_ids or index in skipped:
+                    continue
+                if any(upstream in skipped or (upstream in states and not states[upstream].is_completed())
+                       for upstream in group["upstream"]):
+                    skipped.add(index)
+                    logger.warning(f"⏭️  Sous-graphe {index} non soumis : sous-graphe amont en échec")
+                elif all(upstream in states for upstream in group["upstream"]):
+                    flow_run_ids[index] = submit(group, [flow_run_ids[upstream] for upstream in group["upstream"]])
+                    logger.info(f"🚚 Sous-graphe {index} soumis au work pool ({flow_run_ids[index]})")
+            for index, flow_run_id in flow_run_ids.items():
+                if index not in states:
+                    state = client.read_flow_run(UUID(flow_run_id)).state
+                    if state is not None and state.is_final():
+                        states[index] = state
+            if len(states) + len(skipped) == len(groups):
+                return flow_run_ids, states, skipped, False
+            if deadline and time.monotonic() > deadline:
+                unfinished = [flow_run_id for index, flow_run_id in flow_run_ids.items() if index not in states]
+                logger.error(f"⏰ Sous-graphes non terminés après {timeout}s: {unfinished}")
+                cancelled = _cancel_unfinished(unfinished, logger)
+                states.update({index: cancelled[flow_run_id] for index, flow_run_id in flow_run_ids.items()
+                               if flow_run_id in cancelled})
+                # Sous-graphes jamais soumis : leurs amont n'ont pas fini à temps
+                skipped |= {group["index"] for group in groups if group["index"] not in flow_run_ids}
+                return flow_run_ids, states, skipped, True
+            logger.debug(f"⏳ {len(states)}/{len(groups)} sous-graphe(s) terminé(s)")
+            time.sleep(POLL_SECONDS)
+
+
+def _cancel_unfinished(flow_run_ids: list[str], logger) -> dict[str, Any]:
+    """Annule les flow runs non terminés ; retourne l'état de chaque flow run {id: State}."""
+    from prefect.states import Cancelling
+
+    states: dict[str, Any] = {}
+    with get_client(sync_client=True) as client:
+        for flow_run_id in flow_run_ids:
+            state = client.read_flow_run(UUID(flow_run_id)).state
+            if state is None or not state.is_final():
+                state = Cancelling(message="Délai d'attente du run distribué dépassé")
+                client.set_flow_run_state(UUID(flow_run_id), state, force=True)
+                logger.warning(f"🛑 Sous-graphe {flow_run_id} annulé (délai dépassé)")
+            states[flow_run_id] = state
+    return states
+
+
+def verify_checkout(manifest: dict[str, Any]) -> None:
+    """
+    Vérifie que les modèles du projet local sont ceux du manifest partagé
+
+    Raises:
+        RuntimeError: Si un fichier de modèle diffère (autre commit que le run parent)
+    """
+    project = manifest["metadata"].get("project_name")
+    mismatched = []
+    for node in manifest["nodes"].values():
+        if node["resource_type"] != "model" or node.get("package_name") != project:
+            continue
+        path = DBT_PROJECT_DIR / node["original_file_path"]
+        try:
+            checksum = hashlib.sha256(path.read_text(encoding="utf-8").strip().encode("utf-8")).hexdigest()
+        except OSError:
+            checksum = None
+        if checksum != node["checksum"]["checksum"]:
+            mismatched.append(node["original_file_path"])
+    if mismatched:
+        raise RuntimeError(
+            f"Projet dbt du worker différent du manifest du run parent ({len(mismatched)} modèle(s)): "
+            f"{', '.join(sorted(mismatched)[:10])}"
+        )
+
+
+@contextmanager
+def _subgraph_env(parent_flow_run_id: str, index: int):
+    """Labels du run parent et artefacts dbt dédiés pendant l'exécution du sous-graphe."""
+    values = {
+        "DBT_FLOW_RUN_ID": parent_flow_run_id,
+        "DBT_TARGET_PATH": str(SUBGRAPH_TARGET_DIR / parent_flow_run_id / str(index)),
+    }
+    previous = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+@flow(name="dbt-subgraph", log_prints=True, **FLOW_METRIC_HOOKS)
+def dbt_subgraph_flow(
+    target: str,
+    parent_flow_run_id: str,
+    index: int,
+    models: list[str],
+    upstream_flow_run_ids: list[str] | None = None,
+    sample_rate: float | None = None,
+    threads: int | str | None = None,
+    full_refresh: bool = False,
+    mart_windows: dict[str, str] | None = None,
+):
+    """
+    Construit un sous-graphe d'un run distribué (voir run_distributed)
+
+    Args:
+        target: Environnement cible
+        parent_flow_run_id: Flow run parent (clé des artefacts partagés, labels des jobs)
+        index: Numéro du sous-graphe
+        models: unique_id des modèles du sous-graphe
+        upstream_flow_run_ids: Flow runs des sous-graphes amont à attendre
+        sample_rate, threads, full_refresh, mart_windows: Paramètres du run parent
+
+    Returns:
+        Nombre de modèles construits
+    """
+    # Import différé : pipeline.py importe ce module
+    from prefect_flows.pipeline import run_dbt_models
+
+    logger = get_run_logger()
+    store = resolve_object_store(target, logger)
+    data = store.read(_run_key(parent_flow_run_id, "manifest.json"))
+    if data is None:
+        raise FileNotFoundError(f"Manifest partagé introuvable: {store.uri(_run_key(parent_flow_run_id, 'manifest.json'))}")
+    manifest = json.loads(data)
+    verify_checkout(manifest)
+    select = [manifest["nodes"][unique_id]["name"] for unique_id in models]
+
+    if upstream_flow_run_ids:
+        logger.info(f"⏳ Sous-graphe {index} : attente de {len(upstream_flow_run_ids)} sous-graphe(s) amont")
+        states = _wait_for_flow_runs(upstream_flow_run_ids, logger, timeout=UPSTREAM_TIMEOUT_SECONDS)
+        failed = [flow_run_id for flow_run_id, state in states.items() if not state.is_completed()]
+        if failed:
+            raise RuntimeError(f"Sous-graphe(s) amont en échec, modèles non construits: {failed}")
+
+    logger.info(f"🧩 Sous-graphe {index} : construction de {len(select)} modèle(s)")
+    started_at = time.time()
+    try:
+        with _subgraph_env(parent_flow_run_id, index):
+            run_dbt_models(
+                target=target, sample_rate=sample_rate, threads=threads,
+                full_refresh=full_refresh, mart_windows=mart_windows, select=select,
+            )
+    finally:
+        # Résumé redéposé même en cas d'échec, pour le flow parent
+        invocations = load_invocations(target, flow_run_id=current_flow_run_id(), operation="run", limit=1)
+        if invocations and invocations[0]["started_at"] >= started_at:
+            payload = json.dumps(invocations[0]).encode("utf-8")
+            store.put(_run_key(parent_flow_run_id, f"results/{index}.json"), payload, crc32c(payload))
+    return len(select)
+
+
+@task(name="run-distributed", **TASK_METRIC_HOOKS)
+def run_distributed(
+    target: str,
+    plan: dict[str, Any],
+    deployment: str = SUBGRAPH_DEPLOYMENT,
+    sample_rate: float | None = None,
+    threads: int | str | None = None,
+    full_refresh: bool = False,
+    mart_windows: dict[str, str] | None = None,
+    timeout_seconds: float = SUBGRAPH_TIMEOUT_SECONDS,
+) -> list[dict[str, Any]]:
+    """
+    Exécute les sous-graphes d'un plan sur les workers et attend leur fin
+
+    Args:
+        target: Environnement cible
+        plan: Résultat de plan_distribution
+        deployment: Déploiement des sous-graphes ({flow}/{déploiement})
+        sample_rate, threads, full_refresh, mart_windows: Paramètres du run
+        timeout_seconds: Attente maximale des sous-graphes ; au-delà, ceux qui ne
+            sont pas terminés (worker perdu, run resté en attente) sont annulés
+
+    Returns:
+        Résultats fusionnés des nœuds construits (format run_history)
+
+    Raises:
+        RuntimeError: Si un sous-graphe échoue ou est annulé (les sous-graphes en aval ne sont pas soumis)
+    """
+    from prefect.runtime import flow_run
+
+    logger = get_run_logger()
+    parent_flow_run_id = current_flow_run_id()
+    store = resolve_object_store(target, logger)
+    manifest_key = _run_key(parent_flow_run_id, "manifest.json")
+    payload = (dbt_target_dir() / "manifest.json").read_bytes()
+    store.put(manifest_key, payload, crc32c(payload))
+    logger.info(f"📤 Manifest partagé: {store.uri(manifest_key)}")
+
+    def submit(group: dict[str, Any], upstream_flow_run_ids: list[str]) -> str:
+        child = run_deployment(
+            deployment,
+            parameters={
+                "target": target,
+                "parent_flow_run_id": parent_flow_run_id,
+                "index": group["index"],
+                "models": group["models"],
+                "upstream_flow_run_ids": upstream_flow_run_ids,
+                "sample_rate": sample_rate,
+                "threads": threads,
+                "full_refresh": full_refresh,
+                "mart_windows": mart_windows or None,
+            },
+            flow_run_name=f"{flow_run.name or 'pipeline'}-subgraph-{group['index']}",
+            timeout=0,
+        )
+        return str(child.id)
+
+    started_at = time.time()
+    logger.info(f"🚚 {len(plan['groups'])} sous-graphe(s) à soumettre au work pool ({deployment}), amont d'abord")
+    flow_run_ids, states, skipped, timed_out = _schedule_subgraphs(
+        plan["groups"], submit, logger, timeout=timeout_seconds,
+    )
+    results = []
+    subgraph_threads = {}
+    for group in plan["groups"]:
+        data = store.read(_run_key(parent_flow_run_id, f"results/{group['index']}.json"))
+        if data is not None:
+            invocation = json.loads(data)
+            results += invocation["results"]
+            subgraph_threads[str(group["index"])] = invocation.get("threads")
+    failed = sorted(skipped | {index for index, state in states.items() if not state.is_completed()})
+    known_threads = [value for value in subgraph_threads.values() if value]
+
+    # Un seul `dbt run` dans l'historique du run parent
+    history_path = record_invocation(target, {
+        "flow_run_id": parent_flow_run_id,
+        "target": target,
+        "operation": "run",
+        "command": f"distributed: {len(flow_run_ids)} sous-graphe(s) via {deployment}",
+        "success": not failed,
+        "started_at": started_at,
+        "finished_at": time.time(),
+        "invocation_id": None,
+        "invocation_started_at": None,
+        "generated_at": None,
+        "elapsed_time": time.time() - started_at,
+        # Concurrence d'un worker (max des sous-graphes), et détail par sous-graphe
+        "threads": max(known_threads) if known_threads else None,
+        "subgraph_threads": subgraph_threads,
+        "results": results,
+    })
+    record_dbt_invocation_metrics(target, "run", time.time() - started_at, history_path)
+    store.delete(sorted(store.list(_run_key(parent_flow_run_id, ""))))
+    if failed:
+        reason = f" (délai de {timeout_seconds}s dépassé)" if timed_out else ""
+        raise RuntimeError(f"Sous-graphe(s) en échec ou annulé(s){reason}: {failed}")
+    logger.info(
+        f"✅ {len(results)} modèle(s) construit(s) par {len(flow_run_ids)} worker(s) en "
+        f"{time.time() - started_at:.0f}s (estimé: {plan['estimate']['distributed']}s)"
+    )
+    return results
+
+
+def register_local_deployment(work_pool: str) -> str:
+    """Déploie dbt_subgraph_flow depuis ce répertoire sur un work pool process local."""
+    dbt_subgraph_flow.from_source(
+        source=str(PROJECT_ROOT), entrypoint="prefect_flows/distributed.py:dbt_subgraph_flow",
+    ).deploy(name="dbt-subgraph", work_pool_name=work_pool, print_next_steps=False)
+    return SUBGRAPH_DEPLOYMENT
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exécution distribuée d'un run dbt (sous-graphes)")
+    parser.add_argument("--target", default="dev")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", default=None)
+    parser.add_argument("--register-local", metavar="WORK_POOL", default=None,
+                        help="Déploie le flow des sous-graphes sur un work pool process local")
+    args = parser.parse_args()
+    if args.register_local:
+        print(f"✅ Déploiement {register_local_deployment(args.register_local)} sur {args.register_local}")
+        return
+    # Aperçu du découpage, sans exécution
+    print(json.dumps(plan_distribution(target=args.target, workers=args.workers, threads=args.threads), indent=2))
+
+
+if __name__ == "__main__":
+    main()
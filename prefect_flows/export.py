@@ -0,0 +1,310 @@
+"""
+Export des marts en fichiers Parquet pour les dashboards Power BI (mode Import)
+
+En DirectQuery, chaque interaction sur un visuel devient une requête
+facturée sur l'entrepôt. Cette étape, lancée après le build dbt, lit les
+marts finaux en record batches Arrow (flux de lecture parallèles) et les
+écrit en Parquet compressé, partitionné, que Power BI importe localement.
+
+Rafraîchissement incrémental:
+    Une empreinte (nombre de lignes + checksum) est calculée par partition
+    dans l'entrepôt. Seules les partitions dont l'empreinte a changé depuis
+    le dernier export sont relues et réécrites ; les partitions disparues
+    sont supprimées. Les empreintes exportées sont conservées dans le
+    manifeste `_manifest.json` de chaque mart.
+
+Arborescence (EXPORT_DIR, surchargeable via MART_EXPORT_DIR):
+    exports/{target}/mart_content_performance/event_date=2025-01-06/part-0.parquet
+    exports/{target}/mart_users/all/part-0.parquet
+
+En local:
+    uv run python -m prefect_flows.export
+"""
+import shutil
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from prefect import flow, task, get_run_logger
+
+from prefect_flows.config import EXPORT_DIR
+from prefect_flows.metrics import FLOW_METRIC_HOOKS, ROWS_INGESTED, TASK_METRIC_HOOKS
+from prefect_flows.state import read_json, write_json_atomic
+from prefect_flows.warehouse import Warehouse, resolve_warehouse
+
+
+# Marts exportés et colonne de partitionnement (None = un seul fichier)
+MART_EXPORTS = {
+    "mart_content_performance": "event_date",
+    "mart_users": None,
+}
+
+# Clé et répertoire de l'unique partition d'un mart non partitionné
+UNPARTITIONED_KEY = "all"
+
+# Nombre de partitions relues par session de lecture (borne les fichiers ouverts)
+PARTITIONS_PER_READ = 100
+
+
+def _partition_dir(partition_by: str | None, key: str) -> str:
+    return f"{partition_by}={key}" if partition_by else UNPARTITIONED_KEY
+
+
+def partition_fingerprints(warehouse: Warehouse, mart: str, partition_by: str | None) -> dict[str, str]:
+    """
+    Calcule l'empreinte de chaque partition d'un mart dans l'entrepôt
+
+    Args:
+        warehouse: Entrepôt du target
+        mart: Nom du mart
+        partition_by: Colonne de partitionnement (None = une seule partition)
+
+    Returns:
+        Dict {clé de partition: "nombre de lignes:checksum"}
+    """
+    key_expr = f"cast(t.{partition_by} as string)" if partition_by else f"'{UNPARTITIONED_KEY}'"
+    rows = warehouse.query(
+        f"select {key_expr} as partition_key, count(*) as row_count, "
+        f"{warehouse.row_checksum('t')} as checksum "
+        f"from {warehouse.relation(mart)} as t group by 1"
+    )
+    return {row["partition_key"]: f"{row['row_count']}:{row['checksum']}" for row in rows}
+
+
+def _partition_filter(partition_by: str | None, keys: list[str]) -> str | None:
+    """Condition SQL sélectionnant les partitions `keys` (littéraux convertis par l'entrepôt)."""
+    if not partition_by:
+        return None
+    for key in keys:
+        if "'" in key or "\\" in key:
+            raise ValueError(f"Clé de partition non exportable: {key!r}")
+    return f"{partition_by} in ({', '.join(repr(str(key)) for key in keys)})"
+
+
+def _write_partitions(
+    warehouse: Warehouse,
+    mart: str,
+    partition_by: str | None,
+    keys: list[str],
+    staging_dir: Path,
+    compression: str,
+    max_streams: int,
+) -> tuple[pa.Schema | None, int]:
+    """
+    Lit les partitions `keys` et écrit un fichier Parquet par partition dans `staging_dir`
+
+    Returns:
+        Tuple (schéma Arrow lu, nombre de lignes écrites)
+    """
+    writers: dict[str, pq.ParquetWriter] = {}
+    schema = None
+    rows_written = 0
+    try:
+        for batch in warehouse.read_record_batches(
+            mart, row_filter=_partition_filter(partition_by, keys), max_streams=max_streams
+        ):
+            if batch.num_rows == 0:
+                continue
+            schema = schema or batch.schema
+            if partition_by:
+                batch_keys = pc.cast(batch.column(partition_by), pa.string())
+                groups = {
+                    key: batch.filter(pc.equal(batch_keys, key))
+                    for key in pc.unique(batch_keys).to_pylist()
+                }
+            else:
+                groups = {UNPARTITIONED_KEY: batch}
+
+            for key, group in groups.items():
+                if key not in writers:
+                    path = staging_dir / _partition_dir(partition_by, key) / "part-0.parquet"
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    writers[key] = pq.ParquetWriter(path, schema, compression=compression)
+                writers[key].write_batch(group.cast(schema))
+                rows_written += group.num_rows
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return schema, rows_written
+
+
+def _swap_partition(mart_dir: Path, staging_dir: Path, partition_dir: str) -> None:
+    """Remplace une partition publiée par sa version en staging (renommages de répertoires)."""
+    published = mart_dir / partition_dir
+    staged = staging_dir / partition_dir
+    trash = mart_dir / f".trash-{uuid.uuid4().hex}"
+    if published.exists():
+        published.rename(trash)
+    staged.rename(published)
+    shutil.rmtree(trash, ignore_errors=True)
+
+
+def export_mart(
+    warehouse: Warehouse,
+    mart: str,
+    partition_by: str | None,
+    export_dir: Path,
+    full_refresh: bool = False,
+    compression: str = "zstd",
+    max_streams: int = 4,
+    logger=None,
+) -> dict:
+    """
+    Exporte un mart en Parquet, en ne réécrivant que les partitions modifiées
+
+    Les fichiers sont d'abord écrits dans un répertoire de staging, puis
+    substitués partition par partition ; le manifeste n'est mis à jour
+    qu'ensuite. Une interruption laisse au pire des partitions déjà à jour,
+    réécrites au prochain export.
+
+    Args:
+        warehouse: Entrepôt du target
+        mart: Nom du mart
+        partition_by: Colonne de partitionnement (None = un seul fichier)
+        export_dir: Répertoire d'export du target
+        full_refresh: Réécrit toutes les partitions, sans tenir compte du manifeste
+        compression: Codec Parquet (zstd, snappy, gzip, ...)
+        max_streams: Nombre maximal de flux de lecture parallèles
+        logger: Logger Prefect de la tâche appelante
+
+    Returns:
+        Statistiques de l'export du mart
+    """
+    mart_dir = export_dir / mart
+    manifest_path = mart_dir / "_manifest.json"
+    manifest = read_json(manifest_path, default={"partitions": {}, "schema": None})
+    published = set(manifest["partitions"])
+    published_by = manifest.get("partition_by")
+    if full_refresh or published_by != partition_by:
+        manifest = {"partitions": {}, "schema": None}
+
+    fingerprints = partition_fingerprints(warehouse, mart, partition_by)
+    exported = manifest["partitions"]
+    changed = sorted(key for key, fp in fingerprints.items() if exported.get(key, {}).get("fingerprint") != fp)
+    # Partitions publiées qui n'existent plus (toutes si le partitionnement a changé)
+    removed = sorted(published if published_by != partition_by else published - set(fingerprints))
+    logger.info(
+        f"📦 {mart}: {len(fingerprints)} partition(s), {len(changed)} à réécrire, {len(removed)} à supprimer"
+    )
+
+    staging_dir = mart_dir / f".staging-{uuid.uuid4().hex}"
+    rows_written = 0
+    schema = None
+    try:
+        for start in range(0, len(changed), PARTITIONS_PER_READ):
+            chunk = changed[start:start + PARTITIONS_PER_READ]
+            chunk_schema, chunk_rows = _write_partitions(
+                warehouse, mart, partition_by, chunk, staging_dir, compression, max_streams
+            )
+            schema = schema or chunk_schema
+            rows_written += chunk_rows
+
+        # Un changement de schéma rendrait les partitions inchangées incompatibles
+        if schema is not None and manifest["schema"] not in (None, schema.to_string()) and not full_refresh:
+            logger.warning(f"⚠️  Schéma de {mart} modifié : export complet")
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return export_mart(
+                warehouse, mart, partition_by, export_dir,
+                full_refresh=True, compression=compression, max_streams=max_streams, logger=logger,
+            )
+
+        exported_at = datetime.now(timezone.utc).isoformat()
+        for key in changed:
+            partition_dir = _partition_dir(partition_by, key)
+            if (staging_dir / partition_dir).exists():
+                _swap_partition(mart_dir, staging_dir, partition_dir)
+            else:
+                # Partition vidée entre le calcul des empreintes et la lecture
+                shutil.rmtree(mart_dir / partition_dir, ignore_errors=True)
+            exported[key] = {"fingerprint": fingerprints[key], "exported_at": exported_at}
+        for key in removed:
+            shutil.rmtree(mart_dir / _partition_dir(published_by, key), ignore_errors=True)
+            if key not in fingerprints:
+                exported.pop(key, None)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    write_json_atomic(manifest_path, {
+        "mart": mart,
+        "partition_by": partition_by,
+        "compression": compression,
+        "schema": schema.to_string() if schema is not None else manifest["schema"],
+        "partitions": exported,
+    })
+
+    return {
+        "partitions_total": len(fingerprints),
+        "partitions_written": len(changed),
+        "partitions_deleted": len(removed),
+        "rows_written": rows_written,
+    }
+
+
+@task(name="export-marts", retries=1, retry_delay_seconds=30, **TASK_METRIC_HOOKS)
+def export_marts(
+    target: str = "dev",
+    marts: list[str] | None = None,
+    full_refresh: bool = False,
+    compression: str = "zstd",
+    max_streams: int = 4,
+) -> dict:
+    """
+    Exporte les marts finaux en Parquet partitionné (voir MART_EXPORTS)
+
+    Args:
+        target: Environnement cible (dev, prod ou local)
+        marts: Marts à exporter (default: tous ceux de MART_EXPORTS)
+        full_refresh: Réécrit toutes les partitions
+        compression: Codec Parquet
+        max_streams: Nombre maximal de flux de lecture parallèles par mart
+
+    Returns:
+        Dict {mart: statistiques de l'export}
+    """
+    logger = get_run_logger()
+    warehouse = resolve_warehouse(target, logger, stage="export")
+    export_dir = EXPORT_DIR / target
+
+    logger.info(f"📤 Export des marts ({warehouse.dialect}) vers {export_dir}")
+    results = {}
+    for mart in marts or list(MART_EXPORTS):
+        results[mart] = export_mart(
+            warehouse,
+            mart,
+            MART_EXPORTS[mart],
+            export_dir,
+            full_refresh=full_refresh,
+            compression=compression,
+            max_streams=max_streams,
+            logger=logger,
+        )
+        ROWS_INGESTED.inc(results[mart]["rows_written"], target=target, stage="export", relation=mart)
+        logger.info(
+            f"✅ {mart}: {results[mart]['partitions_written']} partition(s) réécrite(s), "
+            f"{results[mart]['rows_written']} ligne(s)"
+        )
+    return results
+
+
+@flow(name="pipeline-export-marts", log_prints=True, **FLOW_METRIC_HOOKS)
+def mart_export_pipeline(target: str = "dev", marts: list[str] | None = None, full_refresh: bool = False):
+    """
+    Export seul des marts (sans build dbt), par exemple après un full refresh manuel
+
+    Args:
+        target: Environnement cible (dev, prod ou local). Par défaut "dev".
+        marts: Marts à exporter (default: tous)
+        full_refresh: Réécrit toutes les partitions
+
+    Returns:
+        Dict {mart: statistiques de l'export}
+    """
+    return export_marts(target=target, marts=marts, full_refresh=full_refresh)
+
+
+if __name__ == "__main__":
+    # Exécution locale pour tester (environnement dev par défaut)
+    mart_export_pipeline(target="dev")
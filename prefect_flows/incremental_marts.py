@@ -0,0 +1,123 @@
+"""
+Fenêtres de recalcul et partitions touchées des marts incrémentaux
+
+mart_content_performance et mart_users sont incrémentaux, partitionnés par
+jour (voir dbt/models/marts/ et dbt/macros/incremental_marts.sql). Un run ne
+relit que les événements des `lookback_days` derniers jours présents dans le
+mart, pour intégrer les données arrivées en retard :
+
+    - mart_content_performance : les jours de la fenêtre sont recalculés et
+      leurs partitions remplacées
+    - mart_users : les utilisateurs actifs dans la fenêtre sont réagrégés sur
+      tout leur historique puis fusionnés sur user_id
+
+Avant le run, le premier jour de la fenêtre est calculé ici et passé à dbt
+(variable `mart_windows`) ; après le run, les partitions de cette fenêtre sont
+relues pour rapporter ce qui a été touché. Les événements plus anciens que la
+fenêtre ne sont repris que par un full refresh (`full_refresh=True`).
+"""
+from datetime import date, timedelta
+from typing import Any
+
+from prefect import task, get_run_logger
+
+from prefect_flows.metrics import TASK_METRIC_HOOKS
+from prefect_flows.warehouse import resolve_warehouse
+
+
+# Jours relus avant le dernier jour présent dans chaque mart
+MART_LOOKBACK_DAYS = 3
+
+# Marts incrémentaux : colonne de partition (jour) et colonne d'activité qui délimite la fenêtre
+INCREMENTAL_MARTS = {
+    "mart_content_performance": {"partition_by": "event_date", "window_column": "event_date"},
+    "mart_users": {"partition_by": "first_activity_at", "window_column": "last_activity_at"},
+}
+
+
+def _as_date(value: Any) -> date:
+    return value.date() if hasattr(value, "date") else value
+
+
+@task(name="plan-mart-windows", **TASK_METRIC_HOOKS)
+def plan_mart_windows(target: str = "dev", lookback_days: int = MART_LOOKBACK_DAYS) -> dict[str, str]:
+    """
+    Premier jour recalculé par le prochain run, pour chaque mart incrémental
+
+    Args:
+        target: Environnement cible
+        lookback_days: Jours relus avant le dernier jour présent dans le mart
+
+    Returns:
+        Dict {mart: "YYYY-MM-DD"}, sans les marts absents ou vides (construits en entier)
+    """
+    if lookback_days < 0:
+        raise ValueError(f"lookback_days doit être >= 0, reçu: {lookback_days}")
+    logger = get_run_logger()
+    warehouse = resolve_warehouse(target, logger, stage="mart_windows")
+
+    windows = {}
+    for mart, spec in INCREMENTAL_MARTS.items():
+        try:
+            row = warehouse.query(
+                f"select max(cast({spec['window_column']} as date)) as last_day from {warehouse.relation(mart)}"
+            )[0]
+        except Exception as e:
+            logger.info(f"🆕 {mart} absent ({type(e).__name__}) : construction complète")
+            continue
+        if row["last_day"] is None:
+            continue
+        windows[mart] = (_as_date(row["last_day"]) - timedelta(days=lookback_days)).isoformat()
+        logger.info(f"🪟 {mart}: recalcul à partir du {windows[mart]} ({lookback_days} jour(s) de retard toléré)")
+    return windows
+
+
+@task(name="report-mart-partitions", **TASK_METRIC_HOOKS)
+def report_mart_partitions(
+    target: str = "dev",
+    windows: dict[str, str] | None = None,
+    exclude: list[str] | None = None,
+) -> dict[str, list[dict]]:
+    """
+    Partitions écrites par le dernier run, pour chaque mart incrémental
+
+    Args:
+        target: Environnement cible
+        windows: Fenêtres passées au run (plan_mart_windows). Un mart sans
+            fenêtre a été construit en entier : toutes ses partitions sont rapportées.
+        exclude: Modèles non construits par le run (en cache, voir build_cache.py) :
+            aucune partition rapportée, sans lire l'entrepôt
+
+    Returns:
+        Dict {mart: [{"partition": "YYYY-MM-DD", "rows": lignes écrites}]}
+    """
+    logger = get_run_logger()
+    warehouse = resolve_warehouse(target, logger, stage="mart_partitions")
+    windows = windows or {}
+    exclude = set(exclude or [])
+
+    touched = {}
+    for mart, spec in INCREMENTAL_MARTS.items():
+        if mart in exclude:
+            touched[mart] = []
+            logger.info(f"🧩 {mart}: aucune partition écrite (modèle en cache, non reconstruit)")
+            continue
+        start = windows.get(mart)
+        condition = f"cast({spec['window_column']} as date) >= cast('{start}' as date)" if start else "true"
+        rows = warehouse.query(
+            f"select cast({spec['partition_by']} as date) as partition_day, count(*) as row_count "
+            f"from {warehouse.relation(mart)} where {condition} group by 1 order by 1"
+        )
+        touched[mart] = [
+            {"partition": _as_date(row["partition_day"]).isoformat(), "rows": row["row_count"]} for row in rows
+        ]
+        scope = f"fenêtre depuis le {start}" if start else "construction complète"
+        if touched[mart]:
+            logger.info(
+                f"🧩 {mart}: {len(touched[mart])} partition(s) écrite(s), "
+                f"{touched[mart][0]['partition']} → {touched[mart][-1]['partition']}, "
+                f"{sum(row['rows'] for row in touched[mart])} ligne(s) ({scope})"
+            )
+        else:
+            logger.info(f"🧩 {mart}: aucune partition écrite ({scope})")
+    return touched
@@ -0,0 +1,329 @@
+"""
+Ingestion dédupliquée des sources brutes (viewing_logs, social_interactions)
+
+Les flux renvoient des fenêtres qui se chevauchent : un même visionnage ou une
+même interaction peut arriver dans plusieurs fichiers. Chaque fichier est un
+batch :
+
+    1. chargé tel quel dans une table de staging du schéma brut
+    2. dédupliqué sur la clé naturelle (RAW_TABLES) et horodaté (`_loaded_at`)
+    3. fusionné (MERGE) dans la table brute : insertion des clés nouvelles,
+       mise à jour des lignes modifiées, lignes identiques ignorées
+
+La correspondance est restreinte aux jours d'événement présents dans le batch
+(la table brute est partitionnée par ce jour sur BigQuery) : le MERGE ne lit
+et ne réécrit que ces partitions. Une ligne renvoyée avec un jour d'événement
+différent de celui déjà chargé est donc insérée comme une nouvelle ligne.
+
+Les lignes insérées ou mises à jour reçoivent le `_loaded_at` du batch : les
+modèles incrémentaux (watermark sur `_loaded_at`) les reprennent au run suivant.
+
+Target local : la table brute est tenue dans le schéma `raw` de la base DuckDB,
+initialisée depuis le CSV de LOCAL_DATA_DIR (fixtures du dépôt, jamais
+modifiées). Après chaque batch, elle est exportée dans LOCAL_INGESTED_DATA_DIR
+(.local/raw/, hors dépôt), répertoire que dbt lit alors à la place de
+LOCAL_DATA_DIR (voir dbt_runner.dbt_env).
+
+En local:
+    uv run python -m prefect_flows.ingestion --target local --table social_interactions data/incoming/*.csv
+"""
+import argparse
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from prefect import flow, task, get_run_logger
+
+from prefect_flows.catalog import catalog_usage, prefetch_catalog
+from prefect_flows.config import LOCAL_DATA_DIR, LOCAL_INGESTED_DATA_DIR, OFFLINE_TARGETS
+from prefect_flows.metrics import FLOW_METRIC_HOOKS, ROWS_INGESTED, TASK_METRIC_HOOKS, Counter
+from prefect_flows.upload import upload_source_file
+from prefect_flows.warehouse import Warehouse, resolve_warehouse
+from prefect_flows.watermarks import format_timestamp
+
+
+# Tables brutes : clé naturelle et colonne d'horodatage de l'événement (jour de partition)
+RAW_TABLES = {
+    "viewing_logs": {"key": ["view_id"], "event_column": "viewed_at"},
+    "social_interactions": {"key": ["interaction_id"], "event_column": "interacted_at"},
+}
+
+# Schéma des tables brutes du target local (base DuckDB)
+LOCAL_RAW_SCHEMA = "raw"
+
+LOADED_AT_COLUMN = "_loaded_at"
+
+INGESTED_ROWS = Counter(
+    "pipeline_ingestion_rows_total", "Lignes des batchs d'ingestion, par issue", ("target", "table", "outcome")
+)
+
+
+def _quote_list(values: list[str]) -> str:
+    for value in values:
+        if "'" in value or "\\" in value:
+            raise ValueError(f"Valeur non utilisable dans un littéral SQL: {value!r}")
+    return ", ".join(f"cast('{value}' as date)" for value in values)
+
+
+def _raw_warehouse(target: str, raw_schema: str | None, logger) -> Warehouse:
+    """Entrepôt positionné sur le schéma des tables brutes."""
+    warehouse = resolve_warehouse(target, logger, stage="ingestion")
+    if raw_schema:
+        return warehouse.in_schema(raw_schema)
+    if target in OFFLINE_TARGETS:
+        return warehouse.in_schema(LOCAL_RAW_SCHEMA)
+    return warehouse
+
+
+def _sync_local_table(warehouse: Warehouse, table: str, to_csv: bool) -> None:
+    """
+    Target local : initialise la table brute depuis son CSV, ou exporte la table pour dbt
+
+    Args:
+        warehouse: Entrepôt DuckDB positionné sur le schéma brut
+        table: Table brute
+        to_csv: False pour initialiser la table (si absente), True pour l'exporter
+            dans LOCAL_INGESTED_DATA_DIR
+    """
+    if not to_csv:
+        ingested_path = LOCAL_INGESTED_DATA_DIR / f"{table}.csv"
+        csv_path = ingested_path if ingested_path.exists() else LOCAL_DATA_DIR / f"{table}.csv"
+        if not warehouse.columns(table) and csv_path.exists():
+            warehouse.load_csv(table, csv_path)
+        return
+    # dbt lit toutes les sources dans ce répertoire : les autres tables y sont copiées telles quelles
+    LOCAL_INGESTED_DATA_DIR.mkdir(parents=True, exist_ok=True)
+    for other in RAW_TABLES:
+        fixture_path = LOCAL_DATA_DIR / f"{other}.csv"
+        if other != table and fixture_path.exists() and not (LOCAL_INGESTED_DATA_DIR / f"{other}.csv").exists():
+            shutil.copyfile(fixture_path, LOCAL_INGESTED_DATA_DIR / f"{other}.csv")
+    csv_path = LOCAL_INGESTED_DATA_DIR / f"{table}.csv"
+    spec = RAW_TABLES[table]
+    tmp_path = csv_path.with_suffix(f".csv.tmp-{uuid.uuid4().hex[:8]}")
+    warehouse.execute(
+        f"copy (select * from {warehouse.relation(table)} order by {spec['event_column']}, {', '.join(spec['key'])}) "
+        f"to '{tmp_path}' (format csv, header, delimiter ',')"
+    )
+    os.replace(tmp_path, csv_path)
+
+
+def merge_batch(warehouse: Warehouse, table: str, path: Path, loaded_at: datetime) -> dict[str, Any]:
+    """
+    Charge un batch en staging et le fusionne dans la table brute
+
+    Args:
+        warehouse: Entrepôt positionné sur le schéma brut
+        table: Table brute (clé de RAW_TABLES)
+        path: Fichier CSV du batch
+        loaded_at: Horodatage d'arrivée attribué aux lignes du batch
+
+    Returns:
+        Dict {"batch", "rows", "rejected", "duplicates_in_batch", "inserted", "updated", "unchanged", "dates"}
+    """
+    spec = RAW_TABLES[table]
+    keys, event_column = spec["key"], spec["event_column"]
+    batch_id = uuid.uuid4().hex[:8]
+    landing, staging = f"_landing_{table}_{batch_id}", f"_staging_{table}_{batch_id}"
+
+    try:
+        warehouse.load_csv(landing, path, like=table)
+        columns = warehouse.columns(landing)
+        missing = [column for column in [*keys, event_column] if column not in columns]
+        if missing:
+            raise ValueError(f"Colonnes manquantes dans {path.name}: {', '.join(missing)}")
+        payload = [column for column in columns if column not in keys and column != LOADED_AT_COLUMN]
+
+        # Déduplication dans le batch : la dernière arrivée l'emporte, sinon une ligne arbitraire.
+        # Les lignes sans clé ou sans horodatage d'événement sont rejetées.
+        valid = " and ".join(f"{column} is not null" for column in [*keys, event_column])
+        order = f"{LOADED_AT_COLUMN} desc" if LOADED_AT_COLUMN in columns else ", ".join(keys)
+        warehouse.execute(
+            f"""
+            create or replace table {warehouse.relation(staging)} as
+            select {', '.join(keys + payload)}, cast('{format_timestamp(loaded_at)}' as timestamp) as {LOADED_AT_COLUMN}
+            from (
+                select *, row_number() over (partition by {', '.join(keys)} order by {order}) as _batch_rank
+                from {warehouse.relation(landing)}
+                where {valid}
+            ) as ranked
+            where _batch_rank = 1
+            """
+        )
+        warehouse.create_table_like(table, staging, partition_date_column=event_column, cluster_by=keys)
+
+        landed = warehouse.query(
+            f"select count(*) as total_rows, sum(case when {valid} then 1 else 0 end) as valid_rows "
+            f"from {warehouse.relation(landing)}"
+        )[0]
+        rows, valid_rows = landed["total_rows"], int(landed["valid_rows"] or 0)
+        dates = sorted(
+            str(row["event_day"]) for row in warehouse.query(
+                f"select distinct cast({event_column} as date) as event_day from {warehouse.relation(staging)}"
+            )
+        )
+        if not dates:
+            return {"batch": path.name, "rows": rows, "rejected": rows, "duplicates_in_batch": 0,
+                    "inserted": 0, "updated": 0, "unchanged": 0, "dates": []}
+
+        match = " and ".join(f"t.{key} = s.{key}" for key in keys)
+        match += f" and cast(t.{event_column} as date) in ({_quote_list(dates)})"
+        same = " and ".join(f"s.{column} is not distinct from t.{column}" for column in payload) or "true"
+
+        counts = warehouse.query(
+            f"""
+            select
+                count(*) as deduplicated,
+                sum(case when t.{keys[0]} is null then 1 else 0 end) as inserted,
+                sum(case when t.{keys[0]} is not null and not ({same}) then 1 else 0 end) as updated
+            from {warehouse.relation(staging)} as s
+            left join {warehouse.relation(table)} as t
+                on {match}
+            """
+        )[0]
+
+        all_columns = keys + payload + [LOADED_AT_COLUMN]
+        warehouse.execute(
+            f"""
+            merge into {warehouse.relation(table)} as t
+            using {warehouse.relation(staging)} as s
+            on {match}
+            when matched and not ({same}) then
+                update set {', '.join(f'{column} = s.{column}' for column in payload + [LOADED_AT_COLUMN])}
+            when not matched then
+                insert ({', '.join(all_columns)})
+                values ({', '.join(f's.{column}' for column in all_columns)})
+            """
+        )
+    finally:
+        warehouse.drop_table(landing)
+        warehouse.drop_table(staging)
+
+    inserted, updated = int(counts["inserted"] or 0), int(counts["updated"] or 0)
+    return {
+        "batch": path.name,
+        "rows": rows,
+        "rejected": rows - valid_rows,
+        "duplicates_in_batch": valid_rows - counts["deduplicated"],
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": counts["deduplicated"] - inserted - updated,
+        "dates": dates,
+    }
+
+
+@task(name="ingest-batch", retries=1, retry_delay_seconds=30, **TASK_METRIC_HOOKS)
+def ingest_batch(target: str, table: str, path: str, raw_schema: str | None = None) -> dict[str, Any]:
+    """
+    Ingère un fichier de batch dans une table brute (staging + MERGE dédupliqué)
+
+    Un retry rejoue le batch entier : le MERGE est idempotent (les lignes déjà
+    fusionnées sont identiques et ignorées).
+
+    Args:
+        target: Environnement cible (dev, prod ou local)
+        table: Table brute (viewing_logs ou social_interactions)
+        path: Fichier CSV du batch
+        raw_schema: Schéma (dataset) des tables brutes (default: celui du target,
+            `raw` sur le target local)
+
+    Returns:
+        Comptes du batch (voir merge_batch)
+    """
+    if table not in RAW_TABLES:
+        raise ValueError(f"Table brute inconnue: {table} (attendu: {', '.join(RAW_TABLES)})")
+    logger = get_run_logger()
+    warehouse = _raw_warehouse(target, raw_schema, logger)
+    local = target in OFFLINE_TARGETS and not raw_schema
+
+    if local:
+        _sync_local_table(warehouse, table, to_csv=False)
+    result = merge_batch(warehouse, table, Path(path), loaded_at=datetime.now(timezone.utc))
+    if local:
+        _sync_local_table(warehouse, table, to_csv=True)
+
+    for outcome in ("inserted", "updated", "unchanged", "duplicates_in_batch", "rejected"):
+        INGESTED_ROWS.inc(result[outcome], target=target, table=table, outcome=outcome)
+    ROWS_INGESTED.inc(result["inserted"] + result["updated"], target=target, stage="ingestion", relation=table)
+
+    dates = f"{result['dates'][0]} → {result['dates'][-1]}" if result["dates"] else "aucun jour"
+    logger.info(
+        f"📥 {table} ← {result['batch']}: {result['rows']} ligne(s) reçue(s), {result['inserted']} insérée(s), "
+        f"{result['updated']} mise(s) à jour, {result['unchanged']} déjà chargée(s), "
+        f"{result['duplicates_in_batch']} doublon(s) dans le batch, {result['rejected']} rejetée(s) "
+        f"({len(result['dates'])} jour(s): {dates})"
+    )
+    if result["rejected"]:
+        logger.warning(f"⚠️  {result['rejected']} ligne(s) sans clé ou sans {RAW_TABLES[table]['event_column']} ignorée(s)")
+    return result
+
+
+@flow(name="pipeline-ingestion", log_prints=True, **FLOW_METRIC_HOOKS)
+def raw_ingestion_pipeline(
+    table: str,
+    paths: list[str],
+    target: str = "dev",
+    raw_schema: str | None = None,
+    landing_prefix: str | None = None,
+):
+    """
+    Ingère des fichiers de batch dans une table brute, un batch à la fois, dans l'ordre
+
+    Args:
+        table: Table brute (viewing_logs ou social_interactions)
+        paths: Fichiers CSV, un batch par fichier
+        target: Environnement cible (dev, prod ou local). Par défaut "dev".
+        raw_schema: Schéma (dataset) des tables brutes, s'il diffère de celui du target
+            (variable dbt `raw_schema`)
+        landing_prefix: Si renseigné, chaque fichier est d'abord déposé dans le magasin
+            d'objets de landing sous `<landing_prefix>/<table>/` (voir prefect_flows/upload.py)
+
+    Returns:
+        Dict {"table", "batches": [...], "totals": {...}, "catalog": {...}}, catalog
+        comptant les recherches de métadonnées servies par le cache (voir catalog.py)
+    """
+    # Existence et colonnes des tables brutes servies par le cache du catalogue (voir catalog.py)
+    prefetch_catalog(target=target, schemas=[raw_schema] if raw_schema else None)
+    batches = []
+    for path in paths:
+        if landing_prefix:
+            upload_source_file(
+                target=target, path=path, destination=f"{landing_prefix.rstrip('/')}/{table}/{Path(path).name}"
+            )
+        batches.append(ingest_batch(target=target, table=table, path=path, raw_schema=raw_schema))
+    totals = {
+        outcome: sum(batch[outcome] for batch in batches)
+        for outcome in ("rows", "inserted", "updated", "unchanged", "duplicates_in_batch", "rejected")
+    }
+    logger = get_run_logger()
+    logger.info(
+        f"✅ {len(batches)} batch(s) ingéré(s) dans {table}: {totals['inserted']} insertion(s), "
+        f"{totals['updated']} mise(s) à jour, {totals['unchanged'] + totals['duplicates_in_batch']} doublon(s)"
+    )
+    catalog = catalog_usage()
+    if any(catalog.values()):
+        logger.info(
+            f"🗂️  Catalogue : {catalog['hit']} aller(s)-retour(s) de métadonnées évité(s), "
+            f"{catalog['miss']} envoyé(s) à l'entrepôt"
+        )
+    return {"table": table, "batches": batches, "totals": totals, "catalog": catalog}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion dédupliquée des sources brutes")
+    parser.add_argument("paths", nargs="+", help="Fichiers CSV, un batch par fichier")
+    parser.add_argument("--table", required=True, choices=sorted(RAW_TABLES))
+    parser.add_argument("--target", default="dev")
+    parser.add_argument("--raw-schema", default=None)
+    parser.add_argument("--landing-prefix", default=None, help="Dépose d'abord chaque fichier sous ce préfixe")
+    args = parser.parse_args()
+    raw_ingestion_pipeline(
+        table=args.table, paths=args.paths, target=args.target, raw_schema=args.raw_schema,
+        landing_prefix=args.landing_prefix,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Rapport de coût et de performance des jobs de l'entrepôt, par modèle et par run
+
+Chaque requête émise par la pipeline porte des labels (voir
+dbt/macros/query_comment.sql et warehouse.pipeline_labels) :
+    flow_run_id, target, dbt_model (requêtes dbt), pipeline_stage (requêtes Python)
+
+Après le build, cette étape relit les statistiques des jobs portant ces
+labels (slot-ms, octets traités et facturés, cache hit) et produit un
+classement par modèle et des totaux par run.
+
+Sources des statistiques:
+    - BigQuery : INFORMATION_SCHEMA.JOBS_BY_PROJECT de la région du dataset
+    - Autres moteurs (target local) ou vue inaccessible : historique des
+      invocations dbt (run_history.py). Les slot-ms y sont approximés par
+      la durée d'exécution des nœuds, les octets lus dans adapter_response.
+
+Rapports écrits dans REPORTS_DIR/{target}/ (JSON + Markdown).
+
+En local:
+    uv run python -m prefect_flows.job_costs --target dev --last-runs 5
+"""
+import argparse
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any
+
+from prefect import flow, task, get_run_logger
+
+from prefect_flows.config import REPORTS_DIR
+from prefect_flows.metrics import FLOW_METRIC_HOOKS, TASK_METRIC_HOOKS
+from prefect_flows.run_history import current_flow_run_id, load_invocations
+from prefect_flows.state import write_json_atomic
+from prefect_flows.warehouse import resolve_warehouse, sanitize_label
+
+
+# Tarif on-demand BigQuery (USD par Tio facturé), pour l'estimation des coûts
+ON_DEMAND_USD_PER_TIB = float(os.getenv("BIGQUERY_USD_PER_TIB", "6.25"))
+
+# Nombre de modèles affichés dans le rapport Markdown
+REPORT_TOP_MODELS = 20
+
+_TIB = 1024 ** 4
+
+_METRICS = ("slot_ms", "bytes_processed", "bytes_billed", "duration_ms")
+
+
+def run_history_job_statistics(target: str, flow_run_ids: list[str]) -> list[dict[str, Any]]:
+    """
+    Statistiques de jobs reconstruites depuis l'historique des invocations dbt
+
+    Un "job" par nœud exécuté ; même format que Warehouse.job_statistics.
+
+    Args:
+        target: Environnement cible
+        flow_run_ids: Flow runs à inclure
+
+    Returns:
+        Liste de statistiques de jobs
+    """
+    jobs = []
+    for flow_run_id in flow_run_ids:
+        for invocation in load_invocations(target, flow_run_id=flow_run_id):
+            for result in invocation["results"]:
+                response = result["adapter_response"]
+                duration_ms = int((result["execution_time"] or 0) * 1000)
+                jobs.append({
+                    "job_id": response.get("job_id") or f"{invocation['invocation_id']}:{result['unique_id']}",
+                    "flow_run_id": sanitize_label(flow_run_id),
+                    "target": sanitize_label(target),
+                    "dbt_model": sanitize_label(result["unique_id"]),
+                    "pipeline_stage": None,
+                    "slot_ms": response.get("slot_ms", duration_ms),
+                    "bytes_processed": response.get("bytes_processed", 0),
+                    "bytes_billed": response.get("bytes_billed", 0),
+                    "cache_hit": False,
+                    "duration_ms": duration_ms,
+                })
+    return jobs
+
+
+def collect_job_statistics(target: str, flow_run_ids: list[str], logger, days: int = 2) -> tuple[str, list[dict]]:
+    """
+    Récupère les statistiques des jobs des flow runs donnés
+
+    Args:
+        target: Environnement cible
+        flow_run_ids: Flow runs à inclure
+        logger: Logger Prefect de la tâche appelante
+        days: Profondeur de recherche dans l'historique des jobs de l'entrepôt
+
+    Returns:
+        Tuple (source des statistiques, liste de statistiques de jobs)
+    """
+    warehouse = resolve_warehouse(target, logger, stage="job_costs")
+    try:
+        return "information_schema", warehouse.job_statistics(flow_run_ids, days=days)
+    except NotImplementedError:
+        logger.info(f"💡 Pas d'historique de jobs sur {warehouse.dialect} : statistiques issues de run_results")
+    except Exception as e:
+        logger.warning(f"⚠️  Historique des jobs inaccessible ({e}) : statistiques issues de run_results")
+    return "run_history", run_history_job_statistics(target, flow_run_ids)
+
+
+def _model_names(target: str, flow_run_ids: list[str]) -> dict[str, str]:
+    """Correspondance label dbt_model -> unique_id dbt (les labels sont normalisés)."""
+    names = {}
+    for flow_run_id in flow_run_ids:
+        for invocation in load_invocations(target, flow_run_id=flow_run_id):
+            for result in invocation["results"]:
+                names[sanitize_label(result["unique_id"])] = result["unique_id"]
+    return names
+
+
+def _estimated_cost(bytes_billed: int) -> float:
+    return round(bytes_billed / _TIB * ON_DEMAND_USD_PER_TIB, 6)
+
+
+def _aggregate(jobs: list[dict], key) -> list[dict[str, Any]]:
+    """Somme les métriques des jobs par clé, classées par slot-ms puis octets facturés décroissants."""
+    totals: dict[str, dict[str, Any]] = defaultdict(lambda: {"jobs": 0, "cache_hits": 0, **dict.fromkeys(_METRICS, 0)})
+    for job in jobs:
+        entry = totals[key(job)]
+        entry["jobs"] += 1
+        entry["cache_hits"] += bool(job["cache_hit"])
+        for metric in _METRICS:
+            entry[metric] += int(job[metric] or 0)
+
+    rows = [
+        {"name": name, **entry, "estimated_cost_usd": _estimated_cost(entry["bytes_billed"])}
+        for name, entry in totals.items()
+    ]
+    return sorted(rows, key=lambda row: (row["slot_ms"], row["bytes_billed"]), reverse=True)
+
+
+def build_cost_report(target: str, flow_run_ids: list[str], source: str, jobs: list[dict]) -> dict[str, Any]:
+    """
+    Construit le rapport de coût par modèle et par run
+
+    Les requêtes sans modèle dbt (export, apprentissage des rollups...) sont
+    regroupées sous "stage:{pipeline_stage}".
+
+    Args:
+        target: Environnement cible
+        flow_run_ids: Flow runs couverts
+        source: Source des statistiques (information_schema ou run_history)
+        jobs: Statistiques de jobs
+
+    Returns:
+        Rapport {"models": [...], "runs": [...], "totals": {...}, ...}
+    """
+    names = _model_names(target, flow_run_ids)
+
+    def model_key(job: dict) -> str:
+        if job.get("dbt_model") and job["dbt_model"] != "none":
+            return names.get(job["dbt_model"], job["dbt_model"])
+        return f"stage:{job.get('pipeline_stage') or 'unknown'}"
+
+    runs = {sanitize_label(run_id): run_id for run_id in flow_run_ids}
+    totals = _aggregate(jobs, key=lambda job: "total")
+    return {
+        "target": target,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "source": source,
+        "usd_per_tib": ON_DEMAND_USD_PER_TIB,
+        "flow_run_ids": flow_run_ids,
+        "totals": totals[0] if totals else None,
+        "models": _aggregate(jobs, key=model_key),
+        "runs": _aggregate(jobs, key=lambda job: runs.get(job["flow_run_id"], job["flow_run_id"])),
+    }
+
+
+def render_cost_report(report: dict[str, Any]) -> str:
+    """Rendu Markdown du rapport (modèles les plus coûteux en tête)."""
+    header = "| {} | Jobs | Slot-ms | Octets traités | Octets facturés | Cache hits | Coût estimé (USD) |"
+    separator = "|---|---:|---:|---:|---:|---:|---:|"
+
+    def table(title: str, rows: list[dict]) -> list[str]:
+        lines = [header.format(title), separator]
+        for row in rows:
+            lines.append(
+                f"| `{row['name']}` | {row['jobs']} | {row['slot_ms']:,} | {row['bytes_processed']:,} "
+                f"| {row['bytes_billed']:,} | {row['cache_hits']} | {row['estimated_cost_usd']:.4f} |"
+            )
+        return lines
+
+    lines = [
+        f"# Coût des jobs — target `{report['target']}`",
+        "",
+        f"Généré le {report['generated_at']} (source : {report['source']}, "
+        f"{report['usd_per_tib']} USD/Tio facturé).",
+        "",
+        f"## Modèles (top {REPORT_TOP_MODELS} par slot-ms)",
+        "",
+        *table("Modèle", report["models"][:REPORT_TOP_MODELS]),
+        "",
+        "## Runs",
+        "",
+        *table("Flow run", report["runs"]),
+        "",
+    ]
+    return "\n".join(lines)
+
+
+def write_cost_report(report: dict[str, Any]) -> dict[str, str]:
+    """
+    Écrit le rapport dans REPORTS_DIR/{target}/ (horodaté + copie "latest")
+
+    Returns:
+        Dict {"json": chemin, "markdown": chemin}
+    """
+    report_dir = REPORTS_DIR / report["target"]
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    json_path = report_dir / f"job_costs-{stamp}.json"
+    markdown_path = report_dir / "job_costs-latest.md"
+
+    write_json_atomic(json_path, report)
+    write_json_atomic(report_dir / "job_costs-latest.json", report)
+    markdown_path.write_text(render_cost_report(report), encoding="utf-8")
+    return {"json": str(json_path), "markdown": str(markdown_path)}
+
+
+@task(name="report-job-costs", **TASK_METRIC_HOOKS)
+def report_job_costs(target: str = "dev", flow_run_ids: list[str] | None = None, days: int = 2) -> dict:
+    """
+    Collecte les statistiques des jobs labellisés et écrit le rapport de coût
+
+    Args:
+        target: Environnement cible (dev, prod ou local)
+        flow_run_ids: Flow runs à couvrir (default: le flow run en cours)
+        days: Profondeur de recherche dans l'historique des jobs
+
+    Returns:
+        Dict {"totals": ..., "top_models": [...], "paths": {...}}
+    """
+    logger = get_run_logger()
+    flow_run_ids = flow_run_ids or [current_flow_run_id()]
+
+    logger.info(f"💰 Collecte des statistiques de jobs pour {len(flow_run_ids)} run(s) sur {target}")
+    source, jobs = collect_job_statistics(target, flow_run_ids, logger, days=days)
+    report = build_cost_report(target, flow_run_ids, source, jobs)
+    paths = write_cost_report(report)
+
+    for row in report["models"][:5]:
+        logger.info(
+            f"📊 {row['name']}: {row['slot_ms']:,} slot-ms, {row['bytes_billed']:,} octets facturés "
+            f"(~{row['estimated_cost_usd']:.4f} USD)"
+        )
+    logger.info(f"✅ Rapport de coût écrit: {paths['markdown']}")
+    return {"totals": report["totals"], "top_models": report["models"][:5], "paths": paths}
+
+
+@flow(name="pipeline-job-costs", log_prints=True, **FLOW_METRIC_HOOKS)
+def job_cost_report_pipeline(target: str = "dev", last_runs: int = 5, days: int = 7):
+    """
+    Rapport de coût sur les derniers flow runs de la pipeline (hors build)
+
+    Args:
+        target: Environnement cible (dev, prod ou local). Par défaut "dev".
+        last_runs: Nombre de flow runs récents couverts (d'après l'historique dbt)
+        days: Profondeur de recherche dans l'historique des jobs
+
+    Returns:
+        Résumé du rapport (voir report_job_costs)
+    """
+    flow_run_ids = []
+    for invocation in reversed(load_invocations(target)):
+        # Les micro-batchs ne sont pas des flow runs de la pipeline
+        if invocation["operation"] == "microbatch":
+            continue
+        if invocation["flow_run_id"] not in flow_run_ids:
+            flow_run_ids.append(invocation["flow_run_id"])
+    return report_job_costs(target=target, flow_run_ids=flow_run_ids[:last_runs] or None, days=days)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rapport de coût des jobs de la pipeline")
+    parser.add_argument("--target", default="dev")
+    parser.add_argument("--last-runs", type=int, default=5)
+    parser.add_argument("--days", type=int, default=7)
+    args = parser.parse_args()
+    job_cost_report_pipeline(target=args.target, last_runs=args.last_runs, days=args.days)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Transmission groupée et bornée de la sortie dbt vers les logs Prefect
+
+Avec `stream_output`, DbtCoreOperation (prefect-shell) émet un log Prefect par
+morceau de sortie dbt : sur un gros run, des milliers d'appels synchrones au
+logger du run (console + API). Pendant une commande dbt, un filtre intercepte
+ces enregistrements et place les lignes dans un buffer borné ; un thread les
+transmet par lots :
+
+    - avertissements et erreurs : toujours transmis, jamais perdus
+    - lignes "N of M START ..." : résumées (comptées, non transmises)
+    - lignes "N of M OK/PASS/SKIP ..." : échantillonnées (1 sur NODE_SAMPLE_EVERY)
+    - autres lignes (en-têtes, récapitulatif final) : transmises
+    - buffer plein : les lignes d'information sont perdues et comptées
+
+Un récapitulatif (reçues, transmises, résumées, perdues) est loggé à la fin de
+chaque commande et reporté dans la métrique pipeline_dbt_log_lines_total.
+
+Benchmark (coût du logging sur la sortie d'un gros run synthétique):
+    uv run python -m prefect_flows.log_forwarding --lines 20000
+"""
+import argparse
+import logging
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+from prefect_flows.metrics import Counter
+
+
+# Taille du buffer de lignes en attente de transmission
+LOG_BUFFER_SIZE = 10_000
+# Nombre maximal de lignes par enregistrement transmis
+LOG_BATCH_SIZE = 200
+# Délai maximal (secondes) avant transmission d'un lot incomplet
+LOG_FLUSH_INTERVAL = 1.0
+# Une ligne de résultat de nœud transmise sur N
+NODE_SAMPLE_EVERY = 10
+
+# Loggers par lesquels prefect-shell émet la sortie des commandes
+SHELL_LOGGER_NAMES = ("prefect.task_runs", "prefect.flow_runs", "prefect.ShellProcess")
+
+_STREAM_PREFIX = re.compile(r"^PID \d+ stream output:\r?\n")
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+_NODE_LINE = re.compile(r"^\s*(?:\d\d:\d\d:\d\d\s+)?\d+ of \d+ (START|OK|PASS|SKIP)\b")
+_ERROR_LINE = re.compile(
+    r"\[(?:ERROR|FAIL)\b|\b(?:Database|Compilation|Runtime|Parsing) Error\b|\bFailure in\b"
+    r"|Completed with \d+ errors?|^\s*(?:\d\d:\d\d:\d\d\s+)?(?:ERROR|Encountered an error)\b"
+)
+_WARNING_LINE = re.compile(r"\[WARN\b|\bWARNING\b|^\s*(?:\d\d:\d\d:\d\d\s+)?(?:\[?WARN|Warning)\b")
+
+LOG_LINES = Counter(
+    "pipeline_dbt_log_lines_total", "Lignes de sortie dbt, par traitement", ("outcome",)
+)
+
+
+def classify_line(line: str) -> int:
+    """Niveau de log d'une ligne de sortie dbt (ERROR, WARNING ou INFO)."""
+    if _ERROR_LINE.search(line):
+        return logging.ERROR
+    if _WARNING_LINE.search(line):
+        return logging.WARNING
+    return logging.INFO
+
+
+class DbtLogForwarder(logging.Filter):
+    """
+    Filtre de logging + thread de transmission par lots (gestionnaire de contexte)
+
+    Args:
+        logger: Logger Prefect du run, utilisé pour transmettre les lots
+        buffer_size: Taille du buffer de lignes d'information
+        batch_size: Nombre maximal de lignes par enregistrement transmis
+        flush_interval: Délai maximal avant transmission d'un lot incomplet
+        node_sample_every: Une ligne de résultat de nœud transmise sur N
+    """
+
+    def __init__(
+        self,
+        logger,
+        buffer_size: int = LOG_BUFFER_SIZE,
+        batch_size: int = LOG_BATCH_SIZE,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+        node_sample_every: int = NODE_SAMPLE_EVERY,
+    ):
+        super().__init__()
+        self.logger = logger
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.node_sample_every = max(node_sample_every, 1)
+        self.stats = {"received": 0, "forwarded": 0, "summarized": 0, "dropped": 0}
+        self._buffer: queue.Queue[tuple[int, str]] = queue.Queue(maxsize=buffer_size)
+        # Avertissements et erreurs arrivés buffer plein : jamais perdus
+        self._overflow: deque[tuple[int, str]] = deque()
+        self._node_lines = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="dbt-log-forwarder", daemon=True)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "dbt_forwarded", False) or not isinstance(record.msg, str):
+            return True
+        match = _STREAM_PREFIX.match(record.msg)
+        if not match:
+            return True
+        for line in _ANSI_ESCAPE.sub("", record.msg[match.end():]).splitlines():
+            self._enqueue(line)
+        return False
+
+    def _enqueue(self, line: str) -> None:
+        self.stats["received"] += 1
+        node = _NODE_LINE.match(line)
+        if node:
+            if node.group(1) == "START":
+                self.stats["summarized"] += 1
+                return
+            self._node_lines += 1
+            if self._node_lines % self.node_sample_every:
+                self.stats["summarized"] += 1
+                return
+        level = classify_line(line)
+        try:
+            self._buffer.put_nowait((level, line))
+        except queue.Full:
+            if level >= logging.WARNING:
+                self._overflow.append((level, line))
+            else:
+                self.stats["dropped"] += 1
+
+    def _drain(self) -> list[tuple[int, str]]:
+        lines = []
+        while self._overflow:
+            lines.append(self._overflow.popleft())
+        while True:
+            try:
+                lines.append(self._buffer.get_nowait())
+            except queue.Empty:
+                return lines
+
+    def _emit(self, lines: list[tuple[int, str]]) -> None:
+        """Transmet les lignes, regroupées par niveau consécutif et par lots de batch_size."""
+        chunk: list[str] = []
+        chunk_level = None
+        for level, line in [*lines, (None, None)]:
+            if chunk and (level != chunk_level or len(chunk) >= self.batch_size):
+                self.logger.log(chunk_level, "\n".join(chunk), extra={"dbt_forwarded": True})
+                self.stats["forwarded"] += len(chunk)
+                chunk = []
+            if level is not None:
+                chunk_level = level
+                chunk.append(line)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            while self._buffer.qsize() < self.batch_size and time.monotonic() < deadline:
+                if self._stop.wait(0.05):
+                    break
+            self._emit(self._drain())
+
+    def __enter__(self) -> "DbtLogForwarder":
+        for name in SHELL_LOGGER_NAMES:
+            logging.getLogger(name).addFilter(self)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for name in SHELL_LOGGER_NAMES:
+            logging.getLogger(name).removeFilter(self)
+        self._stop.set()
+        self._thread.join()
+        self._emit(self._drain())
+
+        for outcome in ("forwarded", "summarized", "dropped"):
+            LOG_LINES.inc(self.stats[outcome], outcome=outcome)
+        message = (
+            f"📉 Sortie dbt: {self.stats['received']} ligne(s) reçue(s), {self.stats['forwarded']} transmise(s), "
+            f"{self.stats['summarized']} résumée(s), {self.stats['dropped']} perdue(s) (buffer plein)"
+        )
+        self.logger.log(
+            logging.WARNING if self.stats["dropped"] else logging.INFO, message, extra={"dbt_forwarded": True}
+        )
+
+
+def _synthetic_dbt_output(lines: int) -> list[str]:
+    """Sortie dbt synthétique d'un gros run (START + OK par nœud, quelques avertissements)."""
+    nodes = max(lines // 2, 1)
+    output = ["Running with dbt=1.10.13", f"Found {nodes} models, 0 tests, 4 sources"]
+    for index in range(1, nodes + 1):
+        output.append(f"12:00:00  {index} of {nodes} START sql table model analytics.model_{index} ...... [RUN]")
+        output.append(f"12:00:01  {index} of {nodes} OK created sql table model analytics.model_{index} [OK in 0.10s]")
+        if index % 500 == 0:
+            output.append(f"12:00:01  [WARNING]: Deprecated functionality in model_{index}")
+    output.append(f"Done. PASS={nodes} WARN=0 ERROR=0 SKIP=0 TOTAL={nodes}")
+    return output
+
+
+def benchmark_forwarding(lines: int = 20_000) -> dict[str, float]:
+    """
+    Compare le coût du logging de la sortie dbt, direct ou via DbtLogForwarder
+
+    Rejoue la sortie synthétique au rythme de prefect-shell (un log par ligne)
+    dans un flow Prefect et mesure le temps passé dans les appels de logging.
+
+    Returns:
+        Dict {"direct_seconds", "forwarded_seconds", "speedup"}
+    """
+    from prefect import flow, get_run_logger
+
+    output = _synthetic_dbt_output(lines)
+
+    @flow(name="benchmark-log-forwarding")
+    def replay(forward: bool) -> float:
+        logger = get_run_logger()
+        forwarder = DbtLogForwarder(logger) if forward else None
+        if forwarder:
+            forwarder.__enter__()
+        start = time.perf_counter()
+        for line in output:
+            logger.info(f"PID 4242 stream output:\n{line}")
+        elapsed = time.perf_counter() - start
+        if forwarder:
+            forwarder.__exit__(None, None, None)
+        return elapsed
+
+    direct = replay(forward=False)
+    forwarded = replay(forward=True)
+    return {"direct_seconds": direct, "forwarded_seconds": forwarded, "speedup": direct / max(forwarded, 1e-9)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la transmission des logs dbt")
+    parser.add_argument("--lines", type=int, default=20_000)
+    args = parser.parse_args()
+    result = benchmark_forwarding(args.lines)
+    print(
+        f"⏱️  {args.lines} lignes : direct {result['direct_seconds']:.2f}s, "
+        f"via buffer {result['forwarded_seconds']:.2f}s (x{result['speedup']:.1f})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,670 @@
+"""
+Conseiller de matérialisation des modèles dbt (view, table, incremental)
+
+dbt_project.yml fixe la matérialisation par dossier (example/ en view, marts/
+en table). Ce conseiller la remet en question modèle par modèle à partir de
+ce que les runs ont réellement coûté, et écrit un rapport à relire avant de
+modifier la config (rien n'est appliqué automatiquement).
+
+Signaux, par modèle:
+    - temps (et octets) de build : historique des invocations dbt (run_history.py)
+    - fan-out : modèles et tests qui le lisent (manifest.json)
+    - lectures en aval : INFORMATION_SCHEMA.JOBS sur BigQuery (requêtes des
+      dashboards et builds des modèles enfants) ; à défaut, une lecture par
+      enfant, par test et par export à chaque run
+    - croissance des sources : lignes chargées par jour dans les sources en
+      amont (colonne `loaded_at_field` de sources.yml), rapportées au volume
+      total et au nombre de runs par jour
+
+Estimation quotidienne (secondes et octets), C = coût de la requête du modèle,
+R = coût d'une lecture de la table matérialisée:
+    - view        : lectures x C
+    - table       : runs x C + lectures x R
+    - incremental : runs x C x max(part de lignes nouvelles, INCREMENTAL_MIN_FRACTION)
+                    + lectures x R
+Le critère est le coût en USD sur BigQuery (facturation à l'octet), le temps
+ailleurs. Un changement n'est recommandé que s'il gagne au moins MIN_GAIN_RATIO.
+
+Partitionnement et clustering (BigQuery, tables d'au moins PARTITION_MIN_BYTES):
+    - partition : colonne de temps la plus filtrée par les requêtes, sinon celle
+      de l'export (export.MART_EXPORTS), sinon la première colonne de temps
+    - clustering : colonnes les plus filtrées (hors partition)
+    - gain estimé : les lectures filtrant sur ces colonnes ne lisent plus que
+      PRUNED_SCAN_FRACTION des octets (hypothèse, à vérifier après application)
+
+Rapports écrits dans REPORTS_DIR/{target}/ (JSON + Markdown).
+
+En local:
+    uv run python -m prefect_flows.materialization --target dev --days 14
+"""
+import argparse
+import re
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Any
+
+from prefect import flow, task, get_run_logger
+
+from prefect_flows.config import REPORTS_DIR
+from prefect_flows.export import MART_EXPORTS
+from prefect_flows.job_costs import ON_DEMAND_USD_PER_TIB
+from prefect_flows.metrics import FLOW_METRIC_HOOKS, TASK_METRIC_HOOKS
+from prefect_flows.run_history import dbt_target_dir, load_invocations
+from prefect_flows.state import read_json, write_json_atomic
+from prefect_flows.warehouse import Warehouse, resolve_warehouse
+
+
+MATERIALIZATIONS = ("view", "table", "incremental")
+
+# Gain relatif minimal pour recommander un changement de matérialisation
+MIN_GAIN_RATIO = 0.20
+# Part de lignes nouvelles par run au-delà de laquelle l'incrémental n'est pas proposé
+INCREMENTAL_MAX_CHANGE_RATIO = 0.5
+# Coût minimal d'un run incrémental rapporté à un build complet (merge, lecture de la cible)
+INCREMENTAL_MIN_FRACTION = 0.05
+
+# Taille à partir de laquelle partitionnement et clustering sont proposés (BigQuery)
+PARTITION_MIN_BYTES = 1024 ** 3
+# Part des octets lus par une requête qui filtre sur la partition ou le clustering (hypothèse)
+PRUNED_SCAN_FRACTION = 0.25
+# Nombre maximal de colonnes de clustering (limite BigQuery)
+MAX_CLUSTER_COLUMNS = 4
+# Part minimale des requêtes filtrant sur une colonne pour la retenir en clustering
+CLUSTER_MIN_QUERY_SHARE = 0.10
+
+_TIB = 1024 ** 4
+_DAY_SECONDS = 86_400
+
+_TIME_COLUMN = re.compile(r"(?:^|_)(?:date|day|at|time|timestamp)$")
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_WHERE_CLAUSE = re.compile(
+    r"\bwhere\b(.*?)(?=\bgroup\s+by\b|\bhaving\b|\border\s+by\b|\blimit\b|\bunion\b|$)", re.I | re.S
+)
+_IDENTIFIER = re.compile(r"[`\w.]+")
+
+
+def load_manifest() -> dict[str, Any]:
+    """Dernier manifest.json de dbt (produit par tout run ou `dbt parse`)."""
+    manifest_path = dbt_target_dir() / "manifest.json"
+    manifest = read_json(manifest_path, default=None)
+    if manifest is None:
+        raise FileNotFoundError(
+            f"{manifest_path} introuvable. "
+            f"Lancez d'abord la pipeline ou `dbt parse` dans dbt/."
+        )
+    return manifest
+
+
+def _usd(bytes_processed: float) -> float:
+    return bytes_processed / _TIB * ON_DEMAND_USD_PER_TIB
+
+
+def _mean(values: list[float]) -> float | None:
+    return sum(values) / len(values) if values else None
+
+
+def build_history(target: str, days: int) -> dict[str, dict[str, Any]]:
+    """
+    Builds réussis de chaque modèle sur les `days` derniers jours
+
+    Args:
+        target: Environnement cible
+        days: Profondeur de l'historique en jours
+
+    Returns:
+        Dict {unique_id: {"builds": [(horodatage, secondes, lignes, octets)], "runs_per_day"}}
+    """
+    since = time.time() - days * _DAY_SECONDS
+    builds: dict[str, list[tuple]] = defaultdict(list)
+    for invocation in load_invocations(target):
+        if invocation["started_at"] < since:
+            continue
+        for result in invocation["results"]:
+            if not result["unique_id"].startswith("model.") or result["status"] != "success":
+                continue
+            response = result["adapter_response"]
+            builds[result["unique_id"]].append((
+                invocation["started_at"],
+                result["execution_time"] or 0.0,
+                response.get("rows_affected"),
+                response.get("bytes_processed"),
+            ))
+
+    history = {}
+    for unique_id, entries in builds.items():
+        span_days = max((time.time() - entries[0][0]) / _DAY_SECONDS, 1.0)
+        history[unique_id] = {"builds": entries, "runs_per_day": len(entries) / span_days}
+    return history
+
+
+def source_growth(warehouse: Warehouse, sources: dict[str, dict], days: int, logger) -> dict[str, dict[str, float]]:
+    """
+    Croissance de chaque source d'après sa colonne `loaded_at_field` (sources.yml)
+
+    Args:
+        warehouse: Entrepôt du target
+        sources: Sources du manifest
+        days: Fenêtre de mesure en jours, jusqu'au dernier chargement
+
+    Returns:
+        Dict {unique_id: {"rows": lignes au total, "rows_per_day": lignes chargées par jour}}
+    """
+    growth = {}
+    for unique_id, source in sources.items():
+        column = source.get("loaded_at_field")
+        if not column:
+            continue
+        try:
+            row = warehouse.query(
+                f"""
+                select
+                    count(*) as total_rows,
+                    min({column}) as first_loaded_at,
+                    max({column}) as last_loaded_at,
+                    sum(case when {column} > (select max({column}) from {source['relation_name']}) - interval {int(days)} day
+                        then 1 else 0 end) as recent_rows
+                from {source['relation_name']}
+                """
+            )[0]
+        except Exception as e:
+            logger.warning(f"⚠️  Croissance de {source['name']} non mesurée: {e}")
+            continue
+        if not row["total_rows"]:
+            continue
+        covered = (row["last_loaded_at"] - row["first_loaded_at"]).total_seconds() / _DAY_SECONDS
+        growth[unique_id] = {
+            "rows": row["total_rows"],
+            "rows_per_day": row["recent_rows"] / max(min(covered, days), 1.0),
+        }
+    return growth
+
+
+def filter_columns(queries: list[dict[str, str]], columns: dict[str, list[str]]) -> dict[str, Counter]:
+    """
+    Colonnes filtrées (clauses WHERE) par les requêtes, par table
+
+    Args:
+        queries: Historique ({"table_id", "query"}), voir Warehouse.recent_queries
+        columns: Colonnes de chaque table
+
+    Returns:
+        Dict {table: Counter({colonne: nombre de requêtes})}, avec la clé "" pour le total
+    """
+    counts: dict[str, Counter] = defaultdict(Counter)
+    for job in queries:
+        table = job["table_id"]
+        known = {column.lower() for column in columns.get(table, [])}
+        text = _STRING_LITERAL.sub("''", job["query"])
+        filtered = set()
+        for clause in _WHERE_CLAUSE.findall(text):
+            filtered |= {identifier.replace("`", "").split(".")[-1].lower() for identifier in _IDENTIFIER.findall(clause)}
+        counts[table][""] += 1
+        counts[table].update(filtered & known)
+    return counts
+
+
+def _layout(
+    name: str,
+    columns: list[str],
+    filters: Counter,
+    size_bytes: int | None,
+    dialect: str,
+) -> tuple[dict | None, list[str], float]:
+    """
+    Partitionnement et clustering proposés pour une table
+
+    Returns:
+        Tuple (partition_by dbt ou None, cluster_by, part des requêtes qui en profitent)
+    """
+    if dialect != "bigquery" or not size_bytes or size_bytes < PARTITION_MIN_BYTES:
+        return None, [], 0.0
+
+    time_columns = [column for column in columns if _TIME_COLUMN.search(column.lower())]
+    filtered_time = [column for column in time_columns if filters[column.lower()]]
+    partition_column = (
+        max(filtered_time, key=lambda column: filters[column.lower()]) if filtered_time
+        else MART_EXPORTS.get(name) or (time_columns[0] if time_columns else None)
+    )
+    partition_by = None
+    if partition_column:
+        data_type = "date" if partition_column.lower().endswith(("date", "day")) else "timestamp"
+        partition_by = {"field": partition_column, "data_type": data_type, "granularity": "day"}
+
+    total = filters[""] or 0
+    cluster_by = [
+        column for column, count in filters.most_common()
+        if column and column != (partition_column or "").lower() and total and count / total >= CLUSTER_MIN_QUERY_SHARE
+    ][:MAX_CLUSTER_COLUMNS]
+
+    pruned = {column.lower() for column in cluster_by} | ({partition_column.lower()} if partition_column else set())
+    # Borne haute : une requête filtrant sur plusieurs colonnes est comptée pour la plus fréquente
+    share = min(max((filters[column] for column in pruned), default=0) / total, 1.0) if total else 0.0
+    return partition_by, cluster_by, share
+
+
+def config_snippet(materialized: str, partition_by: dict | None, cluster_by: list[str]) -> str:
+    """Bloc `config()` dbt correspondant à une recommandation."""
+    options = [f"materialized='{materialized}'"]
+    if partition_by:
+        options.append(
+            "partition_by={" + ", ".join(f"'{key}': '{value}'" for key, value in partition_by.items()) + "}"
+        )
+    if cluster_by:
+        options.append("cluster_by=[" + ", ".join(f"'{column}'" for column in cluster_by) + "]")
+    return "{{ config(" + ", ".join(options) + ") }}"
+
+
+def advise_model(
+    node: dict[str, Any],
+    history: dict[str, Any] | None,
+    source_change_ratio: float | None,
+    source_rows_per_day: float | None,
+    readers: dict[str, Any],
+    size: dict[str, int | None],
+    scan: dict[str, float | None] | None,
+    throughput: float | None,
+    columns: list[str],
+    filters: Counter,
+    dialect: str,
+) -> dict[str, Any]:
+    """
+    Recommandation pour un modèle
+
+    Args:
+        node: Nœud du manifest
+        history: Builds du modèle (build_history), None s'il n'a jamais été construit
+        source_change_ratio: Part des lignes des sources en amont nouvelle à chaque run
+        source_rows_per_day: Lignes nouvelles par jour dans les sources en amont
+        readers: {"reads_per_day", "seconds_per_read", "bytes_per_read", "fan_out", "tests"}
+        size: {"rows", "bytes"} de la relation
+        scan: Coût mesuré d'une lecture complète (vues), voir Warehouse.scan_cost
+        throughput: Octets traités par seconde sur l'entrepôt (estimation des durées)
+        columns: Colonnes de la relation
+        filters: Colonnes filtrées par les requêtes (filter_columns)
+        dialect: Dialecte de l'entrepôt
+
+    Returns:
+        Recommandation (matérialisation, partition, clustering, estimations, raisons)
+    """
+    current = node["config"]["materialized"]
+    # Part d'un build complet recalculée par un run incrémental (1 si la croissance est inconnue)
+    incremental_fraction = (
+        max(source_change_ratio, INCREMENTAL_MIN_FRACTION) if source_change_ratio is not None else 1.0
+    )
+    runs_per_day = history["runs_per_day"] if history else 0.0
+    builds = history["builds"] if history else []
+    reasons = []
+
+    # C : coût d'un build complet (secondes, octets)
+    if current == "view":
+        compute_bytes = (scan or {}).get("bytes") or 0
+        compute_seconds = (scan or {}).get("seconds")
+        if compute_seconds is None:
+            compute_seconds = compute_bytes / throughput if throughput else 0.0
+    else:
+        compute_seconds = _mean([entry[1] for entry in builds]) or 0.0
+        compute_bytes = _mean([entry[3] for entry in builds if entry[3] is not None]) or 0
+        if current == "incremental":
+            # Les builds observés sont incrémentaux : coût d'un build complet extrapolé
+            compute_seconds, compute_bytes = compute_seconds / incremental_fraction, compute_bytes / incremental_fraction
+
+    # R : lecture de la table matérialisée (pour une vue, la lecture observée inclut C)
+    read_seconds = readers["seconds_per_read"]
+    read_bytes = readers["bytes_per_read"]
+    if read_seconds is None:
+        read_seconds, read_bytes = 0.0, (size.get("bytes") or 0) if current != "view" else 0
+    elif current == "view":
+        read_seconds, read_bytes = max(read_seconds - compute_seconds, 0.0), max(read_bytes - compute_bytes, 0)
+
+    partition_by, cluster_by, pruned_share = _layout(
+        node["name"], columns, filters, size.get("bytes") or (compute_bytes if current == "view" else None), dialect
+    )
+    pruning = 1 - pruned_share * (1 - PRUNED_SCAN_FRACTION)
+    reads = readers["reads_per_day"]
+
+    def estimate(seconds: float, bytes_processed: float) -> dict[str, float]:
+        return {"seconds_per_day": round(seconds, 3), "usd_per_day": round(_usd(bytes_processed), 6)}
+
+    candidates = {
+        "view": estimate(reads * compute_seconds, reads * compute_bytes),
+        "table": estimate(
+            runs_per_day * compute_seconds + reads * read_seconds * pruning,
+            runs_per_day * compute_bytes + reads * read_bytes * pruning,
+        ),
+    }
+    incremental_ok = (
+        source_change_ratio is not None
+        and source_change_ratio < INCREMENTAL_MAX_CHANGE_RATIO
+        and any(_TIME_COLUMN.search(column.lower()) for column in columns)
+    )
+    if incremental_ok or current == "incremental":
+        candidates["incremental"] = estimate(
+            runs_per_day * compute_seconds * incremental_fraction + reads * read_seconds * pruning,
+            runs_per_day * compute_bytes * incremental_fraction + reads * read_bytes * pruning,
+        )
+    # État actuel : sans le gain du partitionnement, pas encore appliqué
+    if current == "view":
+        current_estimate = candidates["view"]
+    else:
+        fraction = incremental_fraction if current == "incremental" else 1.0
+        current_estimate = estimate(
+            runs_per_day * compute_seconds * fraction + reads * read_seconds,
+            runs_per_day * compute_bytes * fraction + reads * read_bytes,
+        )
+
+    criterion = "usd_per_day" if dialect == "bigquery" else "seconds_per_day"
+    best = min(candidates, key=lambda name: (candidates[name][criterion], MATERIALIZATIONS.index(name)))
+    recommended = current
+    if best != current and candidates[best][criterion] <= current_estimate[criterion] * (1 - MIN_GAIN_RATIO):
+        recommended = best
+
+    if not history:
+        reasons.append("jamais construit dans l'historique : estimation limitée aux lectures")
+    if recommended == "view":
+        reasons.append(f"lu {reads:.1f} fois/jour pour {runs_per_day:.1f} build(s)/jour : recalculer à la lecture coûte moins")
+    elif recommended == "table" and current == "view":
+        reasons.append(f"lu {reads:.1f} fois/jour par {readers['fan_out']} modèle(s) enfant(s) et les requêtes : matérialiser évite de recalculer la vue")
+    elif recommended == "incremental" and current != "incremental":
+        reasons.append(f"{source_change_ratio:.1%} de lignes nouvelles par run dans les sources en amont")
+    elif recommended == current:
+        reasons.append(f"{current} reste la matérialisation la moins coûteuse (ou gain < {MIN_GAIN_RATIO:.0%})")
+    if recommended == "incremental" and current != "incremental":
+        reasons.append("vérifier que la requête peut être filtrée sur la fenêtre de chargement (agrégats à recalculer)")
+    if recommended == "view":
+        partition_by, cluster_by, pruned_share = None, [], 0.0
+    if partition_by or cluster_by:
+        reasons.append(f"{pruned_share:.0%} des requêtes filtrent sur la partition ou le clustering proposés")
+
+    recommended_estimate = current_estimate if recommended == current and not (partition_by or cluster_by) \
+        else candidates[recommended]
+    return {
+        "unique_id": node["unique_id"],
+        "name": node["name"],
+        "current": current,
+        "recommended": recommended,
+        "changed": recommended != current or bool(partition_by or cluster_by),
+        "partition_by": partition_by,
+        "cluster_by": cluster_by,
+        "config": config_snippet(recommended, partition_by, cluster_by),
+        "signals": {
+            "build_seconds": round(compute_seconds, 3),
+            "build_bytes": int(compute_bytes),
+            "runs_per_day": round(runs_per_day, 2),
+            "reads_per_day": round(reads, 2),
+            "fan_out": readers["fan_out"],
+            "tests": readers["tests"],
+            "downstream_bytes_per_day": int(reads * (readers["bytes_per_read"] or 0)),
+            "rows": size.get("rows"),
+            "size_bytes": size.get("bytes"),
+            "source_rows_per_day": round(source_rows_per_day, 1) if source_rows_per_day is not None else None,
+            "source_change_ratio": round(source_change_ratio, 4) if source_change_ratio is not None else None,
+        },
+        "current_estimate": current_estimate,
+        "recommended_estimate": recommended_estimate,
+        "delta": {
+            "seconds_per_day": round(recommended_estimate["seconds_per_day"] - current_estimate["seconds_per_day"], 3),
+            "usd_per_day": round(recommended_estimate["usd_per_day"] - current_estimate["usd_per_day"], 6),
+        },
+        "reasons": reasons,
+    }
+
+
+def _reader_statistics(
+    warehouse: Warehouse,
+    models: dict[str, dict],
+    child_map: dict[str, list[str]],
+    history: dict[str, dict],
+    days: int,
+    logger,
+) -> tuple[str, dict[str, dict[str, Any]]]:
+    """Lectures en aval de chaque modèle : historique de l'entrepôt, sinon lignage dbt."""
+    names = [node["name"] for node in models.values()]
+    observed = None
+    try:
+        observed = {row["table_id"]: row for row in warehouse.table_read_statistics(names, days)}
+        source = "information_schema"
+    except NotImplementedError:
+        logger.info(f"💡 Pas d'historique de requêtes sur {warehouse.dialect} : lectures déduites du lignage dbt")
+        source = "dbt_lineage"
+    except Exception as e:
+        logger.warning(f"⚠️  Historique des requêtes inaccessible ({e}) : lectures déduites du lignage dbt")
+        source = "dbt_lineage"
+
+    readers = {}
+    for unique_id, node in models.items():
+        children = child_map.get(unique_id, [])
+        fan_out = sum(1 for child in children if child.startswith("model."))
+        tests = sum(1 for child in children if child.startswith("test."))
+        runs_per_day = history.get(unique_id, {}).get("runs_per_day", 0.0)
+        row = (observed or {}).get(node["name"])
+        if row and row["reads"]:
+            readers[unique_id] = {
+                "reads_per_day": row["reads"] / days,
+                "seconds_per_read": row["duration_ms"] / 1000 / row["reads"],
+                "bytes_per_read": row["bytes_processed"] / row["reads"],
+                "fan_out": fan_out,
+                "tests": tests,
+            }
+        else:
+            exported = 1 if node["name"] in MART_EXPORTS else 0
+            readers[unique_id] = {
+                "reads_per_day": runs_per_day * (fan_out + tests + exported),
+                "seconds_per_read": None,
+                "bytes_per_read": None,
+                "fan_out": fan_out,
+                "tests": tests,
+            }
+    return source, readers
+
+
+def build_advice(target: str, warehouse: Warehouse, days: int, logger) -> dict[str, Any]:
+    """
+    Construit le rapport de recommandations pour tous les modèles du projet
+
+    Args:
+        target: Environnement cible
+        warehouse: Entrepôt du target
+        days: Profondeur de l'historique (runs dbt et requêtes) en jours
+        logger: Logger Prefect de la tâche appelante
+
+    Returns:
+        Rapport {"models": [...], "totals": {...}, ...}
+    """
+    manifest = load_manifest()
+    models = {
+        unique_id: node for unique_id, node in manifest["nodes"].items()
+        if node["resource_type"] == "model" and node["config"].get("materialized") in MATERIALIZATIONS
+    }
+    parents = {unique_id: node["depends_on"]["nodes"] for unique_id, node in models.items()}
+    history = build_history(target, days)
+    names = [node["name"] for node in models.values()]
+    sizes = warehouse.table_sizes(names)
+
+    growth = source_growth(warehouse, manifest.get("sources", {}), days, logger)
+
+    def upstream_sources(unique_id: str, seen: set) -> set:
+        if unique_id in seen:
+            return set()
+        seen.add(unique_id)
+        found = {unique_id} if unique_id in growth else set()
+        for parent in parents.get(unique_id, []):
+            found |= upstream_sources(parent, seen)
+        return found
+
+    reads_source, readers = _reader_statistics(warehouse, models, manifest.get("child_map", {}), history, days, logger)
+
+    queries, columns = [], {name: warehouse.columns(name) for name in names if name in sizes}
+    if reads_source == "information_schema":
+        queries = warehouse.recent_queries(list(columns), days)
+    filters = filter_columns(queries, columns)
+
+    # Débit de l'entrepôt (octets/s) pour convertir en durée les octets d'un dry run
+    measured = [entry for model in history.values() for entry in model["builds"] if entry[3]]
+    total_seconds = sum(entry[1] for entry in measured)
+    throughput = sum(entry[3] for entry in measured) / total_seconds if total_seconds else None
+
+    advice = []
+    for unique_id, node in sorted(models.items(), key=lambda item: item[1]["name"]):
+        upstream = upstream_sources(unique_id, set())
+        rows_per_day = sum(growth[source]["rows_per_day"] for source in upstream)
+        total_rows = sum(growth[source]["rows"] for source in upstream)
+        runs_per_day = history.get(unique_id, {}).get("runs_per_day") or 1.0
+        scan = None
+        if node["config"]["materialized"] == "view" and node["name"] in sizes:
+            scan = warehouse.scan_cost(node["name"])
+        advice.append(advise_model(
+            node,
+            history.get(unique_id),
+            source_change_ratio=min(rows_per_day / runs_per_day / total_rows, 1.0) if upstream else None,
+            source_rows_per_day=rows_per_day if upstream else None,
+            readers=readers[unique_id],
+            size=sizes.get(node["name"], {}),
+            scan=scan,
+            throughput=throughput,
+            columns=columns.get(node["name"], []),
+            filters=filters[node["name"]],
+            dialect=warehouse.dialect,
+        ))
+
+    def total(key: str, metric: str) -> float:
+        return round(sum(model[key][metric] for model in advice), 6)
+
+    return {
+        "target": target,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "dialect": warehouse.dialect,
+        "days": days,
+        "reads_source": reads_source,
+        "usd_per_tib": ON_DEMAND_USD_PER_TIB,
+        "totals": {
+            key: {metric: total(key, metric) for metric in ("seconds_per_day", "usd_per_day")}
+            for key in ("current_estimate", "recommended_estimate")
+        },
+        "models": advice,
+    }
+
+
+def render_advice(report: dict[str, Any]) -> str:
+    """Rendu Markdown du rapport (tableau récapitulatif puis détail des changements)."""
+    lines = [
+        f"# Matérialisation des modèles — target `{report['target']}`",
+        "",
+        f"Généré le {report['generated_at']} ({report['dialect']}, historique de {report['days']} jour(s), "
+        f"lectures : {report['reads_source']}, {report['usd_per_tib']} USD/Tio).",
+        "",
+        f"Estimation quotidienne : {report['totals']['current_estimate']['seconds_per_day']:.1f}s -> "
+        f"{report['totals']['recommended_estimate']['seconds_per_day']:.1f}s, "
+        f"{report['totals']['current_estimate']['usd_per_day']:.4f} -> "
+        f"{report['totals']['recommended_estimate']['usd_per_day']:.4f} USD.",
+        "",
+        "| Modèle | Actuelle | Recommandée | Partition | Clustering | Build complet (s) | Runs/j | Lectures/j "
+        "| Fan-out | Lignes sources/j | Δ temps/j (s) | Δ coût/j (USD) |",
+        "|---|---|---|---|---|---:|---:|---:|---:|---:|---:|---:|",
+    ]
+    for model in report["models"]:
+        signals = model["signals"]
+        partition = model["partition_by"]["field"] if model["partition_by"] else "—"
+        growth = signals["source_rows_per_day"]
+        lines.append(
+            f"| `{model['name']}` | {model['current']} | {'**' + model['recommended'] + '**' if model['changed'] else model['recommended']} "
+            f"| {partition} | {', '.join(model['cluster_by']) or '—'} | {signals['build_seconds']:.2f} "
+            f"| {signals['runs_per_day']:.1f} | {signals['reads_per_day']:.1f} | {signals['fan_out']} "
+            f"| {'—' if growth is None else f'{growth:,.0f}'} | {model['delta']['seconds_per_day']:+.1f} "
+            f"| {model['delta']['usd_per_day']:+.4f} |"
+        )
+
+    changed = [model for model in report["models"] if model["changed"]]
+    lines += ["", "## Changements proposés", ""]
+    if not changed:
+        lines.append("Aucun : les matérialisations actuelles sont les moins coûteuses d'après l'historique.")
+    for model in changed:
+        lines += [
+            f"### `{model['name']}` : {model['current']} -> {model['recommended']}",
+            "",
+            *[f"- {reason}" for reason in model["reasons"]],
+            "",
+            "```sql",
+            model["config"],
+            "```",
+            "",
+        ]
+    return "\n".join(lines)
+
+
+def write_advice(report: dict[str, Any]) -> dict[str, str]:
+    """
+    Écrit le rapport dans REPORTS_DIR/{target}/ (horodaté + copie "latest")
+
+    Returns:
+        Dict {"json": chemin, "markdown": chemin}
+    """
+    report_dir = REPORTS_DIR / report["target"]
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    json_path = report_dir / f"materialization-{stamp}.json"
+    markdown_path = report_dir / "materialization-latest.md"
+
+    write_json_atomic(json_path, report)
+    write_json_atomic(report_dir / "materialization-latest.json", report)
+    markdown_path.write_text(render_advice(report), encoding="utf-8")
+    return {"json": str(json_path), "markdown": str(markdown_path)}
+
+
+@task(name="advise-materializations", **TASK_METRIC_HOOKS)
+def advise_materializations(target: str = "dev", days: int = 14) -> dict:
+    """
+    Analyse l'historique et écrit les recommandations de matérialisation
+
+    Args:
+        target: Environnement cible (dev, prod ou local)
+        days: Profondeur de l'historique en jours
+
+    Returns:
+        Dict {"changes": [...], "totals": ..., "paths": {...}}
+    """
+    logger = get_run_logger()
+    warehouse = resolve_warehouse(target, logger, stage="materialization")
+    logger.info(f"🧮 Analyse des matérialisations sur {target} ({days} jour(s) d'historique)")
+
+    report = build_advice(target, warehouse, days, logger)
+    paths = write_advice(report)
+
+    changes = [model for model in report["models"] if model["changed"]]
+    for model in changes:
+        logger.info(
+            f"📐 {model['name']}: {model['current']} -> {model['recommended']} "
+            f"({model['delta']['seconds_per_day']:+.1f}s/j, {model['delta']['usd_per_day']:+.4f} USD/j)"
+        )
+    logger.info(f"✅ {len(changes)} changement(s) proposé(s), rapport écrit: {paths['markdown']}")
+    return {
+        "changes": [{key: model[key] for key in ("name", "current", "recommended", "config")} for model in changes],
+        "totals": report["totals"],
+        "paths": paths,
+    }
+
+
+@flow(name="pipeline-materialization-advisor", log_prints=True, **FLOW_METRIC_HOOKS)
+def materialization_advisor_pipeline(target: str = "dev", days: int = 14):
+    """
+    Recommandations de matérialisation, partitionnement et clustering des modèles
+
+    Args:
+        target: Environnement cible (dev, prod ou local). Par défaut "dev".
+        days: Profondeur de l'historique en jours
+
+    Returns:
+        Résumé du rapport (voir advise_materializations)
+    """
+    return advise_materializations(target=target, days=days)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conseiller de matérialisation des modèles dbt")
+    parser.add_argument("--target", default="dev")
+    parser.add_argument("--days", type=int, default=14)
+    args = parser.parse_args()
+    materialization_advisor_pipeline(target=args.target, days=args.days)
+
+
+if __name__ == "__main__":
+    main()
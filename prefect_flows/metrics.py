@@ -0,0 +1,333 @@
+"""
+Métriques de la pipeline au format d'exposition texte Prometheus
+
+Compteurs et histogrammes tenus en mémoire (incrément = un verrou et une
+addition, négligeable sur le chemin critique), puis cumulés entre les runs à
+la fin de chaque flow :
+    STATE_DIR/metrics/metrics.json    valeurs cumulées (état persistant)
+    METRICS_FILE                      exposition texte, pour le "textfile collector"
+                                      de node_exporter (PIPELINE_METRICS_FILE)
+
+Les flows et tâches sont instrumentés par des hooks d'état Prefect
+(`**FLOW_METRIC_HOOKS` / `**TASK_METRIC_HOOKS` dans les décorateurs) : durée et statut de chaque flow
+et tâche, nombre de retries. dbt_runner y ajoute les nœuds dbt par statut
+et les lignes écrites.
+
+Endpoint HTTP local (relit l'état cumulé à chaque scrape):
+    uv run python -m prefect_flows.metrics serve --port 9108
+Affichage:
+    uv run python -m prefect_flows.metrics show
+"""
+import argparse
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+from prefect_flows.config import REPORTS_DIR, STATE_DIR
+from prefect_flows.state import FileLock, read_json, write_json_atomic
+
+
+METRICS_STATE_PATH = STATE_DIR / "metrics" / "metrics.json"
+METRICS_FILE = Path(os.getenv("PIPELINE_METRICS_FILE", REPORTS_DIR / "metrics" / "pipeline.prom"))
+
+# Bornes (secondes) des histogrammes de durée : de la tâche courte au run complet
+DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+_lock = threading.Lock()
+_metrics: dict[str, "_Metric"] = {}
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        # Valeurs non encore cumulées dans l'état persistant, par combinaison de labels
+        self.pending: dict[tuple[str, ...], Any] = {}
+        _metrics[name] = self
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    """Compteur cumulatif."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            self.pending[key] = self.pending.get(key, 0) + amount
+
+    @staticmethod
+    def merge(cumulated: float | None, delta: float) -> float:
+        return (cumulated or 0) + delta
+
+    def render(self, series: dict[str, Any]) -> list[str]:
+        return [f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}"
+                for key, value in series.items()]
+
+
+class Gauge(_Metric):
+    """Valeur instantanée (la dernière écrite l'emporte)."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with _lock:
+            self.pending[self._key(labels)] = value
+
+    @staticmethod
+    def merge(cumulated: float | None, delta: float) -> float:
+        return delta
+
+    render = Counter.render
+
+
+class Histogram(_Metric):
+    """Histogramme cumulatif à bornes fixes (compteurs par borne, somme, effectif)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            entry = self.pending.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][index] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    @staticmethod
+    def merge(cumulated: dict | None, delta: dict) -> dict:
+        if cumulated is None or len(cumulated["buckets"]) != len(delta["buckets"]):
+            return delta
+        return {
+            "buckets": [a + b for a, b in zip(cumulated["buckets"], delta["buckets"])],
+            "sum": cumulated["sum"] + delta["sum"],
+            "count": cumulated["count"] + delta["count"],
+        }
+
+    def render(self, series: dict[str, Any]) -> list[str]:
+        lines = []
+        for key, entry in series.items():
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, entry["buckets"]):
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {entry['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(entry['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {entry['count']}")
+        return lines
+
+
+FLOW_RUNS = Counter("pipeline_flow_runs_total", "Flow runs terminés, par statut", ("flow", "status"))
+FLOW_DURATION = Histogram("pipeline_flow_duration_seconds", "Durée des flow runs", ("flow", "status"))
+FLOW_LAST_SUCCESS = Gauge(
+    "pipeline_flow_last_success_timestamp_seconds", "Horodatage du dernier flow run réussi", ("flow",)
+)
+STAGE_RUNS = Counter("pipeline_stage_runs_total", "Task runs terminés, par statut", ("flow", "stage", "status"))
+STAGE_DURATION = Histogram("pipeline_stage_duration_seconds", "Durée des task runs (retries inclus)", ("flow", "stage"))
+STAGE_RETRIES = Counter("pipeline_stage_retries_total", "Retries des task runs", ("flow", "stage"))
+DBT_NODES = Counter(
+    "pipeline_dbt_nodes_total", "Nœuds dbt exécutés, par statut", ("target", "operation", "status")
+)
+DBT_INVOCATION_DURATION = Histogram(
+    "pipeline_dbt_invocation_duration_seconds", "Durée des commandes dbt (sous-processus complet)",
+    ("target", "operation"),
+)
+ROWS_INGESTED = Counter(
+    "pipeline_rows_ingested_total", "Lignes écrites par étape (modèles dbt, export, ingestion)",
+    ("target", "stage", "relation"),
+)
+
+
+def _state_key(key: tuple[str, ...]) -> str:
+    return "\x1f".join(key)
+
+
+def _series(state: dict, metric: _Metric) -> dict[tuple[str, ...], Any]:
+    stored = state.get(metric.name, {})
+    return {tuple(key.split("\x1f")) if metric.labelnames else (): value for key, value in stored.items()}
+
+
+def render_metrics(state: dict) -> str:
+    """Rendu au format d'exposition texte Prometheus (version 0.0.4)."""
+    lines = []
+    for metric in _metrics.values():
+        series = _series(state, metric)
+        if metric.kind == "histogram":
+            # Bornes modifiées depuis le cumul : séries ignorées jusqu'à réinitialisation
+            series = {key: entry for key, entry in series.items() if len(entry["buckets"]) == len(metric.buckets)}
+        if not series:
+            continue
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render(series))
+    return "\n".join(lines) + "\n"
+
+
+def flush_metrics(attempts: int = 20) -> bool:
+    """
+    Cumule les valeurs en mémoire dans l'état persistant et réécrit METRICS_FILE
+
+    Sans verrou obtenu, les valeurs restent en mémoire pour le flush suivant.
+
+    Returns:
+        True si les valeurs ont été cumulées
+    """
+    lock = FileLock(METRICS_STATE_PATH.with_suffix(".lock"), stale_after_seconds=60)
+    for _ in range(attempts):
+        if lock.acquire():
+            break
+        time.sleep(0.1)
+    else:
+        return False
+
+    with lock:
+        with _lock:
+            pending = {metric: metric.pending for metric in _metrics.values() if metric.pending}
+            for metric in pending:
+                metric.pending = {}
+
+        state = read_json(METRICS_STATE_PATH, default={})
+        for metric, deltas in pending.items():
+            stored = state.setdefault(metric.name, {})
+            for key, delta in deltas.items():
+                stored[_state_key(key)] = metric.merge(stored.get(_state_key(key)), delta)
+        write_json_atomic(METRICS_STATE_PATH, state)
+
+        METRICS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = METRICS_FILE.with_name(f".{METRICS_FILE.name}.tmp")
+        tmp_path.write_text(render_metrics(state), encoding="utf-8")
+        os.replace(tmp_path, METRICS_FILE)
+    return True
+
+
+def _duration(run) -> float:
+    if run.start_time and run.state and run.state.timestamp:
+        return max((run.state.timestamp - run.start_time).total_seconds(), 0.0)
+    return 0.0
+
+
+def record_flow_state(flow, flow_run, state) -> None:
+    """Hook d'état de flow : durée, statut, puis flush des métriques du run."""
+    status = state.type.value.lower()
+    FLOW_RUNS.inc(flow=flow.name, status=status)
+    FLOW_DURATION.observe(_duration(flow_run), flow=flow.name, status=status)
+    if state.is_completed():
+        FLOW_LAST_SUCCESS.set(time.time(), flow=flow.name)
+    flush_metrics()
+
+
+def record_task_state(task, task_run, state) -> None:
+    """Hook d'état de tâche : durée, statut et retries."""
+    from prefect.runtime import flow_run
+
+    flow_name = flow_run.flow_name or ""
+    STAGE_RUNS.inc(flow=flow_name, stage=task.name, status=state.type.value.lower())
+    STAGE_DURATION.observe(_duration(task_run), flow=flow_name, stage=task.name)
+    if task_run.run_count > 1:
+        STAGE_RETRIES.inc(task_run.run_count - 1, flow=flow_name, stage=task.name)
+
+
+# Hooks à passer aux décorateurs : @flow(..., **FLOW_METRIC_HOOKS), @task(..., **TASK_METRIC_HOOKS)
+FLOW_METRIC_HOOKS = {
+    "on_completion": [record_flow_state],
+    "on_failure": [record_flow_state],
+    "on_crashed": [record_flow_state],
+}
+TASK_METRIC_HOOKS = {
+    "on_completion": [record_task_state],
+    "on_failure": [record_task_state],
+}
+
+
+def record_dbt_invocation_metrics(target: str, operation: str, duration: float, history_path: Path | None) -> None:
+    """
+    Métriques d'une commande dbt : durée, nœuds par statut, lignes écrites par modèle
+
+    Args:
+        target: Environnement cible
+        operation: Nom court de l'opération (run, test, ...)
+        duration: Durée du sous-processus en secondes
+        history_path: Entrée d'historique archivée (run_history.py), None si absente
+    """
+    DBT_INVOCATION_DURATION.observe(duration, target=target, operation=operation)
+    if history_path is None:
+        return
+    for result in read_json(history_path)["results"]:
+        DBT_NODES.inc(target=target, operation=operation, status=result["status"])
+        # rows_affected vaut -1 quand l'adaptateur ne le connaît pas
+        rows = result["adapter_response"].get("rows_affected") or 0
+        if rows > 0 and result["unique_id"].startswith("model."):
+            ROWS_INGESTED.inc(rows, target=target, stage=f"dbt_{operation}", relation=result["unique_id"])
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_metrics(read_json(METRICS_STATE_PATH, default={})).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(host: str = "127.0.0.1", port: int = 9108) -> None:
+    """Sert les métriques cumulées sur http://{host}:{port}/metrics (bloquant)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    print(f"📈 Métriques exposées sur http://{host}:{port}/metrics")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Métriques de la pipeline (format Prometheus)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve = subparsers.add_parser("serve", help="Endpoint HTTP /metrics")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=9108)
+    subparsers.add_parser("show", help="Affiche les métriques cumulées")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve_metrics(args.host, args.port)
+    else:
+        print(render_metrics(read_json(METRICS_STATE_PATH, default={})), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Flow Prefect micro-batch piloté par watermarks
+
+Exécuté toutes les quelques minutes (voir le deployment 'microbatch' dans
+prefect.yml), il ne traite que les lignes arrivées depuis le dernier
+watermark validé, via les modèles incrémentaux tagués `microbatch`, puis met à
+jour les modèles en aval (marts, rollups) sur leur fenêtre de recalcul.
+
+Déroulement d'un batch:
+    1. Prise du verrou dbt du target (target_lock), partagé avec le dbt run de
+       la pipeline complète : un seul des deux écrit les modèles à la fois
+    2. Calcul des fenêtres ]watermark validé, maintenant - marge] par source,
+       et des fenêtres de recalcul des marts (incremental_marts.py)
+    3. dbt run --select tag:microbatch+ avec les fenêtres en variables
+    4. Validation atomique des nouveaux watermarks + mesure de latence sur les
+       `_loaded_at` des lignes de la fenêtre, visibles jusque dans les marts
+
+En local:
+    uv run python -m prefect_flows.microbatch
+"""
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+
+from prefect import flow, task, get_run_logger
+
+from prefect_flows.config import STATE_DIR
+from prefect_flows.dbt_runner import build_dbt_command, run_dbt_command
+from prefect_flows.incremental_marts import plan_mart_windows
+from prefect_flows.metrics import FLOW_METRIC_HOOKS, TASK_METRIC_HOOKS
+from prefect_flows.state import FileLock
+from prefect_flows.warehouse import resolve_warehouse
+from prefect_flows.watermarks import WatermarkStore, format_timestamp, parse_timestamp
+
+
+# Sources suivies par watermark (tables du source dbt 'raw')
+MICROBATCH_SOURCES = ("viewing_logs", "social_interactions")
+
+# Modèle incrémental alimenté par chaque source (ses lignes portent leur `_loaded_at`)
+MICROBATCH_MODELS = {
+    "viewing_logs": "stg_viewing_logs",
+    "social_interactions": "stg_social_interactions",
+}
+
+# Au-delà de cette durée sans rafraîchissement, un verrou est considéré comme abandonné
+LOCK_STALE_AFTER_SECONDS = 3600
+
+# Verrou détenu par la pipeline complète : rafraîchissement, attente maximale et intervalle d'essai
+LOCK_HEARTBEAT_SECONDS = 300
+LOCK_WAIT_SECONDS = 1800
+LOCK_POLL_SECONDS = 5
+
+
+def target_lock(target: str) -> FileLock:
+    """Verrou dbt d'un target, pris par le micro-batch et par le dbt run de la pipeline complète."""
+    return FileLock(STATE_DIR / f"microbatch-{target}.lock", stale_after_seconds=LOCK_STALE_AFTER_SECONDS)
+
+
+@contextmanager
+def holding_target_lock(target: str, logger, wait_seconds: float = LOCK_WAIT_SECONDS) -> Iterator[None]:
+    """
+    Attend le verrou dbt du target puis le détient, rafraîchi pendant les longs runs
+
+    Le fichier de verrou est touché toutes les LOCK_HEARTBEAT_SECONDS : un run
+    plus long que LOCK_STALE_AFTER_SECONDS ne se le fait pas reprendre.
+
+    Args:
+        target: Environnement cible
+        logger: Logger Prefect de l'appelant
+        wait_seconds: Attente maximale d'un micro-batch en cours
+
+    Raises:
+        TimeoutError: Verrou toujours détenu après `wait_seconds`
+    """
+    lock = target_lock(target)
+    deadline = time.monotonic() + wait_seconds
+    waiting = False
+    while not lock.acquire():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Verrou {lock.path} toujours détenu après {wait_seconds}s")
+        if not waiting:
+            logger.info(f"⏳ Micro-batch en cours sur {target} : attente du verrou {lock.path.name}")
+            waiting = True
+        time.sleep(LOCK_POLL_SECONDS)
+
+    stop = threading.Event()
+
+    def heartbeat() -> None:
+        while not stop.wait(LOCK_HEARTBEAT_SECONDS):
+            try:
+                lock.path.touch()
+            except OSError:
+                pass
+
+    thread = threading.Thread(target=heartbeat, name=f"lock-heartbeat-{target}", daemon=True)
+    thread.start()
+    try:
+        with lock:
+            yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _watermark_store(target: str) -> WatermarkStore:
+    return WatermarkStore(STATE_DIR / f"watermarks-{target}.json")
+
+
+@task(name="plan-microbatch-windows", **TASK_METRIC_HOOKS)
+def plan_microbatch_windows(
+    target: str,
+    sources: list[str],
+    safety_lag_seconds: int = 60,
+) -> dict[str, dict[str, str | None]]:
+    """
+    Calcule la fenêtre de chargement à traiter pour chaque source
+
+    La borne haute est fixée à maintenant moins une marge de sécurité, pour ne
+    pas couper au milieu d'un chargement en cours. La fenêtre est figée avant
+    l'exécution dbt : un retry retraite exactement les mêmes lignes.
+
+    Args:
+        target: Environnement cible (dev ou prod)
+        sources: Sources à traiter
+        safety_lag_seconds: Marge entre maintenant et la borne haute
+
+    Returns:
+        Dict {source: {"from": borne basse exclue ou None, "to": borne haute incluse}}
+    """
+    logger = get_run_logger()
+    store = _watermark_store(target)
+    upper = datetime.now(timezone.utc) - timedelta(seconds=safety_lag_seconds)
+
+    windows = {}
+    for source in sources:
+        lower = store.get(source)
+        windows[source] = {
+            "from": format_timestamp(lower) if lower else None,
+            "to": format_timestamp(upper),
+        }
+        logger.info(f"🪟 {source}: ]{windows[source]['from'] or '-∞'}, {windows[source]['to']}]")
+    return windows
+
+
+@task(name="dbt-run-microbatch", retries=2, retry_delay_seconds=30, **TASK_METRIC_HOOKS)
+def run_microbatch_models(
+    target: str,
+    windows: dict[str, dict[str, str | None]],
+    mart_windows: dict[str, str] | None = None,
+):
+    """
+    Exécute les modèles du micro-batch et leur aval (dbt run --select tag:microbatch+)
+
+    Les modèles incrémentaux tagués lisent la fenêtre de leur source via la
+    variable `microbatch_windows` (macro `microbatch_window_filter`) ; les marts
+    et rollups en aval recalculent leur fenêtre (`mart_windows`), pour que les
+    lignes du batch soient visibles des dashboards à la validation.
+
+    Args:
+        target: Environnement cible (dev ou prod)
+        windows: Fenêtres calculées par `plan_microbatch_windows`
+        mart_windows: Fenêtres des marts (plan_mart_windows), vides pour un mart à construire
+
+    Returns:
+        Résultat de l'exécution dbt
+    """
+    logger = get_run_logger()
+    dbt_vars = {"microbatch_windows": windows}
+    if mart_windows:
+        dbt_vars["mart_windows"] = mart_windows
+    command = build_dbt_command("run", select=["tag:microbatch+"], dbt_vars=dbt_vars)
+    logger.info(f"🚀 Micro-batch dbt sur l'environnement: {target}")
+    # Opération distincte : l'historique des micro-batchs ne se mêle pas à celui des runs complets
+    return run_dbt_command(command, target=target, operation="microbatch", logger=logger)
+
+
+def _as_utc(value) -> datetime:
+    """Timestamp lu dans l'entrepôt (naïf sur DuckDB, avec fuseau sur BigQuery) en UTC."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def _window_loaded_at(target: str, windows: dict[str, dict[str, str | None]], logger) -> dict[str, dict]:
+    """
+    Lignes de chaque fenêtre dans le modèle incrémental de la source : nombre et bornes de `_loaded_at`
+
+    Returns:
+        Dict {source: {"row_count", "first_loaded_at", "last_loaded_at"}}, sans les
+        sources dont le modèle n'a pas pu être lu
+    """
+    warehouse = resolve_warehouse(target, logger, stage="microbatch_latency")
+    loaded = {}
+    for source, window in windows.items():
+        condition = f"_loaded_at <= cast('{window['to']}' as timestamp)"
+        if window["from"]:
+            condition += f" and _loaded_at > cast('{window['from']}' as timestamp)"
+        try:
+            loaded[source] = warehouse.query(
+                f"select count(*) as row_count, min(_loaded_at) as first_loaded_at, "
+                f"max(_loaded_at) as last_loaded_at "
+                f"from {warehouse.relation(MICROBATCH_MODELS[source])} where {condition}"
+            )[0]
+        except Exception as e:
+            logger.warning(f"⚠️  {source}: latence non mesurée ({type(e).__name__}: {e})")
+    return loaded
+
+
+@task(name="commit-watermarks", **TASK_METRIC_HOOKS)
+def commit_watermarks(
+    target: str,
+    windows: dict[str, dict[str, str | None]],
+    started_at: float,
+) -> dict:
+    """
+    Valide les nouveaux watermarks et mesure la latence de bout en bout
+
+    Pour chaque source, une ligne chargée dans la fenêtre devient visible au
+    moment de la validation : sa latence de données est (validation - son
+    `_loaded_at`). Les bornes sont mesurées sur les lignes de la fenêtre
+    présentes dans le modèle incrémental de la source (MICROBATCH_MODELS).
+
+    Args:
+        target: Environnement cible (dev ou prod)
+        windows: Fenêtres traitées
+        started_at: Horodatage (time.time()) du début du batch
+
+    Returns:
+        Statistiques du batch validé
+    """
+    logger = get_run_logger()
+    loaded = _window_loaded_at(target, windows, logger)
+    committed_at = datetime.now(timezone.utc)
+
+    latency = {}
+    for source, window in windows.items():
+        rows = loaded.get(source)
+        if not rows or not rows["row_count"]:
+            latency[source] = {"rows": rows["row_count"] if rows else None,
+                               "min_data_latency_seconds": None, "max_data_latency_seconds": None}
+            logger.info(f"⏱️  {source}: aucune ligne dans la fenêtre, latence non mesurée")
+            continue
+        latency[source] = {
+            "rows": rows["row_count"],
+            "min_data_latency_seconds": round((committed_at - _as_utc(rows["last_loaded_at"])).total_seconds(), 3),
+            "max_data_latency_seconds": round((committed_at - _as_utc(rows["first_loaded_at"])).total_seconds(), 3),
+        }
+        logger.info(
+            f"⏱️  {source}: latence de données mesurée entre "
+            f"{latency[source]['min_data_latency_seconds']}s et "
+            f"{latency[source]['max_data_latency_seconds']}s ({rows['row_count']} ligne(s))"
+        )
+
+    run_info = {
+        "committed_at": format_timestamp(committed_at),
+        "batch_duration_seconds": round(time.time() - started_at, 3),
+        "windows": windows,
+        "latency": latency,
+    }
+    _watermark_store(target).commit(
+        {source: parse_timestamp(window["to"]) for source, window in windows.items()},
+        run_info,
+    )
+    logger.info(f"✅ Watermarks validés ({', '.join(windows)})")
+    return run_info
+
+
+@flow(name="pipeline-dbt-microbatch", log_prints=True, **FLOW_METRIC_HOOKS)
+def dbt_microbatch_pipeline(
+    target: str = "dev",
+    sources: list[str] | None = None,
+    safety_lag_seconds: int = 60,
+):
+    """
+    Pipeline micro-batch : traite uniquement les nouvelles lignes depuis le dernier watermark
+
+    Les runs qui se chevauchent sont évités par le verrou dbt du target
+    (target_lock, en plus de la limite de concurrence du deployment), également
+    pris par le dbt run de la pipeline complète. Un run qui trouve le verrou
+    pris se termine immédiatement sans rien traiter.
+
+    Args:
+        target: Environnement cible (dev ou prod). Par défaut "dev".
+        sources: Sources à traiter (default: viewing_logs, social_interactions)
+        safety_lag_seconds: Marge de sécurité sur la borne haute des fenêtres
+
+    Returns:
+        Dict contenant le statut, les fenêtres traitées et les latences mesurées
+        (sur les `_loaded_at` des lignes de chaque fenêtre)
+    """
+    logger = get_run_logger()
+    started_at = time.time()
+    sources = list(sources or MICROBATCH_SOURCES)
+
+    lock = target_lock(target)
+    if not lock.acquire():
+        logger.warning(f"⏭️  Un micro-batch ou un dbt run est déjà en cours sur {target}, run ignoré")
+        return {"target": target, "status": "skipped"}
+
+    with lock:
+        logger.info(f"🚀 Démarrage du micro-batch (environnement: {target})...")
+        windows = plan_microbatch_windows(target, sources, safety_lag_seconds)
+        mart_windows = plan_mart_windows(target=target)
+        run_result = run_microbatch_models(target, windows, mart_windows)
+        run_info = commit_watermarks(target, windows, started_at)
+
+    logger.info(f"🎉 Micro-batch terminé en {run_info['batch_duration_seconds']}s sur {target}")
+    return {
+        "target": target,
+        "status": "committed",
+        "run": run_result,
+        **run_info,
+    }
+
+
+if __name__ == "__main__":
+    # Exécution locale pour tester (environnement dev par défaut)
+    dbt_microbatch_pipeline(target="dev")
@@ -8,14 +8,75 @@ infrastructure/setup_profiles/flows.py.
 Pour générer profiles.yml :
     uv run python -m infrastructure.setup_profiles --local-only
 """
-from prefect import flow, task, get_run_logger
-from prefect_dbt.cli.commands import DbtCoreOperation
-from prefect_dbt.cli import DbtCliProfile, BigQueryTargetConfigs
+import sys
+import time
 from pathlib import Path
 
+from prefect import flow, task, get_run_logger
+
+if __package__ in (None, ""):
+    # Exécution directe (python prefect_flows/pipeline.py) : rend le package importable
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from prefect_flows.build_cache import plan_model_builds, record_model_builds
+from prefect_flows.config import FULL_VOLUME_TARGETS, STATE_DIR
+from prefect_flows.credentials import token_usage
+from prefect_flows.dbt_runner import build_dbt_command, run_dbt_command
+from prefect_flows.distributed import SUBGRAPH_DEPLOYMENT, SUBGRAPH_TIMEOUT_SECONDS, plan_distribution, run_distributed
+from prefect_flows.export import export_marts
+from prefect_flows.incremental_marts import MART_LOOKBACK_DAYS, plan_mart_windows, report_mart_partitions
+from prefect_flows.job_costs import report_job_costs
+from prefect_flows.metrics import FLOW_METRIC_HOOKS, TASK_METRIC_HOOKS
+from prefect_flows.microbatch import holding_target_lock
+from prefect_flows.state import read_json, write_json_atomic
+from prefect_flows.test_cache import plan_cached_tests, record_test_passes, report_cached_tests
+from prefect_flows.thread_tuning import log_makespan_effect, resolve_thread_args
+
+
+def sampling_vars(target: str, sample_rate: float | None) -> dict:
+    """
+    Variables dbt d'échantillonnage des sources (voir dbt/macros/sampling.sql)
+
+    Args:
+        target: Environnement cible
+        sample_rate: Fraction des utilisateurs conservée, dans ]0, 1]. None = volume complet
+
+    Returns:
+        Dict de variables dbt (vide si aucun échantillonnage ne s'applique)
+    """
+    if sample_rate is None or sample_rate == 1:
+        return {}
+    if not 0 < sample_rate <= 1:
+        raise ValueError(f"sample_rate doit être dans ]0, 1], reçu: {sample_rate}")
+    if target in FULL_VOLUME_TARGETS:
+        raise ValueError(f"L'échantillonnage est interdit sur le target '{target}' (volume complet obligatoire)")
+    return {"sample_rate": sample_rate}
+
+
+def _sampling_state_path(target: str):
+    return STATE_DIR / f"sampling-{target}.json"
+
+
+def built_sample_rate(target: str) -> float | None:
+    """Taux d'échantillonnage du dernier dbt run réussi sur le target (None = volume complet)."""
+    return read_json(_sampling_state_path(target), default={}).get("sample_rate")
 
-@task(name="dbt-run", retries=2, retry_delay_seconds=30)
-def run_dbt_models(target: str = "dev"):
+
+def record_built_sample_rate(target: str, sample_rate: float | None) -> None:
+    """Enregistre le taux d'échantillonnage avec lequel les tables du target viennent d'être construites."""
+    write_json_atomic(_sampling_state_path(target), {"sample_rate": sample_rate, "built_at": time.time()})
+
+
+@task(name="dbt-run", retries=2, retry_delay_seconds=30, **TASK_METRIC_HOOKS)
+def run_dbt_models(
+    target: str = "dev",
+    sample_rate: float | None = None,
+    threads: int | str | None = None,
+    full_refresh: bool = False,
+    mart_windows: dict[str, str] | None = None,
+    exclude: list[str] | None = None,
+    select: list[str] | None = None,
+):
     """
     Exécute les transformations dbt (dbt run)
     
@@ -30,88 +91,43 @@ def run_dbt_models(target: str = "dev"):
     
     Args:
         target: Environnement cible (dev ou prod). Correspond au target dans profiles.yml
+        sample_rate: Fraction des utilisateurs lue dans les sources (None = volume complet)
+        threads: Threads dbt du run : None (profil), un entier, ou "auto" (voir thread_tuning.py)
+        full_refresh: Reconstruit entièrement les modèles incrémentaux (--full-refresh)
+        mart_windows: Premier jour recalculé par mart incrémental (voir incremental_marts.py)
+        exclude: Modèles à ne pas reconstruire (cache de construction, voir build_cache.py)
+        select: Modèles à construire (sous-graphe d'un run distribué, voir distributed.py).
+            None = tout le projet
     
     Returns:
         Résultat de l'exécution dbt
     """
     logger = get_run_logger()
-    project_dir = Path(__file__).parent.parent / "dbt"
-    profiles_dir = project_dir
-    
-    logger.info(f"🚀 Exécution de dbt run sur l'environnement: {target}")
-    logger.info("🔎 Tentative d'exécution via un bloc Prefect (mode Cloud)...")
-
-    # 1) Tentative Cloud (profil): charger les blocs et reconstruire le profil
-    try:
-        # Charger les target configs et le profil séparément
-        bigquery_target_configs = BigQueryTargetConfigs.load(f"bigquery-target-configs-{target}")
-        logger.info(f"✅ BigQuery target configs chargé: {bigquery_target_configs}")
-        
-        dbt_cli_profile_block = DbtCliProfile.load(f"dbt-cli-profile-{target}")
-        logger.info(f"✅ Profil dbt chargé: {dbt_cli_profile_block.name}")
-        
-        # Reconstruire le profil avec les target configs à jour
-        profile = DbtCliProfile(
-            name=dbt_cli_profile_block.name,
-            target=dbt_cli_profile_block.target,
-            target_configs=bigquery_target_configs
-        )
-        
-        logger.info(f"☁️  Exécution via le profil Prefect reconstruit pour {target}")
-        result = DbtCoreOperation(
-            project_dir=project_dir,
-            commands=["dbt run"],
-            dbt_cli_profile=profile,
-            overwrite_profiles=True,
-        ).run()
-        logger.info(f"✅ dbt run terminé avec succès via profil '{target}'")
-        return result
-    except Exception as e:
-        logger.warning(f"⚠️  Impossible de charger les blocs Prefect pour {target}: {e}")
-
-    # 2) Tentative Cloud (opération): charger une opération dbt depuis Prefect Blocks
-    preferred_block_names = [
-        f"dbt-operation-run-{target}",
-        f"dbt-core-operation-{target}",
-        "dbt-core-operation",
-    ]
-    for block_name in preferred_block_names:
-        try:
-            op = DbtCoreOperation.load(block_name)
-            logger.info(f"☁️  Exécution via le bloc Prefect: {block_name}")
-            result = op.run()
-            logger.info(f"✅ dbt run terminé avec succès via bloc '{block_name}'")
-            return result
-        except Exception:
-            # On essaye le prochain bloc
-            continue
-
-    # 3) Fallback Local: utiliser le profiles.yml local
-    logger.info("💻 Aucun bloc Prefect compatible trouvé. Bascule en mode local (profiles.yml)...")
-    logger.info(f"📁 Répertoire du projet: {project_dir}")
-    logger.info(f"📋 Fichier de profils: {profiles_dir / 'profiles.yml'}")
-
-    if not (profiles_dir / "profiles.yml").exists():
-        logger.error("❌ Le fichier profiles.yml n'existe pas!")
-        logger.error("Générez-le avec: uv run python -m infrastructure.setup_profiles --local-only")
-        raise FileNotFoundError(
-            f"Le fichier {profiles_dir / 'profiles.yml'} n'existe pas. "
-            f"Exécutez: uv run python -m infrastructure.setup_profiles --local-only"
-        )
 
-    result = DbtCoreOperation(
-        commands=[f"dbt run --target {target}"],
-        project_dir=str(project_dir),
-        profiles_dir=str(profiles_dir),
-        overwrite_profiles=False,
-    ).run()
-
-    logger.info(f"✅ dbt run terminé avec succès sur {target}")
+    logger.info(f"🚀 Exécution de dbt run sur l'environnement: {target}")
+    dbt_vars = sampling_vars(target, sample_rate)
+    # Un échantillon ne se fusionne pas avec des tables incrémentales construites
+    # à un autre taux : reconstruction complète (peu coûteuse, le volume est réduit)
+    extra_args = ["--full-refresh"] if dbt_vars or full_refresh else []
+    if mart_windows:
+        dbt_vars = {**dbt_vars, "mart_windows": mart_windows}
+    command = build_dbt_command("run", select=select, exclude=exclude, dbt_vars=dbt_vars, extra_args=extra_args)
+    extra_args += resolve_thread_args(target, "run", threads, logger, command=command)
+    command = build_dbt_command("run", select=select, exclude=exclude, dbt_vars=dbt_vars, extra_args=extra_args)
+    result = run_dbt_command(command, target=target, operation="run", logger=logger)
+    if threads is not None:
+        log_makespan_effect(target, "run", logger)
     return result
 
 
-@task(name="dbt-test", retries=1)
-def test_dbt_models(target: str = "dev"):
+@task(name="dbt-test", retries=1, **TASK_METRIC_HOOKS)
+def test_dbt_models(
+    target: str = "dev",
+    sample_rate: float | None = None,
+    threads: int | str | None = None,
+    use_cache: bool = True,
+    force: bool = False,
+):
     """
     Teste les modèles dbt (dbt test)
     
@@ -125,87 +141,93 @@ def test_dbt_models(target: str = "dev"):
     
     Args:
         target: Environnement cible (dev ou prod). Correspond au target dans profiles.yml
+        sample_rate: Même échantillon que le run, pour tester les tables construites
+        threads: Threads dbt des tests : None (profil), un entier, ou "auto"
+        use_cache: Saute les tests dont le SQL compilé et les données lues n'ont pas
+            changé depuis leur dernier succès (voir prefect_flows/test_cache.py)
+        force: Exécute tous les tests sans lire le cache (les succès sont enregistrés)
     
     Returns:
-        Résultat des tests dbt
+        Résultat des tests dbt (vide si tous les tests sont en cache)
     """
     logger = get_run_logger()
-    project_dir = Path(__file__).parent.parent / "dbt"
-    profiles_dir = project_dir
-    
-    logger.info(f"🧪 Exécution de dbt test sur l'environnement: {target}")
-    logger.info("🔎 Tentative d'exécution via un bloc Prefect (mode Cloud)...")
 
-    # 1) Tentative Cloud (profil): charger les blocs et reconstruire le profil
+    logger.info(f"🧪 Exécution de dbt test sur l'environnement: {target}")
+    dbt_vars = sampling_vars(target, sample_rate)
+    plan = plan_cached_tests(target, dbt_vars, force, logger) if use_cache else None
+    if plan:
+        report_cached_tests(target, plan, logger)
+        if plan["total"] and len(plan["cached"]) == plan["total"]:
+            return []
+    exclude = plan["exclude"] if plan else None
+    command = build_dbt_command("test", exclude=exclude, dbt_vars=dbt_vars)
+    command = build_dbt_command(
+        "test",
+        exclude=exclude,
+        dbt_vars=dbt_vars,
+        extra_args=resolve_thread_args(target, "test", threads, logger, command=command),
+    )
     try:
-        # Charger les target configs et le profil séparément
-        bigquery_target_configs = BigQueryTargetConfigs.load(f"bigquery-target-configs-{target}")
-        logger.info(f"✅ BigQuery target configs chargé: {bigquery_target_configs}")
-        
-        dbt_cli_profile_block = DbtCliProfile.load(f"dbt-cli-profile-{target}")
-        logger.info(f"✅ Profil dbt chargé: {dbt_cli_profile_block.name}")
-        
-        # Reconstruire le profil avec les target configs à jour
-        profile = DbtCliProfile(
-            name=dbt_cli_profile_block.name,
-            target=dbt_cli_profile_block.target,
-            target_configs=bigquery_target_configs
-        )
-        
-        logger.info(f"☁️  Exécution via le profil Prefect reconstruit pour {target}")
-        result = DbtCoreOperation(
-            project_dir=project_dir,
-            commands=["dbt test"],
-            dbt_cli_profile=profile,
-            overwrite_profiles=True,
-        ).run()
-        logger.info(f"✅ dbt test terminé avec succès via profil '{target}'")
-        return result
-    except Exception as e:
-        logger.warning(f"⚠️  Impossible de charger les blocs Prefect pour {target}: {e}")
-
-    # 2) Tentative Cloud (opération): charger une opération dbt depuis Prefect Blocks
-    preferred_block_names = [
-        f"dbt-operation-test-{target}",
-        f"dbt-core-operation-{target}",
-        "dbt-core-operation",
-    ]
-    for block_name in preferred_block_names:
-        try:
-            op = DbtCoreOperation.load(block_name)
-            logger.info(f"☁️  Exécution via le bloc Prefect: {block_name}")
-            result = op.run()
-            logger.info(f"✅ dbt test terminé avec succès via bloc '{block_name}'")
-            return result
-        except Exception:
-            continue
-
-    # 3) Fallback Local: utiliser le profiles.yml local
-    logger.info("💻 Aucun bloc Prefect compatible trouvé. Bascule en mode local (profiles.yml)...")
-    logger.info(f"📁 Répertoire du projet: {project_dir}")
-
-    if not (profiles_dir / "profiles.yml").exists():
-        logger.error("❌ Le fichier profiles.yml n'existe pas!")
-        raise FileNotFoundError(
-            f"Le fichier {profiles_dir / 'profiles.yml'} n'existe pas. "
-            f"Exécutez: uv run python -m infrastructure.setup_profiles --local-only"
-        )
+        result = run_dbt_command(command, target=target, operation="test", logger=logger)
+    finally:
+        # Les succès sont enregistrés même si d'autres tests échouent
+        if plan:
+            record_test_passes(target, plan, logger)
+    if threads is not None:
+        log_makespan_effect(target, "test", logger)
+    return result
 
-    result = DbtCoreOperation(
-        commands=[f"dbt test --target {target}"],
-        project_dir=str(project_dir),
-        profiles_dir=str(profiles_dir),
-        overwrite_profiles=False,
-    ).run()
 
-    logger.info(f"✅ dbt test terminé avec succès sur {target}")
-    return result
+@task(name="dbt-snapshot", retries=1, **TASK_METRIC_HOOKS)
+def snapshot_dbt_models(
+    target: str = "dev",
+    full_refresh: bool = False,
+    lookback_days: int = MART_LOOKBACK_DAYS,
+):
+    """
+    Historise les dimensions à évolution lente (dbt snapshot)
+
+    Les snapshots utilisent la stratégie `hash` (voir dbt/macros/snapshots.sql) :
+    seules les clés présentes dans les partitions sources récentes sont relues,
+    et seule l'empreinte de leurs colonnes suivies est comparée.
+
+    Args:
+        target: Environnement cible (dev ou prod). Correspond au target dans profiles.yml
+        full_refresh: Les marts ont été reconstruits en entier : toutes les clés sont
+            comparées (changements possibles hors de la fenêtre des sources)
+        lookback_days: Jours de partitions sources relus avant le dernier jour historisé
+
+    Returns:
+        Résultat de l'exécution dbt
+    """
+    logger = get_run_logger()
 
+    logger.info(f"📸 Exécution de dbt snapshot sur l'environnement: {target}")
+    dbt_vars = {"snapshot_lookback_days": lookback_days}
+    if full_refresh:
+        dbt_vars["snapshot_full_scan"] = True
+    command = build_dbt_command("snapshot", dbt_vars=dbt_vars)
+    return run_dbt_command(command, target=target, operation="snapshot", logger=logger)
 
-@flow(name="pipeline-dbt-complet", log_prints=True)
-def dbt_full_pipeline(target: str = "dev"):
+
+@flow(name="pipeline-dbt-complet", log_prints=True, **FLOW_METRIC_HOOKS)
+def dbt_full_pipeline(
+    target: str = "dev",
+    sample_rate: float | None = None,
+    export: bool = True,
+    cost_report: bool = True,
+    threads: int | str | None = None,
+    full_refresh: bool = False,
+    lookback_days: int = MART_LOOKBACK_DAYS,
+    force_tests: bool = False,
+    build_cache: bool = True,
+    workers: int = 1,
+    subgraph_deployment: str = SUBGRAPH_DEPLOYMENT,
+    subgraph_timeout_seconds: int = SUBGRAPH_TIMEOUT_SECONDS,
+    snapshots: bool = True,
+):
     """
-    Pipeline complète dbt : run + test
+    Pipeline complète dbt : run + test + export des marts + rapport de coût
     
     Cette pipeline orchestre l'exécution complète de dbt en utilisant les blocs
     Prefect configurés par infrastructure/setup_profiles/flows.py.
@@ -214,9 +236,39 @@ def dbt_full_pipeline(target: str = "dev"):
         target: Environnement cible (dev ou prod). Par défaut "dev".
                 - dev : utilise le bloc 'dbt-cli-profile-dev' (dataset dev, 1 thread)
                 - prod : utilise le bloc 'dbt-cli-profile-prod' (dataset prod, 4 threads)
+        sample_rate: Fraction des utilisateurs lue dans les sources, dans ]0, 1].
+                Échantillon déterministe (hash de user_id) : un utilisateur retenu
+                l'est dans toutes les sources. Interdit sur prod. None = volume complet.
+        export: Exporte les marts en Parquet pour Power BI (voir prefect_flows/export.py)
+        cost_report: Produit le rapport slot-ms / octets facturés par modèle du run
+                (voir prefect_flows/job_costs.py)
+        threads: Concurrence dbt du run, sans modifier les blocs : None (valeur du profil),
+                un entier, ou "auto" (choisie d'après l'attente et la largeur du DAG
+                observées aux runs précédents, voir prefect_flows/thread_tuning.py)
+        full_refresh: Reconstruit entièrement les modèles incrémentaux, marts compris
+                (données arrivées après la fenêtre de recalcul, changement de logique)
+        lookback_days: Jours relus avant le dernier jour présent dans les marts
+                incrémentaux, pour intégrer les données en retard (voir
+                prefect_flows/incremental_marts.py)
+        force_tests: Exécute tous les tests, y compris ceux dont le SQL et les données
+                n'ont pas changé depuis leur dernier succès (voir prefect_flows/test_cache.py)
+        build_cache: Saute les modèles dont le SQL, la config et les entrées n'ont pas
+                changé depuis leur dernière construction (voir prefect_flows/build_cache.py).
+                Sans effet en full refresh ou sur échantillon.
+        workers: Nombre maximal de workers du work pool pour dbt run : au-delà de 1,
+                les modèles sont découpés en sous-graphes exécutés par le déploiement
+                `subgraph_deployment`, si le makespan estimé est meilleur qu'avec un
+                seul worker (voir prefect_flows/distributed.py)
+        subgraph_deployment: Déploiement des sous-graphes ({flow}/{déploiement})
+        subgraph_timeout_seconds: Attente maximale des sous-graphes ; au-delà, les
+                sous-graphes non terminés sont annulés et la pipeline échoue
+        snapshots: Historise les dimensions après les tests (dbt snapshot, stratégie
+                `hash`, voir dbt/macros/snapshots.sql). Jamais sur échantillon.
     
     Returns:
-        Dict contenant les résultats de run et test
+        Dict contenant les résultats de run, test, snapshot, export, les partitions des marts
+        écrites par le run, le résumé du cache de construction, celui du rapport de coût et
+        les jetons d'accès servis par le courtier (voir prefect_flows/credentials.py)
     
     Exemples d'utilisation:
         
@@ -230,27 +282,120 @@ def dbt_full_pipeline(target: str = "dev"):
             prefect deployment build prefect_flows/pipeline.py:dbt_full_pipeline -n "dbt-dev" -p default-pool
             prefect deployment apply dbt_full_pipeline-deployment.yaml
             prefect deployment run pipeline-dbt-complet/dbt-dev --param target=dev
+
+        Run de développement sur 10% des utilisateurs:
+            prefect deployment run pipeline-dbt-complet/dbt-dev --param sample_rate=0.1
+
+        Concurrence dbt réglée automatiquement:
+            prefect deployment run pipeline-dbt-complet/dbt-prod --param threads=auto
+
+        Reconstruction complète des marts incrémentaux:
+            prefect deployment run pipeline-dbt-complet/dbt-prod --param full_refresh=true
+
+        dbt run réparti sur 4 workers du work pool:
+            prefect deployment run pipeline-dbt-complet/dbt-prod --param workers=4
     """
     logger = get_run_logger()
     
     logger.info(f"🚀 Démarrage de la pipeline dbt complète (environnement: {target})...")
+    # Validation immédiate, avant de lancer le moindre modèle
+    if sampling_vars(target, sample_rate):
+        logger.info(f"🎲 Sources échantillonnées à {sample_rate:.0%} des utilisateurs")
+    # Tables construites à un autre taux (y compris un retour au volume complet) :
+    # les modèles incrémentaux ne rechargeraient que les nouvelles lignes
+    run_sample_rate = sampling_vars(target, sample_rate).get("sample_rate")
+    previous_sample_rate = built_sample_rate(target)
+    if previous_sample_rate != run_sample_rate and not full_refresh:
+        logger.info(
+            f"🎲 Tables construites avec sample_rate={previous_sample_rate}, run avec "
+            f"sample_rate={run_sample_rate} : reconstruction complète (--full-refresh)"
+        )
+        full_refresh = True
     
     # 1. Exécute les transformations dbt
-    logger.info("📊 Étape 1/2 : Exécution des modèles dbt (dbt run)...")
-    run_result = run_dbt_models(target=target)
+    logger.info("📊 Étape 1/4 : Exécution des modèles dbt (dbt run)...")
+    # Verrou dbt du target partagé avec le micro-batch : fenêtres, run et relectures
+    # ne voient pas les modèles réécrits en parallèle
+    with holding_target_lock(target, logger):
+        # Un run échantillonné ou en full refresh reconstruit les marts en entier
+        mart_windows = {}
+        if not full_refresh and not sampling_vars(target, sample_rate):
+            mart_windows = plan_mart_windows(target=target, lookback_days=lookback_days)
+        build_plan = None
+        if build_cache and not full_refresh and not sampling_vars(target, sample_rate):
+            build_plan = plan_model_builds(
+                target=target, dbt_vars={"mart_windows": mart_windows} if mart_windows else None
+            )
+        distribution = None
+        if workers > 1:
+            distribution = plan_distribution(
+                target=target, workers=workers, exclude=build_plan["exclude"] if build_plan else None,
+                threads=threads, compiled=build_plan is not None,
+            )
+        if build_plan and build_plan["total"] and len(build_plan["cached"]) == build_plan["total"]:
+            logger.info("📦 Tous les modèles sont en cache : dbt run n'est pas lancé")
+            run_result = []
+        elif distribution and distribution["distribute"]:
+            run_result = run_distributed(
+                target=target, plan=distribution, deployment=subgraph_deployment, sample_rate=sample_rate,
+                threads=threads, full_refresh=full_refresh, mart_windows=mart_windows,
+                timeout_seconds=subgraph_timeout_seconds,
+            )
+        else:
+            run_result = run_dbt_models(
+                target=target, sample_rate=sample_rate, threads=threads,
+                full_refresh=full_refresh, mart_windows=mart_windows,
+                exclude=build_plan["exclude"] if build_plan else None,
+            )
+        record_built_sample_rate(target, run_sample_rate)
+        build_summary = record_model_builds(target=target, plan=build_plan) if build_plan else None
+        # Marts en cache (dont tous les modèles quand dbt run n'est pas lancé) : aucune partition écrite
+        partitions = report_mart_partitions(
+            target=target, windows=mart_windows, exclude=build_plan["exclude"] if build_plan else None,
+        )
     logger.info(f"✅ Modèles dbt exécutés avec succès sur l'environnement {target}")
     
     # 2. Teste les modèles (seulement si run a réussi)
-    logger.info("🧪 Étape 2/2 : Test des modèles dbt (dbt test)...")
-    test_result = test_dbt_models(target=target)
+    logger.info("🧪 Étape 2/4 : Test des modèles dbt (dbt test)...")
+    test_result = test_dbt_models(target=target, sample_rate=sample_rate, threads=threads, force=force_tests)
     logger.info(f"✅ Tests dbt passés avec succès sur l'environnement {target}")
+
+    # Historique des dimensions, sur les tables testées (un échantillon fausserait l'historique)
+    snapshot_result = None
+    if snapshots and not sampling_vars(target, sample_rate):
+        snapshot_result = snapshot_dbt_models(target=target, full_refresh=full_refresh, lookback_days=lookback_days)
+    
+    # 3. Exporte les marts testés (seulement les partitions modifiées)
+    export_result = None
+    if export:
+        logger.info("📤 Étape 3/4 : Export Parquet des marts...")
+        export_result = export_marts(target=target)
+    
+    # 4. Classe les modèles du run par coût (jobs labellisés par flow run)
+    cost_result = None
+    if cost_report:
+        logger.info("💰 Étape 4/4 : Rapport de coût des jobs...")
+        cost_result = report_job_costs(target=target)
     
+    tokens = token_usage()
+    if any(tokens.values()):
+        logger.info(
+            f"🔑 Jetons d'accès : {tokens['mint']} émis, {tokens['memory'] + tokens['file']} "
+            f"servi(s) depuis le cache du worker"
+        )
     logger.info(f"🎉 Pipeline terminée avec succès sur l'environnement {target}!")
     
     return {
         "target": target,
+        "sample_rate": sample_rate,
         "run": run_result,
+        "partitions": partitions,
+        "build_cache": build_summary,
         "test": test_result,
+        "snapshot": snapshot_result,
+        "export": export_result,
+        "costs": cost_result,
+        "tokens": tokens,
     }
 
 
@@ -262,8 +407,36 @@ if __name__ == "__main__":
         # Environnement dev (par défaut)
         uv run python prefect_flows/pipeline.py
         
-        # Pour prod, modifiez l'appel ci-dessous ou utilisez Prefect CLI
+        # Autre environnement
+        uv run python prefect_flows/pipeline.py --target local
+        
+        # Profilage du surcoût d'orchestration (voir prefect_flows/profiling.py)
+        uv run python prefect_flows/pipeline.py --target local --profile --sample-interval-ms 5
     """
-    # Exécution locale pour tester (environnement dev par défaut)
-    dbt_full_pipeline(target="dev")
+    import argparse
+
+    from prefect_flows.profiling import add_profiling_arguments, run_entry_point
+
+    parser = argparse.ArgumentParser(description="Pipeline dbt complète")
+    parser.add_argument("--target", default="dev")
+    parser.add_argument("--sample-rate", type=float, default=None)
+    parser.add_argument("--no-export", dest="export", action="store_false")
+    parser.add_argument("--threads", default=None, help="Nombre de threads dbt ou 'auto'")
+    parser.add_argument("--full-refresh", action="store_true")
+    parser.add_argument("--lookback-days", type=int, default=MART_LOOKBACK_DAYS)
+    parser.add_argument("--force-tests", action="store_true", help="Ignore le cache des résultats de tests")
+    parser.add_argument("--no-build-cache", dest="build_cache", action="store_false")
+    parser.add_argument("--workers", type=int, default=1, help="Workers du work pool pour dbt run (sous-graphes)")
+    parser.add_argument("--subgraph-deployment", default=SUBGRAPH_DEPLOYMENT)
+    parser.add_argument("--subgraph-timeout-seconds", type=int, default=SUBGRAPH_TIMEOUT_SECONDS)
+    parser.add_argument("--no-snapshots", dest="snapshots", action="store_false")
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
 
+    run_entry_point(
+        dbt_full_pipeline, "pipeline", args,
+        target=args.target, sample_rate=args.sample_rate, export=args.export, threads=args.threads,
+        full_refresh=args.full_refresh, lookback_days=args.lookback_days, force_tests=args.force_tests,
+        build_cache=args.build_cache, workers=args.workers, subgraph_deployment=args.subgraph_deployment,
+        subgraph_timeout_seconds=args.subgraph_timeout_seconds, snapshots=args.snapshots,
+    )
@@ -0,0 +1,358 @@
+"""
+Profilage du surcoût d'orchestration des points d'entrée (pipeline.py, test.py)
+
+Répond à la question : sur un run de `dbt_full_pipeline`, quelle part revient à
+Prefect et aux blocs, au parsing dbt et à l'entrepôt ?
+
+Phases mesurées (intervalles horodatés, imbriqués par inclusion) :
+    flow_startup          appel du flow -> flow run à l'état Running
+    flow_body             corps du flow (état Running -> terminé)
+      task:{nom}          task runs du flow (relus depuis l'API Prefect)
+        block_load:{bloc} chargement d'un bloc Prefect
+        dbt:{opération}   sous-processus dbt, décomposé d'après run_results.json :
+          spawn             lancement du processus jusqu'au début de l'invocation dbt
+          parse             chargement du projet, du manifeste et du graphe
+          execute           exécution des nœuds (elapsed_time de dbt)
+          result_handling   écriture des artefacts, fin du processus, archivage
+    flow_teardown         fin du flow -> retour à l'appelant
+
+Le temps "propre" d'une phase (hors sous-phases) est le surcoût non attribué,
+typiquement l'orchestration Prefect des tâches.
+
+Sorties dans REPORTS_DIR/profiles/ :
+    {entrée}-{horodatage}.phases.folded   phases au format "folded stacks" (µs)
+    {entrée}-{horodatage}.samples.folded  piles échantillonnées (option --sample-interval-ms)
+    {entrée}-{horodatage}.md              tableau de répartition par phase
+    {entrée}-{horodatage}.json            intervalles bruts
+
+Les fichiers .folded se lisent avec flamegraph.pl ou speedscope.
+
+En local:
+    uv run python prefect_flows/pipeline.py --target local --profile --sample-interval-ms 5
+"""
+import argparse
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from prefect_flows.config import REPORTS_DIR
+from prefect_flows.state import read_json, write_json_atomic
+
+
+PROFILES_DIR = REPORTS_DIR / "profiles"
+
+# Catégories du tableau de synthèse, d'après le nom de la phase feuille
+PHASE_CATEGORIES = {
+    "flow_startup": "flow start-up",
+    "block_load": "block loads",
+    "spawn": "subprocess spawn",
+    "parse": "dbt parse",
+    "execute": "execution",
+    "result_handling": "result handling",
+    "flow_teardown": "result handling",
+}
+OTHER_CATEGORY = "orchestration (autre)"
+
+_active: "Profiler | None" = None
+
+
+def _parse_iso(value: str) -> float:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+class StackSampler:
+    """Profileur par échantillonnage : relève les piles de tous les threads à intervalle fixe."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{Path(code.co_filename).stem}:{code.co_qualname}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+class Profiler:
+    """Collecte les phases (intervalles horodatés) d'un point d'entrée."""
+
+    def __init__(self, entry: str, sample_interval: float | None = None):
+        self.entry = entry
+        self.phases: list[dict[str, Any]] = []
+        self.flow_run_id: str | None = None
+        self.sampler = StackSampler(sample_interval) if sample_interval else None
+        self._lock = threading.Lock()
+
+    def record(self, name: str, start: float, end: float) -> None:
+        with self._lock:
+            self.phases.append({"name": name, "start": start, "end": max(start, end)})
+
+    def __enter__(self) -> "Profiler":
+        global _active
+        _active = self
+        if self.sampler:
+            self.sampler.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        global _active
+        if self.sampler:
+            self.sampler.stop()
+        _active = None
+
+
+@contextmanager
+def phase(name: str):
+    """Mesure une phase si un profilage est en cours (sans effet sinon)."""
+    if _active is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        _active.record(name, start, time.time())
+
+
+def record_dbt_invocation(operation: str, started_at: float, finished_at: float, history_path: Path | None) -> None:
+    """
+    Enregistre une invocation dbt et sa décomposition spawn / parse / execute / result_handling
+
+    Args:
+        operation: Nom court de l'opération (run, test, ...)
+        started_at: Lancement de l'opération (time.time())
+        finished_at: Retour de l'opération (time.time())
+        history_path: Entrée d'historique archivée (run_history.py), None si absente
+    """
+    if _active is None:
+        return
+    _active.record(f"dbt:{operation}", started_at, finished_at)
+    if history_path is None:
+        return
+    invocation = read_json(history_path)
+    if not invocation.get("invocation_started_at") or not invocation.get("generated_at"):
+        return
+
+    # Bornes successives, contraintes à rester croissantes dans [started_at, finished_at]
+    bounds = [started_at]
+    generated_at = _parse_iso(invocation["generated_at"])
+    for moment in (
+        _parse_iso(invocation["invocation_started_at"]),
+        generated_at - (invocation["elapsed_time"] or 0),
+        generated_at,
+        finished_at,
+    ):
+        bounds.append(min(max(moment, bounds[-1]), finished_at))
+    for name, start, end in zip(("spawn", "parse", "execute", "result_handling"), bounds, bounds[1:]):
+        _active.record(name, start, end)
+
+
+def _task_run_phases(flow_run_id: str) -> list[dict[str, Any]]:
+    """Intervalles des task runs d'un flow run, relus depuis l'API Prefect."""
+    from prefect.client.orchestration import get_client
+    from prefect.client.schemas.filters import FlowRunFilter, FlowRunFilterId
+
+    with get_client(sync_client=True) as client:
+        task_runs = client.read_task_runs(flow_run_filter=FlowRunFilter(id=FlowRunFilterId(any_=[flow_run_id])))
+    return [
+        {"name": f"task:{task_run.name.rsplit('-', 1)[0]}",
+         "start": task_run.start_time.timestamp(), "end": task_run.end_time.timestamp()}
+        for task_run in task_runs
+        if task_run.start_time and task_run.end_time
+    ]
+
+
+def build_phase_tree(phases: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    Imbrique les phases par inclusion d'intervalles
+
+    Returns:
+        Phases enrichies de "path" (tuple des noms, racine en tête) et "self" (durée hors sous-phases)
+    """
+    ordered = sorted(phases, key=lambda p: (p["start"], -(p["end"] - p["start"])))
+    stack: list[dict[str, Any]] = []
+    tree = []
+    for item in ordered:
+        while stack and item["end"] > stack[-1]["end"] + 1e-6:
+            stack.pop()
+        node = {**item, "duration": item["end"] - item["start"], "children": 0.0}
+        node["path"] = (*stack[-1]["path"], item["name"]) if stack else (item["name"],)
+        if stack:
+            stack[-1]["children"] += node["duration"]
+        stack.append(node)
+        tree.append(node)
+    for node in tree:
+        node["self"] = max(node["duration"] - node.pop("children"), 0.0)
+    return tree
+
+
+def _category(path: tuple[str, ...]) -> str:
+    return PHASE_CATEGORIES.get(path[-1].split(":", 1)[0], OTHER_CATEGORY)
+
+
+def render_phase_table(entry: str, tree: list[dict[str, Any]]) -> str:
+    """Tableau Markdown : synthèse par catégorie puis détail par phase (durées cumulées)."""
+    total = max((node["duration"] for node in tree if len(node["path"]) == 1), default=0.0) or 1e-9
+
+    categories: dict[str, float] = defaultdict(float)
+    for node in tree:
+        categories[_category(node["path"])] += node["self"]
+
+    by_path: dict[tuple[str, ...], dict[str, float]] = {}
+    for node in tree:
+        stats = by_path.setdefault(node["path"], {"count": 0, "total": 0.0, "self": 0.0})
+        stats["count"] += 1
+        stats["total"] += node["duration"]
+        stats["self"] += node["self"]
+
+    lines = [
+        f"# Profil de `{entry}`",
+        "",
+        f"Durée totale : {total * 1000:,.0f} ms",
+        "",
+        "## Synthèse",
+        "",
+        "| Catégorie | Temps (ms) | % |",
+        "|---|---:|---:|",
+    ]
+    for name, seconds in sorted(categories.items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"| {name} | {seconds * 1000:,.0f} | {seconds / total:.1%} |")
+    lines += [
+        "",
+        "## Phases",
+        "",
+        "| Phase | Appels | Total (ms) | Propre (ms) | % du total |",
+        "|---|---:|---:|---:|---:|",
+    ]
+    for path, stats in by_path.items():
+        label = "&nbsp;&nbsp;" * (len(path) - 1) + path[-1]
+        lines.append(
+            f"| {label} | {stats['count']} | {stats['total'] * 1000:,.0f} "
+            f"| {stats['self'] * 1000:,.0f} | {stats['total'] / total:.1%} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def write_profile(profiler: Profiler) -> dict[str, str]:
+    """
+    Écrit les sorties du profil dans REPORTS_DIR/profiles/
+
+    Returns:
+        Dict {type de sortie: chemin}
+    """
+    tree = build_phase_tree(profiler.phases)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    base = PROFILES_DIR / f"{profiler.entry}-{stamp}"
+    base.parent.mkdir(parents=True, exist_ok=True)
+
+    folded: Counter[str] = Counter()
+    for node in tree:
+        folded[";".join(node["path"])] += int(node["self"] * 1_000_000)
+    paths = {
+        "phases": base.with_suffix(".phases.folded"),
+        "table": base.with_suffix(".md"),
+        "raw": base.with_suffix(".json"),
+    }
+    paths["phases"].write_text("".join(f"{stack} {weight}\n" for stack, weight in folded.items() if weight))
+    paths["table"].write_text(render_phase_table(profiler.entry, tree), encoding="utf-8")
+    write_json_atomic(paths["raw"], {
+        "entry": profiler.entry,
+        "flow_run_id": profiler.flow_run_id,
+        "phases": [{"path": list(node["path"]), "start": node["start"], "end": node["end"]} for node in tree],
+    })
+    if profiler.sampler:
+        paths["samples"] = base.with_suffix(".samples.folded")
+        paths["samples"].write_text("".join(f"{stack} {count}\n" for stack, count in profiler.sampler.samples.items()))
+    return {kind: str(path) for kind, path in paths.items()}
+
+
+def run_profiled(flow_obj, entry: str, sample_interval: float | None = None, **parameters):
+    """
+    Exécute un flow en profilant ses phases, puis écrit le profil
+
+    Args:
+        flow_obj: Flow Prefect à exécuter
+        entry: Nom du point d'entrée (préfixe des fichiers de sortie)
+        sample_interval: Intervalle d'échantillonnage des piles en secondes (None = désactivé)
+        **parameters: Paramètres du flow
+
+    Returns:
+        Résultat du flow
+    """
+    marks: dict[str, float] = {}
+
+    def on_running(flow, flow_run, state):
+        marks["running"] = time.time()
+        profiler.flow_run_id = str(flow_run.id)
+
+    def on_finished(flow, flow_run, state):
+        marks["finished"] = time.time()
+
+    profiled_flow = flow_obj.with_options(
+        on_running=[*flow_obj.on_running_hooks, on_running],
+        on_completion=[*flow_obj.on_completion_hooks, on_finished],
+        on_failure=[*flow_obj.on_failure_hooks, on_finished],
+    )
+
+    profiler = Profiler(entry, sample_interval)
+    start = time.time()
+    try:
+        with profiler:
+            return profiled_flow(**parameters)
+    finally:
+        end = time.time()
+        profiler.record(entry, start, end)
+        running = marks.get("running", start)
+        finished = marks.get("finished", end)
+        profiler.record("flow_startup", start, running)
+        profiler.record("flow_body", running, finished)
+        profiler.record("flow_teardown", finished, end)
+        if profiler.flow_run_id:
+            try:
+                for task_phase in _task_run_phases(profiler.flow_run_id):
+                    profiler.record(task_phase["name"], task_phase["start"], task_phase["end"])
+            except Exception as e:
+                print(f"⚠️  Task runs non récupérés depuis l'API Prefect: {e}")
+        paths = write_profile(profiler)
+        print(f"⏱️  Profil écrit: {paths['table']} (flame graph: {paths['phases']})")
+
+
+def add_profiling_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options de profilage communes aux points d'entrée."""
+    parser.add_argument("--profile", action="store_true", help="Mesure les phases du run (voir profiling.py)")
+    parser.add_argument(
+        "--sample-interval-ms", type=float, default=None,
+        help="Active l'échantillonnage des piles à cet intervalle (implique --profile)",
+    )
+
+
+def run_entry_point(flow_obj, entry: str, args: argparse.Namespace, **parameters):
+    """Exécute le flow d'un point d'entrée, profilé si demandé sur la ligne de commande."""
+    if not (args.profile or args.sample_interval_ms):
+        return flow_obj(**parameters)
+    sample_interval = args.sample_interval_ms / 1000 if args.sample_interval_ms else None
+    return run_profiled(flow_obj, entry, sample_interval=sample_interval, **parameters)
@@ -0,0 +1,542 @@
+"""
+Profils de ressources des invocations dbt et contrôle d'admission sur le worker
+
+À la fin de chaque commande, dbt écrit dans logs/dbt.log un `Resource report`
+(mémoire résidente maximale, temps CPU utilisateur et noyau, durée). Après
+chaque invocation, dbt_runner relit la partie du journal écrite pendant la
+commande et en extrait ce rapport (read_resource_report) :
+
+    - le rapport est archivé avec l'invocation (run_history.py) ;
+    - il alimente le profil de l'opération pour le target, dans
+      STATE_DIR/resources/{target}.json (RESOURCE_PROFILE_RETENTION
+      dernières mesures par opération) ;
+    - il est exposé dans les métriques pipeline_dbt_invocation_memory_mb et
+      pipeline_dbt_invocation_cpu_seconds_total.
+
+Le journal est partagé par les processus dbt du worker : le rapport retenu est
+celui de la même sous-commande dont l'horodatage (UTC) est le plus proche de la
+fin de l'invocation. Sous forte concurrence d'une même sous-commande, la
+mesure peut être celle d'une invocation voisine.
+
+Avant de lancer dbt, run_dbt_command demande son admission (admitted) : le pic
+prévu (profil des commandes de même sélection si connues, voir
+run_history.selection_signature, sinon de l'opération, majoré de
+ADMISSION_MEMORY_MARGIN) est réservé dans ADMISSION_DIR/admission.json. Sur un
+work pool Docker, ce registre est sur un volume monté dans tous les conteneurs
+du worker (prefect.yml) et les réservations sont regroupées par hôte du worker
+(worker_host), pas par conteneur. Une invocation attend la fin d'autres
+invocations si sa réservation dépasserait :
+
+    - le budget de l'hôte : DBT_MEMORY_BUDGET_MB (sinon 80% de la mémoire
+      totale), la mémoire disponible, DBT_CPU_BUDGET (sinon tous les cœurs),
+      pour les réservations de l'hôte ;
+    - les limites cgroup du conteneur (memory.max, cpu.max ; v2, sinon v1),
+      pour les réservations du même conteneur.
+
+Au-delà de ADMISSION_MAX_WAIT_SECONDS, elle est refusée (AdmissionRefused) et
+la tâche Prefect est replanifiée par ses retries. Une invocation seule sur
+l'hôte est toujours admise. Une réservation est rafraîchie pendant
+l'invocation : celle d'un conteneur disparu expire après
+ADMISSION_RESERVATION_STALE_SECONDS. PIPELINE_DBT_ADMISSION=0 désactive le contrôle.
+"""
+import json
+import os
+import re
+import shlex
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Iterator
+
+from prefect_flows.config import (
+    ADMISSION_DIR,
+    DBT_ADMISSION_ENABLED,
+    DBT_CPU_BUDGET,
+    DBT_MEMORY_BUDGET_MB,
+    DBT_PROJECT_DIR,
+    STATE_DIR,
+    WORKER_HOST,
+    WORKER_HOST_FILE,
+)
+from prefect_flows.metrics import Counter, Histogram
+from prefect_flows.run_history import selection_signature
+from prefect_flows.state import FileLock, read_json, write_json_atomic
+
+
+RESOURCES_DIR = STATE_DIR / "resources"
+ADMISSION_LEDGER_PATH = ADMISSION_DIR / "admission.json"
+
+# Limites cgroup du conteneur (v2, puis v1)
+CGROUP_DIR = Path("/sys/fs/cgroup")
+
+# Mesures conservées par opération et par target, et mesures récentes utilisées pour la prévision
+RESOURCE_PROFILE_RETENTION = 30
+RESOURCE_PROFILE_WINDOW = 10
+
+# Prévision sans historique, et marge appliquée au pic mesuré
+ADMISSION_DEFAULT_MEMORY_MB = 512
+ADMISSION_DEFAULT_CPU = 1.0
+ADMISSION_MEMORY_MARGIN = 1.2
+
+# Attente d'admission : intervalle entre deux essais et durée maximale avant refus
+ADMISSION_POLL_SECONDS = 2
+ADMISSION_MAX_WAIT_SECONDS = 900
+
+# Rafraîchissement d'une réservation en cours, et délai sans rafraîchissement au-delà
+# duquel elle est abandonnée (conteneur tué sans nettoyage)
+ADMISSION_HEARTBEAT_SECONDS = 60
+ADMISSION_RESERVATION_STALE_SECONDS = 5 * ADMISSION_HEARTBEAT_SECONDS
+
+# Tolérance entre la fin mesurée par dbt et celle mesurée par le runner
+_REPORT_CLOCK_SLACK_SECONDS = 5
+
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+_RESOURCE_REPORT = re.compile(r"^(\d{2}):(\d{2}):(\d{2})\.(\d+) \[\s*\w+\s*\] \[[^\]]*\]: Resource report: (\{.*\})\s*$")
+
+MEMORY_BUCKETS_MB = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+DBT_INVOCATION_MEMORY = Histogram(
+    "pipeline_dbt_invocation_memory_mb", "Mémoire résidente maximale des commandes dbt (Resource report)",
+    ("target", "operation"), buckets=MEMORY_BUCKETS_MB,
+)
+DBT_INVOCATION_CPU = Counter(
+    "pipeline_dbt_invocation_cpu_seconds_total", "Temps CPU des commandes dbt, par mode (user, kernel)",
+    ("target", "operation", "mode"),
+)
+DBT_ADMISSIONS = Counter(
+    "pipeline_dbt_admissions_total", "Décisions d'admission des commandes dbt (admitted, delayed, refused)",
+    ("target", "operation", "decision"),
+)
+DBT_ADMISSION_WAIT = Histogram(
+    "pipeline_dbt_admission_wait_seconds", "Attente avant admission des commandes dbt", ("target", "operation"),
+)
+
+
+class AdmissionRefused(RuntimeError):
+    """Commande dbt non admise sur le worker dans le délai imparti (budget mémoire ou CPU)."""
+
+
+def dbt_log_path() -> Path:
+    """Journal fichier de dbt (DBT_LOG_PATH s'il est défini, sinon logs/ du projet)."""
+    log_path = os.getenv("DBT_LOG_PATH")
+    return (DBT_PROJECT_DIR / log_path if log_path else DBT_PROJECT_DIR / "logs") / "dbt.log"
+
+
+def dbt_log_position() -> int:
+    """Taille actuelle du journal dbt : position à partir de laquelle lire la prochaine invocation."""
+    try:
+        return dbt_log_path().stat().st_size
+    except OSError:
+        return 0
+
+
+def _read_log_since(position: int) -> str:
+    """Lignes écrites depuis `position`, y compris avant une rotation du journal (dbt.log.1)."""
+    path = dbt_log_path()
+    chunks = []
+    try:
+        if path.stat().st_size < position:
+            with open(path.with_name(path.name + ".1"), "rb") as rotated:
+                rotated.seek(position)
+                chunks.append(rotated.read())
+            position = 0
+        with open(path, "rb") as log_file:
+            log_file.seek(position)
+            chunks.append(log_file.read())
+    except OSError:
+        pass
+    return b"".join(chunks).decode("utf-8", errors="replace")
+
+
+def _command_verb(command: str) -> str | None:
+    words = shlex.split(command)
+    return words[1] if len(words) > 1 and words[0] == "dbt" else None
+
+
+def read_resource_report(position: int, command: str, started_at: float, finished_at: float) -> dict[str, Any] | None:
+    """
+    Resource report de la commande dbt qui vient de se terminer
+
+    Args:
+        position: Position du journal avant l'invocation (dbt_log_position)
+        command: Commande dbt exécutée
+        started_at: Horodatage (time.time()) du lancement de la commande
+        finished_at: Horodatage (time.time()) de la fin de la commande
+
+    Returns:
+        {"command_name", "success", "memory_mb", "user_seconds", "kernel_seconds", "wall_seconds"},
+        ou None si aucun rapport de cette sous-commande n'a été écrit pendant l'invocation
+    """
+    verb = _command_verb(command)
+    finished = datetime.fromtimestamp(finished_at, tz=timezone.utc)
+    finished_of_day = finished.hour * 3600 + finished.minute * 60 + finished.second + finished.microsecond / 1e6
+    window = finished_at - started_at + _REPORT_CLOCK_SLACK_SECONDS
+
+    best, best_delta = None, None
+    for line in _read_log_since(position).splitlines():
+        match = _RESOURCE_REPORT.match(_ANSI_ESCAPE.sub("", line))
+        if not match:
+            continue
+        try:
+            report = json.loads(match.group(5))
+        except ValueError:
+            continue
+        if verb is not None and report.get("command_name") != verb:
+            continue
+        hours, minutes, seconds, fraction = match.group(1, 2, 3, 4)
+        written_of_day = int(hours) * 3600 + int(minutes) * 60 + int(seconds) + float(f"0.{fraction}")
+        # Horodatage sans date : écart ramené à [0, 1 jour[ (invocation à cheval sur minuit)
+        delta = (finished_of_day - written_of_day + _REPORT_CLOCK_SLACK_SECONDS) % 86400
+        if delta <= window and (best_delta is None or delta < best_delta):
+            best, best_delta = report, delta
+
+    if best is None:
+        return None
+    return {
+        "command_name": best.get("command_name"),
+        "success": best.get("command_success"),
+        # ru_maxrss en kilo-octets (Linux)
+        "memory_mb": round(float(best.get("process_mem_max_rss") or 0) / 1024, 1),
+        "user_seconds": float(best.get("process_user_time") or 0),
+        "kernel_seconds": float(best.get("process_kernel_time") or 0),
+        "wall_seconds": float(best.get("command_wall_clock_time") or 0),
+    }
+
+
+def _profile_path(target: str) -> Path:
+    return RESOURCES_DIR / f"{target}.json"
+
+
+@contextmanager
+def _locked(path: Path, wait_seconds: float = 10) -> Iterator[None]:
+    """Verrou inter-processus d'un fichier d'état, attendu au plus `wait_seconds`."""
+    lock = FileLock(path.with_suffix(".lock"), stale_after_seconds=60)
+    deadline = time.monotonic() + wait_seconds
+    while not lock.acquire():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Verrou {lock.path} non obtenu après {wait_seconds}s")
+        time.sleep(0.05)
+    with lock:
+        yield
+
+
+def record_resource_report(target: str, operation: str, command: str, report: dict[str, Any]) -> None:
+    """
+    Ajoute une mesure au profil de l'opération et aux métriques
+
+    Args:
+        target: Environnement cible
+        operation: Nom court de l'opération (run, test, ...)
+        command: Commande dbt exécutée
+        report: Rapport retourné par read_resource_report
+    """
+    DBT_INVOCATION_MEMORY.observe(report["memory_mb"], target=target, operation=operation)
+    DBT_INVOCATION_CPU.inc(report["user_seconds"], target=target, operation=operation, mode="user")
+    DBT_INVOCATION_CPU.inc(report["kernel_seconds"], target=target, operation=operation, mode="kernel")
+
+    path = _profile_path(target)
+    with _locked(path):
+        profile = read_json(path, default={"operations": {}})
+        samples = profile["operations"].setdefault(operation, [])
+        samples.append({"command": command, "at": time.time(), **report})
+        del samples[:-RESOURCE_PROFILE_RETENTION]
+        write_json_atomic(path, profile)
+
+
+def predict_resources(target: str, operation: str, command: str) -> dict[str, Any]:
+    """
+    Pic mémoire (Mo) et cœurs CPU prévus pour une commande dbt
+
+    La prévision porte sur les RESOURCE_PROFILE_WINDOW dernières mesures des
+    commandes de même sélection (selection_signature : fenêtres datées de --vars
+    et --threads ignorés), sinon de l'opération : mémoire maximale majorée de
+    ADMISSION_MEMORY_MARGIN, et temps CPU rapporté à la durée (cœurs occupés).
+
+    Args:
+        target: Environnement cible
+        operation: Nom court de l'opération (run, test, ...)
+        command: Commande dbt à exécuter
+
+    Returns:
+        {"memory_mb", "cpu", "wall_seconds", "basis"} ; wall_seconds est la durée
+        maximale mesurée (None sans historique) ; basis vaut "command", "operation" ou "default"
+    """
+    samples = read_json(_profile_path(target), default={"operations": {}})["operations"].get(operation, [])
+    selection = selection_signature(command)
+    same_command = [sample for sample in samples if selection_signature(sample["command"]) == selection]
+    basis = "command" if same_command else "operation"
+    recent = (same_command or samples)[-RESOURCE_PROFILE_WINDOW:]
+    if not recent:
+        return {
+            "memory_mb": ADMISSION_DEFAULT_MEMORY_MB, "cpu": ADMISSION_DEFAULT_CPU, "wall_seconds": None, "basis": "default",
+        }
+
+    cores = [
+        (sample["user_seconds"] + sample["kernel_seconds"]) / sample["wall_seconds"]
+        for sample in recent if sample["wall_seconds"] > 0
+    ]
+    return {
+        "memory_mb": round(max(sample["memory_mb"] for sample in recent) * ADMISSION_MEMORY_MARGIN, 1),
+        "cpu": round(max(cores), 2) if cores else ADMISSION_DEFAULT_CPU,
+        "wall_seconds": max(sample["wall_seconds"] for sample in recent),
+        "basis": basis,
+    }
+
+
+def _meminfo() -> dict[str, float]:
+    """Valeurs de /proc/meminfo en Mo (vide hors Linux)."""
+    values = {}
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as meminfo:
+            for line in meminfo:
+                key, _, value = line.partition(":")
+                values[key] = int(value.split()[0]) / 1024
+    except (OSError, ValueError, IndexError):
+        return {}
+    return values
+
+
+def _read_cgroup(*names: str) -> str | None:
+    for name in names:
+        try:
+            return (CGROUP_DIR / name).read_text(encoding="utf-8").strip()
+        except OSError:
+            continue
+    return None
+
+
+def container_limits() -> dict[str, float | None]:
+    """
+    Limites cgroup du conteneur courant
+
+    /proc/meminfo et os.cpu_count() décrivent l'hôte, même dans un conteneur limité.
+
+    Returns:
+        {"memory_mb", "available_mb", "cpu"} : limite mémoire, limite moins l'usage
+        courant, quota de cœurs ; None sans limite (ou hors cgroup)
+    """
+    memory_mb = available_mb = cpu = None
+    limit = _read_cgroup("memory.max", "memory/memory.limit_in_bytes")
+    # cgroup v1 sans limite : valeur proche de 2^63
+    if limit and limit != "max" and int(limit) < 2 ** 62:
+        memory_mb = int(limit) / 1024 / 1024
+        usage = _read_cgroup("memory.current", "memory/memory.usage_in_bytes")
+        available_mb = round(memory_mb - int(usage) / 1024 / 1024, 1) if usage else None
+        memory_mb = round(memory_mb, 1)
+
+    cpu_max = _read_cgroup("cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+    else:
+        quota, period = _read_cgroup("cpu/cpu.cfs_quota_us"), _read_cgroup("cpu/cpu.cfs_period_us")
+    if quota and period and quota not in ("max", "-1"):
+        cpu = round(int(quota) / int(period), 2)
+    return {"memory_mb": memory_mb, "available_mb": available_mb, "cpu": cpu}
+
+
+def host_budget() -> dict[str, float | None]:
+    """
+    Budget de l'hôte pour les commandes dbt
+
+    Returns:
+        {"memory_mb", "available_mb", "cpu"} : budget mémoire (DBT_MEMORY_BUDGET_MB,
+        sinon 80% de la mémoire totale), mémoire disponible à l'instant, cœurs
+        (DBT_CPU_BUDGET, sinon nombre de cœurs) ; None si inconnu
+    """
+    meminfo = _meminfo()
+    total = meminfo.get("MemTotal")
+    return {
+        "memory_mb": DBT_MEMORY_BUDGET_MB or (round(total * 0.8, 1) if total else None),
+        "available_mb": meminfo.get("MemAvailable"),
+        "cpu": DBT_CPU_BUDGET or os.cpu_count(),
+    }
+
+
+def worker_host() -> str:
+    """Hôte du worker, commun aux conteneurs qu'il lance (clé des réservations)."""
+    if WORKER_HOST:
+        return WORKER_HOST
+    try:
+        return WORKER_HOST_FILE.read_text(encoding="utf-8").strip() or socket.gethostname()
+    except OSError:
+        return socket.gethostname()
+
+
+def _is_alive(reservation: dict[str, Any]) -> bool:
+    if time.time() - reservation.get("heartbeat_at", reservation["since"]) > ADMISSION_RESERVATION_STALE_SECONDS:
+        return False
+    # PID vérifiable seulement depuis le même conteneur
+    if reservation.get("container") != socket.gethostname():
+        return True
+    try:
+        os.kill(reservation["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _fits(reserved: float, requested: float, budget: float | None, available: float | None = None) -> bool:
+    """True si `requested` tient dans le budget (None : sans limite) après les réservations."""
+    if budget is None:
+        return True
+    return reserved + requested <= budget and (available is None or requested <= available)
+
+
+def _try_reserve(reservation_id: str, request: dict[str, Any]) -> tuple[bool, dict[str, Any]]:
+    """
+    Réserve les ressources prévues si le budget de l'hôte le permet
+
+    Returns:
+        (admis, état) ; état décrit les réservations en cours et le budget
+    """
+    with _locked(ADMISSION_LEDGER_PATH):
+        ledger = read_json(ADMISSION_LEDGER_PATH, default={"reservations": {}})
+        reservations = {key: value for key, value in ledger["reservations"].items() if _is_alive(value)}
+        on_host = [value for value in reservations.values() if value["host"] == request["host"]]
+        in_container = [value for value in on_host if value.get("container") == request["container"]]
+        budget = host_budget()
+        limits = container_limits()
+        state = {
+            "running": len(on_host),
+            "reserved_memory_mb": round(sum(value["memory_mb"] for value in on_host), 1),
+            "reserved_cpu": round(sum(value["cpu"] for value in on_host), 2),
+            **budget,
+            "container_reserved_memory_mb": round(sum(value["memory_mb"] for value in in_container), 1),
+            "container_reserved_cpu": round(sum(value["cpu"] for value in in_container), 2),
+            "container_memory_mb": limits["memory_mb"],
+            "container_cpu": limits["cpu"],
+        }
+
+        memory_ok = _fits(state["reserved_memory_mb"], request["memory_mb"], budget["memory_mb"], budget["available_mb"])
+        cpu_ok = _fits(state["reserved_cpu"], request["cpu"], budget["cpu"])
+        container_ok = _fits(
+            state["container_reserved_memory_mb"], request["memory_mb"], limits["memory_mb"], limits["available_mb"],
+        ) and _fits(state["container_reserved_cpu"], request["cpu"], limits["cpu"])
+        # Seule sur l'hôte, une invocation est toujours admise (pas d'attente sans fin)
+        admitted = not on_host or (memory_ok and cpu_ok and container_ok)
+        if admitted:
+            reservations[reservation_id] = {**request, "heartbeat_at": time.time()}
+        write_json_atomic(ADMISSION_LEDGER_PATH, {"reservations": reservations})
+    return admitted, state
+
+
+def _heartbeat(reservation_id: str) -> None:
+    with _locked(ADMISSION_LEDGER_PATH):
+        ledger = read_json(ADMISSION_LEDGER_PATH, default={"reservations": {}})
+        if reservation_id in ledger["reservations"]:
+            ledger["reservations"][reservation_id]["heartbeat_at"] = time.time()
+            write_json_atomic(ADMISSION_LEDGER_PATH, ledger)
+
+
+@contextmanager
+def _kept_alive(reservation_id: str) -> Iterator[None]:
+    """Rafraîchit la réservation toutes les ADMISSION_HEARTBEAT_SECONDS tant que la commande tourne."""
+    stop = threading.Event()
+
+    def beat() -> None:
+        while not stop.wait(ADMISSION_HEARTBEAT_SECONDS):
+            try:
+                _heartbeat(reservation_id)
+            except (OSError, TimeoutError):
+                pass
+
+    thread = threading.Thread(target=beat, name=f"admission-{reservation_id[:8]}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _release(reservation_id: str) -> None:
+    with _locked(ADMISSION_LEDGER_PATH):
+        ledger = read_json(ADMISSION_LEDGER_PATH, default={"reservations": {}})
+        ledger["reservations"].pop(reservation_id, None)
+        write_json_atomic(ADMISSION_LEDGER_PATH, ledger)
+
+
+@contextmanager
+def admitted(target: str, operation: str, command: str, logger) -> Iterator[dict[str, Any] | None]:
+    """
+    Attend que le budget de l'hôte permette la commande dbt, et la réserve pendant son exécution
+
+    Args:
+        target: Environnement cible
+        operation: Nom court de l'opération (run, test, ...)
+        command: Commande dbt à exécuter
+        logger: Logger Prefect de la tâche appelante
+
+    Yields:
+        Prévision retenue (predict_resources), None si le contrôle est désactivé
+
+    Raises:
+        AdmissionRefused: Commande non admise après ADMISSION_MAX_WAIT_SECONDS
+    """
+    if not DBT_ADMISSION_ENABLED:
+        yield None
+        return
+
+    prediction = predict_resources(target, operation, command)
+    now = time.time()
+    request = {
+        "host": worker_host(),
+        "container": socket.gethostname(),
+        "pid": os.getpid(),
+        "target": target,
+        "operation": operation,
+        "memory_mb": prediction["memory_mb"],
+        "cpu": prediction["cpu"],
+        "since": now,
+        "heartbeat_at": now,
+    }
+    reservation_id = uuid.uuid4().hex
+    started = time.monotonic()
+    delayed = False
+    while True:
+        is_admitted, state = _try_reserve(reservation_id, request)
+        if is_admitted:
+            break
+        waited = time.monotonic() - started
+        if waited > ADMISSION_MAX_WAIT_SECONDS:
+            DBT_ADMISSIONS.inc(target=target, operation=operation, decision="refused")
+            DBT_ADMISSION_WAIT.observe(waited, target=target, operation=operation)
+            raise AdmissionRefused(
+                f"dbt {operation} non admis après {round(waited)}s : "
+                f"{prediction['memory_mb']} Mo / {prediction['cpu']} cœurs prévus, "
+                f"{state['reserved_memory_mb']} Mo / {state['reserved_cpu']} cœurs réservés "
+                f"sur {state['memory_mb']} Mo / {state['cpu']} cœurs (conteneur: "
+                f"{state['container_reserved_memory_mb']} Mo / {state['container_reserved_cpu']} cœurs réservés "
+                f"sur {state['container_memory_mb'] or '∞'} Mo / {state['container_cpu'] or '∞'} cœurs)"
+            )
+        if not delayed:
+            logger.info(
+                f"⏳ dbt {operation} en attente d'admission : {prediction['memory_mb']} Mo / "
+                f"{prediction['cpu']} cœurs prévus ({prediction['basis']}), "
+                f"{state['running']} invocation(s) en cours réservant {state['reserved_memory_mb']} Mo / "
+                f"{state['reserved_cpu']} cœurs sur {state['memory_mb']} Mo / {state['cpu']} cœurs"
+            )
+            delayed = True
+        time.sleep(ADMISSION_POLL_SECONDS)
+
+    waited = time.monotonic() - started
+    DBT_ADMISSIONS.inc(target=target, operation=operation, decision="delayed" if delayed else "admitted")
+    DBT_ADMISSION_WAIT.observe(waited, target=target, operation=operation)
+    if delayed:
+        logger.info(f"▶️  dbt {operation} admis après {round(waited, 1)}s d'attente")
+    elif state["memory_mb"] is not None and prediction["memory_mb"] > state["memory_mb"]:
+        logger.warning(
+            f"⚠️  Pic prévu pour dbt {operation} ({prediction['memory_mb']} Mo) supérieur au budget "
+            f"({state['memory_mb']} Mo) : exécution seule sur l'hôte"
+        )
+    try:
+        with _kept_alive(reservation_id):
+            yield prediction
+    finally:
+        _release(reservation_id)
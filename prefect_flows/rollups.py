@@ -0,0 +1,504 @@
+"""
+Rollups : agrégats pré-calculés des marts pour les requêtes des dashboards
+
+Les dashboards DirectQuery répètent les mêmes GROUP BY sur les marts. Un
+rollup pré-calcule un de ces regroupements à un grain plus grossier (jour,
+semaine, mois...) pour que la requête lise quelques lignes au lieu de
+rebalayer le mart détaillé.
+
+Sources de configuration (dbt/rollups/):
+    - rollups.yml : rollups déclarés (dimensions, mesures, grain)
+    - learned.yml : rollups appris depuis l'historique des requêtes BigQuery
+                    (flow `pipeline-rollups-learning`)
+
+Génération (`generate`):
+    - un modèle par rollup dans dbt/models/rollups/, construit par
+      `dbt run` avec le reste du projet (macro `rollup`, dbt/macros/rollups.sql)
+    - la carte de routage dbt/rollups/routing.json : pour chaque mart, les
+      rollups du plus petit au plus gros, avec les dimensions, mesures et
+      grains de requête auxquels chacun sait répondre (agrégations Power BI)
+
+En local:
+    uv run python -m prefect_flows.rollups generate
+    uv run python -m prefect_flows.rollups learn --target prod --days 30
+"""
+import argparse
+import json
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any
+
+import yaml
+from prefect import flow, get_run_logger
+
+from prefect_flows.config import DBT_PROJECT_DIR
+from prefect_flows.incremental_marts import INCREMENTAL_MARTS
+from prefect_flows.metrics import FLOW_METRIC_HOOKS
+from prefect_flows.warehouse import resolve_warehouse
+
+
+ROLLUPS_DIR = DBT_PROJECT_DIR / "rollups"
+ROLLUP_CONFIG_PATH = ROLLUPS_DIR / "rollups.yml"
+LEARNED_ROLLUPS_PATH = ROLLUPS_DIR / "learned.yml"
+ROUTING_PATH = ROLLUPS_DIR / "routing.json"
+ROLLUP_MODELS_DIR = DBT_PROJECT_DIR / "models" / "rollups"
+
+# En-tête des fichiers générés (les fichiers sans cet en-tête ne sont jamais supprimés)
+GENERATED_HEADER = "-- Généré par `python -m prefect_flows.rollups generate` : ne pas modifier"
+
+# Grains du plus fin au plus grossier
+GRAINS = ("day", "week", "month", "quarter", "year")
+
+# Grains de requête calculables depuis un rollup d'un grain donné
+# (une semaine ISO peut chevaucher deux mois : week ne donne que week)
+DERIVABLE_GRAINS = {
+    "day": set(GRAINS),
+    "week": {"week"},
+    "month": {"month", "quarter", "year"},
+    "quarter": {"quarter", "year"},
+    "year": {"year"},
+}
+
+# Agrégation à appliquer sur le rollup pour ré-agréger chaque type de mesure
+REAGGREGATION = {"sum": "sum", "min": "min", "max": "max", "count": "sum"}
+
+
+def rollup_name(spec: dict[str, Any]) -> str:
+    """Nom du modèle dbt d'un rollup, ex: rollup_content_performance_week_by_content_id."""
+    model = spec["model"].removeprefix("mart_")
+    grain = spec.get("grain") or "all"
+    dimensions = "_by_" + "_".join(spec["dimensions"]) if spec["dimensions"] else "_total"
+    return f"rollup_{model}_{grain}{dimensions}"
+
+
+def normalize_rollup(spec: dict[str, Any]) -> dict[str, Any]:
+    """
+    Valide et complète la déclaration d'un rollup
+
+    Args:
+        spec: Rollup tel que déclaré dans rollups.yml ou learned.yml
+
+    Returns:
+        Rollup normalisé (avec son nom de modèle)
+    """
+    time_column = spec.get("time_column")
+    grain = spec.get("grain") if time_column else None
+    if time_column and grain not in GRAINS:
+        raise ValueError(f"Grain invalide pour {spec['model']}: {grain!r} (attendu: {', '.join(GRAINS)})")
+
+    measures = dict(spec["measures"])
+    for column, aggregation in measures.items():
+        if aggregation not in REAGGREGATION:
+            raise ValueError(
+                f"Agrégation non ré-agrégeable pour {spec['model']}.{column}: {aggregation!r} "
+                f"(attendu: {', '.join(REAGGREGATION)})"
+            )
+
+    normalized = {
+        "model": spec["model"],
+        "time_column": time_column,
+        "grain": grain,
+        "dimensions": list(spec.get("dimensions") or []),
+        "measures": measures,
+    }
+    if "query_count" in spec:
+        normalized["query_count"] = spec["query_count"]
+    normalized["name"] = rollup_name(normalized)
+    return normalized
+
+
+def load_rollups(include_learned: bool = True) -> list[dict[str, Any]]:
+    """
+    Charge les rollups déclarés puis appris (un rollup déclaré l'emporte à nom égal)
+
+    Args:
+        include_learned: Inclut les rollups de learned.yml
+
+    Returns:
+        Liste des rollups normalisés
+    """
+    rollups = {}
+    paths = [ROLLUP_CONFIG_PATH, LEARNED_ROLLUPS_PATH] if include_learned else [ROLLUP_CONFIG_PATH]
+    for path in paths:
+        if not path.exists():
+            continue
+        for spec in (yaml.safe_load(path.read_text(encoding="utf-8")) or {}).get("rollups") or []:
+            normalized = normalize_rollup(spec)
+            rollups.setdefault(normalized["name"], normalized)
+    return list(rollups.values())
+
+
+def _is_incremental_rollup(spec: dict[str, Any]) -> bool:
+    """
+    Un rollup n'est incrémental que si sa colonne de temps délimite la fenêtre de son mart
+
+    Le run ne recalcule que les périodes de la fenêtre du mart (macro
+    rollup_window_start). Ailleurs (mart_users agrégé par first_activity_at, dont
+    la fenêtre porte sur last_activity_at, ou mart non incrémental), une ligne
+    modifiée peut tomber dans n'importe quelle période : le rollup est reconstruit.
+    """
+    mart = INCREMENTAL_MARTS.get(spec["model"])
+    return bool(spec["time_column"]) and mart is not None and mart["window_column"] == spec["time_column"]
+
+
+def render_rollup_model(spec: dict[str, Any]) -> str:
+    """Contenu SQL du modèle dbt d'un rollup."""
+    if _is_incremental_rollup(spec):
+        unique_key = ["period_start", *spec["dimensions"]]
+        config = (
+            "        materialized='incremental',\n"
+            f"        unique_key={unique_key!r},\n"
+            "        incremental_strategy=upsert_strategy(),\n"
+        )
+        time_args = f"    time_column={spec['time_column']!r},\n    grain={spec['grain']!r},\n"
+    else:
+        # Toute l'histoire est ré-agrégée à chaque run
+        config = "        materialized='table',\n"
+        time_args = (
+            f"    time_column={spec['time_column']!r},\n    grain={spec['grain']!r},\n" if spec["time_column"] else ""
+        )
+
+    return (
+        f"{GENERATED_HEADER}\n"
+        f"-- Rollup de {spec['model']} (voir dbt/rollups/ et macros/rollups.sql)\n"
+        "\n"
+        "{{\n"
+        "    config(\n"
+        f"{config}"
+        "        tags=['rollup'],\n"
+        "    )\n"
+        "}}\n"
+        "\n"
+        "{{ rollup(\n"
+        f"    {spec['model']!r},\n"
+        f"    dimensions={spec['dimensions']!r},\n"
+        f"    measures={spec['measures']!r},\n"
+        f"{time_args}"
+        ") }}\n"
+    )
+
+
+def _rollup_size_rank(spec: dict[str, Any]) -> tuple[int, int]:
+    """Clé de tri : les rollups les plus petits (moins de dimensions, grain plus grossier) d'abord."""
+    grain_rank = len(GRAINS) - GRAINS.index(spec["grain"]) if spec["grain"] else 0
+    return len(spec["dimensions"]), grain_rank
+
+
+def build_routing_map(rollups: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Construit la carte de routage requête -> rollup
+
+    Returns:
+        Dict {"models": {mart: [rollups du plus petit au plus gros]}}
+    """
+    models = defaultdict(list)
+    for spec in sorted(rollups, key=_rollup_size_rank):
+        models[spec["model"]].append({
+            "rollup": spec["name"],
+            "time_column": spec["time_column"],
+            "grain": spec["grain"],
+            "answers_grains": [g for g in GRAINS if g in DERIVABLE_GRAINS[spec["grain"]]] if spec["grain"] else [],
+            "dimensions": spec["dimensions"],
+            "measures": {
+                column: {"aggregation": aggregation, "reaggregate_with": REAGGREGATION[aggregation]}
+                for column, aggregation in spec["measures"].items()
+            },
+        })
+    return {
+        "description": (
+            "Pour une requête sur un mart, utiliser le premier rollup dont les dimensions "
+            "contiennent les colonnes de regroupement et de filtre, qui porte les mesures "
+            "demandées et dont answers_grains contient le grain de temps demandé "
+            "(period_start = début de période)."
+        ),
+        "models": dict(sorted(models.items())),
+    }
+
+
+def _serves_measure(candidate: dict[str, Any], column: str, aggregation: str) -> bool:
+    """Un rollup sert une mesure s'il la porte avec la même agrégation (tout count compte les lignes)."""
+    if aggregation == "count":
+        return any(measure["aggregation"] == "count" for measure in candidate["measures"].values())
+    return candidate["measures"].get(column, {}).get("aggregation") == aggregation
+
+
+def route_query(
+    routing: dict[str, Any],
+    model: str,
+    dimensions: list[str] | tuple[str, ...] = (),
+    measures: dict[str, str] | None = None,
+    grain: str | None = None,
+) -> str | None:
+    """
+    Trouve le plus petit rollup capable de répondre à une forme de requête
+
+    Args:
+        routing: Carte de routage (`build_routing_map` ou routing.json)
+        model: Mart interrogé
+        dimensions: Colonnes de regroupement et de filtre (hors colonne de temps)
+        measures: {colonne: agrégation} demandées
+        grain: Grain de temps demandé (None = pas de regroupement temporel)
+
+    Returns:
+        Nom du rollup, ou None si seule la table détaillée convient
+    """
+    for candidate in routing["models"].get(model, []):
+        if not set(dimensions) <= set(candidate["dimensions"]):
+            continue
+        if grain is not None and grain not in candidate["answers_grains"]:
+            continue
+        if not all(_serves_measure(candidate, column, aggregation) for column, aggregation in (measures or {}).items()):
+            continue
+        return candidate["rollup"]
+    return None
+
+
+def generate_rollups(
+    rollups: list[dict[str, Any]],
+    models_dir: Path = ROLLUP_MODELS_DIR,
+    routing_path: Path = ROUTING_PATH,
+) -> dict[str, Any]:
+    """
+    Écrit les modèles dbt des rollups et la carte de routage
+
+    Les modèles générés qui ne correspondent plus à aucun rollup sont supprimés.
+
+    Returns:
+        Dict {"written": [...], "removed": [...], "routing": chemin de la carte}
+    """
+    models_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+    for spec in rollups:
+        path = models_dir / f"{spec['name']}.sql"
+        path.write_text(render_rollup_model(spec), encoding="utf-8")
+        written.append(path.name)
+
+    removed = []
+    for path in sorted(models_dir.glob("*.sql")):
+        if path.name not in written and path.read_text(encoding="utf-8").startswith(GENERATED_HEADER):
+            path.unlink()
+            removed.append(path.name)
+
+    schema = {
+        "version": 2,
+        "models": [
+            {
+                "name": spec["name"],
+                "description": (
+                    f"Rollup de {spec['model']} "
+                    + (f"au grain {spec['grain']}" if spec["grain"] else "sur toute l'histoire")
+                    + (f" par {', '.join(spec['dimensions'])}" if spec["dimensions"] else "")
+                ),
+                "meta": {"rollup_of": spec["model"], "grain": spec["grain"], "dimensions": spec["dimensions"]},
+                "columns": (
+                    [{"name": "period_start", "description": "Début de période", "data_tests": ["not_null"]}]
+                    if spec["time_column"] else []
+                ),
+            }
+            for spec in rollups
+        ],
+    }
+    (models_dir / "_rollups.yml").write_text(
+        f"# {GENERATED_HEADER.removeprefix('-- ')}\n" + yaml.safe_dump(schema, sort_keys=False, allow_unicode=True),
+        encoding="utf-8",
+    )
+
+    routing_path.write_text(
+        json.dumps(build_routing_map(rollups), indent=2, ensure_ascii=False) + "\n",
+        encoding="utf-8",
+    )
+    return {"written": written, "removed": removed, "routing": str(routing_path)}
+
+
+# --- Apprentissage depuis l'historique des requêtes -------------------------
+
+_STRING_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_AGGREGATE_RE = re.compile(r"\b(sum|min|max|count)\s*\(\s*(distinct\s+)?([`\w.]+|\*)\s*\)", re.I)
+_DATE_TRUNC_RE = re.compile(r"\b(?:date|timestamp)_trunc\s*\(\s*([`\w.]+)\s*,\s*(\w+)\s*\)", re.I)
+_GROUP_BY_RE = re.compile(r"\bgroup\s+by\b(.*?)(?=\bhaving\b|\border\s+by\b|\blimit\b|\bunion\b|\)|$)", re.I | re.S)
+_WHERE_RE = re.compile(r"\bwhere\b(.*?)(?=\bgroup\s+by\b|\bhaving\b|\border\s+by\b|\blimit\b|\bunion\b|$)", re.I | re.S)
+_IDENTIFIER_RE = re.compile(r"[`\w.]+")
+
+
+def _column_name(identifier: str) -> str:
+    return identifier.replace("`", "").split(".")[-1].lower()
+
+
+def query_shape(sql: str, columns: list[str], time_column: str | None = None) -> dict[str, Any] | None:
+    """
+    Extrait la forme d'une requête de dashboard (heuristique, sans parseur SQL complet)
+
+    Args:
+        sql: Texte de la requête
+        columns: Colonnes du mart interrogé
+        time_column: Colonne de temps du mart
+
+    Returns:
+        {"dimensions", "measures", "grain"}, ou None si la requête ne peut pas
+        être servie par un rollup (COUNT DISTINCT, COUNT(colonne), pas d'agrégat)
+    """
+    text = _STRING_LITERAL_RE.sub("''", sql)
+    known = {column.lower() for column in columns}
+
+    measures = {}
+    for function, distinct, argument in _AGGREGATE_RE.findall(text):
+        function = function.lower()
+        if distinct:
+            return None
+        if function == "count":
+            if argument not in ("*", "1"):
+                return None
+            measures["row_count"] = "count"
+        elif _column_name(argument) in known:
+            measures[_column_name(argument)] = function
+    if not measures:
+        return None
+
+    group_columns, filter_columns = set(), set()
+    for clause in _GROUP_BY_RE.findall(text):
+        group_columns |= {_column_name(i) for i in _IDENTIFIER_RE.findall(clause)} & known
+    for clause in _WHERE_RE.findall(text):
+        filter_columns |= {_column_name(i) for i in _IDENTIFIER_RE.findall(clause)} & known
+
+    grain = None
+    if time_column:
+        for column, unit in _DATE_TRUNC_RE.findall(text):
+            unit = "week" if unit.lower() == "isoweek" else unit.lower()
+            if _column_name(column) == time_column and unit in GRAINS:
+                grain = unit
+        # Regroupement ou filtre au jour près : seul un rollup journalier convient
+        if grain is None and time_column in group_columns | filter_columns:
+            grain = "day"
+
+    return {
+        "dimensions": sorted((group_columns | filter_columns) - set(measures) - {time_column}),
+        "measures": measures,
+        "grain": grain,
+    }
+
+
+def learn_rollups(
+    queries: list[dict[str, str]],
+    model_columns: dict[str, list[str]],
+    time_columns: dict[str, str],
+    known_rollups: list[dict[str, Any]],
+    min_queries: int = 20,
+) -> list[dict[str, Any]]:
+    """
+    Propose des rollups pour les formes de requêtes fréquentes non couvertes
+
+    Args:
+        queries: Historique ({"table_id", "query"}), voir Warehouse.recent_queries
+        model_columns: Colonnes de chaque mart
+        time_columns: Colonne de temps de chaque mart
+        known_rollups: Rollups existants (les requêtes qu'ils servent déjà sont ignorées)
+        min_queries: Nombre minimal de requêtes pour proposer un rollup
+
+    Returns:
+        Rollups appris, les plus fréquents d'abord
+    """
+    routing = build_routing_map(known_rollups)
+    counts: Counter = Counter()
+    shape_measures: dict[tuple, dict[str, str]] = defaultdict(dict)
+
+    for job in queries:
+        model = job["table_id"]
+        shape = query_shape(job["query"], model_columns[model], time_columns.get(model))
+        if shape is None:
+            continue
+        if route_query(routing, model, shape["dimensions"], shape["measures"], shape["grain"]):
+            continue
+        key = (model, shape["grain"], tuple(shape["dimensions"]))
+        counts[key] += 1
+        shape_measures[key].update(shape["measures"])
+
+    learned = []
+    for (model, grain, dimensions), count in counts.most_common():
+        if count < min_queries:
+            break
+        spec = {
+            "model": model,
+            "dimensions": list(dimensions),
+            "measures": shape_measures[(model, grain, dimensions)],
+            "query_count": count,
+        }
+        if grain:
+            spec.update(time_column=time_columns[model], grain=grain)
+        learned.append(normalize_rollup(spec))
+    return learned
+
+
+@flow(name="pipeline-rollups-learning", log_prints=True, **FLOW_METRIC_HOOKS)
+def rollup_learning_pipeline(target: str = "prod", days: int = 30, min_queries: int = 20):
+    """
+    Apprend des rollups depuis l'historique des requêtes et régénère les modèles
+
+    À lancer depuis un poste de développement : learned.yml, les modèles
+    générés et routing.json sont écrits dans le dépôt, à committer ensuite.
+
+    Args:
+        target: Environnement dont l'historique est analysé (BigQuery uniquement)
+        days: Profondeur de l'historique en jours
+        min_queries: Nombre minimal de requêtes pour retenir une forme
+
+    Returns:
+        Dict contenant les rollups appris et le résultat de la génération
+    """
+    logger = get_run_logger()
+    declared = load_rollups(include_learned=False)
+    models = sorted({spec["model"] for spec in declared})
+    time_columns = {}
+    for spec in declared:
+        if spec["time_column"]:
+            time_columns.setdefault(spec["model"], spec["time_column"])
+
+    warehouse = resolve_warehouse(target, logger, stage="rollup_learning")
+    queries = warehouse.recent_queries(models, days)
+    logger.info(f"🔎 {len(queries)} requête(s) sur {', '.join(models)} ces {days} derniers jours")
+
+    learned = learn_rollups(
+        queries,
+        model_columns={model: warehouse.columns(model) for model in models},
+        time_columns=time_columns,
+        known_rollups=declared,
+        min_queries=min_queries,
+    )
+    for spec in learned:
+        logger.info(f"📈 {spec['name']} ({spec['query_count']} requête(s))")
+
+    LEARNED_ROLLUPS_PATH.write_text(
+        "# Rollups appris par `python -m prefect_flows.rollups learn` : ne pas modifier\n"
+        + yaml.safe_dump(
+            {"rollups": [{k: v for k, v in spec.items() if k != "name"} for spec in learned]},
+            sort_keys=False,
+        ),
+        encoding="utf-8",
+    )
+    result = generate_rollups(load_rollups())
+    logger.info(f"✅ {len(result['written'])} rollup(s) générés, carte de routage: {result['routing']}")
+    return {"learned": learned, **result}
+
+
+def main() -> int:
+    """Point d'entrée CLI."""
+    parser = argparse.ArgumentParser(description="Génère ou apprend les rollups des marts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("generate", help="Génère les modèles dbt et routing.json depuis dbt/rollups/")
+    learn = subparsers.add_parser("learn", help="Apprend des rollups depuis l'historique BigQuery")
+    learn.add_argument("--target", default="prod", help="Target analysé (default: prod)")
+    learn.add_argument("--days", type=int, default=30, help="Profondeur de l'historique (default: 30)")
+    learn.add_argument("--min-queries", type=int, default=20, help="Seuil de fréquence (default: 20)")
+    args = parser.parse_args()
+
+    if args.command == "learn":
+        rollup_learning_pipeline(target=args.target, days=args.days, min_queries=args.min_queries)
+    else:
+        result = generate_rollups(load_rollups())
+        print(f"✅ {len(result['written'])} rollup(s) générés, {len(result['removed'])} supprimé(s)")
+        print(f"🧭 Carte de routage: {result['routing']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
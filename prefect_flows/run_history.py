@@ -0,0 +1,211 @@
+"""
+Historique des invocations dbt de la pipeline.
+
+Après chaque commande dbt, `dbt_runner` archive un résumé de
+dbt/target/run_results.json (statut, durées et réponse de l'adaptateur par
+nœud) dans STATE_DIR/runs/{target}/, avec l'identifiant du flow run Prefect.
+Cet historique alimente les rapports et les réglages basés sur les runs
+précédents.
+
+Chaque invocation porte sa signature de sélection (selection_signature) : deux
+runs ne sont comparables que s'ils construisent les mêmes nœuds de la même
+façon (un micro-batch, un sous-ensemble du cache de construction ou un run
+échantillonné ne se comparent pas au run nocturne complet). La rotation est
+faite par opération : les micro-batchs (opération `microbatch`) n'évincent
+pas l'historique des runs nocturnes.
+"""
+import json
+import os
+import shlex
+import time
+from pathlib import Path
+from typing import Any
+
+from prefect_flows.config import DBT_PROJECT_DIR, STATE_DIR
+from prefect_flows.state import read_json, write_json_atomic
+
+
+# Artefacts produits par dbt (target-path par défaut du projet)
+DBT_TARGET_DIR = DBT_PROJECT_DIR / "target"
+
+# Nombre d'invocations conservées par target et par opération
+RUN_HISTORY_RETENTION = 200
+
+
+def current_flow_run_id() -> str:
+    """Identifiant du flow run Prefect en cours, ou "manual" hors Prefect."""
+    from prefect.runtime import flow_run
+
+    return str(flow_run.id) if flow_run.id else "manual"
+
+
+def dbt_target_dir() -> Path:
+    """Répertoire des artefacts de la prochaine commande dbt (DBT_TARGET_PATH s'il est défini)."""
+    target_path = os.getenv("DBT_TARGET_PATH")
+    return DBT_PROJECT_DIR / target_path if target_path else DBT_TARGET_DIR
+
+
+def _history_dir(target: str) -> Path:
+    return STATE_DIR / "runs" / target
+
+
+def selection_signature(command: str) -> str:
+    """
+    Signature de sélection d'une commande dbt : la commande sans --threads ni --target,
+    et --vars réduit aux noms des variables (les fenêtres datées changent à chaque run)
+
+    Exemple: "dbt run --select tag:microbatch+ --vars microbatch_windows,mart_windows"
+    """
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        return command
+    kept = []
+    index = 0
+    while index < len(words):
+        word = words[index]
+        if word in ("--threads", "--target") and index + 1 < len(words):
+            index += 2
+            continue
+        if word == "--vars" and index + 1 < len(words):
+            try:
+                names = sorted(json.loads(words[index + 1]))
+            except (ValueError, TypeError):
+                names = ["?"]
+            kept += ["--vars", ",".join(names)]
+            index += 2
+            continue
+        kept.append(word)
+        index += 1
+    return " ".join(kept)
+
+
+def _selection(record: dict[str, Any]) -> str:
+    # Entrées archivées avant l'ajout de la signature : recalculée depuis la commande
+    return record.get("selection") or selection_signature(record["command"])
+
+
+def _operation_of(path: Path) -> str:
+    # Nom de fichier : {ms}-{opération}-{flow run}.json
+    return path.stem.split("-", 1)[1].rsplit("-", 1)[0]
+
+
+def archive_invocation(
+    target: str,
+    operation: str,
+    command: str,
+    started_at: float,
+    success: bool,
+    resources: dict[str, Any] | None = None,
+) -> Path | None:
+    """
+    Archive le résultat de la dernière commande dbt
+
+    Ne fait rien si run_results.json est absent ou antérieur à la commande
+    (dbt arrêté avant l'exécution des nœuds, ex: erreur de compilation).
+
+    Args:
+        target: Environnement cible
+        operation: Nom court de l'opération (run, test, ...)
+        command: Commande dbt exécutée
+        started_at: Horodatage (time.time()) du lancement de la commande
+        success: True si la commande a réussi
+        resources: Resource report de la commande (voir resources.py), s'il a été lu
+
+    Returns:
+        Path de l'entrée d'historique écrite, ou None
+    """
+    run_results_path = dbt_target_dir() / "run_results.json"
+    try:
+        if run_results_path.stat().st_mtime < started_at:
+            return None
+        run_results = read_json(run_results_path)
+    except (OSError, ValueError):
+        return None
+
+    record = {
+        "flow_run_id": current_flow_run_id(),
+        "target": target,
+        "operation": operation,
+        "command": command,
+        "selection": selection_signature(command),
+        "success": success,
+        "started_at": started_at,
+        "finished_at": time.time(),
+        "invocation_id": run_results["metadata"].get("invocation_id"),
+        "invocation_started_at": run_results["metadata"].get("invocation_started_at"),
+        "generated_at": run_results["metadata"].get("generated_at"),
+        "elapsed_time": run_results.get("elapsed_time"),
+        "threads": (run_results.get("args") or {}).get("threads"),
+        "resources": resources,
+        "results": [
+            {
+                "unique_id": result["unique_id"],
+                "status": result["status"],
+                "execution_time": result.get("execution_time"),
+                "thread_id": result.get("thread_id"),
+                "timing": result.get("timing") or [],
+                "adapter_response": result.get("adapter_response") or {},
+                "failures": result.get("failures"),
+                "message": result.get("message"),
+            }
+            for result in run_results.get("results", [])
+        ],
+    }
+    return record_invocation(target, record)
+
+
+def record_invocation(target: str, record: dict[str, Any]) -> Path:
+    """
+    Écrit une invocation dans l'historique du target (rotation par opération comprise)
+
+    Args:
+        target: Environnement cible
+        record: Invocation au format d'archive_invocation
+
+    Returns:
+        Path de l'entrée d'historique écrite
+    """
+    history_dir = _history_dir(target)
+    path = history_dir / f"{int(record['started_at'] * 1000)}-{record['operation']}-{record['flow_run_id'][:8]}.json"
+    write_json_atomic(path, record)
+
+    same_operation = [
+        entry for entry in sorted(history_dir.glob("*.json")) if _operation_of(entry) == record["operation"]
+    ]
+    for stale in same_operation[:-RUN_HISTORY_RETENTION]:
+        stale.unlink(missing_ok=True)
+    return path
+
+
+def load_invocations(
+    target: str,
+    flow_run_id: str | None = None,
+    operation: str | None = None,
+    limit: int | None = None,
+    selection: str | None = None,
+) -> list[dict[str, Any]]:
+    """
+    Relit l'historique des invocations d'un target, de la plus ancienne à la plus récente
+
+    Args:
+        target: Environnement cible
+        flow_run_id: Ne garder que les invocations de ce flow run
+        operation: Ne garder que cette opération (run, test, ...)
+        limit: Ne garder que les `limit` invocations les plus récentes
+        selection: Ne garder que les invocations de cette signature (selection_signature)
+
+    Returns:
+        Liste des invocations archivées
+    """
+    invocations = []
+    for path in sorted(_history_dir(target).glob("*.json")):
+        if operation and _operation_of(path) != operation:
+            continue
+        record = read_json(path)
+        if flow_run_id and record["flow_run_id"] != flow_run_id:
+            continue
+        if selection and _selection(record) != selection:
+            continue
+        invocations.append(record)
+    return invocations[-limit:] if limit else invocations
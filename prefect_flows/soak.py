@@ -0,0 +1,602 @@
+"""
+Test de charge (soak) des flows sur un serveur Prefect et un entrepôt locaux
+
+Combien de runs concurrents de `dbt_full_pipeline` et `setup_dbt_blocks_pipeline`
+un worker et un serveur Prefect local supportent-ils avant que la latence ne
+décroche ? Le harnais :
+
+    1. déploie les flows (déploiements `soak`) sur un work pool process local,
+       et démarre un worker si demandé (--start-worker) ;
+    2. pour chaque palier N (1, 2, 4, 8... par défaut), maintient N flow runs
+       en vol jusqu'à en avoir terminé N x --rounds (boucle fermée : un run est
+       soumis dès qu'un autre se termine), en alternant les flows ;
+    3. mesure à chaque palier :
+         - le débit (runs terminés par minute),
+         - la latence des runs p50/p95/p99 (création -> fin, horodatages de
+           l'API) et l'attente avant démarrage (création -> Running),
+         - le taux d'erreurs de l'API (appels du harnais en échec) et de runs
+           en échec,
+         - le CPU (moyen, pic) et la RSS (pic) du worker et de ses processus
+           enfants (flow runs, dbt), relevés dans /proc ;
+    4. s'arrête au premier palier saturé : erreurs au-delà de
+       SOAK_ERROR_RATE_MAX, débit qui ne progresse plus de SOAK_THROUGHPUT_GAIN_MIN,
+       ou p95 au-delà de SOAK_P95_FACTOR_MAX fois celui du premier palier.
+       Le point de saturation est le dernier palier non saturé.
+
+Chaque emplacement de concurrence a sa propre base DuckDB, son état et son
+répertoire d'artefacts dbt (variables DBT_DUCKDB_RUNTIME_PATH, PIPELINE_STATE_DIR,
+DBT_TARGET_PATH passées au run) : DuckDB n'accepte qu'un écrivain par fichier,
+le harnais mesure l'orchestration et non ce verrou.
+
+Rapports dans REPORTS_DIR/soak/ : {version}-{horodatage}.json (paliers bruts,
+à suivre d'une version à l'autre) et .md (tableau, comparaison avec le rapport
+précédent).
+
+Le serveur doit être local (PREFECT_API_URL sur localhost) : le flow
+setup-dbt-blocks y réécrit les blocs du target `local`.
+
+En local:
+    prefect server start &
+    export PREFECT_API_URL=http://127.0.0.1:4200/api
+    uv run python -m prefect_flows.soak --pool soak --start-worker --levels 1,2,4,8 --rounds 2
+"""
+import argparse
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+import tomllib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+from urllib.parse import urlparse
+
+import yaml
+
+from prefect_flows.config import DBT_PROJECT_DIR, PROJECT_ROOT, REPORTS_DIR, STATE_DIR
+from prefect_flows.state import read_json, write_json_atomic
+
+
+SOAK_REPORTS_DIR = REPORTS_DIR / "soak"
+SOAK_SLOTS_DIR = STATE_DIR / "soak" / "slots"
+
+DEFAULT_LEVELS = (1, 2, 4, 8, 16)
+DEFAULT_ROUNDS = 2
+POLL_SECONDS = 2
+SAMPLE_SECONDS = 1
+# Durée maximale d'un palier ; les runs encore en vol sont annulés et comptés en échec
+LEVEL_TIMEOUT_SECONDS = 1800
+
+# Critères de saturation d'un palier
+SOAK_ERROR_RATE_MAX = 0.05
+SOAK_THROUGHPUT_GAIN_MIN = 0.10
+SOAK_P95_FACTOR_MAX = 3.0
+
+# Flows chargés : entrypoint et paramètres du déploiement `soak`
+SOAK_FLOWS = {
+    "pipeline": {
+        "entrypoint": "prefect_flows/pipeline.py:dbt_full_pipeline",
+        "parameters": {"target": "local", "export": False, "cost_report": False},
+    },
+    "setup-blocks": {
+        "entrypoint": "infrastructure/setup_profiles/flows.py:setup_dbt_blocks_pipeline",
+        "parameters": {"gcp_project": "soak-local", "dbt_commands": ["dbt debug"]},
+    },
+}
+SOAK_DEPLOYMENT = "soak"
+LOCAL_API_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """Percentile (interpolation linéaire, q dans [0, 100]) ; None sans valeur."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _release() -> dict[str, str | None]:
+    """Version du projet (pyproject.toml) et commit courant, pour suivre les rapports d'une version à l'autre."""
+    version = tomllib.loads((PROJECT_ROOT / "pyproject.toml").read_text(encoding="utf-8"))["project"]["version"]
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"version": version, "commit": commit}
+
+
+def _host() -> dict[str, Any]:
+    memory_mb = None
+    try:
+        for line in Path("/proc/meminfo").read_text().splitlines():
+            if line.startswith("MemTotal:"):
+                memory_mb = int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return {"cpus": os.cpu_count(), "memory_mb": memory_mb}
+
+
+class ProcessTreeSampler:
+    """
+    Relève le CPU et la RSS d'un processus et de ses descendants (Linux, /proc)
+
+    Le temps CPU de l'arbre est la somme, sur les processus vivants, de leur
+    temps propre et de celui de leurs enfants terminés (cutime/cstime) : un
+    flow run ou un dbt qui se termine reste compté via son parent.
+    """
+
+    def __init__(self, pid: int, interval: float = SAMPLE_SECONDS):
+        self.pid = pid
+        self.interval = interval
+        self.samples: list[tuple[float, float, int]] = []
+        self._clock_ticks = os.sysconf("SC_CLK_TCK")
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="soak-sampler", daemon=True)
+
+    @staticmethod
+    def available() -> bool:
+        return Path("/proc/self/stat").exists()
+
+    def _tree(self) -> dict[int, list[str]]:
+        """Champs de /proc/{pid}/stat des processus de l'arbre (après le nom de commande)."""
+        stats, children = {}, {}
+        for entry in Path("/proc").iterdir():
+            if not entry.name.isdigit():
+                continue
+            try:
+                fields = (entry / "stat").read_text().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            stats[int(entry.name)] = fields
+            children.setdefault(int(fields[1]), []).append(int(entry.name))
+        tree, pending = {}, [self.pid]
+        while pending:
+            pid = pending.pop()
+            if pid in stats:
+                tree[pid] = stats[pid]
+                pending += children.get(pid, [])
+        return tree
+
+    def sample(self) -> tuple[float, float, int]:
+        """(horodatage, secondes CPU cumulées de l'arbre, RSS de l'arbre en octets)."""
+        tree = self._tree()
+        # Champs 14-17 de stat (utime, stime, cutime, cstime), 24 (rss en pages), décalés du pid et du nom
+        cpu = sum(sum(int(value) for value in fields[11:15]) for fields in tree.values()) / self._clock_ticks
+        rss = sum(int(fields[21]) for fields in tree.values()) * self._page_size
+        return time.monotonic(), cpu, rss
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.samples.append(self.sample())
+
+    def __enter__(self) -> "ProcessTreeSampler":
+        self.samples = [self.sample()]
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.samples.append(self.sample())
+
+    def summary(self) -> dict[str, float | None]:
+        """CPU moyen et pic (% d'un cœur), RSS pic (Mo) sur la période relevée."""
+        if len(self.samples) < 2:
+            return {"cpu_mean_pct": None, "cpu_peak_pct": None, "rss_peak_mb": None}
+        rates = [
+            100 * max(cpu - prev_cpu, 0.0) / (at - prev_at)
+            for (prev_at, prev_cpu, _), (at, cpu, _) in zip(self.samples, self.samples[1:]) if at > prev_at
+        ]
+        first, last = self.samples[0], self.samples[-1]
+        return {
+            "cpu_mean_pct": round(100 * max(last[1] - first[1], 0.0) / max(last[0] - first[0], 1e-9), 1),
+            "cpu_peak_pct": round(max(rates, default=0.0), 1),
+            "rss_peak_mb": round(max(rss for _, _, rss in self.samples) / 2**20, 1),
+        }
+
+
+class ApiCalls:
+    """Appels du harnais à l'API Prefect, comptés avec leurs échecs."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.last_error: str | None = None
+
+    def __call__(self, function: Callable, *args, **kwargs):
+        """Résultat de l'appel, ou None s'il a échoué (erreur comptée)."""
+        self.calls += 1
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            self.errors += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            return None
+
+
+def _slot_env(slot: int) -> dict[str, str]:
+    """Variables d'un emplacement de concurrence : base DuckDB, état et artefacts dbt isolés."""
+    slot_dir = SOAK_SLOTS_DIR / str(slot)
+    slot_dir.mkdir(parents=True, exist_ok=True)
+    return {
+        "DBT_DUCKDB_RUNTIME_PATH": str(slot_dir / "soak.duckdb"),
+        "DBT_DUCKDB_PATH": str(slot_dir / "soak.duckdb"),
+        "PIPELINE_STATE_DIR": str(slot_dir / "state"),
+        "PIPELINE_REPORTS_DIR": str(slot_dir / "reports"),
+        "DBT_TARGET_PATH": str(slot_dir / "target"),
+    }
+
+
+def _local_template() -> Path:
+    """Template de profils réduit au target `local` (setup-dbt-blocks sans GCP)."""
+    template = yaml.safe_load((DBT_PROJECT_DIR / "profiles.tpl.yml").read_text(encoding="utf-8"))
+    profile_name, profile = next(iter(template.items()))
+    path = STATE_DIR / "soak" / "profiles.local.tpl.yml"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        yaml.safe_dump({profile_name: {"target": "local", "outputs": {"local": profile["outputs"]["local"]}}}),
+        encoding="utf-8",
+    )
+    return path
+
+
+def check_local_api() -> str:
+    """
+    URL de l'API Prefect, si elle désigne un serveur local
+
+    Raises:
+        RuntimeError: PREFECT_API_URL absente ou distante (Prefect Cloud)
+    """
+    from prefect.settings import PREFECT_API_URL
+
+    url = PREFECT_API_URL.value()
+    if not url or urlparse(url).hostname not in LOCAL_API_HOSTS:
+        raise RuntimeError(
+            f"PREFECT_API_URL doit désigner un serveur Prefect local (reçu: {url!r}). "
+            f"Lancez `prefect server start` puis exportez PREFECT_API_URL=http://127.0.0.1:4200/api"
+        )
+    return url
+
+
+def register_soak_deployments(work_pool: str, flows: list[str]) -> dict[str, str]:
+    """
+    Crée le work pool process s'il manque et déploie les flows chargés
+
+    Returns:
+        Dict {flow chargé: id du déploiement}
+    """
+    from prefect import flow as prefect_flow, get_client
+    from prefect.client.schemas.actions import WorkPoolCreate
+    from prefect.exceptions import ObjectNotFound
+
+    with get_client(sync_client=True) as client:
+        try:
+            client.read_work_pool(work_pool)
+        except ObjectNotFound:
+            client.create_work_pool(WorkPoolCreate(name=work_pool, type="process"))
+
+    deployments = {}
+    for name in flows:
+        spec = SOAK_FLOWS[name]
+        parameters = dict(spec["parameters"])
+        if name == "setup-blocks":
+            parameters["template_path"] = str(_local_template())
+        deployments[name] = str(
+            prefect_flow.from_source(source=str(PROJECT_ROOT), entrypoint=spec["entrypoint"]).deploy(
+                name=SOAK_DEPLOYMENT, work_pool_name=work_pool, parameters=parameters, print_next_steps=False,
+            )
+        )
+    return deployments
+
+
+def run_level(
+    concurrency: int,
+    deployments: dict[str, str],
+    rounds: int = DEFAULT_ROUNDS,
+    worker_pid: int | None = None,
+    timeout: float = LEVEL_TIMEOUT_SECONDS,
+) -> dict[str, Any]:
+    """
+    Maintient `concurrency` flow runs en vol jusqu'à en terminer concurrency x rounds
+
+    Args:
+        concurrency: Runs simultanés du palier
+        deployments: Déploiements chargés {flow: id}, soumis à tour de rôle
+        rounds: Runs terminés par emplacement de concurrence
+        worker_pid: Processus du worker dont l'arbre est relevé (CPU, RSS)
+        timeout: Durée maximale du palier (secondes)
+
+    Returns:
+        Mesures du palier (débit, latences, erreurs, ressources du worker)
+    """
+    from uuid import UUID
+
+    from prefect import get_client
+    from prefect.client.schemas.filters import FlowRunFilter, FlowRunFilterId
+    from prefect.states import Cancelling
+
+    api = ApiCalls()
+    names = list(deployments)
+    total = concurrency * rounds
+    in_flight: dict[str, tuple[int, str]] = {}
+    free_slots = list(range(concurrency))
+    runs: list[dict[str, Any]] = []
+    submitted = 0
+    sampler = ProcessTreeSampler(worker_pid) if worker_pid and ProcessTreeSampler.available() else None
+
+    started = time.monotonic()
+    with get_client(sync_client=True) as client:
+        if sampler:
+            sampler.__enter__()
+        try:
+            while len(runs) < total and time.monotonic() - started < timeout:
+                while free_slots and submitted < total:
+                    name = names[submitted % len(names)]
+                    slot = free_slots[-1]
+                    flow_run = api(
+                        client.create_flow_run_from_deployment, UUID(deployments[name]),
+                        job_variables={"env": _slot_env(slot)},
+                    )
+                    if flow_run is None:
+                        break
+                    free_slots.pop()
+                    in_flight[str(flow_run.id)] = (slot, name)
+                    submitted += 1
+
+                flow_runs = api(
+                    client.read_flow_runs,
+                    flow_run_filter=FlowRunFilter(id=FlowRunFilterId(any_=[UUID(id_) for id_ in in_flight])),
+                ) if in_flight else []
+                for flow_run in flow_runs or []:
+                    if flow_run.state is None or not flow_run.state.is_final():
+                        continue
+                    slot, name = in_flight.pop(str(flow_run.id))
+                    free_slots.append(slot)
+                    end_time = flow_run.end_time or flow_run.state.timestamp
+                    runs.append({
+                        "flow": name,
+                        "state": flow_run.state.type.value,
+                        "latency": (end_time - flow_run.created).total_seconds(),
+                        "queue": (flow_run.start_time - flow_run.created).total_seconds()
+                        if flow_run.start_time else None,
+                    })
+                time.sleep(POLL_SECONDS)
+        finally:
+            elapsed = time.monotonic() - started
+            if sampler:
+                sampler.__exit__(None, None, None)
+            # Palier expiré : runs restants annulés, comptés en échec
+            for flow_run_id, (_, name) in in_flight.items():
+                api(client.set_flow_run_state, UUID(flow_run_id), Cancelling(), force=True)
+                runs.append({"flow": name, "state": "TIMED_OUT", "latency": None, "queue": None})
+
+    latencies = [run["latency"] for run in runs if run["state"] == "COMPLETED"]
+    completed = len(latencies)
+    failed = len(runs) - completed
+    by_flow = {}
+    for name in names:
+        flow_latencies = [run["latency"] for run in runs if run["flow"] == name and run["state"] == "COMPLETED"]
+        by_flow[name] = {
+            "runs": sum(1 for run in runs if run["flow"] == name),
+            "p50_seconds": percentile(flow_latencies, 50),
+            "p95_seconds": percentile(flow_latencies, 95),
+        }
+    return {
+        "concurrency": concurrency,
+        "runs": len(runs),
+        "completed": completed,
+        "failed": failed,
+        "elapsed_seconds": round(elapsed, 1),
+        "throughput_per_minute": round(60 * completed / max(elapsed, 1e-9), 2),
+        "p50_seconds": percentile(latencies, 50),
+        "p95_seconds": percentile(latencies, 95),
+        "p99_seconds": percentile(latencies, 99),
+        "queue_p95_seconds": percentile([run["queue"] for run in runs if run["queue"] is not None], 95),
+        "failure_rate": round(failed / max(len(runs), 1), 4),
+        "api_calls": api.calls,
+        "api_errors": api.errors,
+        "api_error_rate": round(api.errors / max(api.calls, 1), 4),
+        "api_last_error": api.last_error,
+        "worker": sampler.summary() if sampler else None,
+        "by_flow": by_flow,
+    }
+
+
+def saturation_reasons(level: dict[str, Any], previous: list[dict[str, Any]]) -> list[str]:
+    """Raisons pour lesquelles un palier est saturé (vide s'il ne l'est pas)."""
+    reasons = []
+    if level["api_error_rate"] > SOAK_ERROR_RATE_MAX:
+        reasons.append(f"erreurs API {level['api_error_rate']:.1%}")
+    if level["failure_rate"] > SOAK_ERROR_RATE_MAX:
+        reasons.append(f"runs en échec {level['failure_rate']:.1%}")
+    if previous:
+        best = max(item["throughput_per_minute"] for item in previous)
+        if level["throughput_per_minute"] < best * (1 + SOAK_THROUGHPUT_GAIN_MIN):
+            reasons.append(f"débit plafonné ({level['throughput_per_minute']} <= {best} runs/min + {SOAK_THROUGHPUT_GAIN_MIN:.0%})")
+        base_p95 = previous[0]["p95_seconds"]
+        if base_p95 and level["p95_seconds"] and level["p95_seconds"] > base_p95 * SOAK_P95_FACTOR_MAX:
+            reasons.append(f"p95 x{level['p95_seconds'] / base_p95:.1f} par rapport au premier palier")
+    return reasons
+
+
+def _previous_report(current: Path | None = None) -> dict[str, Any] | None:
+    reports = sorted(path for path in SOAK_REPORTS_DIR.glob("*.json") if path != current)
+    return read_json(reports[-1]) if reports else None
+
+
+def _format(value: float | None, suffix: str = "") -> str:
+    return "-" if value is None else f"{value:.1f}{suffix}"
+
+
+def render_report(report: dict[str, Any], previous: dict[str, Any] | None) -> str:
+    """Rapport Markdown : paliers, point de saturation, comparaison avec le rapport précédent."""
+    release = report["release"]
+    lines = [
+        f"# Soak test — {release['version']} ({release['commit'] or 'hors git'})",
+        "",
+        f"- Démarré le {report['started_at']}, flows : {', '.join(report['flows'])}, "
+        f"{report['rounds']} run(s) par emplacement et par palier",
+        f"- Hôte : {report['host']['cpus']} CPU, {report['host']['memory_mb'] or '?'} Mo",
+        "",
+        "| Concurrence | Runs | Débit (runs/min) | p50 (s) | p95 (s) | p99 (s) | Attente p95 (s) "
+        "| Échecs | Erreurs API | CPU moy. / pic (%) | RSS pic (Mo) | Saturé |",
+        "|---|---|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    for level in report["levels"]:
+        worker = level["worker"] or {}
+        lines.append(
+            f"| {level['concurrency']} | {level['runs']} | {level['throughput_per_minute']} "
+            f"| {_format(level['p50_seconds'])} | {_format(level['p95_seconds'])} | {_format(level['p99_seconds'])} "
+            f"| {_format(level['queue_p95_seconds'])} | {level['failure_rate']:.1%} | {level['api_error_rate']:.1%} "
+            f"| {_format(worker.get('cpu_mean_pct'))} / {_format(worker.get('cpu_peak_pct'))} "
+            f"| {_format(worker.get('rss_peak_mb'))} | {', '.join(level['saturation']) or 'non'} |"
+        )
+    saturation = report["saturation"]
+    lines += [
+        "",
+        f"**Point de saturation : {saturation['level'] or 'non atteint (aucun palier sain)'}** "
+        f"run(s) concurrent(s)"
+        + (f", saturé à {saturation['saturated_at']} ({', '.join(saturation['reasons'])})"
+           if saturation["saturated_at"] else ", non saturé sur les paliers testés"),
+    ]
+    if previous:
+        previous_levels = {level["concurrency"]: level for level in previous["levels"]}
+        lines += [
+            "",
+            f"## Comparaison avec {previous['release']['version']} ({previous['release']['commit'] or 'hors git'}, "
+            f"{previous['started_at']})",
+            "",
+            f"- Point de saturation : {previous['saturation']['level']} -> {saturation['level']}",
+            "",
+            "| Concurrence | Débit (runs/min) | p95 (s) |",
+            "|---|---|---|",
+        ]
+        for level in report["levels"]:
+            before = previous_levels.get(level["concurrency"])
+            if before:
+                lines.append(
+                    f"| {level['concurrency']} | {before['throughput_per_minute']} -> {level['throughput_per_minute']} "
+                    f"| {_format(before['p95_seconds'])} -> {_format(level['p95_seconds'])} |"
+                )
+    return "\n".join(lines) + "\n"
+
+
+def soak_test(
+    work_pool: str,
+    levels: list[int] = DEFAULT_LEVELS,
+    rounds: int = DEFAULT_ROUNDS,
+    flows: list[str] | None = None,
+    worker_pid: int | None = None,
+    stop_at_saturation: bool = True,
+) -> dict[str, Any]:
+    """
+    Monte la concurrence palier par palier jusqu'à saturation et écrit le rapport
+
+    Args:
+        work_pool: Work pool process du worker chargé
+        levels: Paliers de concurrence, croissants
+        rounds: Runs terminés par emplacement de concurrence et par palier
+        flows: Flows chargés (clés de SOAK_FLOWS), défaut : tous
+        worker_pid: Processus du worker relevé (CPU, RSS)
+        stop_at_saturation: S'arrête au premier palier saturé
+
+    Returns:
+        Rapport {"release", "host", "levels", "saturation", "paths"}
+    """
+    api_url = check_local_api()
+    flows = flows or list(SOAK_FLOWS)
+    started_at = datetime.now(timezone.utc)
+    print(f"🏋️  Soak test sur {api_url} (work pool {work_pool}) : paliers {list(levels)}, flows {flows}")
+    deployments = register_soak_deployments(work_pool, flows)
+
+    results: list[dict[str, Any]] = []
+    saturation = {"level": None, "saturated_at": None, "reasons": []}
+    for concurrency in levels:
+        print(f"⏫ Palier {concurrency} : {concurrency * rounds} run(s)...")
+        level = run_level(concurrency, deployments, rounds=rounds, worker_pid=worker_pid)
+        level["saturation"] = saturation_reasons(level, results)
+        print(
+            f"   {level['throughput_per_minute']} runs/min, p95 {_format(level['p95_seconds'], 's')}, "
+            f"échecs {level['failure_rate']:.1%}, erreurs API {level['api_error_rate']:.1%}"
+            + (f" — saturé : {', '.join(level['saturation'])}" if level["saturation"] else "")
+        )
+        if level["saturation"] and saturation["saturated_at"] is None:
+            saturation.update(saturated_at=concurrency, reasons=level["saturation"])
+        elif not level["saturation"] and saturation["saturated_at"] is None:
+            saturation["level"] = concurrency
+        results.append(level)
+        if level["saturation"] and stop_at_saturation:
+            break
+
+    report = {
+        "release": _release(),
+        "started_at": started_at.isoformat(),
+        "host": _host(),
+        "flows": flows,
+        "rounds": rounds,
+        "levels": results,
+        "saturation": saturation,
+    }
+    stem = f"{report['release']['version']}-{started_at.strftime('%Y%m%dT%H%M%SZ')}"
+    json_path = SOAK_REPORTS_DIR / f"{stem}.json"
+    previous = _previous_report()
+    write_json_atomic(json_path, report)
+    markdown_path = json_path.with_suffix(".md")
+    markdown_path.write_text(render_report(report, previous), encoding="utf-8")
+    report["paths"] = {"json": str(json_path), "markdown": str(markdown_path)}
+    print(f"📄 Rapport : {markdown_path}")
+    return report
+
+
+def _start_worker(work_pool: str, limit: int | None) -> subprocess.Popen:
+    command = [sys.executable, "-m", "prefect", "worker", "start", "--pool", work_pool, "--type", "process"]
+    if limit:
+        command += ["--limit", str(limit)]
+    worker = subprocess.Popen(command, cwd=PROJECT_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(5)
+    if worker.poll() is not None:
+        raise RuntimeError(f"Le worker s'est arrêté au démarrage (code {worker.returncode})")
+    return worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge des flows sur un serveur Prefect local")
+    parser.add_argument("--pool", default="soak", help="Work pool process (créé s'il manque)")
+    parser.add_argument("--levels", default=",".join(str(level) for level in DEFAULT_LEVELS))
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument("--flows", default=",".join(SOAK_FLOWS), help=f"Parmi {', '.join(SOAK_FLOWS)}")
+    parser.add_argument("--start-worker", action="store_true", help="Démarre (et arrête) un worker sur le pool")
+    parser.add_argument("--worker-limit", type=int, default=None, help="--limit du worker démarré")
+    parser.add_argument("--worker-pid", type=int, default=None, help="Worker existant à relever (CPU, RSS)")
+    parser.add_argument("--all-levels", dest="stop_at_saturation", action="store_false",
+                        help="Continue au-delà du premier palier saturé")
+    args = parser.parse_args()
+
+    levels = sorted(int(level) for level in args.levels.split(","))
+    flows = [name.strip() for name in args.flows.split(",")]
+    unknown = set(flows) - set(SOAK_FLOWS)
+    if unknown:
+        parser.error(f"Flows inconnus: {sorted(unknown)}")
+
+    check_local_api()
+    worker = _start_worker(args.pool, args.worker_limit) if args.start_worker else None
+    try:
+        soak_test(
+            args.pool, levels=levels, rounds=args.rounds, flows=flows,
+            worker_pid=worker.pid if worker else args.worker_pid, stop_at_saturation=args.stop_at_saturation,
+        )
+    finally:
+        if worker:
+            worker.terminate()
+            worker.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Utilitaires de persistance de l'état local des flows.
+
+Écritures JSON atomiques (fichier temporaire + os.replace) et verrou
+inter-processus basé sur la création exclusive d'un fichier.
+"""
+import json
+import os
+import socket
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+
+def read_json(path: Path, default: Any = None) -> Any:
+    """
+    Lit un fichier JSON d'état
+
+    Args:
+        path: Chemin du fichier
+        default: Valeur retournée si le fichier n'existe pas
+
+    Returns:
+        Contenu désérialisé du fichier, ou `default`
+    """
+    if not path.exists():
+        return default
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def write_json_atomic(path: Path, payload: Any) -> Path:
+    """
+    Écrit un fichier JSON de manière atomique
+
+    Le contenu est d'abord écrit dans un fichier temporaire du même répertoire,
+    synchronisé sur disque, puis renommé : un lecteur concurrent voit soit
+    l'ancienne version complète, soit la nouvelle, jamais un fichier partiel.
+
+    Args:
+        path: Chemin de destination
+        payload: Données sérialisables en JSON
+
+    Returns:
+        Path du fichier écrit
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+            json.dump(payload, tmp_file, indent=2, sort_keys=True, default=str)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+    return path
+
+
+class FileLock:
+    """
+    Verrou inter-processus non bloquant
+
+    Le verrou est un fichier créé avec O_EXCL contenant l'hôte et le PID du
+    détenteur. Un verrou laissé par un processus mort (même hôte) ou plus
+    ancien que `stale_after_seconds` est considéré comme abandonné et repris.
+    """
+
+    def __init__(self, path: Path, stale_after_seconds: float | None = None):
+        self.path = path
+        self.stale_after_seconds = stale_after_seconds
+        self._held = False
+
+    def _is_stale(self) -> bool:
+        try:
+            holder = json.loads(self.path.read_text(encoding="utf-8"))
+            age = time.time() - self.path.stat().st_mtime
+        except (OSError, ValueError):
+            return False
+
+        if self.stale_after_seconds is not None and age > self.stale_after_seconds:
+            return True
+
+        if holder.get("host") == socket.gethostname():
+            try:
+                os.kill(int(holder["pid"]), 0)
+            except ProcessLookupError:
+                return True
+            except (PermissionError, KeyError, ValueError):
+                return False
+        return False
+
+    def acquire(self) -> bool:
+        """
+        Tente de prendre le verrou
+
+        Returns:
+            True si le verrou est obtenu, False s'il est détenu par un autre processus
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._is_stale():
+                    return False
+                # Verrou abandonné : on le supprime puis on retente une fois
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as lock_file:
+                json.dump(
+                    {"host": socket.gethostname(), "pid": os.getpid(), "acquired_at": time.time()},
+                    lock_file,
+                )
+            self._held = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """Libère le verrou s'il est détenu par ce processus."""
+        if self._held:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self._held = False
+
+    def __enter__(self) -> "FileLock":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.release()
@@ -1,10 +1,18 @@
 """
 Simple test flow to validate dbt operation blocks
 """
+import sys
+import time
 from pathlib import Path
 from prefect import flow
 from prefect_dbt.cli import DbtCoreOperation, DbtCliProfile, BigQueryTargetConfigs
 
+if __package__ in (None, ""):
+    # Exécution directe (python prefect_flows/test.py) : rend le package importable
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from prefect_flows.profiling import phase, record_dbt_invocation
+
 @flow(name="test-dbt-debug", log_prints=True)
 def test_dbt_debug_flow():
     """
@@ -14,14 +22,17 @@ def test_dbt_debug_flow():
     
     Usage:
         uv run python prefect_flows/test.py
+        uv run python prefect_flows/test.py --profile
     """
     project_dir = Path(__file__).parent.parent / "dbt"
 
-    bigquery_target_configs = BigQueryTargetConfigs.load("bigquery-target-configs-dev")
+    with phase("block_load:bigquery-target-configs-dev"):
+        bigquery_target_configs = BigQueryTargetConfigs.load("bigquery-target-configs-dev")
     print(f"Using BigQuery target configs: {bigquery_target_configs}")
 
     # Charger le bloc profil dbt
-    dbt_cli_profile_block = DbtCliProfile.load("dbt-cli-profile-dev")
+    with phase("block_load:dbt-cli-profile-dev"):
+        dbt_cli_profile_block = DbtCliProfile.load("dbt-cli-profile-dev")
     print(f"Using dbt profile: {dbt_cli_profile_block}")
     
     
@@ -43,11 +54,22 @@ def test_dbt_debug_flow():
         target="dev",
     )
     print(f"Using dbt operation: {dbt_operation}")  
-    result = dbt_operation.run()
+    # dbt debug n'écrit pas de run_results.json : pas de décomposition parse/execute
+    started_at = time.time()
+    try:
+        result = dbt_operation.run()
+    finally:
+        record_dbt_invocation("debug", started_at, time.time(), history_path=None)
     
     return result
 
 
 if __name__ == "__main__":
     # Exécution locale pour tester
-    test_dbt_debug_flow()
+    import argparse
+
+    from prefect_flows.profiling import add_profiling_arguments, run_entry_point
+
+    parser = argparse.ArgumentParser(description="Test du bloc dbt debug")
+    add_profiling_arguments(parser)
+    run_entry_point(test_dbt_debug_flow, "test", parser.parse_args())
@@ -0,0 +1,158 @@
+"""
+Cache des résultats de tests dbt, dépendant des données testées
+
+Un test de données n'a pas besoin d'être relancé si son SQL compilé et les
+données qu'il lit sont identiques à ceux de son dernier succès. Avant
+`dbt test`, les tests sont compilés (`dbt compile`) et chacun reçoit une clé :
+
+    empreinte(SHA-256 du SQL compilé, versions des relations lues)
+
+(versions : voir data_versions.py). Un test dont la clé correspond à un succès
+en cache est rapporté `cached-pass` et exclu de la commande ; les autres sont
+exécutés, et leurs succès enregistrés. Les tests dont une relation est absente
+et les tests unitaires sont toujours exécutés.
+
+Le cache est conservé par target dans STATE_DIR/test_cache/{target}.json :
+une entrée par test (la dernière clé en succès), expirée après
+TEST_CACHE_MAX_AGE_DAYS jours pour forcer une réexécution périodique, et
+TEST_CACHE_MAX_ENTRIES entrées au plus (les moins récemment utilisées sont
+évincées). `force=True` exécute tous les tests, sans lire le cache.
+"""
+import time
+from typing import Any
+
+from prefect_flows.config import STATE_DIR
+from prefect_flows.data_versions import fingerprint, node_data_versions
+from prefect_flows.dbt_runner import build_dbt_command, run_dbt_command
+from prefect_flows.materialization import load_manifest
+from prefect_flows.metrics import DBT_NODES
+from prefect_flows.run_history import current_flow_run_id, load_invocations
+from prefect_flows.state import read_json, write_json_atomic
+from prefect_flows.warehouse import resolve_warehouse
+
+
+TEST_CACHE_DIR = STATE_DIR / "test_cache"
+
+# Âge maximal d'un succès en cache, et taille maximale du cache par target
+TEST_CACHE_MAX_AGE_DAYS = 7
+TEST_CACHE_MAX_ENTRIES = 5000
+
+# Statut rapporté pour un test non exécuté car en cache
+CACHED_PASS = "cached-pass"
+
+
+def _cache_path(target: str):
+    return TEST_CACHE_DIR / f"{target}.json"
+
+
+def load_test_cache(target: str) -> dict[str, dict[str, Any]]:
+    """Entrées non expirées du cache : {clé: {"unique_id", "passed_at", "last_hit"}}."""
+    cutoff = time.time() - TEST_CACHE_MAX_AGE_DAYS * 86400
+    cache = read_json(_cache_path(target), default={})
+    return {key: entry for key, entry in cache.items() if entry["passed_at"] >= cutoff}
+
+
+def save_test_cache(target: str, cache: dict[str, dict[str, Any]]) -> None:
+    """Écrit le cache après éviction des entrées les moins récemment utilisées."""
+    kept = sorted(cache.items(), key=lambda item: item[1]["last_hit"], reverse=True)[:TEST_CACHE_MAX_ENTRIES]
+    write_json_atomic(_cache_path(target), dict(kept))
+
+
+def plan_cached_tests(target: str, dbt_vars: dict[str, Any], force: bool, logger) -> dict[str, Any]:
+    """
+    Compile les tests et repère ceux dont le dernier succès est toujours valable
+
+    Args:
+        target: Environnement cible
+        dbt_vars: Variables dbt de la commande de test (même compilation)
+        force: Ignore le cache (tous les tests sont exécutés, les succès enregistrés)
+        logger: Logger Prefect de la tâche appelante
+
+    Returns:
+        Dict {"planned_at", "keys": {unique_id: clé}, "cached": [unique_id],
+        "exclude": [nom des tests en cache], "total": nœuds de test du projet}
+    """
+    planned_at = time.time()
+    run_dbt_command(
+        build_dbt_command("compile", select=["resource_type:test"], dbt_vars=dbt_vars),
+        target=target, operation="compile", logger=logger,
+    )
+    manifest = load_manifest()
+    tests = {
+        unique_id: node for unique_id, node in manifest["nodes"].items()
+        if node["resource_type"] == "test" and node.get("compiled_code")
+    }
+    # Tests exécutés par `dbt test` : tests de données et tests unitaires
+    total = sum(1 for node in manifest["nodes"].values() if node["resource_type"] == "test")
+    total += len(manifest.get("unit_tests", {}))
+
+    warehouse = resolve_warehouse(target, logger, stage="test_cache")
+    parents = sorted({parent for node in tests.values() for parent in node["depends_on"]["nodes"]})
+    versions = node_data_versions(warehouse, manifest, parents)
+
+    keys = {}
+    for unique_id, node in tests.items():
+        read = {parent: versions.get(parent) for parent in node["depends_on"]["nodes"]}
+        if None in read.values():
+            continue
+        keys[unique_id] = fingerprint([fingerprint(node["compiled_code"]), read])
+
+    cache = {} if force else load_test_cache(target)
+    cached = sorted(unique_id for unique_id, key in keys.items() if key in cache)
+    for unique_id in cached:
+        cache[keys[unique_id]]["last_hit"] = planned_at
+    if cached:
+        save_test_cache(target, cache)
+    return {
+        "planned_at": planned_at,
+        "keys": keys,
+        "cached": cached,
+        "exclude": [tests[unique_id]["name"] for unique_id in cached],
+        "total": total,
+    }
+
+
+def record_test_passes(target: str, plan: dict[str, Any], logger) -> int:
+    """
+    Enregistre les succès du dernier `dbt test` du flow run en cours
+
+    Args:
+        target: Environnement cible
+        plan: Résultat de plan_cached_tests
+        logger: Logger Prefect de la tâche appelante
+
+    Returns:
+        Nombre de succès enregistrés
+    """
+    invocations = load_invocations(target, flow_run_id=current_flow_run_id(), operation="test", limit=1)
+    if not invocations or invocations[0]["started_at"] < plan["planned_at"]:
+        return 0
+
+    results = [result for result in invocations[0]["results"] if result["unique_id"] in plan["keys"]]
+    executed = {result["unique_id"] for result in results}
+    # Une seule clé par test : celle d'un test réexécuté ne peut plus correspondre
+    cache = {key: entry for key, entry in load_test_cache(target).items() if entry["unique_id"] not in executed}
+    now = time.time()
+    recorded = 0
+    for result in results:
+        if result["status"] == "pass":
+            entry = {"unique_id": result["unique_id"], "passed_at": now, "last_hit": now}
+            cache[plan["keys"][result["unique_id"]]] = entry
+            recorded += 1
+    save_test_cache(target, cache)
+    logger.info(f"🗃️  {recorded} succès de test enregistré(s) dans le cache ({len(cache)} entrée(s))")
+    return recorded
+
+
+def report_cached_tests(target: str, plan: dict[str, Any], logger) -> None:
+    """Logge et compte les tests rapportés `cached-pass`."""
+    if not plan["cached"]:
+        logger.info(f"🗃️  Aucun test en cache : {plan['total']} test(s) exécuté(s)")
+        return
+    DBT_NODES.inc(len(plan["cached"]), target=target, operation="test", status=CACHED_PASS)
+    logger.info(
+        f"🗃️  {len(plan['cached'])}/{plan['total']} test(s) {CACHED_PASS} (SQL et données inchangés "
+        f"depuis leur dernier succès), {plan['total'] - len(plan['cached'])} exécuté(s)"
+    )
+    for unique_id in plan["cached"]:
+        logger.debug(f"   {CACHED_PASS}: {unique_id}")
@@ -0,0 +1,258 @@
+"""
+Réglage automatique du nombre de threads dbt d'après les runs précédents
+
+Les threads sont fixés par target dans dbt/profiles.tpl.yml et recopiés dans
+les blocs Prefect. En mode auto (`threads="auto"` sur dbt_full_pipeline), la
+concurrence du prochain run est choisie à partir de l'historique des
+invocations (run_history.py) et passée en `--threads` : les blocs stockés ne
+sont pas modifiés.
+
+Seuls les runs de même sélection sont comparés (signature de la commande sans
+--threads ni valeurs de --vars, voir run_history.selection_signature) : un
+micro-batch, un sous-ensemble du cache de construction ou un run distribué ne
+sert pas à régler le run complet.
+
+Signaux relevés sur le dernier run de la même opération et de la même sélection :
+    - attente : délai entre le moment où un nœud est prêt (parents terminés)
+      et son démarrage, rapporté au temps d'exécution des nœuds
+    - largeur du DAG : nombre maximal de nœuds au même niveau de dépendance
+    - pression sur l'entrepôt : erreurs de quota, de débit ou de timeout
+
+Décision, dans les bornes THREAD_BOUNDS du target :
+    - pression détectée                  -> divise par 2
+    - le dernier changement a allongé le makespan de plus de 10% -> retour à la valeur précédente
+    - attente > 25% de l'exécution       -> double, sans dépasser la largeur du DAG
+                                            ni une valeur qui a déjà ralenti le run
+    - attente < 5% et threads > largeur  -> réduit à la largeur du DAG
+    - sinon                              -> conserve
+"""
+import re
+from datetime import datetime
+from typing import Any
+
+from prefect_flows.run_history import dbt_target_dir, load_invocations, selection_signature
+from prefect_flows.state import read_json
+
+
+# Bornes (min, max) des threads choisis automatiquement, par target
+THREAD_BOUNDS = {
+    "dev": (1, 4),
+    "prod": (2, 16),
+    "local": (1, 8),
+}
+DEFAULT_THREAD_BOUNDS = (1, 8)
+
+# Seuils d'attente (temps d'attente / temps d'exécution des nœuds)
+QUEUE_RATIO_HIGH = 0.25
+QUEUE_RATIO_LOW = 0.05
+
+# Allongement du makespan au-delà duquel un changement est annulé
+# (relatif, et absolu pour ignorer le bruit des runs courts)
+MAKESPAN_REGRESSION = 0.10
+MAKESPAN_MIN_DELTA_SECONDS = 2.0
+
+_PRESSURE_MESSAGE = re.compile(
+    r"rateLimitExceeded|quota exceeded|too many (?:concurrent|requests)|\b429\b|"
+    r"deadline exceeded|timed? ?out|resources exceeded",
+    re.IGNORECASE,
+)
+
+
+def _timestamp(value: str) -> float:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def _node_window(result: dict) -> tuple[float, float] | None:
+    """Début (compilation) et fin (exécution) d'un nœud, None s'il n'a pas été exécuté."""
+    timing = {step["name"]: step for step in result.get("timing") or []}
+    if not timing.get("compile", {}).get("started_at") or not timing.get("execute", {}).get("completed_at"):
+        return None
+    return _timestamp(timing["compile"]["started_at"]), _timestamp(timing["execute"]["completed_at"])
+
+
+def load_parents() -> dict[str, list[str]]:
+    """Parents de chaque nœud, d'après le dernier manifest.json de dbt (vide s'il est absent)."""
+    manifest = read_json(dbt_target_dir() / "manifest.json", default={})
+    return {
+        unique_id: node.get("depends_on", {}).get("nodes", [])
+        for unique_id, node in manifest.get("nodes", {}).items()
+    }
+
+
+def invocation_signals(invocation: dict[str, Any], parents: dict[str, list[str]]) -> dict[str, Any]:
+    """
+    Signaux de concurrence d'une invocation dbt archivée
+
+    Args:
+        invocation: Entrée d'historique (run_history.load_invocations)
+        parents: Parents de chaque nœud (load_parents)
+
+    Returns:
+        Dict {"threads", "makespan", "queue_seconds", "execution_seconds", "queue_ratio",
+        "dag_width", "pressure_errors"}
+    """
+    windows = {
+        result["unique_id"]: window
+        for result in invocation["results"]
+        if (window := _node_window(result)) is not None
+    }
+    execution_start = min((start for start, _ in windows.values()), default=0.0)
+
+    queue_seconds = 0.0
+    execution_seconds = 0.0
+    depth: dict[str, int] = {}
+    for unique_id, (start, end) in sorted(windows.items(), key=lambda item: item[1][0]):
+        upstream = [parent for parent in parents.get(unique_id, []) if parent in windows]
+        ready_at = max((windows[parent][1] for parent in upstream), default=execution_start)
+        queue_seconds += max(start - ready_at, 0.0)
+        execution_seconds += end - start
+        depth[unique_id] = 1 + max((depth.get(parent, 0) for parent in upstream), default=0)
+
+    levels: dict[int, int] = {}
+    for level in depth.values():
+        levels[level] = levels.get(level, 0) + 1
+
+    threads_seen = len({result["thread_id"] for result in invocation["results"] if result.get("thread_id")})
+    return {
+        "threads": invocation.get("threads") or threads_seen or None,
+        "makespan": invocation.get("elapsed_time"),
+        "queue_seconds": round(queue_seconds, 3),
+        "execution_seconds": round(execution_seconds, 3),
+        "queue_ratio": queue_seconds / execution_seconds if execution_seconds else 0.0,
+        "dag_width": max(levels.values(), default=0),
+        "pressure_errors": sum(
+            1 for result in invocation["results"]
+            if result["status"] in ("error", "fail") and _PRESSURE_MESSAGE.search(result.get("message") or "")
+        ),
+    }
+
+
+def _regressed(slower: dict[str, Any], faster: dict[str, Any]) -> bool:
+    """True si `slower` a un makespan nettement plus long que `faster`."""
+    if not slower["makespan"] or not faster["makespan"]:
+        return False
+    delta = slower["makespan"] - faster["makespan"]
+    return delta > MAKESPAN_MIN_DELTA_SECONDS and delta > MAKESPAN_REGRESSION * faster["makespan"]
+
+
+def choose_threads(
+    target: str,
+    operation: str,
+    bounds: tuple[int, int] | None = None,
+    selection: str | None = None,
+) -> tuple[int | None, str]:
+    """
+    Choisit le nombre de threads du prochain run d'une opération dbt
+
+    Args:
+        target: Environnement cible
+        operation: Nom court de l'opération (run, test, ...)
+        bounds: Bornes (min, max) (default: THREAD_BOUNDS du target)
+        selection: Signature de sélection de la commande à lancer (selection_signature) ;
+            None compare toutes les invocations de l'opération
+
+    Returns:
+        Tuple (threads, raison). threads est None sans historique exploitable
+        (la valeur du profil s'applique).
+    """
+    low, high = bounds or THREAD_BOUNDS.get(target, DEFAULT_THREAD_BOUNDS)
+    history = [
+        invocation for invocation in load_invocations(target, operation=operation, limit=10, selection=selection)
+        if invocation["results"]
+    ]
+    if not history:
+        return None, "aucun run précédent de même sélection" if selection else "aucun run précédent"
+
+    parents = load_parents()
+    last = invocation_signals(history[-1], parents)
+    current = last["threads"]
+    if not current:
+        return None, "threads du dernier run inconnus"
+
+    def clamp(value: int) -> int:
+        return max(low, min(high, value))
+
+    if last["pressure_errors"]:
+        return clamp(current // 2), f"{last['pressure_errors']} erreur(s) de quota/débit au dernier run"
+
+    # Runs précédents effectués avec une autre valeur (le plus récent par valeur)
+    others = [
+        signals for invocation in history[:-1]
+        if (signals := invocation_signals(invocation, parents))["threads"] not in (None, current)
+    ]
+    tried = {signals["threads"]: signals for signals in others}
+
+    # Dernier changement : conservé seulement s'il n'a pas ralenti le run
+    previous = others[-1] if others else None
+    if previous and _regressed(last, previous):
+        return clamp(previous["threads"]), (
+            f"makespan {previous['makespan']:.1f}s -> {last['makespan']:.1f}s "
+            f"en passant de {previous['threads']} à {current} threads : retour arrière"
+        )
+
+    width = last["dag_width"] or current
+    if last["queue_ratio"] > QUEUE_RATIO_HIGH and width > current:
+        candidate = clamp(min(current * 2, width))
+        if candidate in tried and _regressed(tried[candidate], last):
+            return clamp(current), f"attente {last['queue_ratio']:.0%}, mais {candidate} threads ont déjà ralenti le run"
+        return candidate, f"attente {last['queue_ratio']:.0%} du temps d'exécution, largeur du DAG {width}"
+    if last["queue_ratio"] < QUEUE_RATIO_LOW and current > width:
+        return clamp(width), f"attente négligeable, largeur du DAG {width} < {current} threads"
+    return clamp(current), f"attente {last['queue_ratio']:.0%}, largeur du DAG {width} : inchangé"
+
+
+def resolve_thread_args(
+    target: str,
+    operation: str,
+    threads: int | str | None,
+    logger,
+    command: str | None = None,
+) -> list[str]:
+    """
+    Arguments --threads d'une commande dbt
+
+    Args:
+        target: Environnement cible
+        operation: Nom court de l'opération (run, test, ...)
+        threads: None (valeur du profil), un entier, ou "auto"
+        logger: Logger Prefect de la tâche appelante
+        command: Commande dbt à lancer, sans --threads : en mode auto, seuls les
+            runs de même sélection sont comparés
+
+    Returns:
+        ["--threads", "N"], ou [] pour garder la valeur du profil
+    """
+    if threads is None:
+        return []
+    if threads != "auto":
+        if int(threads) < 1:
+            raise ValueError(f"threads doit être >= 1 ou 'auto', reçu: {threads}")
+        return ["--threads", str(int(threads))]
+
+    selection = selection_signature(command) if command else None
+    chosen, reason = choose_threads(target, operation, selection=selection)
+    if chosen is None:
+        logger.info(f"🧵 Threads auto ({operation}): valeur du profil ({reason})")
+        return []
+    logger.info(f"🧵 Threads auto ({operation}): {chosen} — {reason}")
+    return ["--threads", str(chosen)]
+
+
+def log_makespan_effect(target: str, operation: str, logger) -> None:
+    """Compare le makespan du run qui vient de se terminer à celui du run précédent de même sélection."""
+    last = load_invocations(target, operation=operation, limit=1)
+    if not last:
+        return
+    history = load_invocations(target, operation=operation, limit=2, selection=selection_signature(last[0]["command"]))
+    if len(history) < 2:
+        return
+    parents = load_parents()
+    previous, last = (invocation_signals(invocation, parents) for invocation in history)
+    if not previous["makespan"] or not last["makespan"]:
+        return
+    change = last["makespan"] / previous["makespan"] - 1
+    logger.info(
+        f"⏱️  Makespan dbt {operation}: {last['makespan']:.1f}s avec {last['threads']} thread(s) "
+        f"(précédent: {previous['makespan']:.1f}s avec {previous['threads']}, {change:+.0%}), "
+        f"attente {last['queue_ratio']:.0%}"
+    )
@@ -0,0 +1,525 @@
+"""
+Dépôt parallèle et reprenable des fichiers sources dans le magasin d'objets
+
+Les dépôts quotidiens de CSV bruts sont poussés dans le bucket de landing
+(PIPELINE_LANDING_BUCKET, sur lequel le compte de service dbt est
+storage.objectAdmin, voir infrastructure/main.tf) avant leur chargement. Un
+fichier volumineux est :
+
+    1. découpé en morceaux de `chunk_size_mb` Mo, déposés en parallèle
+       (`parallelism` flux) sous `<destination>.parts/<upload_id>/`
+    2. vérifié morceau par morceau (CRC32C calculé localement, validé par le
+       magasin) ; chaque morceau validé est noté dans un manifeste d'état
+    3. recomposé côté serveur (compose GCS, 32 sources au plus par appel,
+       en plusieurs niveaux au-delà) puis contrôlé : le CRC32C de l'objet
+       final doit être celui du fichier local
+
+Après une coupure (ou un retry de la tâche), le dépôt reprend au dernier
+morceau validé : seuls les morceaux absents du manifeste, ou dont l'objet a
+disparu ou diffère, sont renvoyés. Le manifeste est invalidé si le fichier
+local ou la taille des morceaux changent.
+
+Le débit (Mo/s, octets envoyés pendant ce run) est journalisé et exposé dans
+les métriques (pipeline_upload_throughput_mb_per_second).
+
+Target local : le magasin est émulé sur disque (LOCAL_OBJECT_STORE_DIR), avec
+les mêmes contrôles d'intégrité et la même recomposition.
+
+En local:
+    uv run python -m prefect_flows.upload --target local data/incoming/*.csv
+"""
+import argparse
+import base64
+import hashlib
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any
+
+from prefect import flow, task, get_run_logger
+
+from prefect_flows.config import LANDING_BUCKET, LOCAL_OBJECT_STORE_DIR, OFFLINE_TARGETS, STATE_DIR
+from prefect_flows.metrics import FLOW_METRIC_HOOKS, TASK_METRIC_HOOKS, Counter, Gauge
+from prefect_flows.state import read_json, write_json_atomic
+from prefect_flows.warehouse import BigQueryWarehouse, resolve_warehouse
+
+
+# Préfixe des objets déposés dans le bucket de landing
+LANDING_PREFIX = "landing"
+
+# Taille des morceaux et nombre de flux parallèles par fichier
+CHUNK_SIZE_MB = 32
+UPLOAD_PARALLELISM = 8
+
+# Tentatives par morceau avant d'abandonner le run (la reprise repartira du manifeste)
+CHUNK_ATTEMPTS = 3
+
+# Manifestes de reprise des dépôts en cours
+UPLOAD_STATE_DIR = STATE_DIR / "uploads"
+
+_READ_BLOCK = 8 * 1024 * 1024
+
+UPLOADED_BYTES = Counter(
+    "pipeline_upload_bytes_total", "Octets déposés dans le magasin d'objets, envoyés ou repris", ("target", "origin")
+)
+UPLOAD_THROUGHPUT = Gauge(
+    "pipeline_upload_throughput_mb_per_second", "Débit du dernier dépôt (Mo/s, morceaux envoyés)", ("target",)
+)
+
+
+def crc32c(data: bytes) -> str:
+    """CRC32C d'un bloc, encodé en base64 comme les métadonnées GCS."""
+    import google_crc32c
+
+    return base64.b64encode(google_crc32c.Checksum(data).digest()).decode("ascii")
+
+
+def file_crc32c(path: Path) -> str:
+    """CRC32C d'un fichier entier (lu par blocs)."""
+    import google_crc32c
+
+    checksum = google_crc32c.Checksum()
+    with path.open("rb") as source:
+        while block := source.read(_READ_BLOCK):
+            checksum.update(block)
+    return base64.b64encode(checksum.digest()).decode("ascii")
+
+
+class ObjectStore:
+    """Interface minimale d'un magasin d'objets pour le dépôt par morceaux."""
+
+    # Sources par appel de composition (limite GCS)
+    max_compose_sources = 32
+
+    def uri(self, name: str) -> str:
+        raise NotImplementedError
+
+    def checksum(self, name: str) -> str | None:
+        """CRC32C (base64) de l'objet, None s'il n'existe pas."""
+        raise NotImplementedError
+
+    def put(self, name: str, data: bytes, checksum: str) -> None:
+        """Dépose un objet ; refusé si son contenu ne correspond pas à `checksum`."""
+        raise NotImplementedError
+
+    def compose(self, sources: list[str], destination: str) -> None:
+        """Concatène des objets existants côté serveur."""
+        raise NotImplementedError
+
+    def delete(self, names: list[str]) -> None:
+        """Supprime des objets (les objets absents sont ignorés)."""
+        raise NotImplementedError
+
+    def list(self, prefix: str) -> dict[str, int]:
+        """Objets sous un préfixe : {nom: taille en octets}."""
+        raise NotImplementedError
+
+    def read(self, name: str) -> bytes | None:
+        """Contenu d'un petit objet (manifeste), None s'il n'existe pas."""
+        raise NotImplementedError
+
+    def download(self, name: str, path: Path) -> None:
+        """Copie un objet dans un fichier local, en flux."""
+        raise NotImplementedError
+
+
+class GCSObjectStore(ObjectStore):
+    """Bucket Google Cloud Storage."""
+
+    def __init__(self, bucket: str, project: str | None = None, credentials=None):
+        self.bucket_name = bucket
+        self.project = project
+        self.credentials = credentials
+        self._local = threading.local()
+
+    @property
+    def bucket(self):
+        # Un client par thread : les sessions HTTP ne sont pas partagées entre flux
+        if not hasattr(self._local, "bucket"):
+            from google.cloud import storage
+
+            client = storage.Client(project=self.project, credentials=self.credentials)
+            self._local.bucket = client.bucket(self.bucket_name)
+        return self._local.bucket
+
+    def uri(self, name: str) -> str:
+        return f"gs://{self.bucket_name}/{name}"
+
+    def checksum(self, name: str) -> str | None:
+        blob = self.bucket.get_blob(name)
+        return blob.crc32c if blob is not None else None
+
+    def put(self, name: str, data: bytes, checksum: str) -> None:
+        blob = self.bucket.blob(name)
+        # Le client compare le CRC32C renvoyé par GCS à celui du contenu envoyé
+        blob.upload_from_string(data, content_type="application/octet-stream", checksum="crc32c")
+        if blob.crc32c != checksum:
+            blob.delete()
+            raise ValueError(f"CRC32C inattendu pour {self.uri(name)}: {blob.crc32c} au lieu de {checksum}")
+
+    def compose(self, sources: list[str], destination: str) -> None:
+        self.bucket.blob(destination).compose([self.bucket.blob(name) for name in sources])
+
+    def delete(self, names: list[str]) -> None:
+        if names:
+            self.bucket.delete_blobs([self.bucket.blob(name) for name in names], on_error=lambda blob: None)
+
+    def list(self, prefix: str) -> dict[str, int]:
+        return {blob.name: blob.size for blob in self.bucket.client.list_blobs(self.bucket_name, prefix=prefix)}
+
+    def read(self, name: str) -> bytes | None:
+        blob = self.bucket.get_blob(name)
+        return blob.download_as_bytes(checksum="crc32c") if blob is not None else None
+
+    def download(self, name: str, path: Path) -> None:
+        self.bucket.blob(name).download_to_filename(str(path), checksum="crc32c")
+
+
+class LocalObjectStore(ObjectStore):
+    """Magasin d'objets émulé sur disque (target local, tests)."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, name: str) -> Path:
+        return self.root / name
+
+    def _write(self, name: str, chunks) -> None:
+        path = self._path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                for chunk in chunks:
+                    tmp_file.write(chunk)
+            os.replace(tmp_name, path)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+
+    def uri(self, name: str) -> str:
+        return str(self._path(name))
+
+    def checksum(self, name: str) -> str | None:
+        path = self._path(name)
+        return file_crc32c(path) if path.exists() else None
+
+    def put(self, name: str, data: bytes, checksum: str) -> None:
+        if crc32c(data) != checksum:
+            raise ValueError(f"CRC32C inattendu pour {self.uri(name)}: contenu altéré pendant l'envoi")
+        self._write(name, [data])
+
+    def compose(self, sources: list[str], destination: str) -> None:
+        def blocks():
+            for name in sources:
+                with self._path(name).open("rb") as source:
+                    while block := source.read(_READ_BLOCK):
+                        yield block
+
+        self._write(destination, blocks())
+
+    def delete(self, names: list[str]) -> None:
+        for name in names:
+            path = self._path(name)
+            path.unlink(missing_ok=True)
+            # Pas de répertoires sur un vrai magasin d'objets : on retire ceux laissés vides
+            for parent in path.parents:
+                if parent == self.root or not parent.is_relative_to(self.root):
+                    break
+                if not parent.is_dir() or any(parent.iterdir()):
+                    break
+                parent.rmdir()
+
+    def list(self, prefix: str) -> dict[str, int]:
+        if not self.root.exists():
+            return {}
+        # Les fichiers temporaires d'écriture (préfixe ".") ne sont pas des objets
+        return {
+            path.relative_to(self.root).as_posix(): path.stat().st_size
+            for path in self.root.rglob("*")
+            if path.is_file() and not path.name.startswith(".")
+            and path.relative_to(self.root).as_posix().startswith(prefix)
+        }
+
+    def read(self, name: str) -> bytes | None:
+        path = self._path(name)
+        return path.read_bytes() if path.exists() else None
+
+    def download(self, name: str, path: Path) -> None:
+        shutil.copyfile(self._path(name), path)
+
+
+def resolve_object_store(target: str, logger, bucket: str | None = None) -> ObjectStore:
+    """
+    Résout le magasin d'objets de landing d'un target
+
+    Args:
+        target: Environnement cible (dev, prod ou local)
+        logger: Logger Prefect de la tâche appelante
+        bucket: Bucket GCS (default: PIPELINE_LANDING_BUCKET)
+
+    Returns:
+        GCSObjectStore, ou LocalObjectStore sur les targets hors-ligne
+    """
+    if target in OFFLINE_TARGETS:
+        return LocalObjectStore(LOCAL_OBJECT_STORE_DIR)
+    bucket = bucket or LANDING_BUCKET
+    if not bucket:
+        raise ValueError(f"Aucun bucket de landing pour le target {target}: définir PIPELINE_LANDING_BUCKET")
+    # Mêmes identifiants que l'entrepôt (compte de service dbt)
+    warehouse = resolve_warehouse(target, logger, stage="upload")
+    if not isinstance(warehouse, BigQueryWarehouse):
+        raise ValueError(f"Le target {target} n'est pas un entrepôt BigQuery: pas de bucket GCS associé")
+    return GCSObjectStore(bucket, project=warehouse.project, credentials=warehouse.credentials)
+
+
+def _manifest_path(store: ObjectStore, destination: str) -> Path:
+    return UPLOAD_STATE_DIR / f"{hashlib.sha1(store.uri(destination).encode('utf-8')).hexdigest()}.json"
+
+
+def _put_chunk(store: ObjectStore, path: Path, name: str, offset: int, length: int) -> str:
+    """Lit un morceau du fichier et le dépose ; retourne son CRC32C."""
+    with path.open("rb") as source:
+        source.seek(offset)
+        data = source.read(length)
+    checksum = crc32c(data)
+    for attempt in range(1, CHUNK_ATTEMPTS + 1):
+        try:
+            store.put(name, data, checksum)
+            return checksum
+        except Exception:
+            if attempt == CHUNK_ATTEMPTS:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def _compose_tree(store: ObjectStore, parts: list[str], destination: str, staging: str) -> list[str]:
+    """Recompose les morceaux dans `destination` ; retourne les objets intermédiaires créés."""
+    intermediates = []
+    level = 0
+    while len(parts) > store.max_compose_sources:
+        groups = [parts[i:i + store.max_compose_sources] for i in range(0, len(parts), store.max_compose_sources)]
+        parts = []
+        for index, group in enumerate(groups):
+            name = f"{staging}/compose-{level}-{index:05d}"
+            store.compose(group, name)
+            parts.append(name)
+        intermediates.extend(parts)
+        level += 1
+    store.compose(parts, destination)
+    return intermediates
+
+
+def upload_file(
+    store: ObjectStore,
+    path: Path,
+    destination: str,
+    chunk_size: int = CHUNK_SIZE_MB * 1024 * 1024,
+    parallelism: int = UPLOAD_PARALLELISM,
+    logger=None,
+) -> dict[str, Any]:
+    """
+    Dépose un fichier par morceaux parallèles, recomposés côté serveur
+
+    Args:
+        store: Magasin d'objets
+        path: Fichier local
+        destination: Nom de l'objet final
+        chunk_size: Taille des morceaux en octets
+        parallelism: Morceaux envoyés simultanément
+        logger: Logger des reprises (optionnel)
+
+    Returns:
+        Dict {"source", "uri", "bytes", "crc32c", "parts", "resumed_parts",
+        "uploaded_bytes", "seconds", "throughput_mb_s", "skipped"}
+    """
+    if chunk_size <= 0 or parallelism <= 0:
+        raise ValueError(f"chunk_size et parallelism doivent être > 0, reçus: {chunk_size}, {parallelism}")
+    size = path.stat().st_size
+    checksum = file_crc32c(path)
+    result = {
+        "source": str(path), "uri": store.uri(destination), "bytes": size, "crc32c": checksum,
+        "parts": max(1, math.ceil(size / chunk_size)), "resumed_parts": 0, "uploaded_bytes": 0,
+        "seconds": 0.0, "throughput_mb_s": None, "skipped": False,
+    }
+
+    manifest_path = _manifest_path(store, destination)
+    identity = {"source": str(path.resolve()), "bytes": size, "crc32c": checksum, "chunk_size": chunk_size}
+    manifest = read_json(manifest_path, default={})
+    if manifest.get("identity") != identity:
+        if manifest:
+            # Fichier ou découpage modifié : les morceaux déjà déposés ne sont plus valables
+            store.delete([f"{manifest['staging']}/{int(index):05d}" for index in manifest["parts"]])
+        elif store.checksum(destination) == checksum:
+            result["skipped"] = True
+            return result
+        manifest = {"identity": identity, "staging": f"{destination}.parts/{uuid.uuid4().hex[:12]}", "parts": {}}
+
+    started = time.monotonic()
+    if result["parts"] == 1:
+        _put_chunk(store, path, destination, 0, size)
+        result["uploaded_bytes"] = size
+    else:
+        staging = manifest["staging"]
+        names = [f"{staging}/{index:05d}" for index in range(result["parts"])]
+        done = {
+            int(index) for index, part_checksum in manifest["parts"].items()
+            if store.checksum(names[int(index)]) == part_checksum
+        }
+        manifest["parts"] = {str(index): manifest["parts"][str(index)] for index in done}
+        result["resumed_parts"] = len(done)
+        if done and logger:
+            logger.info(f"♻️  {path.name}: reprise après {len(done)}/{result['parts']} morceau(x) déjà déposé(s)")
+        write_json_atomic(manifest_path, manifest)
+
+        lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=parallelism) as pool:
+            futures = {
+                pool.submit(
+                    _put_chunk, store, path, names[index], index * chunk_size, min(chunk_size, size - index * chunk_size)
+                ): index
+                for index in range(result["parts"]) if index not in done
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                part_checksum = future.result()
+                with lock:
+                    manifest["parts"][str(index)] = part_checksum
+                    write_json_atomic(manifest_path, manifest)
+                    result["uploaded_bytes"] += min(chunk_size, size - index * chunk_size)
+
+        intermediates = _compose_tree(store, names, destination, staging)
+        final_checksum = store.checksum(destination)
+        store.delete(intermediates)
+        if final_checksum != checksum:
+            store.delete([destination])
+            manifest_path.unlink(missing_ok=True)
+            store.delete(names)
+            raise ValueError(
+                f"CRC32C de {store.uri(destination)} ({final_checksum}) différent de celui de {path} ({checksum})"
+            )
+        store.delete(names)
+    manifest_path.unlink(missing_ok=True)
+
+    elapsed = time.monotonic() - started
+    result["seconds"] = round(elapsed, 3)
+    if elapsed > 0:
+        result["throughput_mb_s"] = round(result["uploaded_bytes"] / 1e6 / elapsed, 2)
+    return result
+
+
+@task(name="upload-file", retries=2, retry_delay_seconds=30, **TASK_METRIC_HOOKS)
+def upload_source_file(
+    target: str,
+    path: str,
+    destination: str | None = None,
+    bucket: str | None = None,
+    chunk_size_mb: int = CHUNK_SIZE_MB,
+    parallelism: int = UPLOAD_PARALLELISM,
+) -> dict[str, Any]:
+    """
+    Dépose un fichier source dans le magasin d'objets de landing
+
+    Un retry reprend au dernier morceau validé (manifeste dans STATE_DIR/uploads).
+
+    Args:
+        target: Environnement cible (dev, prod ou local)
+        path: Fichier local
+        destination: Nom de l'objet (default: LANDING_PREFIX/<nom du fichier>)
+        bucket: Bucket GCS (default: PIPELINE_LANDING_BUCKET)
+        chunk_size_mb: Taille des morceaux en Mo
+        parallelism: Morceaux envoyés simultanément
+
+    Returns:
+        Résultat du dépôt (voir upload_file)
+    """
+    logger = get_run_logger()
+    store = resolve_object_store(target, logger, bucket)
+    source = Path(path)
+    destination = destination or f"{LANDING_PREFIX}/{source.name}"
+    result = upload_file(store, source, destination, chunk_size_mb * 1024 * 1024, parallelism, logger)
+
+    if result["skipped"]:
+        logger.info(f"⏭️  {source.name} déjà présent dans {result['uri']} (CRC32C identique)")
+        return result
+    UPLOADED_BYTES.inc(result["uploaded_bytes"], target=target, origin="uploaded")
+    UPLOADED_BYTES.inc(result["bytes"] - result["uploaded_bytes"], target=target, origin="resumed")
+    if result["throughput_mb_s"] is not None:
+        UPLOAD_THROUGHPUT.set(result["throughput_mb_s"], target=target)
+    logger.info(
+        f"📤 {source.name} → {result['uri']}: {result['bytes'] / 1e6:.1f} Mo en {result['parts']} morceau(x) "
+        f"({result['resumed_parts']} repris), {result['seconds']:.1f}s, "
+        f"{result['throughput_mb_s'] if result['throughput_mb_s'] is not None else '-'} Mo/s, CRC32C vérifié"
+    )
+    return result
+
+
+@flow(name="pipeline-upload", log_prints=True, **FLOW_METRIC_HOOKS)
+def source_upload_pipeline(
+    paths: list[str],
+    target: str = "dev",
+    prefix: str = LANDING_PREFIX,
+    bucket: str | None = None,
+    chunk_size_mb: int = CHUNK_SIZE_MB,
+    parallelism: int = UPLOAD_PARALLELISM,
+):
+    """
+    Dépose des fichiers sources dans le magasin d'objets de landing, un fichier à la fois
+
+    Args:
+        paths: Fichiers locaux
+        target: Environnement cible (dev, prod ou local). Par défaut "dev".
+        prefix: Préfixe des objets déposés
+        bucket: Bucket GCS (default: PIPELINE_LANDING_BUCKET)
+        chunk_size_mb: Taille des morceaux en Mo
+        parallelism: Morceaux envoyés simultanément par fichier
+
+    Returns:
+        Dict {"files": [...], "bytes", "uploaded_bytes", "throughput_mb_s"}
+    """
+    files = [
+        upload_source_file(
+            target=target, path=path, destination=f"{prefix.rstrip('/')}/{Path(path).name}", bucket=bucket,
+            chunk_size_mb=chunk_size_mb, parallelism=parallelism,
+        )
+        for path in paths
+    ]
+    uploaded = sum(result["uploaded_bytes"] for result in files)
+    seconds = sum(result["seconds"] for result in files)
+    throughput = round(uploaded / 1e6 / seconds, 2) if seconds else None
+    get_run_logger().info(
+        f"✅ {len(files)} fichier(s) déposé(s), {uploaded / 1e6:.1f} Mo envoyé(s)"
+        + (f" à {throughput} Mo/s" if throughput is not None else "")
+    )
+    return {
+        "files": files,
+        "bytes": sum(result["bytes"] for result in files),
+        "uploaded_bytes": uploaded,
+        "throughput_mb_s": throughput,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dépôt parallèle et reprenable des fichiers sources")
+    parser.add_argument("paths", nargs="+", help="Fichiers à déposer")
+    parser.add_argument("--target", default="dev")
+    parser.add_argument("--prefix", default=LANDING_PREFIX)
+    parser.add_argument("--bucket", default=None)
+    parser.add_argument("--chunk-size-mb", type=int, default=CHUNK_SIZE_MB)
+    parser.add_argument("--parallelism", type=int, default=UPLOAD_PARALLELISM)
+    args = parser.parse_args()
+    source_upload_pipeline(
+        paths=args.paths, target=args.target, prefix=args.prefix, bucket=args.bucket,
+        chunk_size_mb=args.chunk_size_mb, parallelism=args.parallelism,
+    )
+
+
+if __name__ == "__main__":
+    main()
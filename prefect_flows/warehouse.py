@@ -0,0 +1,733 @@
+"""
+Accès direct à l'entrepôt (hors dbt) pour les étapes Python des flows.
+
+Deux implémentations, choisies selon le type du target dbt :
+  - BigQueryWarehouse : requêtes via google-cloud-bigquery et lecture Arrow
+    en flux parallèles via la BigQuery Storage Read API
+  - DuckDBWarehouse : base DuckDB du target local (moteur embarqué), qui sert
+    aussi de lecteur de substitution pour tester les étapes hors-ligne
+
+La connexion est résolue comme pour dbt (voir dbt_runner.py) : blocs Prefect
+'{bigquery,duckdb}-target-configs-{target}', puis fallback sur dbt/profiles.yml.
+
+Les jobs BigQuery lancés depuis Python portent les mêmes labels que ceux de
+dbt (flow run, target), plus `pipeline_stage` pour l'étape appelante.
+"""
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cached_property
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterator
+
+import yaml
+from prefect_dbt.cli import BigQueryTargetConfigs
+
+from prefect_flows.catalog import CatalogCache, written_relations
+from prefect_flows.config import DBT_PROJECT_DIR, OFFLINE_TARGETS
+from prefect_flows.credentials import block_service_account_info, brokered_credentials
+from prefect_flows.dbt_runner import load_target_configs
+from prefect_flows.run_history import current_flow_run_id
+
+if TYPE_CHECKING:
+    import pyarrow
+
+
+# Nom du profil dbt (dbt_project.yml)
+DBT_PROFILE_NAME = "projet_m2_bi"
+
+_LABEL_INVALID_CHARS = re.compile(r"[^a-z0-9_-]")
+
+# Champ de dbt/profiles.yml rendu par dbt : {{ env_var('NOM', 'défaut') }}
+_PROFILE_ENV_VAR = re.compile(r"""\{\{\s*env_var\(\s*'(\w+)'\s*(?:,\s*'([^']*)'\s*)?\)\s*\}\}""")
+
+
+def sanitize_label(value: str) -> str:
+    """Valeur de label BigQuery valide (même règle que dbt-bigquery pour les query comments)."""
+    return _LABEL_INVALID_CHARS.sub("_", str(value).strip().lower())[:63]
+
+
+def pipeline_labels(target: str, stage: str) -> dict[str, str]:
+    """Labels des jobs lancés par une étape Python de la pipeline."""
+    return {
+        "app": "projet_m2_bi",
+        "flow_run_id": sanitize_label(current_flow_run_id()),
+        "target": sanitize_label(target),
+        "pipeline_stage": sanitize_label(stage),
+    }
+
+
+class Warehouse:
+    """Interface commune aux entrepôts supportés."""
+
+    dialect: str
+    # Cache du catalogue du target (voir catalog.py), attaché par resolve_warehouse
+    catalog: CatalogCache | None = None
+
+    @property
+    def namespace(self) -> str:
+        """Identifiant du schéma (dataset) de l'entrepôt dans le cache du catalogue."""
+        raise NotImplementedError
+
+    def relation(self, name: str) -> str:
+        """Nom qualifié d'une table du schéma du target, utilisable en SQL."""
+        raise NotImplementedError
+
+    def query(self, sql: str) -> list[dict[str, Any]]:
+        """Exécute une requête et retourne les lignes sous forme de dicts."""
+        raise NotImplementedError
+
+    def in_schema(self, schema: str) -> "Warehouse":
+        """Même entrepôt, tables d'un autre schéma (dataset BigQuery)."""
+        raise NotImplementedError
+
+    def execute(self, sql: str) -> int | None:
+        """Exécute une instruction (DDL, DML) et retourne le nombre de lignes modifiées s'il est connu."""
+        raise NotImplementedError
+
+    def load_csv(self, name: str, path: Path, like: str | None = None) -> None:
+        """
+        Charge un fichier CSV (avec en-tête) dans une table, remplacée si elle existe
+
+        Args:
+            name: Table de destination
+            path: Fichier CSV
+            like: Table dont reprendre les types des colonnes (sinon détection automatique)
+        """
+        raise NotImplementedError
+
+    def create_table_like(
+        self,
+        name: str,
+        like: str,
+        partition_date_column: str | None = None,
+        cluster_by: list[str] | None = None,
+    ) -> None:
+        """Crée une table vide, de même schéma que `like`, si elle n'existe pas."""
+        raise NotImplementedError
+
+    def drop_table(self, name: str) -> None:
+        """Supprime une table si elle existe."""
+        self.execute(f"drop table if exists {self.relation(name)}")
+
+    def row_checksum(self, alias: str) -> str:
+        """Expression SQL d'agrégat : empreinte (indépendante de l'ordre) des lignes de `alias`."""
+        raise NotImplementedError
+
+    def columns(self, name: str) -> list[str]:
+        """Colonnes d'une table du schéma du target, dans l'ordre (vide si elle n'existe pas)."""
+        if self.catalog is not None:
+            cached = self.catalog.columns(self.namespace, name)
+            if cached is not None:
+                return cached
+            columns = self.fetch_columns(name)
+            self.catalog.store(self.namespace, name, columns)
+            return columns
+        return self.fetch_columns(name)
+
+    def fetch_columns(self, name: str) -> list[str]:
+        """Colonnes d'une table lues dans l'entrepôt (sans le cache du catalogue)."""
+        raise NotImplementedError
+
+    def catalog_entries(self) -> dict[str, list[str]]:
+        """Catalogue du schéma en une requête : {relation: colonnes dans l'ordre}."""
+        raise NotImplementedError
+
+    def _written(self, sql: str) -> None:
+        """Invalide dans le cache du catalogue les relations écrites par une instruction."""
+        if self.catalog is not None:
+            self.catalog.invalidate(written_relations(sql), self.namespace)
+
+    def recent_queries(self, tables: list[str], days: int) -> list[dict[str, str]]:
+        """
+        Requêtes SELECT réussies des derniers jours portant sur `tables`
+
+        Args:
+            tables: Tables du schéma du target
+            days: Profondeur de l'historique en jours
+
+        Returns:
+            Liste de {"table_id": table référencée, "query": texte SQL, ...}
+        """
+        raise NotImplementedError(f"Historique des requêtes indisponible sur {self.dialect}")
+
+    def job_statistics(self, flow_run_ids: list[str], days: int = 2) -> list[dict[str, Any]]:
+        """
+        Statistiques des jobs portant le label flow_run_id de l'un des runs donnés
+
+        Args:
+            flow_run_ids: Identifiants de flow runs (valeurs de label)
+            days: Profondeur de recherche dans l'historique des jobs
+
+        Returns:
+            Liste de {"job_id", "flow_run_id", "target", "dbt_model", "pipeline_stage",
+            "slot_ms", "bytes_processed", "bytes_billed", "cache_hit", "duration_ms"}
+        """
+        raise NotImplementedError(f"Statistiques de jobs indisponibles sur {self.dialect}")
+
+    def table_sizes(self, names: list[str]) -> dict[str, dict[str, int | None]]:
+        """
+        Taille des relations (tables ou vues) du schéma du target
+
+        Args:
+            names: Relations du schéma du target (les absentes sont ignorées)
+
+        Returns:
+            Dict {nom: {"rows": nombre de lignes, "bytes": octets stockés ou None}}
+        """
+        raise NotImplementedError
+
+    def scan_cost(self, name: str) -> dict[str, float | None]:
+        """
+        Coût d'une lecture complète d'une relation (pour une vue : coût de sa requête)
+
+        Returns:
+            Dict {"seconds": durée mesurée ou None, "bytes": octets traités ou None}
+        """
+        raise NotImplementedError
+
+    def table_read_statistics(self, tables: list[str], days: int) -> list[dict[str, Any]]:
+        """
+        Lectures des derniers jours portant sur `tables` (hors jobs qui les écrivent)
+
+        Un job qui lit plusieurs tables compte entièrement pour chacune d'elles.
+
+        Args:
+            tables: Tables du schéma du target
+            days: Profondeur de l'historique en jours
+
+        Returns:
+            Liste de {"table_id", "reads", "bytes_processed", "duration_ms"}
+        """
+        raise NotImplementedError(f"Historique des requêtes indisponible sur {self.dialect}")
+
+    def data_versions(self, relation_names: list[str]) -> dict[str, str | None]:
+        """
+        Version des données de relations désignées par leur nom complet
+
+        La version change dès que le contenu d'une table peut avoir changé
+        (elle peut aussi changer sans modification réelle, jamais l'inverse).
+
+        Args:
+            relation_names: Noms complets (relation_name du manifest dbt)
+
+        Returns:
+            Dict {relation_name: version, ou None si la relation est absente}
+        """
+        raise NotImplementedError
+
+    def read_record_batches(
+        self,
+        name: str,
+        row_filter: str | None = None,
+        max_streams: int = 4,
+    ) -> Iterator["pyarrow.RecordBatch"]:
+        """
+        Lit une table en record batches Arrow
+
+        Args:
+            name: Nom de la table dans le schéma du target
+            row_filter: Condition SQL optionnelle sur les lignes à lire
+            max_streams: Nombre maximal de flux de lecture parallèles
+
+        Returns:
+            Itérateur de pyarrow.RecordBatch (ordre non garanti)
+        """
+        raise NotImplementedError
+
+
+class BigQueryWarehouse(Warehouse):
+    """Dataset BigQuery d'un target (dev, prod)."""
+
+    dialect = "bigquery"
+
+    def __init__(
+        self,
+        project: str,
+        dataset: str,
+        credentials=None,
+        location: str | None = None,
+        labels: dict[str, str] | None = None,
+    ):
+        self.project = project
+        self.dataset = dataset
+        self.credentials = credentials
+        self.location = location
+        self.labels = labels or {}
+
+    @cached_property
+    def client(self):
+        from google.cloud import bigquery
+
+        return bigquery.Client(project=self.project, credentials=self.credentials, location=self.location)
+
+    @property
+    def namespace(self) -> str:
+        return f"{self.project}.{self.dataset}"
+
+    def relation(self, name: str) -> str:
+        return f"`{self.project}.{self.dataset}.{name}`"
+
+    def query(self, sql: str) -> list[dict[str, Any]]:
+        from google.cloud import bigquery
+
+        job_config = bigquery.QueryJobConfig(labels=self.labels)
+        return [dict(row.items()) for row in self.client.query(sql, job_config=job_config).result()]
+
+    def in_schema(self, schema: str) -> "BigQueryWarehouse":
+        warehouse = BigQueryWarehouse(self.project, schema, self.credentials, self.location, self.labels)
+        warehouse.catalog = self.catalog
+        return warehouse
+
+    def execute(self, sql: str) -> int | None:
+        from google.cloud import bigquery
+
+        try:
+            job = self.client.query(sql, job_config=bigquery.QueryJobConfig(labels=self.labels))
+            job.result()
+        finally:
+            self._written(sql)
+        return job.num_dml_affected_rows
+
+    def load_csv(self, name: str, path: Path, like: str | None = None) -> None:
+        from google.api_core.exceptions import NotFound
+        from google.cloud import bigquery
+
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.CSV,
+            skip_leading_rows=1,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+            labels=self.labels,
+            autodetect=True,
+        )
+        if like:
+            try:
+                fields = {field.name: field for field in self.client.get_table(f"{self.project}.{self.dataset}.{like}").schema}
+            except NotFound:
+                fields = {}
+            with open(path, encoding="utf-8") as file:
+                header = file.readline().strip().split(",")
+            if fields and all(column in fields for column in header):
+                job_config.autodetect = False
+                job_config.schema = [fields[column] for column in header]
+
+        try:
+            with open(path, "rb") as file:
+                self.client.load_table_from_file(
+                    file, f"{self.project}.{self.dataset}.{name}", job_config=job_config
+                ).result()
+        finally:
+            if self.catalog is not None:
+                self.catalog.invalidate([name], self.namespace)
+
+    def create_table_like(
+        self,
+        name: str,
+        like: str,
+        partition_date_column: str | None = None,
+        cluster_by: list[str] | None = None,
+    ) -> None:
+        options = ""
+        if partition_date_column:
+            options += f" partition by date({partition_date_column})"
+        if cluster_by:
+            options += f" cluster by {', '.join(cluster_by)}"
+        self.execute(
+            f"create table if not exists {self.relation(name)}{options} "
+            f"as select * from {self.relation(like)} limit 0"
+        )
+
+    def _jobs_view(self) -> str:
+        if not self.location:
+            raise ValueError("La location BigQuery est requise pour lire INFORMATION_SCHEMA.JOBS")
+        return f"`{self.project}`.`region-{self.location.lower()}`.INFORMATION_SCHEMA.JOBS_BY_PROJECT"
+
+    def row_checksum(self, alias: str) -> str:
+        return f"bit_xor(farm_fingerprint(to_json_string({alias})))"
+
+    def fetch_columns(self, name: str) -> list[str]:
+        from google.api_core.exceptions import NotFound
+
+        try:
+            return [field.name for field in self.client.get_table(f"{self.project}.{self.dataset}.{name}").schema]
+        except NotFound:
+            return []
+
+    def catalog_entries(self) -> dict[str, list[str]]:
+        rows = self.query(
+            f"""
+            select table_name, column_name
+            from `{self.project}.{self.dataset}`.INFORMATION_SCHEMA.COLUMNS
+            order by table_name, ordinal_position
+            """
+        )
+        entries: dict[str, list[str]] = {}
+        for row in rows:
+            entries.setdefault(row["table_name"], []).append(row["column_name"])
+        return entries
+
+    def recent_queries(self, tables: list[str], days: int) -> list[dict[str, str]]:
+        table_list = ", ".join(f"'{table}'" for table in tables)
+        return self.query(
+            f"""
+            select distinct job_id, referenced.table_id, query
+            from {self._jobs_view()},
+                unnest(referenced_tables) as referenced
+            where creation_time >= timestamp_sub(current_timestamp(), interval {int(days)} day)
+              and job_type = 'QUERY'
+              and statement_type = 'SELECT'
+              and state = 'DONE'
+              and error_result is null
+              and referenced.dataset_id = '{self.dataset}'
+              and referenced.table_id in ({table_list})
+            """
+        )
+
+    def table_sizes(self, names: list[str]) -> dict[str, dict[str, int | None]]:
+        table_list = ", ".join(f"'{name}'" for name in names)
+        rows = self.query(
+            f"""
+            select table_id, row_count, size_bytes
+            from `{self.project}.{self.dataset}.__TABLES__`
+            where table_id in ({table_list})
+            """
+        )
+        return {row["table_id"]: {"rows": row["row_count"], "bytes": row["size_bytes"]} for row in rows}
+
+    def data_versions(self, relation_names: list[str]) -> dict[str, str | None]:
+        # Dernière modification et nombre de lignes lus dans __TABLES__, un appel par dataset
+        datasets: dict[tuple[str, str], dict[str, str]] = {}
+        for relation_name in relation_names:
+            project, dataset, table = relation_name.replace("`", "").split(".")
+            datasets.setdefault((project, dataset), {})[table] = relation_name
+        versions = dict.fromkeys(relation_names)
+        for (project, dataset), tables in datasets.items():
+            table_list = ", ".join(f"'{table}'" for table in tables)
+            rows = self.query(
+                f"""
+                select table_id, last_modified_time, row_count
+                from `{project}.{dataset}.__TABLES__`
+                where table_id in ({table_list})
+                """
+            )
+            for row in rows:
+                versions[tables[row["table_id"]]] = f"{row['last_modified_time']}:{row['row_count']}"
+        return versions
+
+    def scan_cost(self, name: str) -> dict[str, float | None]:
+        from google.cloud import bigquery
+
+        # Dry run : octets qu'une lecture traiterait, sans exécution ni facturation
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False, labels=self.labels)
+        job = self.client.query(f"select * from {self.relation(name)}", job_config=job_config)
+        return {"seconds": None, "bytes": job.total_bytes_processed}
+
+    def table_read_statistics(self, tables: list[str], days: int) -> list[dict[str, Any]]:
+        table_list = ", ".join(f"'{table}'" for table in tables)
+        return self.query(
+            f"""
+            select
+                referenced.table_id,
+                count(distinct job_id) as reads,
+                sum(coalesce(total_bytes_processed, 0)) as bytes_processed,
+                sum(timestamp_diff(end_time, start_time, millisecond)) as duration_ms
+            from {self._jobs_view()},
+                unnest(referenced_tables) as referenced
+            where creation_time >= timestamp_sub(current_timestamp(), interval {int(days)} day)
+              and job_type = 'QUERY'
+              and state = 'DONE'
+              and error_result is null
+              and referenced.dataset_id = '{self.dataset}'
+              and referenced.table_id in ({table_list})
+              and coalesce(destination_table.table_id, '') != referenced.table_id
+            group by 1
+            """
+        )
+
+    def job_statistics(self, flow_run_ids: list[str], days: int = 2) -> list[dict[str, Any]]:
+        run_list = ", ".join(f"'{sanitize_label(run_id)}'" for run_id in flow_run_ids)
+
+        def label(key: str) -> str:
+            return f"(select value from unnest(labels) where key = '{key}')"
+
+        return self.query(
+            f"""
+            select
+                job_id,
+                {label('flow_run_id')} as flow_run_id,
+                {label('target')} as target,
+                {label('dbt_model')} as dbt_model,
+                {label('pipeline_stage')} as pipeline_stage,
+                coalesce(total_slot_ms, 0) as slot_ms,
+                coalesce(total_bytes_processed, 0) as bytes_processed,
+                coalesce(total_bytes_billed, 0) as bytes_billed,
+                coalesce(cache_hit, false) as cache_hit,
+                timestamp_diff(end_time, start_time, millisecond) as duration_ms
+            from {self._jobs_view()}
+            where creation_time >= timestamp_sub(current_timestamp(), interval {int(days)} day)
+              and {label('flow_run_id')} in ({run_list})
+            """
+        )
+
+    def read_record_batches(
+        self,
+        name: str,
+        row_filter: str | None = None,
+        max_streams: int = 4,
+    ) -> Iterator["pyarrow.RecordBatch"]:
+        from google.cloud import bigquery_storage
+        from google.cloud.bigquery_storage import types
+
+        read_client = bigquery_storage.BigQueryReadClient(credentials=self.credentials)
+        requested_session = types.ReadSession(
+            table=f"projects/{self.project}/datasets/{self.dataset}/tables/{name}",
+            data_format=types.DataFormat.ARROW,
+            read_options=types.ReadSession.TableReadOptions(row_restriction=row_filter or ""),
+        )
+        session = read_client.create_read_session(
+            parent=f"projects/{self.project}",
+            read_session=requested_session,
+            max_stream_count=max_streams,
+        )
+        if not session.streams:
+            # Aucune ligne ne correspond au filtre
+            return
+
+        def read_stream(stream) -> list:
+            pages = read_client.read_rows(stream.name).rows(session).pages
+            return [page.to_arrow() for page in pages]
+
+        # Un thread par flux ; les batches d'un flux sont rendus dès qu'il est terminé
+        with ThreadPoolExecutor(max_workers=len(session.streams)) as pool:
+            futures = [pool.submit(read_stream, stream) for stream in session.streams]
+            for future in as_completed(futures):
+                yield from future.result()
+
+
+class DuckDBWarehouse(Warehouse):
+    """Base DuckDB du target local."""
+
+    dialect = "duckdb"
+
+    def __init__(self, path: Path, schema: str = "main"):
+        self.path = Path(path)
+        self.schema = schema
+
+    def connect(self, read_only: bool = True):
+        import duckdb
+
+        # Base absente (premier run, ingestion avant tout build) : créée vide
+        return duckdb.connect(str(self.path), read_only=read_only and self.path.exists())
+
+    @property
+    def namespace(self) -> str:
+        return f"{self.path}:{self.schema}"
+
+    def relation(self, name: str) -> str:
+        return f'"{self.schema}"."{name}"'
+
+    def query(self, sql: str) -> list[dict[str, Any]]:
+        with self.connect() as con:
+            cursor = con.execute(sql)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def in_schema(self, schema: str) -> "DuckDBWarehouse":
+        warehouse = DuckDBWarehouse(self.path, schema)
+        warehouse.catalog = self.catalog
+        return warehouse
+
+    def execute(self, sql: str) -> int | None:
+        try:
+            with self.connect(read_only=False) as con:
+                con.execute(f'create schema if not exists "{self.schema}"')
+                rows = con.execute(sql).fetchall()
+        finally:
+            self._written(sql)
+        # Les instructions DML retournent une ligne (nombre de lignes modifiées)
+        return rows[0][0] if len(rows) == 1 and len(rows[0]) == 1 and isinstance(rows[0][0], int) else None
+
+    def load_csv(self, name: str, path: Path, like: str | None = None) -> None:
+        select = f"select * from read_csv('{path}', header = true, auto_detect = true)"
+        target_columns = self.columns(like) if like else []
+        if target_columns:
+            with open(path, encoding="utf-8") as file:
+                header = file.readline().strip().split(",")
+            types = {
+                row["column_name"]: row["data_type"]
+                for row in self.query(
+                    "select column_name, data_type from information_schema.columns "
+                    f"where table_schema = '{self.schema}' and table_name = '{like}'"
+                )
+            }
+            select = "select " + ", ".join(
+                f'cast("{column}" as {types[column]}) as "{column}"' if column in types else f'"{column}"'
+                for column in header
+            ) + f" from read_csv('{path}', header = true, all_varchar = true)"
+        self.execute(f"create or replace table {self.relation(name)} as {select}")
+
+    def create_table_like(
+        self,
+        name: str,
+        like: str,
+        partition_date_column: str | None = None,
+        cluster_by: list[str] | None = None,
+    ) -> None:
+        # Pas de partitions ni de clustering de table sur DuckDB
+        self.execute(f"create table if not exists {self.relation(name)} as select * from {self.relation(like)} limit 0")
+
+    def row_checksum(self, alias: str) -> str:
+        return f"bit_xor(hash({alias}))"
+
+    def fetch_columns(self, name: str) -> list[str]:
+        rows = self.query(
+            "select column_name from information_schema.columns "
+            f"where table_schema = '{self.schema}' and table_name = '{name}' order by ordinal_position"
+        )
+        return [row["column_name"] for row in rows]
+
+    def catalog_entries(self) -> dict[str, list[str]]:
+        if not self.path.exists():
+            return {}
+        rows = self.query(
+            "select table_name, column_name from information_schema.columns "
+            f"where table_schema = '{self.schema}' order by table_name, ordinal_position"
+        )
+        entries: dict[str, list[str]] = {}
+        for row in rows:
+            entries.setdefault(row["table_name"], []).append(row["column_name"])
+        return entries
+
+    def table_sizes(self, names: list[str]) -> dict[str, dict[str, int | None]]:
+        name_list = ", ".join(f"'{name}'" for name in names)
+        existing = self.query(
+            "select table_name from information_schema.tables "
+            f"where table_schema = '{self.schema}' and table_name in ({name_list})"
+        )
+        # DuckDB n'expose pas la taille par table : nombre de lignes seulement
+        return {
+            row["table_name"]: {
+                "rows": self.query(f"select count(*) as n from {self.relation(row['table_name'])}")[0]["n"],
+                "bytes": None,
+            }
+            for row in existing
+        }
+
+    def data_versions(self, relation_names: list[str]) -> dict[str, str | None]:
+        # Pas de date de modification par table : nombre de lignes et empreinte du contenu
+        versions = {}
+        for relation_name in relation_names:
+            try:
+                row = self.query(
+                    f"select count(*) as row_count, {self.row_checksum('t')} as checksum from {relation_name} t"
+                )[0]
+            except Exception:
+                versions[relation_name] = None
+                continue
+            versions[relation_name] = f"{row['row_count']}:{row['checksum']}"
+        return versions
+
+    def scan_cost(self, name: str) -> dict[str, float | None]:
+        with self.connect() as con:
+            start = time.perf_counter()
+            con.execute(f"select count(*) from (select * from {self.relation(name)})").fetchall()
+            return {"seconds": time.perf_counter() - start, "bytes": None}
+
+    def read_record_batches(
+        self,
+        name: str,
+        row_filter: str | None = None,
+        max_streams: int = 4,
+    ) -> Iterator["pyarrow.RecordBatch"]:
+        # DuckDB parallélise le scan en interne : un seul flux côté client
+        with self.connect() as con:
+            con.execute(f"set threads = {max_streams}")
+            reader = con.execute(
+                f"select * from {self.relation(name)} where {row_filter or 'true'}"
+            ).fetch_record_batch()
+            yield from reader
+
+
+def _warehouse_from_blocks(target: str, logger, labels: dict[str, str]) -> Warehouse:
+    """Construit l'entrepôt depuis le bloc de target configs du target."""
+    target_configs = load_target_configs(target, logger)
+    extras = target_configs.extras or {}
+
+    if isinstance(target_configs, BigQueryTargetConfigs):
+        gcp_credentials = target_configs.credentials
+        return BigQueryWarehouse(
+            project=target_configs.project or gcp_credentials.project,
+            dataset=target_configs.schema_,
+            credentials=brokered_credentials(
+                block_service_account_info(gcp_credentials),
+                fallback=gcp_credentials.get_credentials_from_service_account(),
+            ),
+            location=extras.get("location"),
+            labels=labels,
+        )
+    return DuckDBWarehouse(path=extras["path"], schema=target_configs.schema_)
+
+
+def _render_env_vars(value: str) -> str:
+    """Rend les env_var d'un champ de profil comme dbt (variable d'environnement, sinon défaut)."""
+    return _PROFILE_ENV_VAR.sub(lambda match: os.getenv(match.group(1), match.group(2) or ""), value)
+
+
+def _warehouse_from_profiles(target: str, logger, labels: dict[str, str]) -> Warehouse:
+    """Construit l'entrepôt depuis l'output du target dans dbt/profiles.yml."""
+    profiles_path = DBT_PROJECT_DIR / "profiles.yml"
+    if not profiles_path.exists():
+        raise FileNotFoundError(
+            f"Le fichier {profiles_path} n'existe pas. "
+            f"Exécutez: uv run python -m infrastructure.setup_profiles --local-only"
+        )
+
+    profiles = yaml.safe_load(profiles_path.read_text(encoding="utf-8"))
+    output = profiles[DBT_PROFILE_NAME]["outputs"][target]
+    logger.info(f"📋 Connexion à l'entrepôt depuis {profiles_path} (target {target}, type {output['type']})")
+
+    if output["type"] == "bigquery":
+        from google.oauth2 import service_account
+
+        credentials = None
+        if output.get("keyfile"):
+            info = json.loads(Path(output["keyfile"]).read_text(encoding="utf-8"))
+            credentials = brokered_credentials(
+                info, fallback=service_account.Credentials.from_service_account_info(info)
+            )
+        return BigQueryWarehouse(
+            project=output["project"],
+            dataset=output["dataset"],
+            credentials=credentials,
+            location=output.get("location"),
+            labels=labels,
+        )
+    if output["type"] == "duckdb":
+        return DuckDBWarehouse(path=_render_env_vars(output["path"]), schema=output.get("schema", "main"))
+    raise ValueError(f"Type d'entrepôt non supporté pour le target {target}: {output['type']}")
+
+
+def resolve_warehouse(target: str, logger, stage: str = "python") -> Warehouse:
+    """
+    Résout l'entrepôt d'un target dbt
+
+    Args:
+        target: Environnement cible (dev, prod ou local)
+        logger: Logger Prefect de la tâche appelante
+        stage: Étape appelante, reprise dans le label `pipeline_stage` des jobs
+
+    Returns:
+        BigQueryWarehouse ou DuckDBWarehouse, avec le cache du catalogue du target
+    """
+    labels = pipeline_labels(target, stage)
+    warehouse = None
+    if target not in OFFLINE_TARGETS:
+        try:
+            warehouse = _warehouse_from_blocks(target, logger, labels)
+        except Exception as e:
+            logger.warning(f"⚠️  Impossible de charger les blocs Prefect pour {target}: {e}")
+    warehouse = warehouse or _warehouse_from_profiles(target, logger, labels)
+    warehouse.catalog = CatalogCache(target)
+    return warehouse
@@ -0,0 +1,65 @@
+"""
+Stockage des high-watermarks par source pour le mode micro-batch.
+
+Un watermark est la borne haute (exclue du batch suivant) de `_loaded_at`
+déjà traitée par les modèles incrémentaux. Les watermarks de toutes les
+sources sont validés ensemble, en une seule écriture atomique.
+"""
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from prefect_flows.state import read_json, write_json_atomic
+
+
+def format_timestamp(value: datetime) -> str:
+    """Formate un timestamp UTC sans fuseau, lisible par BigQuery et DuckDB."""
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Relit un timestamp produit par `format_timestamp`."""
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S.%f").replace(tzinfo=timezone.utc)
+
+
+class WatermarkStore:
+    """
+    Watermarks validés, persistés dans un fichier JSON par target
+
+    Structure du fichier:
+        {
+          "watermarks": {"viewing_logs": "2025-01-01 10:00:00.000000", ...},
+          "last_run": {... statistiques du dernier batch validé ...}
+        }
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def load(self) -> dict[str, Any]:
+        """Retourne l'état complet (vide si aucun batch n'a encore été validé)."""
+        return read_json(self.path, default={"watermarks": {}, "last_run": None})
+
+    def get(self, source: str) -> datetime | None:
+        """Retourne le dernier watermark validé d'une source, ou None."""
+        value = self.load()["watermarks"].get(source)
+        return parse_timestamp(value) if value else None
+
+    def commit(self, watermarks: dict[str, datetime], run_info: dict[str, Any]) -> dict[str, Any]:
+        """
+        Avance les watermarks de façon atomique
+
+        Args:
+            watermarks: Nouvelle borne haute par source
+            run_info: Statistiques du batch (latences, fenêtres, ...)
+
+        Returns:
+            Le nouvel état écrit
+        """
+        state = self.load()
+        state["watermarks"].update(
+            {source: format_timestamp(value) for source, value in watermarks.items()}
+        )
+        state["last_run"] = run_info
+        write_json_atomic(self.path, state)
+        return state
@@ -0,0 +1,134 @@
+"""Découpage du DAG en sous-graphes (prefect_flows/distributed.py) sur un manifest synthétique."""
+import logging
+
+import pytest
+
+from prefect_flows import distributed
+from prefect_flows.distributed import model_graph, partition_dag, plan_distribution, topological_order
+
+
+def _model(name: str, parents: list[str], materialized: str = "table") -> dict:
+    return {
+        "name": name,
+        "resource_type": "model",
+        "config": {"materialized": materialized, "enabled": True},
+        "depends_on": {"nodes": [f"model.p.{parent}" if "." not in parent else parent for parent in parents]},
+    }
+
+
+def _manifest(models: dict[str, dict]) -> dict:
+    return {"nodes": {f"model.p.{name}": node for name, node in models.items()}}
+
+
+def _chains(count: int, length: int) -> dict[str, dict]:
+    """`count` chaînes indépendantes source -> stg -> ... -> mart de `length` modèles."""
+    models = {}
+    for chain in range(count):
+        parents = ["source.p.raw"]
+        for step in range(length):
+            name = f"c{chain}_{step}"
+            models[name] = _model(name, parents)
+            parents = [name]
+    return models
+
+
+def _check_partition(graph: dict[str, list[str]], groups: list[list[str]]) -> None:
+    """Chaque modèle dans un seul sous-graphe ; un sous-graphe ne dépend que des précédents."""
+    assert sorted(unique_id for group in groups for unique_id in group) == sorted(graph)
+    assert all(groups)
+    position = {unique_id: (index, rank) for index, group in enumerate(groups) for rank, unique_id in enumerate(group)}
+    for unique_id, parents in graph.items():
+        for parent in parents:
+            assert position[parent] < position[unique_id]
+
+
+def test_model_graph_traverses_ephemeral_and_skips_excluded():
+    manifest = _manifest({
+        "stg": _model("stg", ["source.p.raw"]),
+        "eph": _model("eph", ["stg"], materialized="ephemeral"),
+        "cached": _model("cached", ["stg"]),
+        "mart": _model("mart", ["eph", "cached"]),
+    })
+
+    graph = model_graph(manifest, exclude=["cached"])
+
+    assert graph == {"model.p.stg": [], "model.p.mart": ["model.p.stg"]}
+
+
+def test_topological_order_rejects_cycles():
+    with pytest.raises(ValueError):
+        topological_order({"a": ["b"], "b": ["a"]})
+
+
+def test_partition_dag_keeps_dependency_order():
+    models = _chains(3, 4)
+    models["mart_all"] = _model("mart_all", ["c0_3", "c1_3", "c2_3"])
+    graph = model_graph(_manifest(models))
+    costs = {unique_id: 10.0 for unique_id in graph}
+
+    groups = partition_dag(graph, costs, workers=3)
+
+    _check_partition(graph, groups)
+    assert len(groups) <= 3
+
+
+def test_partition_dag_balances_independent_branches():
+    graph = model_graph(_manifest(_chains(4, 3)))
+    costs = {unique_id: 10.0 for unique_id in graph}
+
+    groups = partition_dag(graph, costs, workers=2)
+
+    _check_partition(graph, groups)
+    assert [sum(costs[unique_id] for unique_id in group) for group in groups] == [60.0, 60.0]
+    # Une chaîne n'est pas coupée entre deux sous-graphes
+    for chain in range(4):
+        assert sum(1 for group in groups if any(unique_id.startswith(f"model.p.c{chain}_") for unique_id in group)) == 1
+
+
+def test_partition_dag_creates_fewer_subgraphs_than_workers():
+    graph = model_graph(_manifest(_chains(2, 1)))
+    costs = {unique_id: 10.0 for unique_id in graph}
+
+    groups = partition_dag(graph, costs, workers=5)
+
+    _check_partition(graph, groups)
+    assert len(groups) == 2
+
+
+@pytest.fixture
+def planned(monkeypatch):
+    """plan_distribution sur un manifest synthétique, sans dbt ni historique de runs."""
+    def plan(models: dict[str, dict], workers: int, cost: float) -> dict:
+        monkeypatch.setattr(distributed, "load_manifest", lambda: _manifest(models))
+        monkeypatch.setattr(distributed, "model_costs", lambda target, ids: {unique_id: cost for unique_id in ids})
+        monkeypatch.setattr(distributed, "get_run_logger", lambda: logging.getLogger(__name__))
+        return plan_distribution.fn(target="dev", workers=workers, threads=1, compiled=True)
+
+    return plan
+
+
+def test_plan_distribution_orders_groups_after_their_upstreams(planned):
+    models = _chains(3, 3)
+    models["mart_all"] = _model("mart_all", ["c0_2", "c1_2", "c2_2"])
+
+    plan = planned(models, workers=3, cost=300.0)
+
+    assert plan["distribute"]
+    assert [group["index"] for group in plan["groups"]] == list(range(len(plan["groups"])))
+    for group in plan["groups"]:
+        assert all(upstream < group["index"] for upstream in group["upstream"])
+    assert plan["estimate"]["distributed"] < plan["estimate"]["single"]
+
+
+def test_plan_distribution_uses_fewer_subgraphs_than_workers(planned):
+    plan = planned(_chains(2, 2), workers=6, cost=300.0)
+
+    assert plan["distribute"]
+    assert len(plan["groups"]) == 2
+    assert [group["cost"] for group in plan["groups"]] == [600.0, 600.0]
+
+
+def test_plan_distribution_keeps_a_single_chain_on_one_worker(planned):
+    plan = planned(_chains(1, 4), workers=4, cost=300.0)
+
+    assert not plan["distribute"]
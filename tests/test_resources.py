@@ -0,0 +1,73 @@
+"""Prévision des ressources d'une commande dbt (prefect_flows/resources.py) sur un profil synthétique."""
+import pytest
+
+from prefect_flows import resources
+from prefect_flows.resources import (
+    ADMISSION_DEFAULT_CPU,
+    ADMISSION_DEFAULT_MEMORY_MB,
+    ADMISSION_MEMORY_MARGIN,
+    RESOURCE_PROFILE_WINDOW,
+    predict_resources,
+    record_resource_report,
+)
+
+
+FULL_RUN = "dbt run --target dev --threads 4"
+MICROBATCH = 'dbt run --select tag:microbatch+ --vars \'{"microbatch_windows": {"start": "%s"}}\''
+
+
+@pytest.fixture(autouse=True)
+def resources_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(resources, "RESOURCES_DIR", tmp_path / "resources")
+    return tmp_path
+
+
+def _report(command: str, memory_mb: float, cpu_seconds: float, wall_seconds: float) -> None:
+    record_resource_report("dev", "run", command, {
+        "memory_mb": memory_mb,
+        "user_seconds": cpu_seconds * 0.75,
+        "kernel_seconds": cpu_seconds * 0.25,
+        "wall_seconds": wall_seconds,
+    })
+
+
+def test_predict_resources_defaults_without_profile():
+    assert predict_resources("dev", "run", FULL_RUN) == {
+        "memory_mb": ADMISSION_DEFAULT_MEMORY_MB, "cpu": ADMISSION_DEFAULT_CPU, "wall_seconds": None, "basis": "default",
+    }
+
+
+def test_predict_resources_uses_commands_of_the_same_selection():
+    _report(FULL_RUN, memory_mb=900, cpu_seconds=240, wall_seconds=120)
+    # Fenêtres datées et threads différents : même sélection
+    _report(MICROBATCH % "2025-01-01", memory_mb=200, cpu_seconds=10, wall_seconds=20)
+    _report(MICROBATCH % "2025-01-02", memory_mb=250, cpu_seconds=30, wall_seconds=20)
+
+    prediction = predict_resources("dev", "run", (MICROBATCH % "2025-01-03") + " --threads 2")
+
+    assert prediction == {
+        "memory_mb": round(250 * ADMISSION_MEMORY_MARGIN, 1), "cpu": 1.5, "wall_seconds": 20, "basis": "command",
+    }
+
+
+def test_predict_resources_falls_back_to_the_operation():
+    _report(FULL_RUN, memory_mb=900, cpu_seconds=240, wall_seconds=120)
+    _report(MICROBATCH % "2025-01-01", memory_mb=200, cpu_seconds=10, wall_seconds=20)
+
+    prediction = predict_resources("dev", "run", "dbt run --select stg_users")
+
+    assert prediction["basis"] == "operation"
+    assert prediction["memory_mb"] == round(900 * ADMISSION_MEMORY_MARGIN, 1)
+    assert prediction["cpu"] == 2.0
+    assert prediction["wall_seconds"] == 120
+
+
+def test_predict_resources_reads_recent_measures_only():
+    _report(FULL_RUN, memory_mb=4000, cpu_seconds=100, wall_seconds=100)
+    for _ in range(RESOURCE_PROFILE_WINDOW):
+        _report(FULL_RUN, memory_mb=500, cpu_seconds=50, wall_seconds=100)
+
+    prediction = predict_resources("dev", "run", FULL_RUN)
+
+    assert prediction["memory_mb"] == round(500 * ADMISSION_MEMORY_MARGIN, 1)
+    assert prediction["cpu"] == 0.5
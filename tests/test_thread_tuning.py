@@ -0,0 +1,100 @@
+"""Choix automatique des threads dbt (prefect_flows/thread_tuning.py) sur un historique synthétique."""
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from prefect_flows import run_history
+from prefect_flows.run_history import record_invocation, selection_signature
+from prefect_flows.thread_tuning import choose_threads
+
+
+FULL_RUN = "dbt run --target dev"
+MICROBATCH = 'dbt run --select tag:microbatch+ --vars \'{"microbatch_windows": {}}\''
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    """Historique des runs et artefacts dbt dans un répertoire temporaire (sans manifest : nœuds indépendants)."""
+    monkeypatch.setattr(run_history, "STATE_DIR", tmp_path / "state")
+    monkeypatch.setenv("DBT_TARGET_PATH", str(tmp_path / "target"))
+    return tmp_path
+
+
+def _iso(seconds: float) -> str:
+    return datetime.fromtimestamp(1_750_000_000 + seconds, tz=timezone.utc).isoformat()
+
+
+def _record(started_at: float, command: str, threads: int, nodes: int, makespan: float) -> None:
+    """
+    Invocation de `nodes` modèles indépendants de 10s exécutés par `threads` threads :
+    un modèle attend qu'un thread se libère.
+    """
+    results = []
+    for node in range(nodes):
+        start = (node // threads) * 10.0
+        results.append({
+            "unique_id": f"model.p.m{node}",
+            "status": "success",
+            "execution_time": 10.0,
+            "thread_id": f"Thread-{node % threads + 1}",
+            "timing": [
+                {"name": "compile", "started_at": _iso(start), "completed_at": _iso(start)},
+                {"name": "execute", "started_at": _iso(start), "completed_at": _iso(start + 10.0)},
+            ],
+            "message": None,
+        })
+    record_invocation("dev", {
+        "flow_run_id": str(uuid.uuid4()),
+        "target": "dev",
+        "operation": "run",
+        "command": command,
+        "selection": selection_signature(command),
+        "success": True,
+        "started_at": started_at,
+        "elapsed_time": makespan,
+        "threads": threads,
+        "results": results,
+    })
+
+
+def test_choose_threads_without_history_keeps_profile():
+    assert choose_threads("dev", "run") == (None, "aucun run précédent")
+
+
+def test_choose_threads_doubles_when_nodes_queue():
+    _record(1, FULL_RUN, threads=1, nodes=4, makespan=40.0)
+
+    threads, reason = choose_threads("dev", "run", bounds=(1, 8))
+
+    assert threads == 2
+    assert "largeur du DAG 4" in reason
+
+
+def test_choose_threads_reverts_a_slower_change():
+    _record(1, FULL_RUN, threads=2, nodes=4, makespan=20.0)
+    _record(2, FULL_RUN, threads=4, nodes=4, makespan=30.0)
+
+    threads, reason = choose_threads("dev", "run", bounds=(1, 8))
+
+    assert threads == 2
+    assert "retour arrière" in reason
+
+
+def test_choose_threads_reduces_to_dag_width():
+    _record(1, FULL_RUN, threads=8, nodes=2, makespan=10.0)
+
+    assert choose_threads("dev", "run", bounds=(1, 8))[0] == 2
+
+
+def test_choose_threads_compares_runs_of_the_same_selection():
+    _record(1, FULL_RUN, threads=4, nodes=4, makespan=10.0)
+    # Micro-batch plus récent, lent et sérialisé : ne règle pas le run complet
+    _record(2, MICROBATCH, threads=1, nodes=4, makespan=40.0)
+
+    full_run, _ = choose_threads("dev", "run", bounds=(1, 8), selection=selection_signature(FULL_RUN))
+    microbatch, _ = choose_threads("dev", "run", bounds=(1, 8), selection=selection_signature(MICROBATCH))
+
+    assert full_run == 4
+    assert microbatch == 2
+    assert choose_threads("dev", "run", selection="dbt build") == (None, "aucun run précédent de même sélection")